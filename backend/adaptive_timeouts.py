@@ -0,0 +1,193 @@
+"""
+Adaptive per-model timeouts for upstream AI calls.
+
+``AI_MATH_TIMEOUT_SECONDS`` and friends are fixed, so a healthy deployment
+that answers fast is still waited on for the full static value when it
+stalls.  :class:`AdaptiveTimeouts` keeps a rolling latency histogram per
+model deployment and derives each call's timeout from it:
+
+    timeout = min(configured,
+                  clamp(p<AI_TIMEOUT_PERCENTILE> × AI_TIMEOUT_MULTIPLIER,
+                        AI_TIMEOUT_MIN_SECONDS, AI_TIMEOUT_MAX_SECONDS))
+
+The caller's configured (static) timeout stays the ceiling, and is used
+as is until a model has ``AI_TIMEOUT_MIN_SAMPLES`` calls in the window.
+Calls that timed out or failed outright are counted as fallbacks but kept
+out of the histogram: a timed-out call only says it took *at least* the
+timeout, and feeding that back in would ratchet the timeout up on every
+hang; a fast error says nothing about how long answers take.
+
+The histogram has log-spaced buckets (about 12% wide) and two
+generations: every ``AI_TIMEOUT_WINDOW_SECONDS / 2`` the older one is
+dropped, so percentiles cover the last half-window to full window.
+
+Configuration (environment variables)
+-------------------------------------
+AI_ADAPTIVE_TIMEOUTS      – set to ``0`` to always use the static timeouts (default on)
+AI_TIMEOUT_PERCENTILE     – latency percentile the timeout is based on (default 99)
+AI_TIMEOUT_MULTIPLIER     – headroom over that percentile (default 1.5)
+AI_TIMEOUT_MIN_SECONDS    – lower bound of an adaptive timeout (default 3)
+AI_TIMEOUT_MAX_SECONDS    – upper bound of an adaptive timeout (default 30)
+AI_TIMEOUT_MIN_SAMPLES    – calls in the window before a model's timeout adapts (default 50)
+AI_TIMEOUT_WINDOW_SECONDS – length of the rolling window (default 600)
+"""
+
+from __future__ import annotations
+
+import bisect
+import os
+import threading
+import time
+
+AI_ADAPTIVE_TIMEOUTS = os.environ.get("AI_ADAPTIVE_TIMEOUTS", "1") == "1"
+AI_TIMEOUT_PERCENTILE = float(os.environ.get("AI_TIMEOUT_PERCENTILE", "99"))
+AI_TIMEOUT_MULTIPLIER = float(os.environ.get("AI_TIMEOUT_MULTIPLIER", "1.5"))
+AI_TIMEOUT_MIN_SECONDS = float(os.environ.get("AI_TIMEOUT_MIN_SECONDS", "3"))
+AI_TIMEOUT_MAX_SECONDS = float(os.environ.get("AI_TIMEOUT_MAX_SECONDS", "30"))
+AI_TIMEOUT_MIN_SAMPLES = int(os.environ.get("AI_TIMEOUT_MIN_SAMPLES", "50"))
+AI_TIMEOUT_WINDOW_SECONDS = float(os.environ.get("AI_TIMEOUT_WINDOW_SECONDS", "600"))
+
+# Upper bounds of the histogram buckets: 50 ms × 1.12ⁿ up to ~2 minutes.
+_BOUNDS: list[float] = []
+_bound = 0.05
+while _bound < 120:
+    _BOUNDS.append(round(_bound, 4))
+    _bound *= 1.12
+_BOUNDS.append(float("inf"))
+
+
+class LatencyHistogram:
+    """Two-generation rolling histogram of call latencies."""
+
+    def __init__(self, window: float = AI_TIMEOUT_WINDOW_SECONDS):
+        self._half = window / 2
+        self._current = [0] * len(_BOUNDS)
+        self._previous = [0] * len(_BOUNDS)
+        self._rotated_at = time.monotonic()
+
+    def add(self, seconds: float) -> None:
+        self._rotate()
+        self._current[bisect.bisect_left(_BOUNDS, seconds)] += 1
+
+    def count(self) -> int:
+        self._rotate()
+        return sum(self._current) + sum(self._previous)
+
+    def percentile(self, pct: float) -> float:
+        """Upper bound of the bucket holding the *pct*-th percentile (0.0 if empty)."""
+        self._rotate()
+        counts = [a + b for a, b in zip(self._current, self._previous)]
+        total = sum(counts)
+        if not total:
+            return 0.0
+        target = total * pct / 100
+        seen = 0
+        for bound, n in zip(_BOUNDS, counts):
+            seen += n
+            if seen >= target:
+                return bound if bound != float("inf") else _BOUNDS[-2]
+        return _BOUNDS[-2]
+
+    def _rotate(self) -> None:
+        elapsed = time.monotonic() - self._rotated_at
+        if elapsed < self._half:
+            return
+        if elapsed >= 2 * self._half:
+            self._previous = [0] * len(_BOUNDS)   # idle for a whole window
+        else:
+            self._previous = self._current
+        self._current = [0] * len(_BOUNDS)
+        self._rotated_at = time.monotonic()
+
+
+class _ModelTimeouts:
+    __slots__ = ("histogram", "calls", "timeouts", "errors", "last_timeout")
+
+    def __init__(self, window: float):
+        self.histogram = LatencyHistogram(window)
+        self.calls = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.last_timeout = 0.0
+
+
+class AdaptiveTimeouts:
+    """Per-model timeout policy driven by recent latency percentiles."""
+
+    def __init__(
+        self,
+        enabled: bool = AI_ADAPTIVE_TIMEOUTS,
+        percentile: float = AI_TIMEOUT_PERCENTILE,
+        multiplier: float = AI_TIMEOUT_MULTIPLIER,
+        min_seconds: float = AI_TIMEOUT_MIN_SECONDS,
+        max_seconds: float = AI_TIMEOUT_MAX_SECONDS,
+        min_samples: int = AI_TIMEOUT_MIN_SAMPLES,
+        window: float = AI_TIMEOUT_WINDOW_SECONDS,
+    ):
+        self.enabled = enabled
+        self.percentile = percentile
+        self.multiplier = multiplier
+        self.min_seconds = min_seconds
+        self.max_seconds = max_seconds
+        self.min_samples = min_samples
+        self.window = window
+        self._lock = threading.Lock()
+        self._models: dict[str, _ModelTimeouts] = {}
+
+    def timeout_for(self, model: str, configured: float) -> float:
+        """Timeout for the next *model* call; *configured* until enough samples exist."""
+        with self._lock:
+            entry = self._model(model)
+            timeout = configured
+            if self.enabled and entry.histogram.count() >= self.min_samples:
+                observed = entry.histogram.percentile(self.percentile) * self.multiplier
+                timeout = min(configured, self.max_seconds, max(self.min_seconds, observed))
+            entry.last_timeout = timeout
+            return timeout
+
+    def record(self, model: str, elapsed: float, timed_out: bool = False, failed: bool = False) -> None:
+        with self._lock:
+            entry = self._model(model)
+            entry.calls += 1
+            entry.timeouts += timed_out
+            entry.errors += failed
+            if not (failed or timed_out):
+                entry.histogram.add(elapsed)
+
+    def latency(self, model: str, pct: float) -> tuple[int, float]:
+        """``(samples, p<pct> latency)`` of *model*'s calls in the window."""
+        with self._lock:
+            entry = self._models.get(model)
+            if entry is None:
+                return 0, 0.0
+            return entry.histogram.count(), entry.histogram.percentile(pct)
+
+    def _model(self, model: str) -> _ModelTimeouts:
+        entry = self._models.get(model)
+        if entry is None:
+            entry = self._models[model] = _ModelTimeouts(self.window)
+        return entry
+
+    def stats(self) -> dict:
+        with self._lock:
+            models = {}
+            for model, m in self._models.items():
+                models[model] = {
+                    "timeout_s": round(m.last_timeout, 2),
+                    "samples": m.histogram.count(),
+                    "p50_s": m.histogram.percentile(50),
+                    "p90_s": m.histogram.percentile(90),
+                    "p99_s": m.histogram.percentile(99),
+                    "calls": m.calls,
+                    "timeouts": m.timeouts,
+                    "errors": m.errors,
+                    "fallback_rate": round((m.timeouts + m.errors) / m.calls, 4) if m.calls else 0.0,
+                }
+            return {
+                "enabled": self.enabled,
+                "percentile": self.percentile,
+                "multiplier": self.multiplier,
+                "min_s": self.min_seconds,
+                "max_s": self.max_seconds,
+                "models": models,
+            }
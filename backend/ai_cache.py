@@ -0,0 +1,214 @@
+"""
+Content-addressed cache for generated AI artifacts.
+
+Children repeat the same problems constantly ("12 x 7", "3/4 + 1/8"), and
+every repeat used to pay full model latency and cost.  :class:`AIArtifactCache`
+stores each generated artifact — math solution, story, mini-games, teaching
+analogy, victory beat — under a SHA-256 of everything its prompt depends on
+plus the prompt template version, in two tiers:
+
+* an in-process LRU with TTL (:class:`backend.cache.TTLCache`) per artifact
+  kind, so repeats on the same worker cost nothing;
+* an optional persistent tier (the ``ai_artifact_cache`` table), shared by
+  every worker and surviving restarts.
+
+Only real model output is stored — never a fallback.  Player-specific text
+is never part of a key: callers replace the player's name with
+:data:`PLAYER_TOKEN` before storing (:func:`template_player`) and put the
+current player's name back after a hit (:func:`fill_player`).
+
+Configuration (environment variables)
+-------------------------------------
+AI_CACHE_ENABLED          – ``0`` turns both tiers off (default 1)
+AI_CACHE_TTL_SECONDS      – artifact lifetime (default 604800, one week)
+AI_CACHE_MAX_ENTRIES      – in-memory entries per artifact kind (default 2000)
+AI_CACHE_DB_MAX_ROWS      – persistent rows kept; oldest pruned (default 200000)
+AI_CACHE_MAX_VALUE_BYTES  – larger artifacts are not cached (default 65536)
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from typing import Any, Callable, Optional
+
+from backend.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+AI_CACHE_ENABLED = os.environ.get("AI_CACHE_ENABLED", "1") != "0"
+AI_CACHE_TTL_SECONDS = int(os.environ.get("AI_CACHE_TTL_SECONDS", "604800"))
+AI_CACHE_MAX_ENTRIES = int(os.environ.get("AI_CACHE_MAX_ENTRIES", "2000"))
+AI_CACHE_DB_MAX_ROWS = int(os.environ.get("AI_CACHE_DB_MAX_ROWS", "200000"))
+AI_CACHE_MAX_VALUE_BYTES = int(os.environ.get("AI_CACHE_MAX_VALUE_BYTES", "65536"))
+
+PLAYER_TOKEN = "{{player}}"
+
+# Persistent rows are pruned (expired first, then oldest) every this many stores.
+_PRUNE_EVERY = 500
+
+
+def template_player(text: str, player_name: str) -> str:
+    """Replace whole-word occurrences of *player_name* with :data:`PLAYER_TOKEN`."""
+    if not player_name:
+        return text
+    return re.sub(rf"(?<!\w){re.escape(player_name)}(?!\w)", PLAYER_TOKEN, text)
+
+
+def fill_player(text: str, player_name: str) -> str:
+    return text.replace(PLAYER_TOKEN, player_name)
+
+
+class AIArtifactCache:
+    """Two-tier, content-addressed store for model outputs."""
+
+    def __init__(
+        self,
+        version: int,
+        load: Optional[Callable[[str], Any]] = None,
+        save: Optional[Callable[[str, str, str, int], None]] = None,
+        prune: Optional[Callable[[int], int]] = None,
+        enabled: bool = AI_CACHE_ENABLED,
+        ttl: int = AI_CACHE_TTL_SECONDS,
+        max_entries: int = AI_CACHE_MAX_ENTRIES,
+        db_max_rows: int = AI_CACHE_DB_MAX_ROWS,
+        max_value_bytes: int = AI_CACHE_MAX_VALUE_BYTES,
+    ):
+        self.version = version
+        self.enabled = enabled
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.db_max_rows = db_max_rows
+        self.max_value_bytes = max_value_bytes
+        self._load = load
+        self._save = save
+        self._prune = prune
+        self._memory: dict[str, TTLCache] = {}
+        self._lock = threading.Lock()
+        self._stores_since_prune = 0
+        self._by_kind: dict[str, dict] = {}
+
+    # ── keys ──────────────────────────────────────────────────────────────────
+
+    def key(self, kind: str, **fields: Any) -> str:
+        """SHA-256 over the template version, the artifact kind and *fields*."""
+        payload = json.dumps([self.version, kind, fields], sort_keys=True, separators=(",", ":"), default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    # ── lookups ───────────────────────────────────────────────────────────────
+
+    def get(self, kind: str, key: str) -> Any:
+        """Cached value or None (blocking: may query the persistent tier)."""
+        if not self.enabled:
+            return None
+        value = self._memory_tier(kind).get(key)
+        if value is not None:
+            self._count(kind, "memory_hits")
+            return value
+        return self._from_persistent(kind, key)
+
+    async def aget(self, kind: str, key: str) -> Any:
+        """:meth:`get` for the event loop; only a memory miss leaves the loop."""
+        if not self.enabled:
+            return None
+        value = self._memory_tier(kind).get(key)
+        if value is not None:
+            self._count(kind, "memory_hits")
+            return value
+        if self._load is None:
+            self._count(kind, "misses")
+            return None
+        return await asyncio.get_running_loop().run_in_executor(None, self._from_persistent, kind, key)
+
+    def _from_persistent(self, kind: str, key: str) -> Any:
+        value = None
+        if self._load is not None:
+            try:
+                raw = self._load(key)
+                if raw is not None:
+                    value = json.loads(raw) if isinstance(raw, (str, bytes)) else raw
+            except Exception as exc:
+                logger.warning(f"[AI_CACHE] Persistent lookup failed: {exc}")
+        if value is None:
+            self._count(kind, "misses")
+            return None
+        self._memory_tier(kind).set(key, value)
+        self._count(kind, "db_hits")
+        return value
+
+    # ── stores ────────────────────────────────────────────────────────────────
+
+    def put(self, kind: str, key: str, value: Any) -> None:
+        """Store *value* in memory now; the persistent write happens in the background."""
+        if not self.enabled or value is None:
+            return
+        encoded = json.dumps(value, separators=(",", ":"))
+        if len(encoded) > self.max_value_bytes:
+            self._count(kind, "too_large")
+            return
+        self._memory_tier(kind).set(key, value)
+        self._count(kind, "stores")
+        if self._save is None:
+            return
+        try:
+            asyncio.get_running_loop().run_in_executor(None, self._persist, kind, key, encoded)
+        except RuntimeError:   # no running loop: sync caller
+            self._persist(kind, key, encoded)
+
+    def _persist(self, kind: str, key: str, encoded: str) -> None:
+        try:
+            self._save(key, kind, encoded, self.ttl)
+        except Exception as exc:
+            logger.warning(f"[AI_CACHE] Persistent store failed: {exc}")
+            return
+        with self._lock:
+            self._stores_since_prune += 1
+            due = self._stores_since_prune >= _PRUNE_EVERY
+            if due:
+                self._stores_since_prune = 0
+        if due and self._prune is not None:
+            try:
+                self._prune(self.db_max_rows)
+            except Exception as exc:
+                logger.warning(f"[AI_CACHE] Prune failed: {exc}")
+
+    def clear(self) -> None:
+        """Drop the in-memory tier (the persistent tier expires on its own)."""
+        with self._lock:
+            tiers = list(self._memory.values())
+        for tier in tiers:
+            tier.clear()
+
+    # ── metrics ───────────────────────────────────────────────────────────────
+
+    def _memory_tier(self, kind: str) -> TTLCache:
+        tier = self._memory.get(kind)
+        if tier is None:
+            with self._lock:
+                tier = self._memory.setdefault(kind, TTLCache(self.max_entries, self.ttl, name=f"ai_{kind}"))
+        return tier
+
+    def _count(self, kind: str, counter: str) -> None:
+        with self._lock:
+            stats = self._by_kind.get(kind)
+            if stats is None:
+                stats = self._by_kind[kind] = {"memory_hits": 0, "db_hits": 0, "misses": 0, "stores": 0, "too_large": 0}
+            stats[counter] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            by_kind = {}
+            for kind, s in self._by_kind.items():
+                lookups = s["memory_hits"] + s["db_hits"] + s["misses"]
+                hits = s["memory_hits"] + s["db_hits"]
+                by_kind[kind] = {
+                    **s,
+                    "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+                    "memory_entries": len(self._memory[kind]) if kind in self._memory else 0,
+                }
+            return {"enabled": self.enabled, "version": self.version, "by_kind": by_kind}
@@ -0,0 +1,259 @@
+"""
+Bounded, instrumented executor for upstream AI calls.
+
+``run_with_timeout()`` used to start a fresh daemon thread per AI call and
+simply walk away from it on timeout.  A slow upstream therefore leaked one
+thread (and one open socket) per request, with no upper bound and no
+visibility.  :class:`AIExecutor` runs every call on one shared, fixed-size
+pool instead:
+
+* at most ``max_workers`` calls are in flight; up to ``max_queue`` more may
+  wait for a worker, and anything beyond that is rejected immediately (the
+  caller takes its usual timeout fallback instead of piling up);
+* a call whose caller gave up while it was still queued is cancelled and
+  never reaches the network;
+* a call that is already running is told its deadline through
+  :func:`time_left`, so the HTTP request itself is made with that timeout
+  and is aborted by the client library when it expires, rather than
+  outliving the caller by a retry cycle or two;
+* queue depth, in-flight calls, rejections, timeouts and calls still
+  running after their caller gave up ("abandoned") are counted per kind
+  for the admin perf endpoint.
+
+Async callers (the ``/api/story`` pipeline) use :meth:`AIExecutor.run_async`
+with the async SDK instead: no thread is held at all, a timeout cancels the
+request outright, and the same per-kind counters are kept.
+
+Configuration (environment variables)
+-------------------------------------
+AI_EXECUTOR_MAX_WORKERS  – concurrent upstream AI calls per worker (default 32)
+AI_EXECUTOR_MAX_QUEUE    – calls allowed to wait for a free slot (default 64)
+AI_ASYNC_MAX_IN_FLIGHT   – concurrent async AI calls per worker (default 256)
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Any, Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+AI_EXECUTOR_MAX_WORKERS = int(os.environ.get("AI_EXECUTOR_MAX_WORKERS", "32"))
+AI_EXECUTOR_MAX_QUEUE = int(os.environ.get("AI_EXECUTOR_MAX_QUEUE", "64"))
+AI_ASYNC_MAX_IN_FLIGHT = int(os.environ.get("AI_ASYNC_MAX_IN_FLIGHT", "256"))
+
+_current = threading.local()
+
+
+def time_left(default: float) -> float:
+    """Seconds until the running AI call's deadline (``default`` outside one).
+
+    Pass this as the SDK's per-request ``timeout`` so the HTTP request is
+    abandoned by the client itself once the caller has stopped waiting.
+    """
+    deadline = getattr(_current, "deadline", None)
+    if deadline is None:
+        return default
+    return max(0.1, min(default, deadline - time.monotonic()))
+
+
+class _Call:
+    __slots__ = ("kind", "deadline", "started", "done", "abandoned")
+
+    def __init__(self, kind: str, deadline: float):
+        self.kind = kind
+        self.deadline = deadline
+        self.started = False
+        self.done = False
+        self.abandoned = False
+
+
+class AIExecutor:
+    """Fixed pool + bounded queue for blocking AI SDK calls."""
+
+    def __init__(
+        self,
+        max_workers: int = AI_EXECUTOR_MAX_WORKERS,
+        max_queue: int = AI_EXECUTOR_MAX_QUEUE,
+        max_async_in_flight: int = AI_ASYNC_MAX_IN_FLIGHT,
+    ):
+        if max_workers < 1:
+            raise ValueError("max_workers must be >= 1")
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.max_async_in_flight = max_async_in_flight
+        self._async_slots: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()   # per event loop
+        self._async_in_flight = 0
+        self._max_async_in_flight = 0
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ai-call")
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._in_flight = 0
+        self._abandoned_running = 0
+
+        # Counters for the admin perf endpoint
+        self._max_queued = 0
+        self._max_in_flight = 0
+        self._by_kind: dict[str, dict] = {}
+
+    # ── calling ───────────────────────────────────────────────────────────────
+
+    def run(self, fn: Callable[[], Any], timeout: float, kind: str = "ai") -> tuple[Optional[Any], bool]:
+        """Run ``fn()`` on the pool and wait up to *timeout* seconds.
+
+        Returns ``(value, False)`` on success and ``(None, True)`` on timeout
+        or when the executor is saturated; exceptions raised by ``fn``
+        propagate, exactly like the old ``run_with_timeout``.
+        """
+        call = _Call(kind, time.monotonic() + timeout)
+        with self._lock:
+            stats = self._kind_stats(kind)
+            stats["calls"] += 1
+            # Queued calls that a free worker is about to pick up don't count.
+            waiting = self._queued - (self.max_workers - self._in_flight)
+            if waiting >= self.max_queue:
+                stats["rejected"] += 1
+                logger.warning("[AI] Executor saturated (%d in flight, %d queued); rejecting %s call",
+                               self._in_flight, self._queued, kind)
+                return None, True
+            self._queued += 1
+            self._max_queued = max(self._max_queued, self._queued)
+        future = self._pool.submit(self._invoke, fn, call)
+        try:
+            return future.result(timeout=timeout), False
+        except FutureTimeout:
+            cancelled = future.cancel()
+            with self._lock:
+                stats["timeouts"] += 1
+                if cancelled:
+                    # Never started: it held a queue slot but no socket.
+                    self._queued -= 1
+                    stats["cancelled_queued"] += 1
+                elif not call.done:
+                    call.abandoned = True
+                    self._abandoned_running += 1
+                    stats["abandoned"] += 1
+            return None, True
+
+    def _invoke(self, fn: Callable[[], Any], call: _Call) -> Any:
+        with self._lock:
+            self._queued -= 1
+            self._in_flight += 1
+            self._max_in_flight = max(self._max_in_flight, self._in_flight)
+            call.started = True
+        started = time.monotonic()
+        _current.deadline = call.deadline
+        failed = False
+        try:
+            if started >= call.deadline:
+                return None   # the caller has already given up
+            return fn()
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            _current.deadline = None
+            elapsed = time.monotonic() - started
+            with self._lock:
+                self._in_flight -= 1
+                call.done = True
+                if call.abandoned:
+                    self._abandoned_running -= 1
+                stats = self._kind_stats(call.kind)
+                stats["completed"] += 1
+                stats["failed"] += failed
+                stats["total_s"] += elapsed
+                stats["max_s"] = max(stats["max_s"], elapsed)
+
+    async def run_async(
+        self, make_call: Callable[[], Awaitable[Any]], timeout: float, kind: str = "ai",
+    ) -> tuple[Optional[Any], bool]:
+        """Async twin of :meth:`run`: await ``make_call()`` for up to *timeout* s.
+
+        On timeout the awaitable is cancelled, which closes its HTTP request.
+        Waiting for one of the ``max_async_in_flight`` slots counts against
+        the same timeout.
+        """
+        loop = asyncio.get_running_loop()
+        slots = self._async_slots.get(loop)
+        if slots is None:
+            slots = self._async_slots.setdefault(loop, asyncio.Semaphore(self.max_async_in_flight))
+        with self._lock:
+            stats = self._kind_stats(kind)
+            stats["calls"] += 1
+
+        async def _guarded():
+            async with slots:
+                with self._lock:
+                    self._async_in_flight += 1
+                    self._max_async_in_flight = max(self._max_async_in_flight, self._async_in_flight)
+                started = time.monotonic()
+                failed = False
+                try:
+                    return await make_call()
+                except Exception:
+                    failed = True
+                    raise
+                finally:
+                    elapsed = time.monotonic() - started
+                    with self._lock:
+                        self._async_in_flight -= 1
+                        stats["completed"] += 1
+                        stats["failed"] += failed
+                        stats["total_s"] += elapsed
+                        stats["max_s"] = max(stats["max_s"], elapsed)
+
+        try:
+            return await asyncio.wait_for(_guarded(), timeout), False
+        except asyncio.TimeoutError:
+            with self._lock:
+                stats["timeouts"] += 1
+            return None, True
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    # ── metrics ───────────────────────────────────────────────────────────────
+
+    def _kind_stats(self, kind: str) -> dict:
+        stats = self._by_kind.get(kind)
+        if stats is None:
+            stats = self._by_kind[kind] = {
+                "calls": 0, "completed": 0, "failed": 0, "timeouts": 0, "rejected": 0,
+                "cancelled_queued": 0, "abandoned": 0, "total_s": 0.0, "max_s": 0.0,
+            }
+        return stats
+
+    def stats(self) -> dict:
+        with self._lock:
+            by_kind = {}
+            for kind, s in self._by_kind.items():
+                by_kind[kind] = {
+                    "calls": s["calls"],
+                    "completed": s["completed"],
+                    "failed": s["failed"],
+                    "timeouts": s["timeouts"],
+                    "rejected": s["rejected"],
+                    "cancelled_queued": s["cancelled_queued"],
+                    "abandoned": s["abandoned"],
+                    "avg_ms": round(s["total_s"] * 1000 / s["completed"], 1) if s["completed"] else 0.0,
+                    "max_ms": round(s["max_s"] * 1000, 1),
+                }
+            return {
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "queued": self._queued,
+                "in_flight": self._in_flight,
+                "abandoned_running": self._abandoned_running,
+                "async_in_flight": self._async_in_flight,
+                "max_async_in_flight": self._max_async_in_flight,
+                "max_queued": self._max_queued,
+                "max_in_flight": self._max_in_flight,
+                "by_kind": by_kind,
+            }
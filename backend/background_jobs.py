@@ -0,0 +1,373 @@
+"""
+In-process background jobs for work a response should not wait for.
+
+The quick-math fast path of ``/api/story`` answers from static content and
+hands the AI enrichment (teaching analogy, victory beat) to
+:class:`BackgroundJobs`; the client then polls for the result with the job
+id it was given.  Jobs are asyncio tasks on the worker's event loop and are
+kept, with their result, until they expire or the store is full.  Job ids
+are only meaningful to the worker that issued them, so ``main.py`` only
+offers jobs when a single worker serves the app (``WEB_CONCURRENCY=1``).
+
+:class:`JobQueue` is the client-facing variant behind ``/api/story/jobs``:
+long quests answered with a job id instead of holding a connection open
+for 20–50 s.  Jobs go *queued* → *running* → *done* / *failed*:
+
+* At most ``STORY_JOB_WORKERS`` jobs run at once; the rest wait their turn.
+  A full queue, or an owner (session) that already has
+  ``STORY_JOB_PER_SESSION`` jobs queued or running, is refused with
+  :class:`JobRejected`.
+* A running job reports partial results as it goes; every change bumps the
+  job's ``version``, which :meth:`JobQueue.wait` long-polls on.
+* A job that raises :class:`JobFailed` fails with that status and detail.
+
+Configuration (environment variables)
+-------------------------------------
+BACKGROUND_JOB_TTL_SECONDS  – how long a job and its result are kept (default 600)
+BACKGROUND_JOB_MAX          – jobs kept per worker; the oldest go first (default 10000)
+STORY_JOB_WORKERS           – story jobs running at once per worker (default 8)
+STORY_JOB_QUEUE_MAX         – story jobs waiting for a slot before new ones are refused (default 200)
+STORY_JOB_PER_SESSION       – queued or running story jobs allowed per session (default 2)
+STORY_JOB_TTL_SECONDS       – how long a story job and its result are kept (default 600)
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import secrets
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+BACKGROUND_JOB_TTL_SECONDS = float(os.environ.get("BACKGROUND_JOB_TTL_SECONDS", "600"))
+BACKGROUND_JOB_MAX = int(os.environ.get("BACKGROUND_JOB_MAX", "10000"))
+STORY_JOB_WORKERS = int(os.environ.get("STORY_JOB_WORKERS", "8"))
+STORY_JOB_QUEUE_MAX = int(os.environ.get("STORY_JOB_QUEUE_MAX", "200"))
+STORY_JOB_PER_SESSION = int(os.environ.get("STORY_JOB_PER_SESSION", "2"))
+STORY_JOB_TTL_SECONDS = float(os.environ.get("STORY_JOB_TTL_SECONDS", "600"))
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class _Job:
+    __slots__ = ("kind", "created", "task", "result", "failed")
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.created = time.monotonic()
+        self.task: Optional[asyncio.Task] = None
+        self.result: Any = None
+        self.failed = False
+
+
+class BackgroundJobs:
+    """TTL- and size-bounded registry of fire-and-forget asyncio jobs."""
+
+    def __init__(self, ttl: float = BACKGROUND_JOB_TTL_SECONDS, max_jobs: int = BACKGROUND_JOB_MAX):
+        self.ttl = ttl
+        self.max_jobs = max_jobs
+        self._jobs: OrderedDict[str, _Job] = OrderedDict()   # oldest first
+        self._lock = threading.Lock()
+
+        # Counters for the admin perf endpoint
+        self._started = 0
+        self._completed = 0
+        self._failed = 0
+        self._evicted = 0
+
+    def start(self, make_coro: Callable[[], Awaitable[Any]], kind: str = "job") -> str:
+        """Schedule ``make_coro()`` on the running loop; returns its job id."""
+        job_id = secrets.token_urlsafe(16)
+        job = _Job(kind)
+        with self._lock:
+            self._prune()
+            self._jobs[job_id] = job
+            self._started += 1
+        job.task = asyncio.get_running_loop().create_task(self._run(job, make_coro))
+        return job_id
+
+    async def _run(self, job: _Job, make_coro: Callable[[], Awaitable[Any]]) -> None:
+        try:
+            job.result = await make_coro()
+            with self._lock:
+                self._completed += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("[JOBS] %s job failed", job.kind)
+            job.failed = True
+            with self._lock:
+                self._failed += 1
+
+    def get(self, job_id: str) -> Optional[dict]:
+        """``{"status": "pending" | "done" | "failed", "result": …}`` or None."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or time.monotonic() - job.created > self.ttl:
+                return None
+        if job.failed:
+            return {"status": "failed", "result": None}
+        if job.task is None or not job.task.done():
+            return {"status": "pending", "result": None}
+        return {"status": "done", "result": job.result}
+
+    def _prune(self) -> None:
+        """Drop expired jobs, then the oldest ones beyond ``max_jobs`` (lock held)."""
+        now = time.monotonic()
+        while self._jobs:
+            job_id, job = next(iter(self._jobs.items()))
+            if now - job.created <= self.ttl and len(self._jobs) < self.max_jobs:
+                break
+            del self._jobs[job_id]
+            self._evicted += 1
+            if job.task is not None and not job.task.done():
+                job.task.cancel()
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = sum(1 for job in self._jobs.values() if job.task is not None and not job.task.done())
+            return {
+                "jobs": len(self._jobs),
+                "pending": pending,
+                "started": self._started,
+                "completed": self._completed,
+                "failed": self._failed,
+                "evicted": self._evicted,
+            }
+
+
+class JobRejected(Exception):
+    """:meth:`JobQueue.submit` refused a job; *reason* is ``queue_full`` or ``owner_limit``."""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class JobFailed(Exception):
+    """Raised by a job to fail with a client-facing *status* and *detail*."""
+
+    def __init__(self, status: int, detail: str):
+        super().__init__(detail)
+        self.status = status
+        self.detail = detail
+
+
+class _QueuedJob:
+    __slots__ = ("kind", "owner", "created", "started", "status", "version",
+                 "partial", "result", "error", "task", "changed")
+
+    def __init__(self, kind: str, owner: str):
+        self.kind = kind
+        self.owner = owner
+        self.created = time.monotonic()
+        self.started: Optional[float] = None
+        self.status = QUEUED
+        self.version = 0
+        self.partial: dict = {}
+        self.result: Any = None
+        self.error: Optional[dict] = None
+        self.task: Optional[asyncio.Task] = None
+        self.changed = asyncio.Event()
+
+
+class JobQueue:
+    """Bounded pool of client-visible jobs with partial results and long-polling.
+
+    Jobs and their waiters live on the worker's event loop; only
+    :meth:`stats` may be called from other threads.
+    """
+
+    def __init__(
+        self,
+        workers: int = STORY_JOB_WORKERS,
+        max_queued: int = STORY_JOB_QUEUE_MAX,
+        per_owner: int = STORY_JOB_PER_SESSION,
+        ttl: float = STORY_JOB_TTL_SECONDS,
+        max_jobs: int = BACKGROUND_JOB_MAX,
+    ):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.per_owner = per_owner
+        self.ttl = ttl
+        self.max_jobs = max_jobs
+        self._jobs: OrderedDict[str, _QueuedJob] = OrderedDict()   # oldest first
+        self._slots: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()   # loop -> Semaphore
+        self._lock = threading.Lock()
+
+        # Counters for the admin perf endpoint
+        self._submitted = 0
+        self._started = 0
+        self._completed = 0
+        self._failed = 0
+        self._dropped = 0
+        self._rejected = {"queue_full": 0, "owner_limit": 0}
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._run_total = 0.0
+
+    def submit(
+        self,
+        make_coro: Callable[[Callable[[dict], None]], Awaitable[Any]],
+        owner: str,
+        kind: str = "job",
+        on_drop: Optional[Callable[[], Awaitable[Any]]] = None,
+    ) -> str:
+        """Queue ``make_coro(report)``; returns its job id or raises :class:`JobRejected`.
+
+        The job calls ``report(partial)`` with its partial result so far.
+        *on_drop* is awaited if the job is dropped (expired, evicted) before
+        it got a slot.
+        """
+        job_id = secrets.token_urlsafe(16)
+        job = _QueuedJob(kind, owner)
+        with self._lock:
+            self._prune()
+            active = [j for j in self._jobs.values() if j.status in (QUEUED, RUNNING)]
+            if sum(1 for j in active if j.owner == owner) >= self.per_owner:
+                reason = "owner_limit"
+            elif len(active) >= self.workers + self.max_queued:
+                reason = "queue_full"
+            else:
+                reason = None
+            if reason is not None:
+                self._rejected[reason] += 1
+                raise JobRejected(reason)
+            self._jobs[job_id] = job
+            self._submitted += 1
+        job.task = asyncio.get_running_loop().create_task(self._run(job, make_coro, on_drop))
+        return job_id
+
+    async def _run(
+        self, job: _QueuedJob, make_coro: Callable[[Callable[[dict], None]], Awaitable[Any]],
+        on_drop: Optional[Callable[[], Awaitable[Any]]],
+    ) -> None:
+        slots = self._slots_for(asyncio.get_running_loop())
+        try:
+            await slots.acquire()
+        except asyncio.CancelledError:
+            if on_drop is not None:
+                await on_drop()
+            raise
+        try:
+            job.started = time.monotonic()
+            waited = job.started - job.created
+            with self._lock:
+                self._started += 1
+                self._wait_total += waited
+                self._wait_max = max(self._wait_max, waited)
+            self._update(job, RUNNING)
+
+            def _report(partial: dict) -> None:
+                job.partial = partial
+                self._update(job)
+
+            try:
+                job.result = await make_coro(_report)
+            except JobFailed as exc:
+                job.error = {"status": exc.status, "detail": exc.detail}
+            except Exception:
+                logger.exception("[JOBS] %s job failed", job.kind)
+                job.error = {"status": 500, "detail": "Job failed"}
+            with self._lock:
+                self._run_total += time.monotonic() - job.started
+                if job.error is None:
+                    self._completed += 1
+                else:
+                    self._failed += 1
+            self._update(job, DONE if job.error is None else FAILED)
+        finally:
+            slots.release()
+
+    def _slots_for(self, loop: asyncio.AbstractEventLoop) -> asyncio.Semaphore:
+        with self._lock:
+            slots = self._slots.get(loop)
+            if slots is None:
+                slots = self._slots[loop] = asyncio.Semaphore(self.workers)
+            return slots
+
+    def _update(self, job: _QueuedJob, status: Optional[str] = None) -> None:
+        """Record a change to *job* and wake its long-pollers."""
+        if status is not None:
+            job.status = status
+        job.version += 1
+        changed, job.changed = job.changed, asyncio.Event()
+        changed.set()
+
+    def get(self, job_id: str) -> Optional[dict]:
+        """The job's current view (see :meth:`wait`), or None if unknown or expired."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or time.monotonic() - job.created > self.ttl:
+                return None
+            view = {"status": job.status, "version": job.version}
+            if job.status == QUEUED:
+                view["queued_ahead"] = sum(
+                    1 for j in self._jobs.values() if j.status == QUEUED and j.created < job.created
+                )
+        if job.status == DONE:
+            view["result"] = job.result
+        elif job.status == FAILED:
+            view["error"] = job.error
+        else:
+            view["partial"] = job.partial
+        return view
+
+    async def wait(self, job_id: str, since: int = 0, timeout: float = 0.0) -> Optional[dict]:
+        """Long-poll: the job's view once its ``version`` passes *since*, it ends, or *timeout* passes.
+
+        ``{"status", "version", "partial" | "result" | "error"}``; None if
+        the job is unknown or expired.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                job = self._jobs.get(job_id)
+            view = self.get(job_id)
+            left = deadline - time.monotonic()
+            if view is None or view["version"] > since or view["status"] in (DONE, FAILED) or left <= 0:
+                return view
+            try:
+                await asyncio.wait_for(job.changed.wait(), left)
+            except asyncio.TimeoutError:
+                pass
+
+    def _prune(self) -> None:
+        """Drop expired jobs, then the oldest ones beyond ``max_jobs`` (lock held)."""
+        now = time.monotonic()
+        while self._jobs:
+            job_id, job = next(iter(self._jobs.items()))
+            if now - job.created <= self.ttl and len(self._jobs) < self.max_jobs:
+                break
+            del self._jobs[job_id]
+            if job.task is not None and not job.task.done():
+                self._dropped += 1
+                job.task.cancel()
+
+    def stats(self) -> dict:
+        with self._lock:
+            statuses = [job.status for job in self._jobs.values()]
+            finished = self._completed + self._failed
+            return {
+                "workers": self.workers,
+                "queued": statuses.count(QUEUED),
+                "running": statuses.count(RUNNING),
+                "jobs": len(statuses),
+                "submitted": self._submitted,
+                "completed": self._completed,
+                "failed": self._failed,
+                "dropped": self._dropped,
+                "rejected": dict(self._rejected),
+                "avg_queue_wait_ms": round(self._wait_total * 1000 / self._started, 1) if self._started else 0.0,
+                "max_queue_wait_ms": round(self._wait_max * 1000, 1),
+                "avg_run_ms": round(self._run_total * 1000 / finished, 1) if finished else 0.0,
+            }
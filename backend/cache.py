@@ -0,0 +1,103 @@
+"""
+Small in-process caches shared by the backend.
+
+:class:`TTLCache` is a thread-safe LRU map whose entries also expire after a
+time-to-live.  It keeps hit / miss / eviction counters so every cache built
+on it can be surfaced through the admin perf endpoint.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Bounded LRU cache with a per-entry time-to-live.
+
+    * ``get`` refreshes recency; expired entries count as misses.
+    * ``set`` evicts the least-recently-used entry once ``maxsize`` is hit.
+    * ``invalidate`` removes a key explicitly (e.g. on a webhook).
+    """
+
+    def __init__(self, maxsize: int, ttl: float, name: str = ""):
+        if maxsize < 1:
+            raise ValueError("maxsize must be >= 1")
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._data: OrderedDict[Hashable, tuple[Any, float]] = OrderedDict()  # key -> (value, expires_at)
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._invalidations = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                self._misses += 1
+                return default
+            value, expires_at = entry
+            if expires_at <= now:
+                del self._data[key]
+                self._expirations += 1
+                self._misses += 1
+                return default
+            self._data.move_to_end(key)
+            self._hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None) -> None:
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self._evictions += 1
+
+    def invalidate(self, key: Hashable) -> bool:
+        """Drop *key*; returns True if it was cached."""
+        with self._lock:
+            if self._data.pop(key, _MISSING) is _MISSING:
+                return False
+            self._invalidations += 1
+            return True
+
+    def clear(self) -> int:
+        with self._lock:
+            count = len(self._data)
+            self._data.clear()
+            return count
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            return entry is not _MISSING and entry[1] > time.monotonic()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl_s": self.ttl,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 4) if lookups else 0.0,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+                "invalidations": self._invalidations,
+            }
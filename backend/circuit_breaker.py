@@ -0,0 +1,199 @@
+"""
+Per-model circuit breakers for upstream AI calls.
+
+When an Azure deployment degrades, every request that uses it used to wait
+its full ``AI_*_TIMEOUT_SECONDS + TIMEOUT_BUFFER_SECONDS`` before taking the
+static fallback.  :class:`CircuitBreakers` keeps one breaker per model
+deployment:
+
+* **closed** – calls go through; outcomes are kept for a rolling window.
+  Once the window holds ``AI_BREAKER_MIN_CALLS`` calls and either the share
+  of failures (errors and timeouts) or the share of slow calls (over
+  ``AI_BREAKER_SLOW_FRACTION`` of the call's own timeout) crosses its
+  threshold, the breaker opens.
+* **open** – calls are refused at once, so callers go straight to their
+  fallback (timeout story segments, static analogies, ...).  After
+  ``AI_BREAKER_OPEN_SECONDS`` the breaker turns half-open.
+* **half-open** – up to ``AI_BREAKER_HALF_OPEN_PROBES`` calls are let
+  through as probes; if they all succeed the breaker closes, and the first
+  failed or slow probe re-opens it.
+
+Thread-safe: blocking callers on the AI executor and the async story
+pipeline share the same breakers.
+
+Configuration (environment variables)
+-------------------------------------
+AI_BREAKER_ENABLED          – set to ``0`` to disable the breakers (default on)
+AI_BREAKER_WINDOW_SECONDS   – rolling window of call outcomes (default 60)
+AI_BREAKER_MIN_CALLS        – calls in the window before the breaker may open (default 10)
+AI_BREAKER_FAILURE_PERCENT  – failed calls that open the breaker (default 50)
+AI_BREAKER_SLOW_PERCENT     – slow calls that open the breaker (default 80)
+AI_BREAKER_SLOW_FRACTION    – a call is slow past this fraction of its timeout (default 0.8)
+AI_BREAKER_OPEN_SECONDS     – time spent open before probing (default 30)
+AI_BREAKER_HALF_OPEN_PROBES – successful probes needed to close again (default 2)
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+AI_BREAKER_ENABLED = os.environ.get("AI_BREAKER_ENABLED", "1") == "1"
+AI_BREAKER_WINDOW_SECONDS = float(os.environ.get("AI_BREAKER_WINDOW_SECONDS", "60"))
+AI_BREAKER_MIN_CALLS = int(os.environ.get("AI_BREAKER_MIN_CALLS", "10"))
+AI_BREAKER_FAILURE_PERCENT = float(os.environ.get("AI_BREAKER_FAILURE_PERCENT", "50"))
+AI_BREAKER_SLOW_PERCENT = float(os.environ.get("AI_BREAKER_SLOW_PERCENT", "80"))
+AI_BREAKER_SLOW_FRACTION = float(os.environ.get("AI_BREAKER_SLOW_FRACTION", "0.8"))
+AI_BREAKER_OPEN_SECONDS = float(os.environ.get("AI_BREAKER_OPEN_SECONDS", "30"))
+AI_BREAKER_HALF_OPEN_PROBES = int(os.environ.get("AI_BREAKER_HALF_OPEN_PROBES", "2"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class _Breaker:
+    __slots__ = ("state", "outcomes", "opened_at", "probes", "probe_successes",
+                 "opened", "rejected", "last_reason")
+
+    def __init__(self):
+        self.state = CLOSED
+        self.outcomes: deque[tuple[float, bool, bool]] = deque()   # (at, failed, slow)
+        self.opened_at = 0.0
+        self.probes = 0
+        self.probe_successes = 0
+        self.opened = 0
+        self.rejected = 0
+        self.last_reason: Optional[str] = None
+
+
+class CircuitBreakers:
+    """One closed / open / half-open breaker per model deployment."""
+
+    def __init__(
+        self,
+        enabled: bool = AI_BREAKER_ENABLED,
+        window: float = AI_BREAKER_WINDOW_SECONDS,
+        min_calls: int = AI_BREAKER_MIN_CALLS,
+        failure_percent: float = AI_BREAKER_FAILURE_PERCENT,
+        slow_percent: float = AI_BREAKER_SLOW_PERCENT,
+        slow_fraction: float = AI_BREAKER_SLOW_FRACTION,
+        open_seconds: float = AI_BREAKER_OPEN_SECONDS,
+        half_open_probes: int = AI_BREAKER_HALF_OPEN_PROBES,
+    ):
+        self.enabled = enabled
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_rate = failure_percent / 100
+        self.slow_rate = slow_percent / 100
+        self.slow_fraction = slow_fraction
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self._lock = threading.Lock()
+        self._breakers: dict[str, _Breaker] = {}
+
+    def allow(self, model: str) -> bool:
+        """May a call to *model* go out now?  ``False`` means take the fallback."""
+        if not self.enabled:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            breaker = self._breaker(model)
+            if breaker.state == OPEN and now - breaker.opened_at >= self.open_seconds:
+                breaker.state = HALF_OPEN
+                breaker.probes = 0
+                breaker.probe_successes = 0
+                logger.info("[AI] Breaker for %s half-open; probing", model)
+            if breaker.state == CLOSED:
+                return True
+            if breaker.state == HALF_OPEN and breaker.probes < self.half_open_probes:
+                breaker.probes += 1
+                return True
+            breaker.rejected += 1
+            return False
+
+    def record(self, model: str, ok: bool, elapsed: float, timeout: float) -> None:
+        """Report the outcome of a call :meth:`allow` let through."""
+        if not self.enabled:
+            return
+        failed = not ok
+        slow = elapsed >= timeout * self.slow_fraction
+        now = time.monotonic()
+        with self._lock:
+            breaker = self._breaker(model)
+            if breaker.state == HALF_OPEN:
+                if failed or slow:
+                    self._open(model, breaker, now, "probe failed" if failed else "probe slow")
+                else:
+                    breaker.probe_successes += 1
+                    if breaker.probe_successes >= self.half_open_probes:
+                        breaker.state = CLOSED
+                        breaker.outcomes.clear()
+                        logger.info("[AI] Breaker for %s closed", model)
+                return
+            if breaker.state == OPEN:
+                return   # a call that started before the breaker opened
+            breaker.outcomes.append((now, failed, slow))
+            self._trim(breaker, now)
+            calls = len(breaker.outcomes)
+            if calls < self.min_calls:
+                return
+            failures = sum(1 for _, f, _ in breaker.outcomes if f)
+            slows = sum(1 for _, _, s in breaker.outcomes if s)
+            if failures >= calls * self.failure_rate:
+                self._open(model, breaker, now, f"{failures}/{calls} calls failed")
+            elif slows >= calls * self.slow_rate:
+                self._open(model, breaker, now, f"{slows}/{calls} calls slow")
+
+    def cancel(self, model: str) -> None:
+        """A call :meth:`allow` let through was abandoned by its caller; no verdict."""
+        if not self.enabled:
+            return
+        with self._lock:
+            breaker = self._breaker(model)
+            if breaker.state == HALF_OPEN and breaker.probes > breaker.probe_successes:
+                breaker.probes -= 1
+
+    def _open(self, model: str, breaker: _Breaker, now: float, reason: str) -> None:
+        breaker.state = OPEN
+        breaker.opened_at = now
+        breaker.opened += 1
+        breaker.last_reason = reason
+        breaker.outcomes.clear()
+        logger.warning("[AI] Breaker for %s opened (%s); using fallbacks for %.0fs",
+                       model, reason, self.open_seconds)
+
+    def _trim(self, breaker: _Breaker, now: float) -> None:
+        cutoff = now - self.window
+        while breaker.outcomes and breaker.outcomes[0][0] < cutoff:
+            breaker.outcomes.popleft()
+
+    def _breaker(self, model: str) -> _Breaker:
+        breaker = self._breakers.get(model)
+        if breaker is None:
+            breaker = self._breakers[model] = _Breaker()
+        return breaker
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            models = {}
+            for model, b in self._breakers.items():
+                self._trim(b, now)
+                models[model] = {
+                    "state": b.state,
+                    "window_calls": len(b.outcomes),
+                    "window_failures": sum(1 for _, f, _ in b.outcomes if f),
+                    "window_slow": sum(1 for _, _, s in b.outcomes if s),
+                    "times_opened": b.opened,
+                    "rejected": b.rejected,
+                    "last_reason": b.last_reason,
+                    "retry_in_s": round(max(0.0, b.opened_at + self.open_seconds - now), 1) if b.state == OPEN else None,
+                }
+            return {"enabled": self.enabled, "models": models}
@@ -1,13 +1,21 @@
 import json
 import os
 import psycopg2
+import psycopg2.extras
 import logging
+import contextlib
+from dataclasses import dataclass
 from threading import Lock
 from datetime import date
 
+from backend.cache import TTLCache
+from backend.db_pool import ConnectionPool, AsyncConnectionPool
+from backend.session_model import decode_session
+
 logger = logging.getLogger(__name__)
 
 FREE_DAILY_LIMIT = 6
+PREMIUM_STATUSES = ("active", "trialing")
 
 _memory_lock = Lock()
 _memory_users = {}
@@ -79,14 +87,94 @@ def _memory_increment_usage(session_id):
 _DB_CONNECT_TIMEOUT_SECONDS = 10  # Max wait for PostgreSQL TCP handshake
 
 
-def get_db_connection():
+def _normalized_database_url() -> str:
     db_url = _database_url()
     if not db_url:
         raise RuntimeError("DATABASE_URL is not configured")
     # psycopg2 requires the postgresql:// scheme; many providers emit postgres://
     if db_url.startswith("postgres://"):
         db_url = db_url.replace("postgres://", "postgresql://", 1)
-    return psycopg2.connect(db_url, connect_timeout=_DB_CONNECT_TIMEOUT_SECONDS)
+    return db_url
+
+
+def connect_direct():
+    """Open a brand-new, unpooled connection.
+
+    Only for callers that must own a dedicated socket (benchmarks, LISTEN
+    loops).  Everything else should go through :func:`get_db_connection`.
+    """
+    return psycopg2.connect(_normalized_database_url(), connect_timeout=_DB_CONNECT_TIMEOUT_SECONDS)
+
+
+# ── Connection pool ───────────────────────────────────────────────────────────
+# One pool per process, created lazily on first use and rebuilt if
+# DATABASE_URL changes (e.g. after the Key Vault bootstrap thread lands it).
+
+_pool_lock = Lock()
+_pool: ConnectionPool | None = None
+_pool_url: str = ""
+_async_pool: AsyncConnectionPool | None = None
+
+
+def get_db_pool() -> ConnectionPool:
+    """Return the process-wide :class:`ConnectionPool` (thread-safe)."""
+    global _pool, _pool_url, _async_pool
+    db_url = _normalized_database_url()
+    pool = _pool
+    if pool is not None and _pool_url == db_url:
+        return pool
+    with _pool_lock:
+        if _pool is None or _pool_url != db_url:
+            stale = _pool
+            _pool = ConnectionPool(
+                lambda: psycopg2.connect(db_url, connect_timeout=_DB_CONNECT_TIMEOUT_SECONDS)
+            )
+            _pool_url = db_url
+            _async_pool = AsyncConnectionPool(_pool)
+            if stale is not None:
+                stale.close()
+        return _pool
+
+
+def get_async_db_pool() -> AsyncConnectionPool:
+    """Return the ``asyncio`` front-end of the process-wide pool."""
+    get_db_pool()
+    return _async_pool
+
+
+def get_db_connection():
+    """Check a connection out of the pool.
+
+    The returned object behaves like a psycopg2 connection; calling
+    ``close()`` hands it back to the pool instead of closing the socket.
+    """
+    return get_db_pool().acquire()
+
+
+@contextlib.contextmanager
+def db_connection():
+    """``with db_connection() as conn:`` — the connection is always returned
+    to the pool, and any uncommitted transaction is rolled back."""
+    conn = get_db_connection()
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+def get_db_pool_stats() -> dict | None:
+    """Pool counters for the admin perf endpoint, or None if no pool exists yet."""
+    pool = _pool
+    return pool.stats() if pool is not None else None
+
+
+def close_db_pool() -> None:
+    """Close all pooled connections (called on application shutdown)."""
+    global _pool, _async_pool
+    with _pool_lock:
+        pool, _pool, _async_pool = _pool, None, None
+    if pool is not None:
+        pool.close()
 
 
 # ── Feature flag defaults — single source of truth ───────────────────────────
@@ -180,6 +268,18 @@ def init_db():
             ALTER TABLE leads
                 ADD COLUMN IF NOT EXISTS email_sent BOOLEAN NOT NULL DEFAULT false;
         """)
+        # Bumped on every session write; lets workers sharing game_sessions
+        # detect that another worker saved a session since they loaded it.
+        cur.execute("""
+            ALTER TABLE game_sessions
+                ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT 0;
+        """)
+        # Binary session document (see backend/session_model.py).  When set it
+        # supersedes ``data``; rows written by older builds only have ``data``.
+        cur.execute("""
+            ALTER TABLE game_sessions
+                ADD COLUMN IF NOT EXISTS blob BYTEA;
+        """)
         # ── Auth users table — persists registered accounts across restarts ─────
         # Primary persistent store for email/password (hashed) credentials.
         # Cosmos DB and the in-memory dict are used as secondary/fallback layers.
@@ -196,6 +296,37 @@ def init_db():
             );
         """)
 
+        # ── Quest history — append-only log, one row per completed quest ────
+        # Sessions keep only a short recent window; the full history lives
+        # here and is read page by page (parent dashboard, PDF report).
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS quest_history (
+                id          BIGSERIAL PRIMARY KEY,
+                session_id  TEXT NOT NULL,
+                entry       JSONB NOT NULL,
+                created_at  TIMESTAMP DEFAULT NOW()
+            );
+        """)
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_quest_history_session
+                ON quest_history (session_id, id DESC);
+        """)
+
+        # ── AI artifact cache — persistent tier of backend/ai_cache.py ──────
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS ai_artifact_cache (
+                cache_key   TEXT PRIMARY KEY,
+                kind        TEXT NOT NULL,
+                value       JSONB NOT NULL,
+                created_at  TIMESTAMP DEFAULT NOW(),
+                expires_at  TIMESTAMP NOT NULL
+            );
+        """)
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_ai_artifact_cache_created
+                ON ai_artifact_cache (created_at);
+        """)
+
         # Seed default flags (INSERT … ON CONFLICT DO NOTHING so existing
         # admin-toggled values are never overwritten on restart).
         for flag_name, (is_active, description) in _DEFAULT_FEATURE_FLAGS.items():
@@ -240,6 +371,7 @@ def get_or_create_user(session_id):
             )
             row = cur.fetchone()
             conn.commit()
+        _remember_status(session_id, row[3])
         return {
             "session_id": row[0],
             "stripe_customer_id": row[1],
@@ -256,10 +388,40 @@ def get_or_create_user(session_id):
             conn.close()
 
 
+# ── Premium-status cache ──────────────────────────────────────────────────────
+# Subscription status only changes when the Stripe webhook calls
+# update_user_stripe(), yet hero-unlock checks and the image endpoints ask for
+# it on every request.  Statuses are cached per session_id and dropped
+# explicitly on every Stripe write; the TTL bounds staleness on *other*
+# workers, which never see this process's invalidations.
+
+PREMIUM_CACHE_TTL_SECONDS = int(os.environ.get("PREMIUM_CACHE_TTL_SECONDS", "120"))
+PREMIUM_CACHE_MAX_ENTRIES = int(os.environ.get("PREMIUM_CACHE_MAX_ENTRIES", "10000"))
+
+_premium_cache = TTLCache(PREMIUM_CACHE_MAX_ENTRIES, PREMIUM_CACHE_TTL_SECONDS, name="premium_status")
+
+
+def _remember_status(session_id, status) -> None:
+    _premium_cache.set(session_id, status or "free")
+
+
+def invalidate_premium_cache(session_id=None) -> None:
+    """Forget the cached status of *session_id* (or of every session)."""
+    if session_id is None:
+        _premium_cache.clear()
+    else:
+        _premium_cache.invalidate(session_id)
+
+
+def get_premium_cache_stats() -> dict:
+    return _premium_cache.stats()
+
+
 def update_user_stripe(session_id, customer_id=None, subscription_id=None, status=None):
     if not _database_url():
         _log_fallback_once("DATABASE_URL is missing")
         _memory_update_user_stripe(session_id, customer_id, subscription_id, status)
+        invalidate_premium_cache(session_id)
         return
 
     conn = None
@@ -285,6 +447,7 @@ def update_user_stripe(session_id, customer_id=None, subscription_id=None, statu
             cur.close()
         if conn:
             conn.close()
+        invalidate_premium_cache(session_id)
 
 
 def get_daily_usage(session_id):
@@ -345,9 +508,17 @@ def increment_usage(session_id):
             conn.close()
 
 
+def get_subscription_status(session_id) -> str:
+    """Subscription status, served from the premium cache when possible."""
+    status = _premium_cache.get(session_id)
+    if status is None:
+        status = get_or_create_user(session_id)["subscription_status"] or "free"
+        _remember_status(session_id, status)
+    return status
+
+
 def is_premium(session_id):
-    user = get_or_create_user(session_id)
-    return user["subscription_status"] in ("active", "trialing")
+    return get_subscription_status(session_id) in PREMIUM_STATUSES
 
 
 def can_solve_problem(session_id):
@@ -358,8 +529,234 @@ def can_solve_problem(session_id):
     return remaining > 0, remaining
 
 
-def load_session_data(session_id: str):
-    """Load a game session from the database. Returns a dict or None."""
+# ── Request-scoped entitlement ────────────────────────────────────────────────
+# /api/story used to call is_premium → get_or_create_user, can_solve_problem
+# (is_premium + get_daily_usage again), increment_usage, get_daily_usage and
+# is_premium once more — about seven queries per quest.  An Entitlement is
+# loaded (or reserved) in a single round trip and passed around instead.
+
+@dataclass
+class Entitlement:
+    """Premium status and today's usage for one session, as of one query."""
+    session_id: str
+    subscription_status: str
+    usage: int
+    usage_date: date
+    reserved: bool = False  # True once reserve_quota() has counted this request
+
+    @property
+    def is_premium(self) -> bool:
+        return self.subscription_status in PREMIUM_STATUSES
+
+    @property
+    def remaining(self) -> int:
+        """Problems left today; -1 means unlimited (premium)."""
+        if self.is_premium:
+            return -1
+        return max(0, FREE_DAILY_LIMIT - self.usage)
+
+    @property
+    def can_solve(self) -> bool:
+        return self.is_premium or self.usage < FREE_DAILY_LIMIT
+
+    def usage_payload(self) -> dict:
+        """The quota fields shared by /api/story and /api/subscription."""
+        return {
+            "daily_usage": self.usage,
+            "daily_limit": FREE_DAILY_LIMIT,
+            "remaining": self.remaining,
+            "is_premium": self.is_premium,
+        }
+
+
+# Shared CTE: fetch the user row, creating it on first sight.  A data-modifying
+# CTE's output is invisible to sibling SELECTs on the same table, hence the
+# UNION with the INSERT's RETURNING.
+_USER_ROW_CTE = """
+    new_user AS (
+        INSERT INTO app_users (session_id) VALUES (%(sid)s)
+        ON CONFLICT (session_id) DO NOTHING
+        RETURNING subscription_status
+    ),
+    user_row AS (
+        SELECT subscription_status FROM app_users WHERE session_id = %(sid)s
+        UNION ALL
+        SELECT subscription_status FROM new_user
+    )
+"""
+
+_LOAD_ENTITLEMENT_SQL = "WITH" + _USER_ROW_CTE + """
+    SELECT
+        (SELECT subscription_status FROM user_row LIMIT 1),
+        COALESCE((SELECT problem_count FROM usage_tracking
+                  WHERE session_id = %(sid)s AND usage_date = %(day)s), 0)
+"""
+
+# Check-and-increment in one statement: the ON CONFLICT ... WHERE guard runs
+# under the row lock, so two concurrent requests can never both take the last
+# free problem.  ``bumped`` is empty when the quota is exhausted.
+_RESERVE_QUOTA_SQL = "WITH" + _USER_ROW_CTE + """,
+    premium AS (
+        SELECT COALESCE((SELECT subscription_status FROM user_row LIMIT 1)
+                        IN ('active', 'trialing'), false) AS is_premium
+    ),
+    bumped AS (
+        INSERT INTO usage_tracking (session_id, usage_date, problem_count)
+        SELECT %(sid)s, %(day)s, 1
+        WHERE (SELECT is_premium FROM premium) OR %(limit)s > 0
+        ON CONFLICT (session_id, usage_date) DO UPDATE
+            SET problem_count = usage_tracking.problem_count + 1
+            WHERE (SELECT is_premium FROM premium)
+               OR usage_tracking.problem_count < %(limit)s
+        RETURNING problem_count
+    )
+    SELECT
+        (SELECT subscription_status FROM user_row LIMIT 1),
+        (SELECT problem_count FROM bumped),
+        COALESCE((SELECT problem_count FROM usage_tracking
+                  WHERE session_id = %(sid)s AND usage_date = %(day)s), 0)
+"""
+
+
+def _memory_load_entitlement(session_id, today):
+    with _memory_lock:
+        user = _memory_users.get(session_id)
+        status = user["subscription_status"] if user else "free"
+        usage = int(_memory_usage.get((session_id, today.isoformat()), 0))
+    if not user:
+        _memory_get_or_create_user(session_id)
+    return Entitlement(session_id, status or "free", usage, today)
+
+
+def _memory_reserve_quota(session_id, today):
+    _memory_get_or_create_user(session_id)
+    key = (session_id, today.isoformat())
+    with _memory_lock:
+        status = _memory_users[session_id]["subscription_status"] or "free"
+        usage = int(_memory_usage.get(key, 0))
+        ent = Entitlement(session_id, status, usage, today)
+        if ent.can_solve:
+            usage += 1
+            _memory_usage[key] = usage
+            ent.usage = usage
+            ent.reserved = True
+        return ent
+
+
+def load_entitlement(session_id) -> Entitlement:
+    """Premium status + today's usage in one round trip (creates the user row)."""
+    today = date.today()
+    if not _database_url():
+        _log_fallback_once("DATABASE_URL is missing")
+        return _memory_load_entitlement(session_id, today)
+
+    conn = None
+    cur = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute(_LOAD_ENTITLEMENT_SQL, {"sid": session_id, "day": today})
+        status, usage = cur.fetchone()
+        conn.commit()
+        _remember_status(session_id, status)
+        return Entitlement(session_id, status or "free", int(usage or 0), today)
+    except Exception as exc:
+        _log_fallback_once(str(exc))
+        return _memory_load_entitlement(session_id, today)
+    finally:
+        if cur:
+            cur.close()
+        if conn:
+            conn.close()
+
+
+def reserve_quota(session_id) -> Entitlement:
+    """Atomically check the daily limit and count one problem against it.
+
+    Returns an Entitlement whose ``reserved`` flag says whether the problem
+    was granted.  Callers that fail after a successful reservation should
+    hand it back with :func:`release_quota`.
+    """
+    today = date.today()
+    if not _database_url():
+        _log_fallback_once("DATABASE_URL is missing")
+        return _memory_reserve_quota(session_id, today)
+
+    conn = None
+    cur = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute(_RESERVE_QUOTA_SQL, {"sid": session_id, "day": today, "limit": FREE_DAILY_LIMIT})
+        status, bumped, previous = cur.fetchone()
+        conn.commit()
+        _remember_status(session_id, status)
+        if bumped is not None:
+            return Entitlement(session_id, status or "free", int(bumped), today, reserved=True)
+        return Entitlement(session_id, status or "free", int(previous or 0), today)
+    except Exception as exc:
+        _log_fallback_once(str(exc))
+        return _memory_reserve_quota(session_id, today)
+    finally:
+        if cur:
+            cur.close()
+        if conn:
+            conn.close()
+
+
+def release_quota(entitlement: Entitlement) -> None:
+    """Undo a successful :func:`reserve_quota` (e.g. the quest failed)."""
+    if not entitlement.reserved:
+        return
+    entitlement.reserved = False
+    entitlement.usage = max(0, entitlement.usage - 1)
+    if not _database_url():
+        key = (entitlement.session_id, entitlement.usage_date.isoformat())
+        with _memory_lock:
+            _memory_usage[key] = max(0, int(_memory_usage.get(key, 0)) - 1)
+        return
+
+    conn = None
+    cur = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute(
+            "UPDATE usage_tracking SET problem_count = GREATEST(problem_count - 1, 0) "
+            "WHERE session_id = %s AND usage_date = %s",
+            (entitlement.session_id, entitlement.usage_date),
+        )
+        conn.commit()
+    except Exception as exc:
+        logger.warning("[DB] Could not release quota for %s: %s", entitlement.session_id, exc)
+    finally:
+        if cur:
+            cur.close()
+        if conn:
+            conn.close()
+
+
+def _session_row_data(data, blob) -> dict:
+    """Decode a game_sessions row: the binary blob if present, else the JSONB."""
+    if blob is not None:
+        return decode_session(blob)
+    # psycopg2 typically returns JSONB columns as dicts; the string
+    # branch is a fallback for environments without automatic JSON decoding.
+    return data if isinstance(data, dict) else json.loads(data)
+
+
+class SessionLoadError(Exception):
+    """A stored session exists (or may) but could not be read or decoded."""
+
+
+def load_session_record(session_id: str):
+    """Load a game session and its version.  Returns ``(dict, int)`` or None.
+
+    None means there is no such row.  A failed query or an undecodable row
+    (say a zstd blob on a host without zstandard) raises
+    :class:`SessionLoadError` instead, so the caller does not start a fresh
+    session that would later be saved over the real one.
+    """
     if not _database_url():
         return None
     conn = None
@@ -367,17 +764,14 @@ def load_session_data(session_id: str):
     try:
         conn = get_db_connection()
         cur = conn.cursor()
-        cur.execute("SELECT data FROM game_sessions WHERE session_id = %s", (session_id,))
+        cur.execute("SELECT data, blob, version FROM game_sessions WHERE session_id = %s", (session_id,))
         row = cur.fetchone()
         if row:
-            data = row[0]
-            # psycopg2 typically returns JSONB columns as dicts; the string
-            # branch is a fallback for environments without automatic JSON decoding.
-            return data if isinstance(data, dict) else json.loads(data)
+            return _session_row_data(row[0], row[1]), int(row[2])
         return None
     except Exception as exc:
-        logger.warning(f"[DB] Could not load session {session_id}: {exc}")
-        return None
+        logger.error(f"[DB] Could not load session {session_id}: {exc}")
+        raise SessionLoadError(f"could not load session {session_id}: {exc}") from exc
     finally:
         if cur:
             cur.close()
@@ -385,27 +779,184 @@ def load_session_data(session_id: str):
             conn.close()
 
 
-def save_session_data(session_id: str, data: dict) -> None:
-    """Persist a game session to the database (upsert). Best-effort — never raises."""
+def save_sessions_batch(
+    rows: list[tuple[str, bytes | str]],
+    expected_versions: dict[str, int] | None = None,
+    notify_channel: str | None = None,
+    origin: str = "",
+) -> dict[str, int]:
+    """Upsert many sessions in one statement; returns ``{session_id: new_version}``.
+
+    *rows* are ``(session_id, payload)`` pairs with unique session ids, where
+    the payload is an :func:`~backend.session_model.encode_session_row`
+    result — a ``(blob, json_text)`` pair stored in ``blob`` and ``data``,
+    or, after the ``SESSION_WRITE_JSON`` cutover, a bare blob (``data`` is
+    then ``{}``) — or plain JSON text (stored in ``data``).
+    Raises on failure so the write-behind persister can keep the rows
+    dirty and retry.
+
+    With *expected_versions*, a row is only overwritten if its stored version
+    still matches (optimistic concurrency), and an id missing from
+    *expected_versions* is a new session that is only inserted if no row
+    exists yet, so the second of two creators loses; ids missing from the
+    result lost that race.  With *notify_channel*, every written id is
+    announced as ``"<origin>|<session_id>"`` via NOTIFY when the
+    transaction commits.
+    """
+    if not rows or not _database_url():
+        return {}
+    guarded = expected_versions is not None
+    versions = expected_versions or {}
+    values = []
+    for sid, payload in rows:
+        if isinstance(payload, str):
+            blob, data = None, payload
+        elif isinstance(payload, tuple):
+            blob, data = psycopg2.Binary(payload[0]), payload[1]
+        else:
+            blob, data = psycopg2.Binary(payload), "{}"
+        values.append((sid, data, blob, versions.get(sid, 0)))
+    updates = [v for v in values if not guarded or v[0] in versions]
+    inserts = [v for v in values if guarded and v[0] not in versions]
+    insert = """INSERT INTO game_sessions AS g (session_id, data, blob, version, updated_at)
+             VALUES %s
+             ON CONFLICT (session_id) DO """
+    upsert = insert + """UPDATE
+             SET data = EXCLUDED.data, blob = EXCLUDED.blob,
+                 version = g.version + 1, updated_at = EXCLUDED.updated_at"""
+    if guarded:
+        upsert += "\n             WHERE g.version = EXCLUDED.version"
+    returning = "\n             RETURNING session_id, version"
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            written = []
+            for sql, batch in ((upsert, updates), (insert + "NOTHING", inserts)):
+                if batch:
+                    written += psycopg2.extras.execute_values(
+                        cur,
+                        sql + returning,
+                        batch,
+                        template="(%s, %s::jsonb, %s, %s, NOW())",
+                        page_size=len(batch),
+                        fetch=True,
+                    )
+            result = {sid: int(version) for sid, version in written}
+            if notify_channel and result:
+                cur.execute(
+                    "SELECT pg_notify(%s, %s || '|' || sid) FROM unnest(%s::text[]) AS sid",
+                    (notify_channel, origin, list(result)),
+                )
+            conn.commit()
+            return result
+        finally:
+            cur.close()
+
+
+def notify(channel: str, payload: str) -> None:
+    """Best-effort NOTIFY (cross-worker cache invalidation)."""
+    if not _database_url():
+        return
+    try:
+        with db_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT pg_notify(%s, %s)", (channel, payload))
+            cur.close()
+            conn.commit()
+    except Exception as exc:
+        logger.warning(f"[DB] NOTIFY on {channel} failed: {exc}")
+
+
+# ── Quest history ─────────────────────────────────────────────────────────────
+# Append-only: rows are never updated, and readers page with keyset
+# pagination on the (session_id, id) index so cost per page is constant no
+# matter how long a player has been around.
+
+_memory_quest_history: dict[str, list[tuple[int, dict]]] = {}
+_memory_quest_seq = 0
+
+
+def _memory_append_quest_history(session_id: str, entries: list[dict]) -> None:
+    global _memory_quest_seq
+    with _memory_lock:
+        log = _memory_quest_history.setdefault(session_id, [])
+        for entry in entries:
+            _memory_quest_seq += 1
+            log.append((_memory_quest_seq, dict(entry)))
+
+
+def _memory_quest_history_page(session_id, before_id, after_id, limit, newest_first):
+    with _memory_lock:
+        rows = list(_memory_quest_history.get(session_id, ()))
+    if before_id is not None:
+        rows = [r for r in rows if r[0] < before_id]
+    if after_id is not None:
+        rows = [r for r in rows if r[0] > after_id]
+    if newest_first:
+        rows.reverse()
+    return rows[:limit]
+
+
+def append_quest_history(session_id: str, entries: list[dict], strict: bool = False) -> None:
+    """Append completed-quest entries for *session_id* (oldest first).
+
+    Database errors fall back to process memory, unless *strict*: then they
+    raise, so a caller moving the only copy of some history knows whether
+    the insert committed.
+    """
+    if not entries:
+        return
     if not _database_url():
+        _memory_append_quest_history(session_id, entries)
         return
     conn = None
     cur = None
     try:
         conn = get_db_connection()
         cur = conn.cursor()
-        # Exclude runtime-only keys that are not worth persisting
-        serializable = {k: v for k, v in data.items() if k != '_ts'}
-        cur.execute(
-            """INSERT INTO game_sessions (session_id, data, updated_at)
-               VALUES (%s, %s::jsonb, NOW())
-               ON CONFLICT (session_id) DO UPDATE
-               SET data = EXCLUDED.data, updated_at = NOW()""",
-            (session_id, json.dumps(serializable))
+        psycopg2.extras.execute_values(
+            cur,
+            "INSERT INTO quest_history (session_id, entry) VALUES %s",
+            [(session_id, json.dumps(entry)) for entry in entries],
+            template="(%s, %s::jsonb)",
         )
         conn.commit()
     except Exception as exc:
-        logger.warning(f"[DB] Could not save session {session_id}: {exc}")
+        if strict:
+            raise
+        _log_fallback_once(str(exc))
+        _memory_append_quest_history(session_id, entries)
+    finally:
+        if cur:
+            cur.close()
+        if conn:
+            conn.close()
+
+
+def _quest_history_rows(session_id, before_id=None, after_id=None, limit=50, newest_first=True):
+    """One keyset page of ``(id, entry)`` rows."""
+    if not _database_url():
+        return _memory_quest_history_page(session_id, before_id, after_id, limit, newest_first)
+    conn = None
+    cur = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT id, entry FROM quest_history "
+            "WHERE session_id = %(sid)s "
+            "AND (%(before)s::bigint IS NULL OR id < %(before)s) "
+            "AND (%(after)s::bigint IS NULL OR id > %(after)s) "
+            "ORDER BY id " + ("DESC" if newest_first else "ASC") + " LIMIT %(limit)s",
+            {"sid": session_id, "before": before_id, "after": after_id, "limit": limit},
+        )
+        return [
+            (row_id, entry if isinstance(entry, dict) else json.loads(entry))
+            for row_id, entry in cur.fetchall()
+        ]
+    except Exception as exc:
+        logger.warning(f"[DB] Could not read quest history for {session_id}: {exc}")
+        return _memory_quest_history_page(session_id, before_id, after_id, limit, newest_first)
     finally:
         if cur:
             cur.close()
@@ -413,6 +964,65 @@ def save_session_data(session_id: str, data: dict) -> None:
             conn.close()
 
 
+def get_quest_history_page(session_id: str, before_id: int | None = None, limit: int = 50) -> dict:
+    """Newest-first page of quest history.
+
+    Returns ``{"entries": [...], "next_before_id": id | None}``; pass
+    ``next_before_id`` back as *before_id* to fetch the next (older) page.
+    """
+    rows = _quest_history_rows(session_id, before_id=before_id, limit=limit + 1)
+    more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        "entries": [{**entry, "id": row_id} for row_id, entry in rows],
+        "next_before_id": rows[-1][0] if more and rows else None,
+    }
+
+
+def iter_quest_history(session_id: str, page_size: int = 500):
+    """Yield every quest-history entry oldest first, one page in memory at a time."""
+    after_id = None
+    while True:
+        rows = _quest_history_rows(session_id, after_id=after_id, limit=page_size, newest_first=False)
+        for _, entry in rows:
+            yield entry
+        if len(rows) < page_size:
+            return
+        after_id = rows[-1][0]
+
+
+def get_quest_guild_counts(session_id: str) -> dict:
+    """Completed quests per guild over the full history."""
+    if _database_url():
+        conn = None
+        cur = None
+        try:
+            conn = get_db_connection()
+            cur = conn.cursor()
+            cur.execute(
+                "SELECT entry->>'guild', COUNT(*) FROM quest_history "
+                "WHERE session_id = %s AND entry->>'guild' IS NOT NULL "
+                "GROUP BY 1",
+                (session_id,),
+            )
+            return {guild: int(count) for guild, count in cur.fetchall()}
+        except Exception as exc:
+            logger.warning(f"[DB] Could not count guild quests for {session_id}: {exc}")
+        finally:
+            if cur:
+                cur.close()
+            if conn:
+                conn.close()
+    counts: dict = {}
+    with _memory_lock:
+        rows = list(_memory_quest_history.get(session_id, ()))
+    for _, entry in rows:
+        guild = entry.get("guild")
+        if guild:
+            counts[guild] = counts.get(guild, 0) + 1
+    return counts
+
+
 # ── Feature flag CRUD ─────────────────────────────────────────────────────────
 
 # In-memory fallback used when DATABASE_URL is absent.  Initialised from
@@ -614,3 +1224,87 @@ def upsert_auth_user(
             cur.close()
         if conn:
             conn.close()
+
+
+# ── AI artifact cache ─────────────────────────────────────────────────────────
+
+def load_ai_artifact(cache_key: str):
+    """Unexpired cached artifact for *cache_key*, or None."""
+    if not _database_url():
+        return None
+    conn = None
+    cur = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT value FROM ai_artifact_cache WHERE cache_key = %s AND expires_at > NOW()",
+            (cache_key,),
+        )
+        row = cur.fetchone()
+        return row[0] if row else None
+    except Exception as exc:
+        logger.warning(f"[DB] Could not load AI artifact: {exc}")
+        return None
+    finally:
+        if cur:
+            cur.close()
+        if conn:
+            conn.close()
+
+
+def save_ai_artifact(cache_key: str, kind: str, value_json: str, ttl_seconds: int) -> None:
+    """Upsert a cached artifact. Best-effort — never raises."""
+    if not _database_url():
+        return
+    conn = None
+    cur = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute(
+            """INSERT INTO ai_artifact_cache (cache_key, kind, value, created_at, expires_at)
+               VALUES (%s, %s, %s::jsonb, NOW(), NOW() + make_interval(secs => %s))
+               ON CONFLICT (cache_key) DO UPDATE
+               SET value = EXCLUDED.value, created_at = NOW(), expires_at = EXCLUDED.expires_at""",
+            (cache_key, kind, value_json, ttl_seconds),
+        )
+        conn.commit()
+    except Exception as exc:
+        logger.warning(f"[DB] Could not save AI artifact: {exc}")
+    finally:
+        if cur:
+            cur.close()
+        if conn:
+            conn.close()
+
+
+def prune_ai_artifacts(max_rows: int) -> int:
+    """Delete expired artifacts, then the oldest beyond *max_rows*. Returns rows deleted."""
+    if not _database_url():
+        return 0
+    conn = None
+    cur = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute("DELETE FROM ai_artifact_cache WHERE expires_at <= NOW()")
+        deleted = cur.rowcount
+        cur.execute(
+            """DELETE FROM ai_artifact_cache WHERE cache_key IN (
+                   SELECT cache_key FROM ai_artifact_cache
+                   ORDER BY created_at DESC OFFSET %s
+               )""",
+            (max_rows,),
+        )
+        deleted += cur.rowcount
+        conn.commit()
+        return deleted
+    except Exception as exc:
+        logger.warning(f"[DB] Could not prune AI artifacts: {exc}")
+        return 0
+    finally:
+        if cur:
+            cur.close()
+        if conn:
+            conn.close()
@@ -0,0 +1,338 @@
+"""
+Process-wide PostgreSQL connection pool for The Math Script.
+
+Every helper in ``backend/database.py`` used to open a brand-new
+``psycopg2.connect()`` per query, paying a TCP + TLS + auth handshake to
+Neon / Azure Postgres each time.  This module keeps a bounded set of warm
+connections instead.
+
+Two flavours are provided:
+
+* :class:`ConnectionPool` — thread-safe, used by the sync FastAPI endpoints
+  (which run in Starlette's threadpool) and every ``database.py`` helper.
+* :class:`AsyncConnectionPool` — an ``asyncio`` front-end for ``async def``
+  endpoints.  psycopg2 is a blocking driver, so it shares the sync pool and
+  runs the blocking work on a worker thread; the event loop never blocks on
+  a socket.
+
+Configuration (environment variables)
+-------------------------------------
+DB_POOL_MIN_SIZE            – connections kept warm (default 1)
+DB_POOL_MAX_SIZE            – hard cap on open connections (default 10)
+DB_POOL_ACQUIRE_TIMEOUT     – seconds to wait for a free connection (default 5)
+DB_POOL_HEALTHCHECK_AFTER   – idle seconds after which a connection is pinged
+                              with ``SELECT 1`` before reuse (default 30)
+DB_POOL_MAX_IDLE            – idle seconds after which surplus connections
+                              (above min size) are closed (default 300)
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable
+
+logger = logging.getLogger(__name__)
+
+try:
+    from psycopg2 import extensions as _pg_extensions
+    _TRANSACTION_STATUS_IDLE = _pg_extensions.TRANSACTION_STATUS_IDLE
+except ImportError:  # pragma: no cover - psycopg2 is a hard dependency in prod
+    _TRANSACTION_STATUS_IDLE = 0
+
+
+DB_POOL_MIN_SIZE = int(os.environ.get("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_ACQUIRE_TIMEOUT = float(os.environ.get("DB_POOL_ACQUIRE_TIMEOUT", "5"))
+DB_POOL_HEALTHCHECK_AFTER = float(os.environ.get("DB_POOL_HEALTHCHECK_AFTER", "30"))
+DB_POOL_MAX_IDLE = float(os.environ.get("DB_POOL_MAX_IDLE", "300"))
+
+
+class PoolTimeout(RuntimeError):
+    """Raised when no connection becomes available within the acquire timeout."""
+
+
+class PooledConnection:
+    """Thin proxy around a raw DB-API connection checked out of a pool.
+
+    Behaves like the underlying connection (cursor, commit, rollback, …) but
+    ``close()`` returns it to the pool instead of tearing down the socket, so
+    existing ``conn.close()`` call sites keep working unchanged.
+    """
+
+    __slots__ = ("_pool", "_conn", "_released")
+
+    def __init__(self, pool: "ConnectionPool", conn: Any):
+        self._pool = pool
+        self._conn = conn
+        self._released = False
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._conn, name)
+
+    @property
+    def raw(self) -> Any:
+        return self._conn
+
+    def close(self) -> None:
+        """Return the connection to the pool.  Safe to call more than once."""
+        if self._released:
+            return
+        self._released = True
+        self._pool.release(self._conn)
+
+    def discard(self) -> None:
+        """Close the underlying connection for good (e.g. after a protocol error)."""
+        if self._released:
+            return
+        self._released = True
+        self._pool.release(self._conn, discard=True)
+
+    def __enter__(self) -> "PooledConnection":
+        return self
+
+    def __exit__(self, *_: object) -> None:
+        self.close()
+
+
+class ConnectionPool:
+    """Bounded, health-checked pool of psycopg2 connections.
+
+    *connect* is a zero-argument factory returning a new raw connection; it
+    is injectable so the pool can be exercised without a live database.
+    """
+
+    def __init__(
+        self,
+        connect: Callable[[], Any],
+        *,
+        min_size: int = DB_POOL_MIN_SIZE,
+        max_size: int = DB_POOL_MAX_SIZE,
+        acquire_timeout: float = DB_POOL_ACQUIRE_TIMEOUT,
+        healthcheck_after: float = DB_POOL_HEALTHCHECK_AFTER,
+        max_idle: float = DB_POOL_MAX_IDLE,
+    ):
+        if max_size < 1:
+            raise ValueError("max_size must be >= 1")
+        self._connect = connect
+        self.min_size = max(0, min(min_size, max_size))
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self.healthcheck_after = healthcheck_after
+        self.max_idle = max_idle
+
+        self._cond = threading.Condition(threading.Lock())
+        self._idle: list[tuple[Any, float]] = []   # (conn, returned_at) — LIFO
+        self._open = 0                              # idle + checked out
+        self._closed = False
+        self._last_prune = time.monotonic()
+
+        # Counters for the admin perf endpoint
+        self._acquired = 0
+        self._created = 0
+        self._discarded = 0
+        self._healthcheck_failures = 0
+        self._timeouts = 0
+        self._wait_seconds_total = 0.0
+
+    # ── checkout / checkin ────────────────────────────────────────────────────
+
+    def acquire(self, timeout: float | None = None) -> PooledConnection:
+        """Check out a connection, waiting up to *timeout* seconds for one."""
+        timeout = self.acquire_timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        while True:
+            conn = None
+            create = False
+            with self._cond:
+                if self._closed:
+                    raise RuntimeError("Connection pool is closed")
+                while not self._idle and self._open >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeout(
+                            f"No database connection available within {timeout:.1f}s "
+                            f"(max_size={self.max_size})"
+                        )
+                    self._cond.wait(remaining)
+                if self._idle:
+                    conn, returned_at = self._idle.pop()
+                else:
+                    self._open += 1
+                    create = True
+
+            if create:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._open -= 1
+                        self._cond.notify()
+                    raise
+                with self._cond:
+                    self._created += 1
+            elif not self._is_usable(conn, returned_at):
+                self._drop(conn)
+                continue
+
+            with self._cond:
+                self._acquired += 1
+                self._wait_seconds_total += time.monotonic() - started
+            return PooledConnection(self, conn)
+
+    def release(self, conn: Any, discard: bool = False) -> None:
+        """Return a raw connection to the pool (or close it if unusable)."""
+        if not discard:
+            discard = self._closed or bool(getattr(conn, "closed", False))
+        if not discard:
+            try:
+                status = conn.get_transaction_status()
+                if status != _TRANSACTION_STATUS_IDLE:
+                    # Never hand the next caller a half-finished transaction.
+                    conn.rollback()
+            except Exception:
+                discard = True
+        if discard:
+            self._drop(conn)
+            return
+        now = time.monotonic()
+        with self._cond:
+            self._idle.append((conn, now))
+            self._cond.notify()
+            prune_due = now - self._last_prune > min(self.max_idle, 60.0)
+            if prune_due:
+                self._last_prune = now
+        if prune_due:
+            self.prune_idle()
+
+    @contextlib.contextmanager
+    def connection(self, timeout: float | None = None):
+        """``with pool.connection() as conn:`` — always returned to the pool."""
+        pooled = self.acquire(timeout)
+        try:
+            yield pooled
+        finally:
+            pooled.close()
+
+    # ── maintenance ───────────────────────────────────────────────────────────
+
+    def _is_usable(self, conn: Any, returned_at: float) -> bool:
+        if getattr(conn, "closed", False):
+            return False
+        if time.monotonic() - returned_at < self.healthcheck_after:
+            return True
+        try:
+            cur = conn.cursor()
+            try:
+                cur.execute("SELECT 1")
+                cur.fetchone()
+            finally:
+                cur.close()
+            conn.rollback()
+            return True
+        except Exception as exc:
+            with self._cond:
+                self._healthcheck_failures += 1
+            logger.info("[DB_POOL] Dropping stale idle connection: %s", exc)
+            return False
+
+    def _drop(self, conn: Any) -> None:
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._open -= 1
+            self._discarded += 1
+            self._cond.notify()
+
+    def prune_idle(self) -> int:
+        """Close surplus connections idle for longer than ``max_idle``."""
+        now = time.monotonic()
+        victims = []
+        with self._cond:
+            keep = []
+            for conn, returned_at in self._idle:
+                surplus = self._open - len(victims) > self.min_size
+                if surplus and now - returned_at > self.max_idle:
+                    victims.append(conn)
+                else:
+                    keep.append((conn, returned_at))
+            self._idle = keep
+        for conn in victims:
+            self._drop(conn)
+        return len(victims)
+
+    def close(self) -> None:
+        """Close every idle connection; checked-out ones are closed on release."""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._drop(conn)
+
+    def stats(self) -> dict:
+        with self._cond:
+            acquired = self._acquired
+            return {
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "open": self._open,
+                "idle": len(self._idle),
+                "in_use": self._open - len(self._idle),
+                "acquired_total": acquired,
+                "connections_created": self._created,
+                "connections_discarded": self._discarded,
+                "healthcheck_failures": self._healthcheck_failures,
+                "acquire_timeouts": self._timeouts,
+                "avg_acquire_wait_ms": round(self._wait_seconds_total * 1000 / acquired, 3) if acquired else 0.0,
+            }
+
+
+class AsyncConnectionPool:
+    """``asyncio`` front-end over a :class:`ConnectionPool`.
+
+    Usage from an ``async def`` endpoint::
+
+        rows = await pool.run(lambda conn: _fetch_rows(conn))
+
+    The callable receives a checked-out connection and runs on a worker
+    thread, so the blocking psycopg2 driver never stalls the event loop.
+    """
+
+    def __init__(self, pool: ConnectionPool):
+        self._pool = pool
+
+    @property
+    def sync_pool(self) -> ConnectionPool:
+        return self._pool
+
+    async def acquire(self, timeout: float | None = None) -> PooledConnection:
+        return await asyncio.to_thread(self._pool.acquire, timeout)
+
+    async def release(self, conn: PooledConnection) -> None:
+        await asyncio.to_thread(conn.close)
+
+    @contextlib.asynccontextmanager
+    async def connection(self, timeout: float | None = None):
+        conn = await self.acquire(timeout)
+        try:
+            yield conn
+        finally:
+            await self.release(conn)
+
+    async def run(self, fn: Callable[[PooledConnection], Any], timeout: float | None = None) -> Any:
+        """Run ``fn(conn)`` on a worker thread with a pooled connection."""
+        def _work():
+            with self._pool.connection(timeout) as conn:
+                return fn(conn)
+        return await asyncio.to_thread(_work)
+
+    def stats(self) -> dict:
+        return self._pool.stats()
@@ -0,0 +1,112 @@
+"""
+End-to-end deadline budgets for multi-call requests.
+
+Each ``/api/story`` stage has its own timeout, so in the worst case the
+pipeline's stages (math 14+2 s, verify 8+2 s, story 16+2 s, then the
+fan-out) add up to far more than the load balancer or a child will wait.
+A :class:`DeadlineBudget` gives the whole request one budget instead:
+
+* :meth:`DeadlineBudget.scope` opens a deadline for the current request.
+  It lives in a context variable, so every task the request spawns (task
+  graph nodes, singleflight leaders, hedges) sees the same deadline.
+* :meth:`DeadlineBudget.timeout` is asked by every AI call for its timeout.
+  It returns the stage's own timeout when there is time to spare, a
+  shortened one when the budget is running out, or ``None`` when too
+  little is left to be worth a call — the caller then goes straight to
+  its fallback (fast story segments, static analogy, fallback mini-games).
+
+Outside a scope nothing is limited.  How often each stage was shortened or
+skipped is counted for the admin perf endpoint.
+
+Configuration (environment variables)
+-------------------------------------
+STORY_DEADLINE_SECONDS          – total budget of one /api/story request (default 20)
+STORY_DEADLINE_MIN_CALL_SECONDS – skip an AI call with less time than this left (default 2)
+"""
+
+from __future__ import annotations
+
+import contextlib
+import contextvars
+import os
+import threading
+import time
+from typing import Iterator, Optional
+
+STORY_DEADLINE_SECONDS = float(os.environ.get("STORY_DEADLINE_SECONDS", "20"))
+STORY_DEADLINE_MIN_CALL_SECONDS = float(os.environ.get("STORY_DEADLINE_MIN_CALL_SECONDS", "2"))
+
+_current: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("deadline", default=None)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left before the current deadline (``None`` outside a scope)."""
+    deadline = _current.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+class DeadlineBudget:
+    """Per-request deadline shared by every stage of a pipeline."""
+
+    def __init__(self, budget: float = STORY_DEADLINE_SECONDS, min_call: float = STORY_DEADLINE_MIN_CALL_SECONDS):
+        self.budget = budget
+        self.min_call = min_call
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._overran = 0
+        self._by_stage: dict[str, dict] = {}
+
+    @contextlib.contextmanager
+    def scope(self) -> Iterator[None]:
+        """Run the body under a fresh deadline of :attr:`budget` seconds."""
+        token = _current.set(time.monotonic() + self.budget)
+        try:
+            yield
+        finally:
+            left = remaining()
+            _current.reset(token)
+            with self._lock:
+                self._requests += 1
+                self._overran += left is not None and left < 0
+
+    def timeout(self, stage: str, timeout: float, overhead: float = 0.0) -> Optional[float]:
+        """Timeout for a *stage* call that may take *timeout* + *overhead* seconds.
+
+        Returns *timeout*, a shorter value that still ends the call by the
+        deadline, or ``None`` to skip the call.
+        """
+        left = remaining()
+        if left is None:
+            return timeout
+        with self._lock:
+            stats = self._by_stage.get(stage)
+            if stats is None:
+                stats = self._by_stage[stage] = {"calls": 0, "shortened": 0, "skipped": 0}
+            stats["calls"] += 1
+            allowed = left - overhead
+            if allowed < self.min_call:
+                stats["skipped"] += 1
+                return None
+            if allowed < timeout:
+                stats["shortened"] += 1
+                return allowed
+            return timeout
+
+    def stats(self) -> dict:
+        with self._lock:
+            by_stage = {}
+            for stage, s in self._by_stage.items():
+                by_stage[stage] = {
+                    **s,
+                    "shortened_rate": round(s["shortened"] / s["calls"], 4) if s["calls"] else 0.0,
+                    "skipped_rate": round(s["skipped"] / s["calls"], 4) if s["calls"] else 0.0,
+                }
+            return {
+                "budget_s": self.budget,
+                "min_call_s": self.min_call,
+                "requests": self._requests,
+                "overran": self._overran,
+                "by_stage": by_stage,
+            }
@@ -0,0 +1,98 @@
+"""
+Stop upstream work for clients that have gone away.
+
+Starlette keeps running an endpoint after its client disconnects, so a
+child who closes the tab mid-quest still had every model, image and
+ElevenLabs call run to completion (and the quest counted against the day's
+quota).  :class:`DisconnectWatcher` runs an endpoint's work as a task and,
+beside it, waits on the request's ASGI ``receive`` for ``http.disconnect``
+(the body has already been read, so that is the only message left to
+come).  ``request.is_disconnected()`` is no use here: its instant-cancel
+probe loses the message behind ``BaseHTTPMiddleware``.
+
+When the client has gone, the task is cancelled — which cancels the async
+AI calls it is awaiting and lets its cleanup (handing back the quota
+reservation) run — and :class:`ClientDisconnected` is raised for the
+endpoint to turn into a response nobody will read.
+
+Work that cannot be interrupted (a blocking SDK call on a thread) is given
+the ``abandoned`` event instead, so it can stop before its next attempt.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import threading
+from typing import Any, Awaitable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ClientDisconnected(Exception):
+    """The client went away before the work finished; the work was cancelled."""
+
+
+class DisconnectWatcher:
+    """Cancels per-request work when its client disconnects, and counts it."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_kind: dict[str, dict] = {}
+
+    async def run(
+        self, request: Any, work: Awaitable[Any], kind: str = "request",
+        abandoned: Optional[threading.Event] = None,
+    ) -> Any:
+        """Await *work* unless *request*'s client disconnects first.
+
+        Raises :class:`ClientDisconnected` after cancelling *work* (and
+        setting *abandoned*, if given) and waiting for its cleanup.
+        """
+        task = asyncio.ensure_future(work)
+        watcher = asyncio.ensure_future(self._wait_for_disconnect(request))
+        try:
+            await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+            if not task.done() and watcher.exception() is not None:
+                # No way to watch this client; just finish the work.
+                await asyncio.wait({task})
+            if task.done():
+                self._count(kind, "completed")
+                return task.result()
+            if abandoned is not None:
+                abandoned.set()
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            self.record(kind)
+            logger.info("[DISCONNECT] Client left; cancelled %s work", kind)
+            raise ClientDisconnected()
+        finally:
+            watcher.cancel()
+            if not task.done():
+                task.cancel()
+
+    @staticmethod
+    async def _wait_for_disconnect(request: Any) -> None:
+        while True:
+            message = await request.receive()
+            if message["type"] == "http.disconnect":
+                return
+
+    def record(self, kind: str) -> None:
+        """Count work of *kind* cancelled because its client left."""
+        self._count(kind, "cancelled")
+
+    def _count(self, kind: str, counter: str) -> None:
+        with self._lock:
+            stats = self._by_kind.get(kind)
+            if stats is None:
+                stats = self._by_kind[kind] = {"completed": 0, "cancelled": 0}
+            stats[counter] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            by_kind = {kind: dict(s) for kind, s in self._by_kind.items()}
+        return {
+            "cancelled": sum(s["cancelled"] for s in by_kind.values()),
+            "by_kind": by_kind,
+        }
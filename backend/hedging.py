@@ -0,0 +1,185 @@
+"""
+Hedged requests for the slow tail of upstream AI calls.
+
+Most storyteller and math-solver replies arrive in a second or two, but now
+and then one stalls until its timeout and the quest drops to the
+``quick_fallback`` path.  A *hedge* is a duplicate of a call that has not
+answered by the time nearly all calls to that model have (its observed
+p90): whichever attempt finishes first wins, the other is cancelled.
+
+* The delay adapts per model from the rolling latency histogram that also
+  drives the adaptive timeouts (:class:`~backend.adaptive_timeouts.AdaptiveTimeouts`);
+  a model is not hedged until enough samples exist.
+* A token bucket caps hedges at ``AI_HEDGE_BUDGET_PERCENT`` of calls, so an
+  upstream that is slow for *everyone* is not sent twice the traffic.
+* If one attempt fails, the other is still awaited; only when both fail
+  does the first error propagate.  A streaming attempt that sees the other
+  one already producing output bows out with :class:`HedgeSuperseded`.
+
+Configuration (environment variables)
+-------------------------------------
+AI_HEDGE_ENABLED         – set to ``1`` to hedge story / math calls (default off)
+AI_HEDGE_PERCENTILE      – latency percentile that triggers a hedge (default 90)
+AI_HEDGE_BUDGET_PERCENT  – hedges allowed per 100 calls (default 5)
+AI_HEDGE_MIN_SAMPLES     – latencies observed before a model is hedged (default 20)
+AI_HEDGE_MIN_DELAY_MS    – never hedge sooner than this (default 250)
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import threading
+from typing import Any, Awaitable, Callable, Iterable, Optional
+
+from backend.adaptive_timeouts import AdaptiveTimeouts
+
+logger = logging.getLogger(__name__)
+
+AI_HEDGE_ENABLED = os.environ.get("AI_HEDGE_ENABLED", "0") == "1"
+AI_HEDGE_PERCENTILE = float(os.environ.get("AI_HEDGE_PERCENTILE", "90"))
+AI_HEDGE_BUDGET_PERCENT = float(os.environ.get("AI_HEDGE_BUDGET_PERCENT", "5"))
+AI_HEDGE_MIN_SAMPLES = int(os.environ.get("AI_HEDGE_MIN_SAMPLES", "20"))
+AI_HEDGE_MIN_DELAY_MS = int(os.environ.get("AI_HEDGE_MIN_DELAY_MS", "250"))
+
+_MAX_TOKENS = 10.0     # burst of hedges the budget allows after a quiet spell
+
+
+class HedgeSuperseded(Exception):
+    """Raised by an attempt that lost the race to produce output."""
+
+
+class _ModelStats:
+    __slots__ = ("calls", "hedged", "hedge_wins", "both_failed")
+
+    def __init__(self):
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.both_failed = 0
+
+
+class Hedger:
+    """Per-model hedging of async AI calls.
+
+    *latencies* is the :class:`AdaptiveTimeouts` whose histograms the
+    hedge delay is read from; its owner records every call into it.
+    """
+
+    def __init__(
+        self,
+        latencies: AdaptiveTimeouts,
+        models: Iterable[str] = (),
+        enabled: bool = AI_HEDGE_ENABLED,
+        percentile: float = AI_HEDGE_PERCENTILE,
+        budget_percent: float = AI_HEDGE_BUDGET_PERCENT,
+        min_samples: int = AI_HEDGE_MIN_SAMPLES,
+        min_delay: float = AI_HEDGE_MIN_DELAY_MS / 1000,
+    ):
+        self.latencies = latencies
+        self.models = frozenset(models)
+        self.enabled = enabled
+        self.percentile = percentile
+        self.budget = budget_percent / 100
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self._lock = threading.Lock()
+        self._tokens = _MAX_TOKENS
+        self._by_model: dict[str, _ModelStats] = {}
+
+    def delay(self, model: str) -> Optional[float]:
+        """Seconds to wait before hedging a *model* call, or ``None`` (don't hedge)."""
+        samples, latency = self.latencies.latency(model, self.percentile)
+        if samples < self.min_samples:
+            return None
+        return max(self.min_delay, latency)
+
+    async def run(
+        self,
+        model: str,
+        make_call: Callable[[], Awaitable[Any]],
+        should_hedge: Callable[[], bool] = lambda: True,
+    ) -> Any:
+        """Await ``make_call()``, hedging it with a second ``make_call()`` if it is slow.
+
+        *should_hedge* is asked at the moment the hedge would fire (a
+        streaming call that is already producing output says no).
+        """
+        if not self.enabled or model not in self.models:
+            return await make_call()
+        with self._lock:
+            stats = self._stats(model)
+            stats.calls += 1
+            self._tokens = min(_MAX_TOKENS, self._tokens + self.budget)
+        delay = self.delay(model)
+
+        primary = asyncio.ensure_future(make_call())
+        attempts = [primary]
+        try:
+            if delay is not None:
+                done, _ = await asyncio.wait(attempts, timeout=delay)
+                if not done and should_hedge() and self._take_token(model):
+                    attempts.append(asyncio.ensure_future(make_call()))
+            pending = set(attempts)
+            first_error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                # Prefer the primary when both land in the same tick.
+                for attempt in sorted(done, key=attempts.index):
+                    error = attempt.exception()
+                    if error is None:
+                        if attempt is not primary:
+                            with self._lock:
+                                stats.hedge_wins += 1
+                        return attempt.result()
+                    if first_error is None or attempt is primary:
+                        first_error = error
+            if len(attempts) > 1:
+                with self._lock:
+                    stats.both_failed += 1
+            raise first_error
+        finally:
+            for attempt in attempts:
+                if not attempt.done():
+                    attempt.cancel()
+
+    def _take_token(self, model: str) -> bool:
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            self._by_model[model].hedged += 1
+        logger.info("[AI] Hedging slow %s call", model)
+        return True
+
+    def _stats(self, model: str) -> _ModelStats:
+        stats = self._by_model.get(model)
+        if stats is None:
+            stats = self._by_model[model] = _ModelStats()
+        return stats
+
+    def stats(self) -> dict:
+        latencies = {model: self.latencies.latency(model, self.percentile) for model in list(self._by_model)}
+        with self._lock:
+            by_model = {}
+            for model, s in self._by_model.items():
+                samples, latency = latencies.get(model, (0, 0.0))
+                delay = max(self.min_delay, latency) if samples >= self.min_samples else None
+                by_model[model] = {
+                    "calls": s.calls,
+                    "hedged": s.hedged,
+                    "hedge_wins": s.hedge_wins,
+                    "both_failed": s.both_failed,
+                    "hedge_rate": round(s.hedged / s.calls, 4) if s.calls else 0.0,
+                    "win_rate": round(s.hedge_wins / s.hedged, 4) if s.hedged else 0.0,
+                    "samples": samples,
+                    "hedge_delay_ms": round(delay * 1000, 1) if delay is not None else None,
+                }
+            return {
+                "enabled": self.enabled,
+                "percentile": self.percentile,
+                "budget_percent": round(self.budget * 100, 2),
+                "tokens": round(self._tokens, 2),
+                "by_model": by_model,
+            }
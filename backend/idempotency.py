@@ -0,0 +1,215 @@
+"""
+Idempotency keys for retried mutating requests.
+
+Mobile clients retry ``/api/story`` on flaky networks, and every retry used
+to re-run the whole model pipeline, take another of the free tier's daily
+quests and append a second history entry and +50 coins; a retried shop
+purchase or daily-chest claim had the same problem.  A client that sends an
+``Idempotency-Key`` header gets each key executed once:
+
+* The first request with a key runs normally; if it succeeds, its response
+  is kept for ``IDEMPOTENCY_TTL_SECONDS``.  A retry with the same key gets
+  that response back at once — no AI calls, no quota, no state changes.
+* A duplicate that arrives while the first is still running waits for it
+  and shares its response (via :class:`backend.singleflight.SingleFlight`,
+  so a first request whose client has gone keeps running for the retry).
+* Failed requests (HTTP errors, rate limits) are not kept: retrying them
+  runs them again.
+* Reusing a key for a different request body raises
+  :class:`IdempotencyConflict`.
+
+Keys are scoped by the caller (endpoint and session), and, like the other
+in-process stores, only seen by the worker that served the first request.
+This only protects single-worker deployments: with ``WEB_CONCURRENCY > 1``
+a retry that lands on another worker runs again (quota, coins and
+purchases included).  ``main.py`` logs a warning at startup in that case.
+
+Configuration (environment variables)
+-------------------------------------
+IDEMPOTENCY_TTL_SECONDS – how long a response is replayed for (default 600)
+IDEMPOTENCY_MAX_KEYS    – responses kept per worker; the oldest go first (default 2000)
+"""
+
+from __future__ import annotations
+
+import copy
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+from backend.singleflight import SingleFlight
+
+IDEMPOTENCY_TTL_SECONDS = float(os.environ.get("IDEMPOTENCY_TTL_SECONDS", "600"))
+IDEMPOTENCY_MAX_KEYS = int(os.environ.get("IDEMPOTENCY_MAX_KEYS", "2000"))
+
+
+class IdempotencyConflict(Exception):
+    """An idempotency key was reused for a different request."""
+
+
+class _Entry:
+    __slots__ = ("digest", "result", "stored")
+
+    def __init__(self, digest: str, result: Any):
+        self.digest = digest
+        self.result = result
+        self.stored = time.monotonic()
+
+
+class IdempotencyStore:
+    """Runs each idempotency key once and replays its response."""
+
+    def __init__(self, ttl: float = IDEMPOTENCY_TTL_SECONDS, max_keys: int = IDEMPOTENCY_MAX_KEYS):
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[Hashable, _Entry] = OrderedDict()   # oldest first
+        self._pending: dict[Hashable, list] = {}   # key -> [digest, callers]
+        self._flights = SingleFlight()
+        self._by_kind: dict[str, dict] = {}
+
+    async def run(
+        self, key: Optional[Hashable], fingerprint: str,
+        make_coro: Callable[[], Awaitable[Any]], kind: str = "request",
+    ) -> tuple[Any, bool]:
+        """Await ``make_coro()`` once per *key*; returns ``(result, replayed)``.
+
+        *fingerprint* identifies the request body.  Without a key the call
+        simply runs.
+        """
+        if key is None:
+            return await make_coro(), False
+        entry, digest = self._begin(key, fingerprint, kind)
+        if entry is not None:
+            return entry.result, True
+        led = []
+
+        async def _lead():
+            entry = self._replay(key, digest)
+            if entry is not None:
+                return entry.result
+            led.append(True)
+            result = await make_coro()
+            self._store(key, digest, result)
+            return result
+
+        try:
+            result = await self._flights.do(key, _lead, kind=kind)
+        finally:
+            self._end(key)
+        return result, self._finish(kind, bool(led))
+
+    def run_sync(
+        self, key: Optional[Hashable], fingerprint: str, fn: Callable[[], Any], kind: str = "request",
+    ) -> tuple[Any, bool]:
+        """Blocking :meth:`run` for endpoints served on the threadpool."""
+        if key is None:
+            return fn(), False
+        entry, digest = self._begin(key, fingerprint, kind)
+        if entry is not None:
+            return entry.result, True
+        led = []
+
+        def _lead():
+            # Another thread may have finished this key since _begin looked.
+            entry = self._replay(key, digest)
+            if entry is not None:
+                return entry.result
+            led.append(True)
+            result = fn()
+            self._store(key, digest, result)
+            return result
+
+        try:
+            result = self._flights.do_sync(key, _lead, kind=kind)
+        finally:
+            self._end(key)
+        return result, self._finish(kind, bool(led))
+
+    def _begin(self, key: Hashable, fingerprint: str, kind: str) -> tuple[Optional[_Entry], str]:
+        """``(entry, digest)``: *entry* is the stored response to replay.
+
+        When there is none, the caller is registered as waiting on *key*
+        until :meth:`_end`.
+        """
+        digest = hashlib.sha256(fingerprint.encode()).hexdigest()
+        with self._lock:
+            self._prune()
+            stats = self._stats(kind)
+            entry = self._entries.get(key)
+            pending = self._pending.get(key)
+            if entry is not None:
+                used_for = entry.digest
+            elif pending is not None:
+                used_for = pending[0]
+            else:
+                used_for = digest
+            if used_for != digest:
+                stats["conflicts"] += 1
+                raise IdempotencyConflict()
+            if entry is not None:
+                stats["replayed"] += 1
+                return entry, digest
+            if pending is None:
+                self._pending[key] = [digest, 1]
+            else:
+                pending[1] += 1
+            return None, digest
+
+    def _replay(self, key: Hashable, digest: str) -> Optional[_Entry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry.stored > self.ttl:
+                return None
+            if entry.digest != digest:
+                raise IdempotencyConflict()
+            return entry
+
+    def _store(self, key: Hashable, digest: str, result: Any) -> None:
+        # A copy: handlers may return live session lists that keep changing.
+        entry = _Entry(digest, copy.deepcopy(result))
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = entry
+            self._prune()
+
+    def _end(self, key: Hashable) -> None:
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending is not None:
+                pending[1] -= 1
+                if pending[1] <= 0:
+                    del self._pending[key]
+
+    def _finish(self, kind: str, led: bool) -> bool:
+        with self._lock:
+            self._stats(kind)["executed" if led else "joined"] += 1
+        return not led
+
+    def _prune(self) -> None:
+        """Drop expired responses, then the oldest beyond ``max_keys`` (lock held)."""
+        now = time.monotonic()
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if now - entry.stored <= self.ttl and len(self._entries) <= self.max_keys:
+                break
+            del self._entries[key]
+
+    def _stats(self, kind: str) -> dict:
+        stats = self._by_kind.get(kind)
+        if stats is None:
+            stats = self._by_kind[kind] = {"executed": 0, "replayed": 0, "joined": 0, "conflicts": 0}
+        return stats
+
+    def stats(self) -> dict:
+        with self._lock:
+            by_kind = {kind: dict(s) for kind, s in self._by_kind.items()}
+            return {
+                "keys": len(self._entries),
+                "in_flight": len(self._pending),
+                "replayed": sum(s["replayed"] + s["joined"] for s in by_kind.values()),
+                "by_kind": by_kind,
+            }
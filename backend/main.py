@@ -10,13 +10,17 @@ import wave
 import random
 import logging
 import operator
+import asyncio
 import threading
+import contextlib
 import concurrent.futures
 import hmac
 import hashlib
 import urllib.parse
 from pathlib import Path
+from collections.abc import Mapping
 import requests as http_requests
+import httpx
 
 logging.basicConfig(level=logging.WARNING)
 logger = logging.getLogger(__name__)
@@ -91,7 +95,7 @@ if AZURE_SDK_AVAILABLE:
 from fastapi import FastAPI, HTTPException, UploadFile, File, Request, Header
 from fastapi.concurrency import run_in_threadpool
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, Response, JSONResponse, RedirectResponse, HTMLResponse
+from fastapi.responses import FileResponse, Response, JSONResponse, RedirectResponse, HTMLResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.gzip import GZipMiddleware
 from starlette.middleware.base import BaseHTTPMiddleware
@@ -100,7 +104,7 @@ from typing import Optional, Any
 from google import genai
 from google.genai import types
 from fpdf import FPDF
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 import stripe
 import jwt as _jwt
 from passlib.context import CryptContext
@@ -193,7 +197,7 @@ def validate_session_id(session_id: str) -> str:
         raise HTTPException(status_code=400, detail="Invalid session format")
     return session_id
 
-from backend.database import init_db, get_or_create_user, update_user_stripe, get_daily_usage, increment_usage, can_solve_problem, is_premium, FREE_DAILY_LIMIT, load_session_data, save_session_data, get_all_feature_flags, get_feature_flag, set_feature_flag
+from backend.database import init_db, get_or_create_user, update_user_stripe, FREE_DAILY_LIMIT, Entitlement, load_entitlement, reserve_quota, release_quota, append_quest_history, get_quest_history_page, iter_quest_history, get_quest_guild_counts, get_all_feature_flags, get_feature_flag, set_feature_flag, close_db_pool, get_db_pool_stats, is_premium, get_premium_cache_stats, load_ai_artifact, save_ai_artifact, prune_ai_artifacts, SessionLoadError
 from backend.healthcheck import (
     start_health_check_scheduler, run_health_checks, get_last_report,
     start_guardian, get_guardian_status, reset_guardian,
@@ -201,6 +205,23 @@ from backend.healthcheck import (
     register_guardian_repair, register_guardian_safe_state_hook,
 )
 from backend.cosmos_service import get_cosmos_service
+from backend.session_cache import SessionCache
+from backend.session_locks import StripedLocks, SessionLockTimeout
+from backend.session_persistence import SessionConflict, SessionFlushError, WriteBehindPersister
+from backend.session_store import create_session_backend
+from backend.ai_executor import AIExecutor, time_left
+from backend.hedging import Hedger, HedgeSuperseded
+from backend.circuit_breaker import CircuitBreakers
+from backend.adaptive_timeouts import AdaptiveTimeouts
+from backend.deadlines import DeadlineBudget
+from backend.disconnect import ClientDisconnected, DisconnectWatcher
+from backend.idempotency import IdempotencyConflict, IdempotencyStore
+from backend.task_graph import GraphTimings, TaskGraph
+from backend.background_jobs import BackgroundJobs, JobFailed, JobQueue, JobRejected
+from backend.ai_cache import AIArtifactCache, fill_player, template_player
+from backend.singleflight import SingleFlight
+from backend.story_stream import SEGMENT_DELIMITER, MAX_SEGMENTS, SegmentBroadcast, SegmentSplitter, StoryEvents, StoryProgress, StreamStats
+from backend.session_model import MATH_SKILLS, MasteryTable, PlayerSession, encode_session_row, session_to_dict
 
 try:
     init_db()
@@ -285,7 +306,30 @@ class ErrorPatcherMiddleware(BaseHTTPMiddleware):
             logger.error(f"CRITICAL ERROR: {e}\n{traceback.format_exc()}")
             raise e
 
-app = FastAPI(docs_url=None, redoc_url=None, openapi_url=None)
+@contextlib.asynccontextmanager
+async def _app_lifespan(_app):
+    # Startup: with SESSION_BACKEND=postgres, start applying other workers'
+    # session / flag invalidations.
+    _session_backend.start(
+        on_invalidate=_on_remote_session_change,
+        on_conflict=_drop_cached_session,
+        on_reset=_on_session_listener_reset,
+    )
+    _session_backend.subscribe("flag", lambda name: _flag_cache.pop(name, None))
+    if _session_backend.name == "local" and WEB_CONCURRENCY > 1:
+        logger.warning("[SESSION] WEB_CONCURRENCY > 1 with SESSION_BACKEND=local: workers will not see each other's session changes")
+    if not STORY_JOBS_ENABLED:
+        logger.warning("[STORY] WEB_CONCURRENCY > 1: /api/story/jobs and quick-math enrichment are off (job state is per worker)")
+        logger.warning("[IDEMPOTENCY] WEB_CONCURRENCY > 1: Idempotency-Key replay is per worker, so a retry on another worker runs again")
+    yield
+    # Shutdown: write every dirty session, then hand every pooled
+    # PostgreSQL connection back cleanly.
+    _session_persister.stop()
+    _session_backend.stop()
+    _ai_executor.shutdown()
+    close_db_pool()
+
+app = FastAPI(docs_url=None, redoc_url=None, openapi_url=None, lifespan=_app_lifespan)
 app.add_middleware(ErrorPatcherMiddleware)
 
 # ── Firebase Admin SDK ─────────────────────────────────────────────────────────
@@ -372,7 +416,8 @@ app.add_middleware(
     allow_origins=_cors_origins,
     allow_credentials=False,
     allow_methods=["GET", "POST", "PATCH"],
-    allow_headers=["Content-Type", "Authorization", "x-admin-key"],
+    allow_headers=["Content-Type", "Authorization", "x-admin-key", "Idempotency-Key"],
+    expose_headers=["Idempotent-Replayed"],
 )
 
 MAX_REQUEST_BODY = 12 * 1024 * 1024
@@ -809,14 +854,23 @@ def _is_production() -> bool:
 
 
 _openai_client = None
+_async_openai_client = None
 _gemini_client = None
 
 def get_openai_client():
     global _openai_client
     if _openai_client is None:
-        _openai_client = OpenAI()
+        # Each call already runs under an executor deadline; SDK-level retries
+        # would only keep the request alive after the caller has given up.
+        _openai_client = OpenAI(max_retries=AI_MAX_RETRIES)
     return _openai_client
 
+def get_async_openai_client():
+    global _async_openai_client
+    if _async_openai_client is None:
+        _async_openai_client = AsyncOpenAI(max_retries=AI_MAX_RETRIES)
+    return _async_openai_client
+
 def get_gemini_client():
     global _gemini_client
     if _gemini_client is None:
@@ -831,6 +885,8 @@ AI_STORY_TIMEOUT_SECONDS = int(os.environ.get("AI_STORY_TIMEOUT_SECONDS", "16"))
 AI_MINIGAME_TIMEOUT_SECONDS = int(os.environ.get("AI_MINIGAME_TIMEOUT_SECONDS", "10"))
 AI_ANALOGY_TIMEOUT_SECONDS = int(os.environ.get("AI_ANALOGY_TIMEOUT_SECONDS", "10"))
 AI_VERIFY_TIMEOUT_SECONDS = int(os.environ.get("AI_VERIFY_TIMEOUT_SECONDS", "8"))
+AI_MAX_RETRIES = int(os.environ.get("AI_MAX_RETRIES", "0"))
+AI_VERIFY_RESOLVE = os.environ.get("AI_VERIFY_RESOLVE", "0") == "1"  # Re-solve /api/story answers the checker marks INCORRECT
 TIMEOUT_BUFFER_SECONDS = 2  # Extra buffer added to run_with_timeout beyond the inner AI call timeout
 
 # Azure model deployment names — override via environment variables to match your Azure deployment names
@@ -841,24 +897,171 @@ AZURE_VERIFY_MODEL = os.environ.get("AZURE_VERIFY_MODEL", "phi-4-mini")      # A
 AZURE_VISION_MODEL = os.environ.get("AZURE_VISION_MODEL", "gpt-4o-mini")     # Image OCR (must be vision-capable)
 GEMINI_IMAGE_MODEL = os.environ.get("GEMINI_IMAGE_MODEL", "gemini-2.5-flash-preview-image-generation")  # Image generation via Gemini 2.5 Flash
 
-def run_with_timeout(callable_fn, timeout_seconds: int):
-    result = {}
-    error = {}
+# Every upstream AI call runs on this shared, bounded pool (see
+# backend/ai_executor.py) instead of a throwaway thread per call.
+_ai_executor = AIExecutor()
 
-    def _target():
-        try:
-            result["value"] = callable_fn()
-        except Exception as exc:
-            error["exc"] = exc
+# Per-deployment circuit breakers: an unhealthy model is skipped outright
+# and callers fall back in milliseconds (see backend/circuit_breaker.py).
+_ai_breakers = CircuitBreakers()
+
+# Each call's timeout follows that model's recent latency percentiles; the
+# AI_*_TIMEOUT_SECONDS values above are used until there is enough data.
+_ai_timeouts = AdaptiveTimeouts()
+
+# Opt-in duplicate requests for the slow tail of story / math calls; the
+# hedge delay reads the same latency histograms as the timeouts.
+_ai_hedger = Hedger(_ai_timeouts, models=(AZURE_STORY_MODEL, AZURE_MATH_MODEL))
+
+# One total budget per /api/story request; async AI calls inside it get
+# whatever is left of it (see backend/deadlines.py).
+_story_deadline = DeadlineBudget()
+
+
+def run_with_timeout(callable_fn, timeout_seconds: int, kind: str = "ai"):
+    """Run an AI call on the shared executor; returns ``(value, timed_out)``."""
+    return _ai_executor.run(callable_fn, timeout_seconds, kind=kind)
+
+
+def _ai_chat(model: str, messages: list, timeout: int, kind: str):
+    """One chat completion on the shared executor; returns ``(response, timed_out)``.
+
+    *timeout* is the configured value; the call actually gets the model's
+    adaptive timeout (see backend/adaptive_timeouts.py).  While *model*'s
+    circuit breaker is open this returns ``(None, True)`` at once, so the
+    caller takes its timeout fallback without waiting.
+    """
+    timeout = _ai_timeouts.timeout_for(model, timeout)
+    if not _ai_breakers.allow(model):
+        return None, True
+    started = _time.monotonic()
+    timed_out, failed = False, True
+    try:
+        response, timed_out = run_with_timeout(
+            lambda: get_openai_client().chat.completions.create(
+                model=model,
+                timeout=time_left(timeout),
+                messages=messages,
+            ),
+            timeout + TIMEOUT_BUFFER_SECONDS,
+            kind=kind,
+        )
+        failed = False
+        return response, timed_out
+    finally:
+        _ai_record_outcome(model, started, timeout, timed_out, failed)
+
+
+def _ai_record_outcome(model: str, started: float, timeout: float, timed_out: bool, failed: bool) -> None:
+    elapsed = _time.monotonic() - started
+    _ai_breakers.record(model, not (timed_out or failed), elapsed, timeout + TIMEOUT_BUFFER_SECONDS)
+    _ai_timeouts.record(model, elapsed, timed_out=timed_out, failed=failed)
+
+
+async def _ai_guarded(model: str, timeout: float, make_call, shortened: bool = False):
+    """Await ``make_call()`` (an executor ``run_async``) under *model*'s circuit breaker.
+
+    A call whose timeout the request deadline *shortened* says nothing
+    about the model's health when it times out, so that is not recorded.
+    """
+    if not _ai_breakers.allow(model):
+        return None, True
+    started = _time.monotonic()
+    try:
+        value, timed_out = await make_call()
+    except asyncio.CancelledError:
+        _ai_breakers.cancel(model)
+        raise
+    except Exception:
+        _ai_record_outcome(model, started, timeout, False, True)
+        raise
+    if timed_out and shortened:
+        _ai_breakers.cancel(model)
+        return value, timed_out
+    _ai_record_outcome(model, started, timeout, timed_out, False)
+    return value, timed_out
+
+
+# Bump whenever a prompt template or its parsing changes: every cached AI
+# artifact from the old prompts then stops matching (see backend/ai_cache.py).
+AI_PROMPT_VERSION = 1
+_ai_cache = AIArtifactCache(AI_PROMPT_VERSION, load=load_ai_artifact, save=save_ai_artifact, prune=prune_ai_artifacts)
 
-    worker = threading.Thread(target=_target, daemon=True)
-    worker.start()
-    worker.join(timeout_seconds)
-    if worker.is_alive():
+# Identical prompts already in flight share one upstream call (keyed by the
+# cache keys above, so a cache miss coalesces before it reaches the model).
+_ai_flights = SingleFlight()
+
+
+def _problem_cache_key(problem: str) -> str:
+    """Problem text as it enters a cache key: "What is 12 × 7?" and "12*7" collide.
+
+    Question wording and ×/÷ are normalised by :func:`_normalize_math_expression`;
+    the trailing question mark it would reject is dropped first.
+    """
+    return _normalize_math_expression(problem.strip().rstrip("?!. ")) or " ".join(problem.lower().split())
+
+
+async def _ai_chat_async(model: str, messages: list, timeout: int, kind: str):
+    """Async :func:`_ai_chat`: awaited on the event loop, cancelled on timeout.
+
+    Slow story / math calls may be hedged (see backend/hedging.py); both
+    attempts share the one timeout.  Inside a /api/story request the
+    timeout is also capped by what is left of its deadline, and the call
+    is skipped (reported as timed out) when too little is left.
+    """
+    full_timeout = _ai_timeouts.timeout_for(model, timeout)
+    timeout = _story_deadline.timeout(kind, full_timeout, TIMEOUT_BUFFER_SECONDS)
+    if timeout is None:
         return None, True
-    if "exc" in error:
-        raise error["exc"]
-    return result.get("value"), False
+    return await _ai_guarded(model, timeout, lambda: _ai_executor.run_async(
+        lambda: _ai_hedger.run(model, lambda: get_async_openai_client().chat.completions.create(
+            model=model,
+            timeout=timeout,
+            messages=messages,
+        )),
+        timeout + TIMEOUT_BUFFER_SECONDS,
+        kind=kind,
+    ), shortened=timeout < full_timeout)
+
+
+async def _ai_chat_stream_async(model: str, messages: list, timeout: int, kind: str, on_text):
+    """Streaming :func:`_ai_chat_async`: ``on_text(delta)`` per token chunk.
+
+    Returns ``(full_text, timed_out)``; the timeout covers the whole stream.
+    When hedged, the first attempt to produce text owns ``on_text`` and the
+    other one stops.
+    """
+    full_timeout = _ai_timeouts.timeout_for(model, timeout)
+    timeout = _story_deadline.timeout(kind, full_timeout, TIMEOUT_BUFFER_SECONDS)
+    if timeout is None:
+        return None, True
+    owner = []
+
+    async def _consume():
+        attempt = object()
+        stream = await get_async_openai_client().chat.completions.create(
+            model=model,
+            timeout=timeout,
+            messages=messages,
+            stream=True,
+        )
+        parts = []
+        async for chunk in stream:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                if not owner:
+                    owner.append(attempt)
+                elif owner[0] is not attempt:
+                    raise HedgeSuperseded()
+                parts.append(delta)
+                on_text(delta)
+        return "".join(parts)
+
+    return await _ai_guarded(model, timeout, lambda: _ai_executor.run_async(
+        lambda: _ai_hedger.run(model, _consume, should_hedge=lambda: not owner),
+        timeout + TIMEOUT_BUFFER_SECONDS,
+        kind=kind,
+    ), shortened=timeout < full_timeout)
 
 CHARACTERS = {
     "Arcanos": {
@@ -948,10 +1151,17 @@ CHARACTERS = {
 FREE_HERO_ROSTER = {"Arcanos", "Blaze", "Shadow", "Zenith"}
 
 
-def _is_hero_unlocked_for_session(session_id: str, hero_name: str) -> bool:
+def _is_hero_unlocked_for_session(session_id: str, hero_name: str, entitlement: Optional[Entitlement] = None) -> bool:
+    """Free heroes are always unlocked; the rest need premium.
+
+    Pass the request's already-loaded *entitlement* to avoid another query;
+    otherwise the status comes from the premium cache.
+    """
     if hero_name in FREE_HERO_ROSTER:
         return True
-    return is_premium(session_id)
+    if entitlement is None:
+        return is_premium(session_id)
+    return entitlement.is_premium
 
 SHOP_ITEMS = [
     {"id": "fire_sword", "name": "Fire Sword", "category": "weapons", "price": 100, "description": "A blazing blade that burns through math problems.", "effect": {"type": "damage_boost", "value": 15}, "rarity": "common"},
@@ -1191,8 +1401,17 @@ def _ideology_label(meter: int) -> str:
 
 DAILY_CHEST_REWARDS = {"5-7": 30, "8-10": 35, "11-13": 40}
 
-sessions: dict = {}
-_MAX_SESSIONS = 10000
+# Live sessions: LRU + idle TTL + byte budget, flushed to the DB before
+# eviction (see backend/session_cache.py).  Wired to the persister below.
+sessions = SessionCache(on_evict=lambda sid, _session: _evict_session(sid))
+# Where sessions are loaded from / written to (SESSION_BACKEND=local|postgres).
+_session_backend = create_session_backend()
+# Completed quests kept inline in the session; the full log is quest_history.
+QUEST_HISTORY_WINDOW = int(os.environ.get("QUEST_HISTORY_WINDOW", "20"))
+# Shape of the session document.  Bump whenever _ensure_session_defaults
+# gains a field or a normalization, so stored sessions are migrated once on
+# their next load instead of being re-normalized on every access.
+SESSION_SCHEMA_VERSION = 1
 
 def normalize_age_group(age_group: Optional[str]) -> str:
     if age_group in AGE_GROUP_SETTINGS:
@@ -1359,7 +1578,6 @@ def _hash_parent_pin(pin: str) -> str:
 def _is_valid_parent_pin(pin: str) -> bool:
     return isinstance(pin, str) and len(pin) == 4 and pin.isdigit()
 
-MATH_SKILLS = ["addition", "subtraction", "multiplication", "division", "fractions", "decimals", "algebra", "exponents"]
 
 def _detect_math_skill(problem: str) -> str:
     p = problem.lower()
@@ -1544,12 +1762,14 @@ MATH_ANALOGIES = {
 
 def _ensure_mastery_defaults(session: dict):
     mastery = session.setdefault("mastery", {})
-    if not isinstance(mastery, dict):
+    if isinstance(mastery, MasteryTable):
+        return  # fixed arrays: every skill is always present
+    if not isinstance(mastery, Mapping):
         mastery = {}
         session["mastery"] = mastery
     for skill in MATH_SKILLS:
         entry = mastery.get(skill)
-        if not isinstance(entry, dict):
+        if not isinstance(entry, Mapping):
             mastery[skill] = {"correct": 0, "total": 0, "mastery_score": 0.0}
         else:
             entry.setdefault("correct", 0)
@@ -1628,7 +1848,7 @@ def _ensure_session_defaults(session: dict):
     _update_badges(session)
 
 def _public_session_payload(session: dict):
-    data = {k: v for k, v in session.items() if not k.startswith("_")}
+    data = {k: v for k, v in session_to_dict(session).items() if not k.startswith("_")}
     data["badge_details"] = _get_badge_details(data.get("badges"))
     data["progression"] = _build_progression(session)
     data["learning_plan"] = _build_learning_plan(session)
@@ -1644,17 +1864,56 @@ def _public_session_payload(session: dict):
     data.setdefault("tycoon_currency", session.get("tycoon_currency", 0))
     return data
 
+def _migrate_session(session: dict) -> bool:
+    """Bring a new or freshly loaded session up to SESSION_SCHEMA_VERSION.
+
+    Runs the full normalization once; afterwards the document carries
+    ``_schema_version`` and steady-state reads skip it.  Returns True if
+    the session was changed.
+    """
+    if session.get("_schema_version", 0) >= SESSION_SCHEMA_VERSION:
+        return False
+    _ensure_session_defaults(session)
+    session["_schema_version"] = SESSION_SCHEMA_VERSION
+    return True
+
+
+def _touch_session(sid: str, session: dict) -> None:
+    """Per-access bookkeeping: roll the daily streak on the first visit of a day.
+
+    That first visit is a real mutation, so it takes the session lock and
+    saves like any other; later visits that day only read the date.
+    """
+    today = datetime.date.today().isoformat()
+    if session.get("last_active_date") == today:
+        return
+    with _session_lock(sid):
+        if session.get("last_active_date") == today:
+            return
+        _update_streak(session)
+        _update_badges(session)
+        _save_session(sid)
+
+
 def get_session(sid: str):
-    if sid not in sessions:
+    s = sessions.get(sid)
+    if s is None:
         # Try to restore from the database first
-        db_data = load_session_data(sid)
+        try:
+            db_data = _session_backend.load(sid)
+        except SessionLoadError:
+            # Not "no session": a fresh one would be saved over the real row.
+            raise HTTPException(status_code=503, detail="Your progress could not be loaded right now. Please try again in a moment.")
         if db_data:
-            sessions[sid] = db_data
+            db_data = PlayerSession(db_data)
+            migrated = _migrate_session(db_data)
+            s = sessions.setdefault(sid, db_data)
+            if s is db_data:
+                _backfill_quest_history(sid, s)
+                if migrated:
+                    _save_session(sid)
         else:
-            if len(sessions) >= _MAX_SESSIONS:
-                oldest_key = next(iter(sessions))
-                del sessions[oldest_key]
-            sessions[sid] = {
+            fresh = PlayerSession({
                 "coins": 0,
                 "inventory": [],
                 "equipped": [],
@@ -1673,22 +1932,164 @@ def get_session(sid: str):
                 "perseverance_score": 0,
                 "hint_count": 0,
                 "difficulty_level": DDA_DEFAULT,
-                "_ts": _time.time(),
-            }
-    s = sessions[sid]
-    s["_ts"] = _time.time()
-    _ensure_session_defaults(s)
+                "_history_logged": True,
+            })
+            _migrate_session(fresh)
+            s = sessions.setdefault(sid, fresh)
+    _touch_session(sid, s)
     return s
 
 
-def _save_session(sid: str) -> None:
-    """Persist the in-memory session to the database (best-effort)."""
-    if sid not in sessions:
+def _backfill_quest_history(sid: str, session: dict) -> bool:
+    """One-time move of a legacy, unbounded ``history`` list into quest_history.
+
+    The list is only cut down to the recent window, and the session marked,
+    once the insert has committed; if it fails the list stays whole and the
+    move is retried with the next quest.  Returns True once it is done.
+    """
+    if session.get("_history_logged"):
+        return True
+    history = session.get("history") or []
+    try:
+        append_quest_history(sid, history, strict=True)
+    except Exception as e:
+        logger.warning(f"[SESSION] Quest history backfill for {sid} failed; will retry: {e}")
+        return False
+    session["history"] = history[-QUEST_HISTORY_WINDOW:]
+    session["_history_logged"] = True
+    _save_session(sid)
+    return True
+
+
+def _record_quest(sid: str, session: dict, entry: dict) -> None:
+    """Log a completed quest and keep only the recent window in the session.
+
+    If the insert fails, the entry stays in the session (counted in
+    ``_history_unlogged``) and the window is not trimmed; the next quest
+    that does get logged takes the backlog with it.
+    """
+    if not _backfill_quest_history(sid, session):
+        # The legacy list is still the only copy: keep it whole, and let
+        # this quest move into quest_history along with it.
+        session["history"].append(entry)
         return
+    history = session["history"]
+    history.append(entry)
+    unlogged = session.get("_history_unlogged", 0) + 1
+    try:
+        append_quest_history(sid, history[-unlogged:], strict=True)
+    except Exception as e:
+        logger.warning(f"[SESSION] Quest history insert for {sid} failed; keeping {unlogged} in the session: {e}")
+        session["_history_unlogged"] = unlogged
+        return
+    session.pop("_history_unlogged", None)
+    if len(history) > QUEST_HISTORY_WINDOW:
+        del history[:-QUEST_HISTORY_WINDOW]
+
+
+def _session_snapshot(sid: str) -> Optional[bytes | tuple[bytes, str]]:
+    """Serialize a session for the write-behind persister (None if evicted)."""
+    session = sessions.peek(sid)
+    if session is None:
+        return None
+    # Serialize under the session's lock for a consistent snapshot.  The short
+    # timeout breaks lock-order cycles with eviction flushes; if the unlocked
+    # fallback trips over a concurrent mutation the persister retries later.
+    lock = _session_locks.lock_for(sid)
+    locked = lock.acquire(timeout=1.0)
+    try:
+        return encode_session_row(session)
+    finally:
+        if locked:
+            lock.release()
+
+
+_session_persister = WriteBehindPersister(_session_snapshot, _session_backend.write_batch)
+_session_locks = StripedLocks()
+
+
+def _evict_session(sid: str) -> None:
+    """SessionCache eviction hook: write pending changes, then forget the sid."""
+    try:
+        _session_persister.flush(sid)
+    except SessionConflict:
+        pass   # our copy was stale; the newer row is already in the database
+    _session_backend.forget(sid)
+
+
+def _drop_cached_session(sid: str) -> None:
+    """Discard our copy of *sid*; the next request reloads it from the DB."""
+    try:
+        with _session_locks.hold(sid, timeout=1.0):
+            sessions.pop(sid, None)
+    except SessionLockTimeout:
+        logger.warning(f"[SESSION] Could not drop stale session {sid}: busy")
+
+
+def _on_session_listener_reset() -> None:
+    """The invalidation listener reconnected: any NOTIFY may have been missed.
+
+    Write what is queued, then drop every cached session so each one is
+    reloaded (with its current version) on next use.
+    """
     try:
-        save_session_data(sid, sessions[sid])
+        _session_persister.flush()
     except Exception as e:
-        logger.warning(f"[SESSION] Could not persist session {sid}: {e}")
+        logger.warning(f"[SESSION] Flush before listener resync failed: {e}")
+    for sid in list(sessions):
+        _drop_cached_session(sid)
+
+
+def _on_remote_session_change(sid: str) -> None:
+    """Another worker saved *sid* (SESSION_BACKEND=postgres)."""
+    if _session_persister.is_dirty(sid):
+        # Our own unsaved change wins the race to the version check instead;
+        # if it loses, _drop_cached_session runs as the conflict handler.
+        return
+    _drop_cached_session(sid)
+
+
+@contextlib.contextmanager
+def _session_lock(sid: str):
+    """Serialize read-modify-write of one session across threadpool workers.
+
+    Wrap only the mutation (get_session → change → _save_session), never an
+    AI call.  Re-entrant, so nested helpers may take it again.
+    """
+    try:
+        with _session_locks.hold(sid):
+            yield
+    except SessionLockTimeout:
+        raise HTTPException(status_code=409, detail="Another request for this session is still running. Please retry.")
+
+
+def _save_session(sid: str, durable: bool = False) -> None:
+    """Persist the in-memory session to the database (best-effort).
+
+    Normally the session is only marked dirty and written by the background
+    flusher within SESSION_FLUSH_INTERVAL_SECONDS.  Pass ``durable=True`` on
+    money-sensitive paths to write it before the response goes out; if that
+    write fails the request fails with 503 instead of reporting success
+    (the change stays queued for the background flusher), and if another
+    worker saved the session first it fails with 409 (our stale copy is
+    dropped, so a retry applies the change to the saved one).
+
+    With SESSION_BACKEND=postgres every save is durable: a deferred write
+    that lost the version race could only be discarded, silently.
+    """
+    if sid not in sessions:
+        return
+    sessions.update_size(sid)
+    _session_persister.mark_dirty(sid)
+    if durable or _session_backend.name == "postgres":
+        try:
+            _session_persister.flush(sid)
+        except SessionConflict as e:
+            logger.warning(f"[SESSION] Durable save of session {sid} lost a version race: {e}")
+            raise HTTPException(status_code=409, detail="Your game was updated elsewhere. Please try again.")
+        except SessionFlushError as e:
+            logger.error(f"[SESSION] Durable save of session {sid} failed: {e}")
+            raise HTTPException(status_code=503, detail="Your progress could not be saved right now. Please try again in a moment.")
 
 
 class StoryRequest(BaseModel):
@@ -1875,25 +2276,26 @@ def get_session_data(session_id: str):
 @app.post("/api/session/profile")
 def update_session_profile(req: SessionProfileRequest, authorization: Optional[str] = Header(default=None)):
     validate_session_id(req.session_id)
-    s = get_session(req.session_id)
-    if req.player_name is not None:
-        s["player_name"] = normalize_player_name(req.player_name)
-    if req.age_group is not None:
-        s["age_group"] = normalize_age_group(req.age_group)
-    if req.selected_realm is not None:
-        s["selected_realm"] = normalize_realm(req.selected_realm)
-    if req.preferred_language is not None:
-        s["preferred_language"] = normalize_preferred_language(req.preferred_language)
-    if req.hero_unlocked is not None:
-        s["hero_unlocked"] = req.hero_unlocked
-    if req.tycoon_currency is not None:
-        s["tycoon_currency"] = req.tycoon_currency
-    if req.player_level is not None:
-        s["player_level"] = req.player_level
-    if req.player_xp is not None:
-        s["player_xp"] = req.player_xp
-    _ensure_session_defaults(s)
-    _save_session(req.session_id)
+    with _session_lock(req.session_id):
+        s = get_session(req.session_id)
+        if req.player_name is not None:
+            s["player_name"] = normalize_player_name(req.player_name)
+        if req.age_group is not None:
+            s["age_group"] = normalize_age_group(req.age_group)
+        if req.selected_realm is not None:
+            s["selected_realm"] = normalize_realm(req.selected_realm)
+        if req.preferred_language is not None:
+            s["preferred_language"] = normalize_preferred_language(req.preferred_language)
+        if req.hero_unlocked is not None:
+            s["hero_unlocked"] = req.hero_unlocked
+        if req.tycoon_currency is not None:
+            s["tycoon_currency"] = req.tycoon_currency
+        if req.player_level is not None:
+            s["player_level"] = req.player_level
+        if req.player_xp is not None:
+            s["player_xp"] = req.player_xp
+        _ensure_session_defaults(s)
+        _save_session(req.session_id)
 
     # Persist tycoon/hero progress to Cosmos DB (best-effort; never blocks the response)
     if req.hero_unlocked is not None or req.tycoon_currency is not None:
@@ -2062,9 +2464,13 @@ async def tycoon_save(req: TycoonSaveRequest, request: Request):
     # Also keep the in-memory session and tycoon_currency in sync.
     # Round to nearest integer for the session field (consistent with the
     # existing tycoon_currency field which is stored as int elsewhere).
-    s = get_session(req.session_id)
-    s["tycoon_currency"] = round(req.coins)
-    _save_session(req.session_id)
+    def _sync_session():
+        with _session_lock(req.session_id):
+            s = get_session(req.session_id)
+            s["tycoon_currency"] = round(req.coins)
+            _save_session(req.session_id)
+
+    await run_in_threadpool(_sync_session)
 
     # Best-effort Cosmos persist — never let a DB error surface to the client
     try:
@@ -2483,17 +2889,11 @@ async def problem_from_image(file: UploadFile = File(...)):
 @app.get("/api/subscription/{session_id}")
 def get_subscription_status(session_id: str):
     validate_session_id(session_id)
-    user = get_or_create_user(session_id)
-    usage = get_daily_usage(session_id)
-    allowed, remaining = can_solve_problem(session_id)
-    premium = user["subscription_status"] in ("active", "trialing")
+    entitlement = load_entitlement(session_id)
     return {
-        "is_premium": premium,
-        "subscription_status": user["subscription_status"],
-        "daily_usage": usage,
-        "daily_limit": FREE_DAILY_LIMIT,
-        "remaining": remaining if not premium else -1,
-        "can_solve": allowed,
+        **entitlement.usage_payload(),
+        "subscription_status": entitlement.subscription_status,
+        "can_solve": entitlement.can_solve,
     }
 
 @app.get("/api/stripe/publishable-key")
@@ -2608,17 +3008,16 @@ async def stripe_webhook(request: Request):
         subscription_id = data.get("id")
         status = data.get("status")
         customer_id = data.get("customer")
-        from backend.database import get_db_connection
+        from backend.database import db_connection
         try:
-            conn = get_db_connection()
-            cur = conn.cursor()
-            cur.execute(
-                "SELECT session_id FROM app_users WHERE stripe_customer_id = %s OR stripe_subscription_id = %s",
-                (customer_id, subscription_id),
-            )
-            row = cur.fetchone()
-            cur.close()
-            conn.close()
+            with db_connection() as conn:
+                cur = conn.cursor()
+                cur.execute(
+                    "SELECT session_id FROM app_users WHERE stripe_customer_id = %s OR stripe_subscription_id = %s",
+                    (customer_id, subscription_id),
+                )
+                row = cur.fetchone()
+                cur.close()
             if row:
                 mapped_status = status if status in ("active", "trialing", "past_due") else "free"
                 if event_type == "customer.subscription.deleted":
@@ -3019,47 +3418,59 @@ def _fallback_mini_games(math_problem, solved, hero_name, age_group, player_leve
     return sanitized
 
 
-def generate_teaching_analogy(math_skill: str, problem: str) -> dict:
+def _analogy_messages(problem: str) -> list:
+    prompt = (
+        f"You are an expert math teacher for children aged 5-13. "
+        f"Create a vivid, memorable analogy that explains the math concept in this problem: '{problem}'\n"
+        f"The analogy must be returned as a JSON object with EXACTLY these fields:\n"
+        f"- title: short catchy title (max 5 words)\n"
+        f"- analogy: one clear sentence describing the analogy\n"
+        f"- why_this_works: array of exactly 3 short bullet-point sentences\n"
+        f"- where_it_breaks: one sentence about a limitation of the analogy\n"
+        f"- example_steps: array of exactly 3 numbered example steps\n"
+        f"- check_question: one follow-up question a child can try\n"
+        f"- alternate_analogies: array of exactly 2 alternative one-sentence analogies\n"
+        f"Return ONLY the JSON object, no markdown or code blocks."
+    )
+    return [
+        {"role": "system", "content": "You are a friendly math teacher who explains concepts with creative analogies for kids."},
+        {"role": "user", "content": prompt},
+    ]
+
+
+def _parse_analogy(response) -> Optional[dict]:
+    text = (response.choices[0].message.content if response.choices else "").strip()
+    text = re.sub(r'^```(?:json)?\s*', '', text)
+    text = re.sub(r'\s*```$', '', text)
+    analogy = json.loads(text)
+    required = {"title", "analogy", "why_this_works", "where_it_breaks", "example_steps", "check_question", "alternate_analogies"}
+    if required.issubset(analogy.keys()):
+        return analogy
+    return None
+
+
+async def generate_teaching_analogy_async(math_skill: str, problem: str) -> dict:
     """Generate a child-friendly teaching analogy for a math skill using GPT-5.2.
 
     Falls back to the pre-written MATH_ANALOGIES entry on any error so the
     rest of the response is never blocked.
     """
     static = MATH_ANALOGIES.get(math_skill, MATH_ANALOGIES["addition"])
-    try:
-        prompt = (
-            f"You are an expert math teacher for children aged 5-13. "
-            f"Create a vivid, memorable analogy that explains the math concept in this problem: '{problem}'\n"
-            f"The analogy must be returned as a JSON object with EXACTLY these fields:\n"
-            f"- title: short catchy title (max 5 words)\n"
-            f"- analogy: one clear sentence describing the analogy\n"
-            f"- why_this_works: array of exactly 3 short bullet-point sentences\n"
-            f"- where_it_breaks: one sentence about a limitation of the analogy\n"
-            f"- example_steps: array of exactly 3 numbered example steps\n"
-            f"- check_question: one follow-up question a child can try\n"
-            f"- alternate_analogies: array of exactly 2 alternative one-sentence analogies\n"
-            f"Return ONLY the JSON object, no markdown or code blocks."
-        )
-        response, timed_out = run_with_timeout(
-            lambda: get_openai_client().chat.completions.create(
-                model=AZURE_ANALOGY_MODEL,
-                timeout=AI_ANALOGY_TIMEOUT_SECONDS,
-                messages=[
-                    {"role": "system", "content": "You are a friendly math teacher who explains concepts with creative analogies for kids."},
-                    {"role": "user", "content": prompt},
-                ],
-            ),
-            AI_ANALOGY_TIMEOUT_SECONDS + TIMEOUT_BUFFER_SECONDS,
-        )
+    cache_key = _ai_cache.key("analogy", problem=_problem_cache_key(problem))
+    cached = await _ai_cache.aget("analogy", cache_key)
+    if cached is not None:
+        return cached
+
+    async def _generate():
+        response, timed_out = await _ai_chat_async(AZURE_ANALOGY_MODEL, _analogy_messages(problem), AI_ANALOGY_TIMEOUT_SECONDS, "analogy")
         if timed_out or response is None:
-            return static
-        text = (response.choices[0].message.content if response.choices else "").strip()
-        text = re.sub(r'^```(?:json)?\s*', '', text)
-        text = re.sub(r'\s*```$', '', text)
-        analogy = json.loads(text)
-        required = {"title", "analogy", "why_this_works", "where_it_breaks", "example_steps", "check_question", "alternate_analogies"}
-        if required.issubset(analogy.keys()):
-            return analogy
+            return None
+        analogy = _parse_analogy(response)
+        _ai_cache.put("analogy", cache_key, analogy)
+        return analogy
+
+    try:
+        return await _ai_flights.do(cache_key, _generate, kind="analogy") or static
     except Exception as e:
         logger.warning(f"[ANALOGY] Generation failed, using static fallback: {sanitize_error(e)}")
     return static
@@ -3074,7 +3485,47 @@ _CHESTER_SECTORS: dict[str, str] = {
 }
 
 
-def generate_victory_story(hero: str, equation_solved: str, answer: str, realm: str) -> str:
+def _victory_static_beat(hero: str, equation_solved: str, answer: str, realm: str) -> str:
+    location = _CHESTER_SECTORS.get(realm, f"{realm}, Chester")
+    return (
+        f"{hero} channels the answer — {answer} — and the Logic Gate shatters in a burst of light, "
+        f"restoring order to {location}. "
+        f"That worked because the equation {equation_solved} = {answer} holds true — "
+        f"the numbers lined up perfectly and the pattern clicked into place. "
+        f"But in the distance, a new Data Anomaly flickers to life... the next challenge awaits."
+    )
+
+
+def _victory_messages(hero: str, equation_solved: str, answer: str, realm: str) -> list:
+    location = _CHESTER_SECTORS.get(realm, f"{realm}, Chester")
+    system_prompt = (
+        "You are the World Builder for The Math Script, a techno-fantasy math RPG set in Chester, Pennsylvania. "
+        "Your job is to write a 3-sentence Victory Story beat that:\n"
+        "1. Features the hero using the exact correct answer to overcome the obstacle or power up.\n"
+        "2. Is set in the specified Chester location with vivid techno-fantasy imagery.\n"
+        "3. Is strictly PG — no violence; focus on 'restoring logic', 'breaking barriers', or 'powering up energy'.\n"
+        "4. The SECOND sentence must be a child-friendly explanation of WHY the math answer is correct — "
+        "explain the mechanism or concept simply (e.g., '5 × 5 equals 25 because five groups of five things "
+        "gives you twenty-five total'). Make it feel like part of the story.\n"
+        "5. Ends with a subtle cliffhanger that teases the next challenge.\n"
+        "Write EXACTLY 3 sentences. No markdown, no headers — plain text only."
+    )
+    user_prompt = (
+        f"Equation Solved: {equation_solved} = {answer}\n"
+        f"Hero: {hero}\n"
+        f"Current Location: {location}"
+    )
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt},
+    ]
+
+
+def _response_text(response) -> str:
+    return (response.choices[0].message.content if response.choices else "").strip()
+
+
+async def generate_victory_story_async(hero: str, equation_solved: str, answer: str, realm: str) -> str:
     """Generate a 3-sentence World Builder Victory Story beat.
 
     Uses AZURE_STORY_MODEL with the World Builder system prompt.  Follows
@@ -3085,55 +3536,51 @@ def generate_victory_story(hero: str, equation_solved: str, answer: str, realm:
     Falls back to a static beat on timeout or error so the response is never
     blocked.
     """
-    location = _CHESTER_SECTORS.get(realm, f"{realm}, Chester")
-    static_beat = (
-        f"{hero} channels the answer — {answer} — and the Logic Gate shatters in a burst of light, "
-        f"restoring order to {location}. "
-        f"That worked because the equation {equation_solved} = {answer} holds true — "
-        f"the numbers lined up perfectly and the pattern clicked into place. "
-        f"But in the distance, a new Data Anomaly flickers to life... the next challenge awaits."
-    )
+    cache_key = _ai_cache.key("victory", problem=_problem_cache_key(equation_solved), hero=hero, answer=answer, realm=realm)
+    cached = await _ai_cache.aget("victory", cache_key)
+    if cached is not None:
+        return cached
+
+    async def _generate():
+        response, timed_out = await _ai_chat_async(
+            AZURE_STORY_MODEL, _victory_messages(hero, equation_solved, answer, realm), AI_STORY_TIMEOUT_SECONDS, "victory",
+        )
+        if timed_out or response is None:
+            return None
+        text = _response_text(response)
+        if text:
+            _ai_cache.put("victory", cache_key, text)
+        return text
 
     try:
-        system_prompt = (
-            "You are the World Builder for The Math Script, a techno-fantasy math RPG set in Chester, Pennsylvania. "
-            "Your job is to write a 3-sentence Victory Story beat that:\n"
-            "1. Features the hero using the exact correct answer to overcome the obstacle or power up.\n"
-            "2. Is set in the specified Chester location with vivid techno-fantasy imagery.\n"
-            "3. Is strictly PG — no violence; focus on 'restoring logic', 'breaking barriers', or 'powering up energy'.\n"
-            "4. The SECOND sentence must be a child-friendly explanation of WHY the math answer is correct — "
-            "explain the mechanism or concept simply (e.g., '5 × 5 equals 25 because five groups of five things "
-            "gives you twenty-five total'). Make it feel like part of the story.\n"
-            "5. Ends with a subtle cliffhanger that teases the next challenge.\n"
-            "Write EXACTLY 3 sentences. No markdown, no headers — plain text only."
-        )
-        user_prompt = (
-            f"Equation Solved: {equation_solved} = {answer}\n"
-            f"Hero: {hero}\n"
-            f"Current Location: {location}"
-        )
-        response, timed_out = run_with_timeout(
-            lambda: get_openai_client().chat.completions.create(
-                model=AZURE_STORY_MODEL,
-                timeout=AI_STORY_TIMEOUT_SECONDS,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt},
-                ],
-            ),
-            AI_STORY_TIMEOUT_SECONDS + TIMEOUT_BUFFER_SECONDS,
-        )
-        if not timed_out and response is not None:
-            text = (response.choices[0].message.content if response.choices else "").strip()
-            if text:
-                return text
+        text = await _ai_flights.do(cache_key, _generate, kind="victory")
+        if text:
+            return text
     except Exception as e:
         logger.warning(f"[VICTORY] Victory story generation failed: {sanitize_error(e)}")
 
-    return static_beat
+    return _victory_static_beat(hero, equation_solved, answer, realm)
+
+
+def _verify_messages(problem: str, proposed_answer: str) -> list:
+    return [
+        {"role": "system", "content": "You are a precise math checker. Verify answers concisely."},
+        {"role": "user", "content": (
+            f"Math problem: {problem}\n"
+            f"Proposed answer: {proposed_answer}\n"
+            f"Is this answer correct? Reply with exactly CORRECT or INCORRECT on the first line, "
+            f"then one short reason on the second line."
+        )},
+    ]
+
+
+def _verify_flight_key(problem: str, proposed_answer: str) -> str:
+    # Verdicts are not cached (a solution is cached only once it passed),
+    # but identical checks in flight are shared.
+    return _ai_cache.key("verify", problem=_problem_cache_key(problem), answer=proposed_answer)
 
 
-def verify_math_answer(problem: str, proposed_answer: str) -> bool:
+async def verify_math_answer_async(problem: str, proposed_answer: str) -> bool:
     """Use Phi-4-mini to fact-check the math answer before the child sees it.
 
     Returns True if the answer appears correct, False if it appears wrong.
@@ -3141,308 +3588,547 @@ def verify_math_answer(problem: str, proposed_answer: str) -> bool:
     """
     if not proposed_answer:
         return True
-    try:
-        response, timed_out = run_with_timeout(
-            lambda: get_openai_client().chat.completions.create(
-                model=AZURE_VERIFY_MODEL,
-                timeout=AI_VERIFY_TIMEOUT_SECONDS,
-                messages=[
-                    {"role": "system", "content": "You are a precise math checker. Verify answers concisely."},
-                    {"role": "user", "content": (
-                        f"Math problem: {problem}\n"
-                        f"Proposed answer: {proposed_answer}\n"
-                        f"Is this answer correct? Reply with exactly CORRECT or INCORRECT on the first line, "
-                        f"then one short reason on the second line."
-                    )},
-                ],
-            ),
-            AI_VERIFY_TIMEOUT_SECONDS + TIMEOUT_BUFFER_SECONDS,
+
+    async def _check():
+        response, timed_out = await _ai_chat_async(
+            AZURE_VERIFY_MODEL, _verify_messages(problem, proposed_answer), AI_VERIFY_TIMEOUT_SECONDS, "verify",
         )
         if timed_out or response is None:
             return True
-        verdict = (response.choices[0].message.content if response.choices else "").strip().upper()
-        return not verdict.startswith("INCORRECT")
+        return not _response_text(response).upper().startswith("INCORRECT")
+
+    try:
+        return await _ai_flights.do(_verify_flight_key(problem, proposed_answer), _check, kind="verify")
     except Exception as e:
         logger.warning(f"[VERIFY] Math verification failed, skipping: {sanitize_error(e)}")
         return True
 
 
-def generate_mini_games(math_problem, math_steps, hero_name, age_group="8-10", player_level: int = 1):
+def _mini_game_messages(math_problem, math_steps, hero_name, age_group) -> list:
     cfg = AGE_GROUP_SETTINGS.get(age_group, AGE_GROUP_SETTINGS["8-10"])
+    prompt = (
+        f"Generate exactly 3 mini-game challenges for a kids' math learning game based on this math problem: {math_problem}\n\n"
+        f"The hero is {hero_name}. The verified solution steps are:\n"
+        + "\n".join(math_steps) + "\n\n"
+        f"Target age group: {age_group}. Difficulty level: {cfg['difficulty']}.\n"
+        f"Keep language age-appropriate: {cfg['story_style']}.\n"
+        f"Each challenge should match this age mode.\n\n"
+        f"Return a JSON array with exactly 3 objects. Each object must have these fields:\n"
+        f"- type: one of 'quicktime', 'timed', 'choice' (use different types for each)\n"
+        f"- title: a short fun action title\n"
+        f"- prompt: kid-friendly instruction\n"
+        f"- question: math question to answer\n"
+        f"- correct_answer: correct answer as a string\n"
+        f"- choices: array of answer choices including the correct answer\n"
+        f"- time_limit: seconds for timed challenge\n"
+        f"- reward_coins: coin reward integer\n"
+        f"- hero_action: what hero does on success\n"
+        f"- fail_message: encouraging message on wrong answer\n\n"
+        f"Mini-game 1 must be 'quicktime'. Mini-game 2 must be 'timed'. Mini-game 3 must be 'choice'.\n"
+        f"For age {age_group}, keep each question fair and not frustrating.\n"
+        f"Return ONLY the JSON array, no markdown, no code blocks."
+    )
+    return [
+        {"role": "system", "content": "You are a kids' game designer. Return only valid JSON."},
+        {"role": "user", "content": prompt},
+    ]
+
+
+def _parse_mini_games(response, age_group) -> Optional[list]:
+    text = _response_text(response)
+    if not text:
+        raise ValueError("No mini-game content returned")
+    text = re.sub(r'^```(?:json)?\s*', '', text)
+    text = re.sub(r'\s*```$', '', text)
+    mini_games = json.loads(text)
+    if isinstance(mini_games, list) and len(mini_games) >= 3:
+        cleaned = []
+        for mg in mini_games[:3]:
+            if mg.get("type") == "dragdrop":
+                mg["type"] = "timed"
+            cleaned.append(_sanitize_mini_game(mg, age_group))
+        return cleaned
+    return None
+
+
+def _reshuffle_choices(mini_games: list) -> list:
+    """Copies of cached mini-games with freshly shuffled answer choices."""
+    return [
+        {**mg, "choices": random.sample(mg["choices"], len(mg["choices"]))} if mg.get("choices") else dict(mg)
+        for mg in mini_games
+    ]
+
+
+async def generate_mini_games_async(math_problem, math_steps, hero_name, age_group="8-10", player_level: int = 1):
     # Fast path for common arithmetic inputs to keep story response quick.
     solved = try_solve_basic_math(math_problem)
     if solved:
         return _fallback_mini_games(math_problem, solved, hero_name, age_group, player_level)
-    try:
-        prompt = (
-            f"Generate exactly 3 mini-game challenges for a kids' math learning game based on this math problem: {math_problem}\n\n"
-            f"The hero is {hero_name}. The verified solution steps are:\n"
-            + "\n".join(math_steps) + "\n\n"
-            f"Target age group: {age_group}. Difficulty level: {cfg['difficulty']}.\n"
-            f"Keep language age-appropriate: {cfg['story_style']}.\n"
-            f"Each challenge should match this age mode.\n\n"
-            f"Return a JSON array with exactly 3 objects. Each object must have these fields:\n"
-            f"- type: one of 'quicktime', 'timed', 'choice' (use different types for each)\n"
-            f"- title: a short fun action title\n"
-            f"- prompt: kid-friendly instruction\n"
-            f"- question: math question to answer\n"
-            f"- correct_answer: correct answer as a string\n"
-            f"- choices: array of answer choices including the correct answer\n"
-            f"- time_limit: seconds for timed challenge\n"
-            f"- reward_coins: coin reward integer\n"
-            f"- hero_action: what hero does on success\n"
-            f"- fail_message: encouraging message on wrong answer\n\n"
-            f"Mini-game 1 must be 'quicktime'. Mini-game 2 must be 'timed'. Mini-game 3 must be 'choice'.\n"
-            f"For age {age_group}, keep each question fair and not frustrating.\n"
-            f"Return ONLY the JSON array, no markdown, no code blocks."
-        )
-        response, timed_out = run_with_timeout(
-            lambda: get_openai_client().chat.completions.create(
-                model=AZURE_STORY_MODEL,
-                timeout=AI_MINIGAME_TIMEOUT_SECONDS,
-                messages=[
-                    {"role": "system", "content": "You are a kids' game designer. Return only valid JSON."},
-                    {"role": "user", "content": prompt},
-                ],
-            ),
-            AI_MINIGAME_TIMEOUT_SECONDS + TIMEOUT_BUFFER_SECONDS,
+    cache_key = _ai_cache.key(
+        "mini_games", problem=_problem_cache_key(math_problem), steps=list(math_steps), hero=hero_name, age_group=age_group,
+    )
+    cached = await _ai_cache.aget("mini_games", cache_key)
+    if cached is not None:
+        return _reshuffle_choices(cached)
+
+    async def _generate():
+        response, timed_out = await _ai_chat_async(
+            AZURE_STORY_MODEL, _mini_game_messages(math_problem, math_steps, hero_name, age_group),
+            AI_MINIGAME_TIMEOUT_SECONDS, "mini_games",
         )
         if timed_out or response is None:
             logger.warning("[MINIGAME] Generation timed out; using fallback mini-games")
-            return _fallback_mini_games(math_problem, solved, hero_name, age_group, player_level)
-        text = (response.choices[0].message.content if response.choices else "").strip()
-        if not text:
-            raise ValueError("No mini-game content returned")
-        text = re.sub(r'^```(?:json)?\s*', '', text)
-        text = re.sub(r'\s*```$', '', text)
-        mini_games = json.loads(text)
-        if isinstance(mini_games, list) and len(mini_games) >= 3:
-            cleaned = []
-            for mg in mini_games[:3]:
-                if mg.get("type") == "dragdrop":
-                    mg["type"] = "timed"
-                cleaned.append(_sanitize_mini_game(mg, age_group))
+            return None
+        cleaned = _parse_mini_games(response, age_group)
+        if cleaned:
+            _ai_cache.put("mini_games", cache_key, cleaned)
+        return cleaned
+
+    try:
+        cleaned = await _ai_flights.do(cache_key, _generate, kind="mini_games")
+        if cleaned:
             return cleaned
     except Exception as e:
         logger.warning(f"Mini-game generation failed: {e}")
 
     return _fallback_mini_games(math_problem, try_solve_basic_math(math_problem), hero_name, age_group, player_level)
 
-@app.post("/api/story")
-def generate_story(req: StoryRequest, request: Request):
-    validate_session_id(req.session_id)
-    scan_input_for_attacks(req.problem, request)
-    if not check_rate_limit(f"story:{req.session_id}", max_requests=8, window=60):
-        raise HTTPException(status_code=429, detail="Too many requests. Please wait a moment.")
-    hero = CHARACTERS.get(req.hero)
-    if not hero:
-        raise HTTPException(status_code=400, detail="Unknown hero")
-    if not _is_hero_unlocked_for_session(req.session_id, req.hero):
-        raise HTTPException(status_code=403, detail="This hero is a Premium unlock. Upgrade to use this hero.")
 
-    allowed, remaining = can_solve_problem(req.session_id)
-    if not allowed:
-        raise HTTPException(status_code=403, detail=f"Daily limit reached! Free accounts get {FREE_DAILY_LIMIT} problems per day. Upgrade to Premium for unlimited access!")
+def _parse_math_solution(math_solution: str) -> tuple[list, str]:
+    """Split the math model's STEP/ANSWER reply into ``(steps, answer_line)``."""
+    math_steps = []
+    answer_line = ""
+    for line in math_solution.split('\n'):
+        line = line.strip()
+        if line.upper().startswith('STEP'):
+            step_text = re.sub(r'^STEP\s*\d+\s*[:\.]\s*', '', line, flags=re.IGNORECASE)
+            if step_text:
+                math_steps.append(step_text)
+        elif line.upper().startswith('ANSWER'):
+            answer_line = re.sub(r'^ANSWER\s*[:\.]\s*', '', line, flags=re.IGNORECASE)
+
+    if not math_steps:
+        for line in math_solution.split('\n'):
+            line = line.strip()
+            if line and not line.upper().startswith('ANSWER'):
+                math_steps.append(line)
+    if answer_line and answer_line not in math_steps:
+        math_steps.append(f"Answer: {answer_line}")
+    return math_steps, answer_line
+
+
+def _story_prelude(req: "StoryRequest") -> dict:
+    """Apply the request's profile overrides and snapshot the prompt context."""
+    with _session_lock(req.session_id):
+        session = get_session(req.session_id)
+        if req.player_name is not None:
+            session["player_name"] = normalize_player_name(req.player_name)
+        if req.age_group is not None:
+            session["age_group"] = normalize_age_group(req.age_group)
+        if req.selected_realm is not None:
+            session["selected_realm"] = normalize_realm(req.selected_realm)
+        if req.guild is not None and req.guild in GUILD_IDS:
+            session["guild"] = req.guild
+        _ensure_session_defaults(session)
+
+        # Update DDA level based on history before generating
+        session["difficulty_level"] = _compute_dda_level(session)
+
+        age_group = normalize_age_group(session.get("age_group"))
+        age_cfg = AGE_GROUP_SETTINGS[age_group]
+        # Guild and DDA context for prompts
+        guild_id = session.get("guild")
+        return {
+            "age_group": age_group,
+            "age_cfg": age_cfg,
+            "player_name": normalize_player_name(session.get("player_name")),
+            "selected_realm": normalize_realm(session.get("selected_realm")),
+            "gear": ", ".join(session["inventory"]) if session["inventory"] else "bare hands",
+            "player_level": int(session.get("player_level", 1)),
+            "guild_ctx": GUILD_CONFIG[guild_id]["prompt_context"] if guild_id and guild_id in GUILD_CONFIG else "",
+            "dda_hint": _dda_prompt_hint(int(session.get("difficulty_level", DDA_DEFAULT)), age_cfg),
+        }
 
-    session = get_session(req.session_id)
-    if req.player_name is not None:
-        session["player_name"] = normalize_player_name(req.player_name)
-    if req.age_group is not None:
-        session["age_group"] = normalize_age_group(req.age_group)
-    if req.selected_realm is not None:
-        session["selected_realm"] = normalize_realm(req.selected_realm)
-    if req.guild is not None and req.guild in GUILD_IDS:
-        session["guild"] = req.guild
-    _ensure_session_defaults(session)
 
-    # Update DDA level based on history before generating
-    session["difficulty_level"] = _compute_dda_level(session)
+# Per-node timings of every /api/story task graph, for /api/admin/perf.
+_story_timings = GraphTimings()
 
-    age_group = normalize_age_group(session.get("age_group"))
-    age_cfg = AGE_GROUP_SETTINGS[age_group]
-    player_name = normalize_player_name(session.get("player_name"))
-    selected_realm = normalize_realm(session.get("selected_realm"))
-    gear = ", ".join(session["inventory"]) if session["inventory"] else "bare hands"
-    player_level = int(session.get("player_level", 1))
-    # Guild and DDA context for prompts
-    guild_id = session.get("guild")
-    guild_ctx = GUILD_CONFIG[guild_id]["prompt_context"] if guild_id and guild_id in GUILD_CONFIG else ""
-    dda_hint = _dda_prompt_hint(int(session.get("difficulty_level", DDA_DEFAULT)), age_cfg)
+# AI analogy / victory beat for quick-math quests, fetched after the response.
+_story_enrichment = BackgroundJobs()
 
-    try:
-        char_pronouns = hero.get('pronouns', 'he/him')
-        pronoun_he = char_pronouns.split('/')[0].capitalize()
-        pronoun_his = char_pronouns.split('/')[1] if '/' in char_pronouns else 'his'
+# Job state (enrichment and /api/story/jobs) lives in this worker's memory,
+# so a poll that lands on another worker would get a 404.  With several
+# workers the job API is off and quick-math quests keep their static
+# analogy and victory beat.
+WEB_CONCURRENCY = int(os.environ.get("WEB_CONCURRENCY", "1"))
+STORY_JOBS_ENABLED = WEB_CONCURRENCY <= 1
 
-        safe_problem = sanitize_input(req.problem)
-        solve_mode = "full_ai"
-        quick_mode_reason = None
-        _teaching_analogy = None
-        _victory_story: Optional[str] = None
-        quick_math = try_solve_basic_math(safe_problem)
-        if quick_math and not req.force_full_ai:
-            solve_mode = "quick_math"
-            quick_mode_reason = "basic_arithmetic_fast_path"
-            math_solution = quick_math["math_solution"]
-            math_steps = quick_math["math_steps"]
-            segments = build_fast_story_segments(
-                req.hero, pronoun_he, pronoun_his, safe_problem, quick_math["answer"], selected_realm, player_name
-            )
-            story_text = "---SEGMENT---".join(segments)
-            mini_games = _fallback_mini_games(safe_problem, quick_math, req.hero, age_group, player_level)
-            _victory_story = generate_victory_story(req.hero, safe_problem, quick_math["answer"], selected_realm)
-        else:
-            math_response = None
-            math_timed_out = False
-            try:
-                math_response, math_timed_out = run_with_timeout(
-                    lambda: get_openai_client().chat.completions.create(
-                        model=AZURE_MATH_MODEL,
-                        timeout=AI_MATH_TIMEOUT_SECONDS,
-                        messages=[
-                            {"role": "user", "content": (
-                                f"Solve this math problem step by step for a child learning math: {safe_problem}\n\n"
-                                f"Age group: {age_group}. {age_cfg['math_style']}\n\n"
-                                f"Format your response EXACTLY like this:\n"
-                                f"STEP 1: (first step, simple and clear)\n"
-                                f"STEP 2: (next step)\n"
-                                f"STEP 3: (next step if needed)\n"
-                                f"STEP 4: (next step if needed)\n"
-                                f"ANSWER: (the final answer)\n\n"
-                                f"Use 2-4 steps. Each step should be one short sentence a child can follow. "
-                                f"Use simple math notation. Show the work clearly. "
-                                f"If possible, include confidence-building wording."
-                            )}
-                        ],
-                    ),
-                    AI_MATH_TIMEOUT_SECONDS + TIMEOUT_BUFFER_SECONDS,
-                )
-            except Exception as e:
-                logger.warning(f"[STORY] AI math solve unavailable, switching to quick mode: {sanitize_error(e)}")
-
-            if math_timed_out or math_response is None:
-                solve_mode = "quick_fallback"
-                quick_mode_reason = "ai_math_timeout" if math_timed_out else "ai_math_unavailable"
-                math_solution = ""
-                math_steps = [
-                    "Quick Mode: Full AI solve is not available right now.",
-                    "Break the problem into smaller operations and solve one step at a time.",
-                    "Retry this exact problem soon for the full step-by-step AI solution.",
-                ]
-                segments = build_timeout_story_segments(req.hero, pronoun_he, pronoun_his, safe_problem, selected_realm, player_name)
-                story_text = "---SEGMENT---".join(segments)
-                mini_games = _fallback_mini_games(safe_problem, None, req.hero, age_group, player_level)
-            else:
-                math_solution = math_response.choices[0].message.content or ""
-
-                math_steps = []
-                answer_line = ""
-                for line in math_solution.split('\n'):
-                    line = line.strip()
-                    if line.upper().startswith('STEP'):
-                        step_text = re.sub(r'^STEP\s*\d+\s*[:\.]\s*', '', line, flags=re.IGNORECASE)
-                        if step_text:
-                            math_steps.append(step_text)
-                    elif line.upper().startswith('ANSWER'):
-                        answer_line = re.sub(r'^ANSWER\s*[:\.]\s*', '', line, flags=re.IGNORECASE)
-
-                if not math_steps:
-                    for line in math_solution.split('\n'):
-                        line = line.strip()
-                        if line and not line.upper().startswith('ANSWER'):
-                            math_steps.append(line)
-                if answer_line and answer_line not in math_steps:
-                    math_steps.append(f"Answer: {answer_line}")
-
-                # Phi-4-mini verification: fact-check the answer before the child sees it
-                answer_verified = verify_math_answer(safe_problem, answer_line)
-                if not answer_verified:
-                    logger.warning(f"[VERIFY] Phi-4-mini flagged a potential math error for problem: {safe_problem!r}")
-
-                prompt = (
-                    f"You are a fun kids' storyteller. Explain the math concept '{safe_problem}' as a short adventure story "
-                    f"starring {req.hero} who {hero['story']}. The hero is equipped with {gear}. "
-                    f"The adventure happens in {selected_realm}. The child player is named {player_name}.\n\n"
-                    f"Target age group is {age_group} ({age_cfg['label']}). "
-                    f"Story style must be: {age_cfg['story_style']}.\n\n"
-                    + (f"GUILD CONTEXT: {guild_ctx}\n\n" if guild_ctx else "")
-                    + f"DIFFICULTY GUIDANCE: {dda_hint}\n\n"
-                    f"CRITICAL MATH ACCURACY: A math expert has verified the solution below. You MUST use this exact answer and steps in your story. DO NOT calculate the answer yourself.\n"
-                    f"Verified solution:\n{math_solution}\n\n"
-                    f"IMPORTANT: {req.hero} uses {char_pronouns} pronouns. Always refer to {req.hero} as '{pronoun_he}' and '{pronoun_his}' — never use the wrong pronouns.\n\n"
-                    f"IMPORTANT: Split the story into EXACTLY 4 short paragraphs separated by the delimiter '---SEGMENT---'.\n"
-                    f"Each paragraph should be 2-3 sentences max, fun, action-packed, and easy for a child to read.\n"
-                    f"Paragraph 1: The hero discovers the math problem (the challenge appears).\n"
-                    f"Paragraph 2: The hero uses {pronoun_his} powers to start solving it (show the steps from the verified solution).\n"
-                    f"Paragraph 3: The hero fights through the tricky part and figures it out.\n"
-                    f"Paragraph 4: Victory! {pronoun_he} celebrates and reveals the verified correct answer clearly.\n\n"
-                    f"Do NOT number the paragraphs. Just write them separated by ---SEGMENT---."
-                )
-                response = None
-                story_timed_out = False
-                try:
-                    response, story_timed_out = run_with_timeout(
-                        lambda: get_openai_client().chat.completions.create(
-                            model=AZURE_STORY_MODEL,
-                            timeout=AI_STORY_TIMEOUT_SECONDS,
-                            messages=[
-                                {"role": "system", "content": "You are a fun kids' storyteller who explains math through exciting adventures."},
-                                {"role": "user", "content": prompt},
-                            ],
-                        ),
-                        AI_STORY_TIMEOUT_SECONDS + TIMEOUT_BUFFER_SECONDS,
-                    )
-                except Exception as e:
-                    logger.warning(f"[STORY] AI storyteller unavailable, using fallback story: {sanitize_error(e)}")
-                story_content = response.choices[0].message.content if response and response.choices else None
-                if story_timed_out or story_content is None:
-                    solve_mode = "quick_fallback"
-                    quick_mode_reason = "ai_story_timeout" if story_timed_out else "ai_story_unavailable"
-                    answer_for_story = answer_line or extract_answer_from_math_steps(math_steps) or "the final answer"
-                    segments = build_fast_story_segments(
-                        req.hero, pronoun_he, pronoun_his, safe_problem, answer_for_story, selected_realm, player_name
-                    )
-                    story_text = "---SEGMENT---".join(segments)
-                    mini_games = _fallback_mini_games(safe_problem, try_solve_basic_math(safe_problem), req.hero, age_group, player_level)
-                else:
-                    story_text = story_content
-
-                    segments = [s.strip() for s in story_text.split('---SEGMENT---') if s.strip()]
-                    if len(segments) < 2:
-                        segments = [s.strip() for s in story_text.split('\n\n') if s.strip()]
-                    if len(segments) > 6:
-                        segments = segments[:6]
-                    if len(segments) == 0:
-                        segments = [story_text]
-
-                    # Run mini_games, teaching_analogy, and victory_story concurrently to reduce latency
-                    problem_skill_for_analogy = _detect_math_skill(safe_problem)
-                    solved_answer = answer_line or extract_answer_from_math_steps(math_steps) or "the answer"
-                    with concurrent.futures.ThreadPoolExecutor(max_workers=3) as pool:
-                        mini_games_future = pool.submit(generate_mini_games, req.problem, math_steps, req.hero, age_group, player_level)
-                        analogy_future = pool.submit(generate_teaching_analogy, problem_skill_for_analogy, safe_problem)
-                        victory_future = pool.submit(generate_victory_story, req.hero, safe_problem, solved_answer, selected_realm)
-                        try:
-                            mini_games = mini_games_future.result()
-                        except Exception as e:
-                            logger.warning(f"[MINIGAME] Concurrent mini-game generation failed: {sanitize_error(e)}")
-                            mini_games = _fallback_mini_games(safe_problem, try_solve_basic_math(safe_problem), req.hero, age_group, player_level)
-                        try:
-                            _teaching_analogy = analogy_future.result()
-                        except Exception as e:
-                            logger.warning(f"[ANALOGY] Concurrent analogy generation failed: {sanitize_error(e)}")
-                        try:
-                            _victory_story = victory_future.result()
-                        except Exception as e:
-                            logger.warning(f"[VICTORY] Concurrent victory story generation failed: {sanitize_error(e)}")
-
-        increment_usage(req.session_id)
+# Streamed story paragraphs, shared by every /api/story/stream quest waiting
+# on the same storyteller call.
+_story_segments = SegmentBroadcast()
 
-        session["coins"] += 50
-        session["quests_completed"] = int(session.get("quests_completed", 0)) + 1
-        session["history"].append({
-            "time": datetime.datetime.now().strftime("%Y-%m-%d %H:%M"),
-            "concept": req.problem,
+
+async def _enrich_fast_story(hero: str, problem: str, answer: str, realm: str, skill: str) -> dict:
+    teaching_analogy, victory_story = await asyncio.gather(
+        generate_teaching_analogy_async(skill, problem),
+        generate_victory_story_async(hero, problem, answer, realm),
+    )
+    return {"teaching_analogy": teaching_analogy, "victory_story": victory_story}
+
+
+def _split_story_segments(story_text: str) -> list:
+    """Storyteller reply → 1–6 paragraphs (``---SEGMENT---``, else blank lines)."""
+    segments = [s.strip() for s in story_text.split(SEGMENT_DELIMITER) if s.strip()]
+    if len(segments) < 2:
+        segments = [s.strip() for s in story_text.split('\n\n') if s.strip()]
+    if len(segments) > MAX_SEGMENTS:
+        segments = segments[:MAX_SEGMENTS]
+    if len(segments) == 0:
+        segments = [story_text]
+    return segments
+
+
+async def _story_content(
+    req: "StoryRequest", hero: dict, safe_problem: str, ctx: dict,
+    events: Optional[StoryEvents | StoryProgress] = None,
+) -> dict:
+    """The AI half of /api/story, run as a task graph on the event loop.
+
+        analogy ─────────────────────────────┐
+        math ──┬── verify                     │
+               ├── story                      ├── response
+               ├── victory                    │
+               └── mini_games ────────────────┘
+
+    Everything downstream of the math solve only needs its answer, and the
+    analogy needs nothing, so each call starts as soon as its input exists.
+    Verification runs beside the storyteller; its verdict only matters when
+    AI_VERIFY_RESOLVE is on and it says INCORRECT.  Every branch degrades to
+    the same quick-mode fallbacks as before.
+
+    Basic arithmetic (unless ``force_full_ai``) makes no model call at all:
+    it answers with static content plus an ``enrichment_job`` id (None
+    when the job API is off, see ``STORY_JOBS_ENABLED``).
+
+    With *events* (``/api/story/stream``, ``/api/story/jobs``) each node also
+    sends its part as it completes, and the storyteller's reply is streamed
+    paragraph by paragraph.
+    """
+    def _emit(event: str, data: dict) -> None:
+        if events is not None:
+            events.emit(event, data)
+
+    age_group = ctx["age_group"]
+    age_cfg = ctx["age_cfg"]
+    player_name = ctx["player_name"]
+    selected_realm = ctx["selected_realm"]
+    player_level = ctx["player_level"]
+    char_pronouns = hero.get('pronouns', 'he/him')
+    pronoun_he = char_pronouns.split('/')[0].capitalize()
+    pronoun_his = char_pronouns.split('/')[1] if '/' in char_pronouns else 'his'
+
+    problem_skill = _detect_math_skill(safe_problem)
+    quick_math = try_solve_basic_math(safe_problem)
+    if quick_math and not req.force_full_ai:
+        # Zero model calls: static analogy and victory beat now, the AI
+        # versions later from GET /api/story/enrichment/{job}.
+        answer = quick_math["answer"]
+        segments = build_fast_story_segments(
+            req.hero, pronoun_he, pronoun_his, safe_problem, answer, selected_realm, player_name
+        )
+        job_id = None
+        if STORY_JOBS_ENABLED:
+            job_id = _story_enrichment.start(
+                lambda: _enrich_fast_story(req.hero, safe_problem, answer, selected_realm, problem_skill),
+                kind="story_enrichment",
+            )
+        return {
+            "segments": segments,
+            "story": "---SEGMENT---".join(segments),
+            "math_steps": quick_math["math_steps"],
+            "mini_games": _fallback_mini_games(safe_problem, quick_math, req.hero, age_group, player_level),
+            "solve_mode": "quick_math",
+            "quick_mode_reason": "basic_arithmetic_fast_path",
+            "teaching_analogy": MATH_ANALOGIES.get(problem_skill, MATH_ANALOGIES["addition"]),
+            "victory_story": _victory_static_beat(req.hero, safe_problem, answer, selected_realm),
+            "enrichment_job": job_id,
+        }
+
+    math_cache_key = _ai_cache.key("math", problem=_problem_cache_key(safe_problem), age_group=age_group)
+
+    async def _math(flagged_answer: Optional[str] = None):
+        """``{"solution", "steps", "answer"}``, or ``{"failed": reason}``."""
+        math = None
+        if flagged_answer is None:
+            cached = await _ai_cache.aget("math", math_cache_key)
+            if cached is not None:
+                math = {**cached, "cached": True}
+        if math is None:
+            math = await _ai_flights.do(
+                (math_cache_key, flagged_answer), lambda: _solve(flagged_answer),
+                kind="math_resolve" if flagged_answer else "math",
+            )
+        if "failed" not in math:
+            _emit("math", {"math_steps": math["steps"]})
+        return math
+
+    async def _solve(flagged_answer: Optional[str]):
+        math_response = None
+        math_timed_out = False
+        try:
+            math_response, math_timed_out = await _ai_chat_async(
+                AZURE_MATH_MODEL,
+                [
+                    {"role": "user", "content": (
+                        f"Solve this math problem step by step for a child learning math: {safe_problem}\n\n"
+                        f"Age group: {age_group}. {age_cfg['math_style']}\n\n"
+                        + (f"A previous solution answered '{flagged_answer}', which a checker flagged as incorrect. "
+                           f"Re-check every step carefully.\n\n" if flagged_answer else "")
+                        + f"Format your response EXACTLY like this:\n"
+                        f"STEP 1: (first step, simple and clear)\n"
+                        f"STEP 2: (next step)\n"
+                        f"STEP 3: (next step if needed)\n"
+                        f"STEP 4: (next step if needed)\n"
+                        f"ANSWER: (the final answer)\n\n"
+                        f"Use 2-4 steps. Each step should be one short sentence a child can follow. "
+                        f"Use simple math notation. Show the work clearly. "
+                        f"If possible, include confidence-building wording."
+                    )}
+                ],
+                AI_MATH_TIMEOUT_SECONDS,
+                "math_resolve" if flagged_answer else "math",
+            )
+        except Exception as e:
+            logger.warning(f"[STORY] AI math solve unavailable, switching to quick mode: {sanitize_error(e)}")
+        if math_timed_out or math_response is None:
+            return {"failed": "ai_math_timeout" if math_timed_out else "ai_math_unavailable"}
+        math_solution = math_response.choices[0].message.content or ""
+        math_steps, answer_line = _parse_math_solution(math_solution)
+        return {
+            "solution": math_solution,
+            "steps": math_steps,
+            "answer": answer_line or extract_answer_from_math_steps(math_steps) or "",
+            "answer_line": answer_line,
+        }
+
+    async def _verify(math):
+        if "failed" in math or math.get("cached"):
+            # Cached solutions were only stored after passing this check.
+            return None
+        # Phi-4-mini verification: fact-check the answer before the child sees it
+        answer_verified = await verify_math_answer_async(safe_problem, math["answer_line"])
+        if not answer_verified:
+            logger.warning(f"[VERIFY] Phi-4-mini flagged a potential math error for problem: {safe_problem!r}")
+        return answer_verified
+
+    async def _story(math):
+        """Storyteller reply text, or ``{"failed": reason}``."""
+        if "failed" in math:
+            return None
+        # The player's name is templated out of cached stories so players
+        # share them; everything else in the prompt is part of the key.  The
+        # default name and a name equal to the hero's are ordinary words in
+        # the story and cannot be templated back out, so they key it instead.
+        templatable = player_name not in ("Hero", req.hero)
+        cache_key = _ai_cache.key(
+            "story", problem=_problem_cache_key(safe_problem), solution=math["solution"], hero=req.hero,
+            realm=selected_realm, gear=ctx["gear"], age_group=age_group, guild=ctx["guild_ctx"], dda=ctx["dda_hint"],
+            player=None if templatable else player_name,
+        )
+        cached = await _ai_cache.aget("story", cache_key)
+        if cached is None and events is None:
+            cached = await _ai_flights.do(cache_key, lambda: _tell(math, cache_key, templatable), kind="story")
+        elif cached is None:
+            # Streamed paragraphs arrive through the broadcast whether this
+            # quest makes the call or joins one already streaming.
+            def _on_segment(item):
+                _emit("segment", {"index": item[0], "text": fill_player(item[1], player_name)})
+
+            _story_segments.subscribe(cache_key, _on_segment)
+            try:
+                cached = await _ai_flights.do(
+                    cache_key, lambda: _tell(math, cache_key, templatable, stream=True), kind="story",
+                )
+            finally:
+                _story_segments.unsubscribe(cache_key, _on_segment)
+        if not isinstance(cached, str):
+            return cached
+        story_text = fill_player(cached, player_name)
+        # Paragraphs not streamed yet: the last one, or all of them for a
+        # cache hit or a quest that joined another's call.
+        for i, text in enumerate(_split_story_segments(story_text)):
+            _emit("segment", {"index": i, "text": text})
+        return story_text
+
+    async def _tell(math, cache_key, templatable, stream=False):
+        """The storyteller call itself; shared by identical in-flight quests."""
+        prompt = (
+            f"You are a fun kids' storyteller. Explain the math concept '{safe_problem}' as a short adventure story "
+            f"starring {req.hero} who {hero['story']}. The hero is equipped with {ctx['gear']}. "
+            f"The adventure happens in {selected_realm}. The child player is named {player_name}.\n\n"
+            f"Target age group is {age_group} ({age_cfg['label']}). "
+            f"Story style must be: {age_cfg['story_style']}.\n\n"
+            + (f"GUILD CONTEXT: {ctx['guild_ctx']}\n\n" if ctx["guild_ctx"] else "")
+            + f"DIFFICULTY GUIDANCE: {ctx['dda_hint']}\n\n"
+            f"CRITICAL MATH ACCURACY: A math expert has verified the solution below. You MUST use this exact answer and steps in your story. DO NOT calculate the answer yourself.\n"
+            f"Verified solution:\n{math['solution']}\n\n"
+            f"IMPORTANT: {req.hero} uses {char_pronouns} pronouns. Always refer to {req.hero} as '{pronoun_he}' and '{pronoun_his}' — never use the wrong pronouns.\n\n"
+            f"IMPORTANT: Split the story into EXACTLY 4 short paragraphs separated by the delimiter '---SEGMENT---'.\n"
+            f"Each paragraph should be 2-3 sentences max, fun, action-packed, and easy for a child to read.\n"
+            f"Paragraph 1: The hero discovers the math problem (the challenge appears).\n"
+            f"Paragraph 2: The hero uses {pronoun_his} powers to start solving it (show the steps from the verified solution).\n"
+            f"Paragraph 3: The hero fights through the tricky part and figures it out.\n"
+            f"Paragraph 4: Victory! {pronoun_he} celebrates and reveals the verified correct answer clearly.\n\n"
+            f"Do NOT number the paragraphs. Just write them separated by ---SEGMENT---."
+        )
+        messages = [
+            {"role": "system", "content": "You are a fun kids' storyteller who explains math through exciting adventures."},
+            {"role": "user", "content": prompt},
+        ]
+        story_content = None
+        story_timed_out = False
+        try:
+            if stream:
+                # Paragraphs are published templated, like the cached story.
+                splitter = SegmentSplitter(lambda i, text: _story_segments.publish(
+                    cache_key, (i, template_player(text, player_name) if templatable else text),
+                ))
+                try:
+                    story_content, story_timed_out = await _ai_chat_stream_async(
+                        AZURE_STORY_MODEL, messages, AI_STORY_TIMEOUT_SECONDS, "story", splitter.feed,
+                    )
+                finally:
+                    _story_segments.end(cache_key)
+            else:
+                response, story_timed_out = await _ai_chat_async(AZURE_STORY_MODEL, messages, AI_STORY_TIMEOUT_SECONDS, "story")
+                story_content = response.choices[0].message.content if response and response.choices else None
+        except Exception as e:
+            logger.warning(f"[STORY] AI storyteller unavailable, using fallback story: {sanitize_error(e)}")
+        if story_timed_out or story_content is None:
+            return {"failed": "ai_story_timeout" if story_timed_out else "ai_story_unavailable"}
+        if templatable:
+            # Every waiter (and every later cache hit) fills in its own name.
+            story_content = template_player(story_content, player_name)
+        if story_content.strip():
+            _ai_cache.put("story", cache_key, story_content)
+        return story_content
+
+    async def _victory(math):
+        if "failed" in math:
+            return None
+        try:
+            victory = await generate_victory_story_async(req.hero, safe_problem, math["answer"] or "the answer", selected_realm)
+        except Exception as e:
+            logger.warning(f"[VICTORY] Concurrent victory story generation failed: {sanitize_error(e)}")
+            return None
+        _emit("victory", {"victory_story": victory})
+        return victory
+
+    async def _mini_games(math):
+        if "failed" in math:
+            mini_games = _fallback_mini_games(safe_problem, None, req.hero, age_group, player_level)
+        else:
+            try:
+                mini_games = await generate_mini_games_async(req.problem, math["steps"], req.hero, age_group, player_level)
+            except Exception as e:
+                logger.warning(f"[MINIGAME] Concurrent mini-game generation failed: {sanitize_error(e)}")
+                mini_games = _fallback_mini_games(safe_problem, quick_math, req.hero, age_group, player_level)
+        _emit("mini_games", {"mini_games": mini_games})
+        return mini_games
+
+    async def _analogy():
+        try:
+            analogy = await generate_teaching_analogy_async(problem_skill, safe_problem)
+        except Exception as e:
+            logger.warning(f"[ANALOGY] Concurrent analogy generation failed: {sanitize_error(e)}")
+            analogy = MATH_ANALOGIES.get(problem_skill, MATH_ANALOGIES["addition"])
+        _emit("analogy", {"teaching_analogy": analogy})
+        return analogy
+
+    graph = (
+        TaskGraph()
+        .add("analogy", _analogy)
+        .add("math", _math)
+        .add("verify", _verify, ["math"])
+        .add("story", _story, ["math"])
+        .add("victory", _victory, ["math"])
+        .add("mini_games", _mini_games, ["math"])
+    )
+    # Every AI call below draws its timeout from one request-wide budget.
+    with _story_deadline.scope():
+        results = await graph.run()
+        _story_timings.record(graph)
+
+        if AI_VERIFY_RESOLVE and results["verify"] is False:
+            # The checker explicitly rejected the answer: solve once more with
+            # that in the prompt and rebuild everything that depends on it.  The
+            # first attempt stands if the re-solve fails or agrees with it.
+            flagged = results["math"]["answer_line"]
+            retry_graph = (
+                TaskGraph()
+                .add("math", lambda: _math(flagged))
+                .add("story", _story, ["math"])
+                .add("victory", _victory, ["math"])
+                .add("mini_games", _mini_games, ["math"])
+            )
+            retry = await retry_graph.run()
+            if "failed" not in retry["math"] and retry["math"]["answer"] != results["math"]["answer"]:
+                logger.info(f"[VERIFY] Re-solved flagged answer {flagged!r} -> {retry['math']['answer_line']!r}")
+                results.update(retry)
+        elif results["verify"] is not False and "failed" not in results["math"] and not results["math"].get("cached"):
+            # Only solutions the checker did not reject are reused.
+            _ai_cache.put("math", math_cache_key, {k: results["math"][k] for k in ("solution", "steps", "answer", "answer_line")})
+
+    math = results["math"]
+    story = results["story"]
+    solve_mode = "full_ai"
+    quick_mode_reason = None
+    if "failed" in math:
+        solve_mode = "quick_fallback"
+        quick_mode_reason = math["failed"]
+        math_steps = [
+            "Quick Mode: Full AI solve is not available right now.",
+            "Break the problem into smaller operations and solve one step at a time.",
+            "Retry this exact problem soon for the full step-by-step AI solution.",
+        ]
+        segments = build_timeout_story_segments(req.hero, pronoun_he, pronoun_his, safe_problem, selected_realm, player_name)
+        story_text = "---SEGMENT---".join(segments)
+    elif isinstance(story, dict):
+        solve_mode = "quick_fallback"
+        quick_mode_reason = story["failed"]
+        math_steps = math["steps"]
+        segments = build_fast_story_segments(
+            req.hero, pronoun_he, pronoun_his, safe_problem, math["answer"] or "the final answer", selected_realm, player_name
+        )
+        story_text = "---SEGMENT---".join(segments)
+    else:
+        math_steps = math["steps"]
+        story_text = story
+        segments = _split_story_segments(story_text)
+
+    return {
+        "segments": segments,
+        "story": story_text,
+        "math_steps": math_steps,
+        "mini_games": results["mini_games"],
+        "solve_mode": solve_mode,
+        "quick_mode_reason": quick_mode_reason,
+        "teaching_analogy": results["analogy"],
+        "victory_story": results["victory"],
+        "enrichment_job": None,
+    }
+
+
+def _story_complete(req: "StoryRequest", entitlement: Entitlement, safe_problem: str, ctx: dict, content: dict) -> dict:
+    """Award the quest and build the /api/story response (blocking; threadpool)."""
+    with _session_lock(req.session_id):
+        # Re-fetch: the AI calls can outlast the session's cache residency.
+        session = get_session(req.session_id)
+        session["coins"] += 50
+        session["quests_completed"] = int(session.get("quests_completed", 0)) + 1
+        _record_quest(req.session_id, session, {
+            "time": datetime.datetime.now().strftime("%Y-%m-%d %H:%M"),
+            "concept": req.problem,
             "hero": req.hero,
             "correct": True,
             "difficulty_level": session.get("difficulty_level", DDA_DEFAULT),
@@ -3455,26 +4141,24 @@ def generate_story(req: StoryRequest, request: Request):
         _update_streak(session)
         _update_badges(session)
 
-        current_usage = get_daily_usage(req.session_id)
-        premium = is_premium(req.session_id)
-
         problem_skill = _detect_math_skill(safe_problem)
         _update_mastery_after_quest(session, safe_problem, correct=True)
         _save_session(req.session_id)
 
+        solve_mode = content["solve_mode"]
         return {
-            "segments": segments,
-            "story": story_text,
+            "segments": content["segments"],
+            "story": content["story"],
             "coins": session["coins"],
-            "math_steps": math_steps,
-            "mini_games": mini_games,
-            "daily_usage": current_usage,
+            "math_steps": content["math_steps"],
+            "mini_games": content["mini_games"],
+            "daily_usage": entitlement.usage,
             "daily_limit": FREE_DAILY_LIMIT,
-            "remaining": max(0, FREE_DAILY_LIMIT - current_usage) if not premium else -1,
-            "is_premium": premium,
-            "player_name": player_name,
-            "age_group": age_group,
-            "selected_realm": selected_realm,
+            "remaining": entitlement.remaining,
+            "is_premium": entitlement.is_premium,
+            "player_name": ctx["player_name"],
+            "age_group": ctx["age_group"],
+            "selected_realm": ctx["selected_realm"],
             "streak_count": session.get("streak_count", 1),
             "quests_completed": session.get("quests_completed", 0),
             "badges": session.get("badges", []),
@@ -3482,9 +4166,10 @@ def generate_story(req: StoryRequest, request: Request):
             "progression": _build_progression(session),
             "solve_mode": solve_mode,
             "quick_mode": solve_mode != "full_ai",
-            "quick_mode_reason": quick_mode_reason,
-            "teaching_analogy": _teaching_analogy if _teaching_analogy is not None else generate_teaching_analogy(problem_skill, safe_problem),
-            "victory_story": _victory_story,
+            "quick_mode_reason": content["quick_mode_reason"],
+            "teaching_analogy": content["teaching_analogy"],
+            "victory_story": content["victory_story"],
+            "enrichment_job": content["enrichment_job"],
             "learning_plan": _build_learning_plan(session, problem_skill),
             "privacy_settings": _sanitize_privacy_settings(session.get("privacy_settings")),
             "guild": session.get("guild"),
@@ -3494,15 +4179,269 @@ def generate_story(req: StoryRequest, request: Request):
             "perseverance_score": session.get("perseverance_score", 0),
             "difficulty_level": session.get("difficulty_level", DDA_DEFAULT),
             "difficulty_label": _difficulty_label(int(session.get("difficulty_level", DDA_DEFAULT))),
-       }
+        }
+
+
+async def _story_admit(req: StoryRequest, request: Request) -> tuple[dict, Entitlement]:
+    """Validate a quest and reserve its quota; returns ``(hero, entitlement)``."""
+    validate_session_id(req.session_id)
+    scan_input_for_attacks(req.problem, request)
+    if not check_rate_limit(f"story:{req.session_id}", max_requests=8, window=60):
+        raise HTTPException(status_code=429, detail="Too many requests. Please wait a moment.")
+    hero = CHARACTERS.get(req.hero)
+    if not hero:
+        raise HTTPException(status_code=400, detail="Unknown hero")
+
+    # One round trip: premium status plus an atomic check-and-increment of
+    # today's quota.  The reservation is handed back if the quest fails.
+    # Blocking work (DB, session lock) goes to the threadpool; the AI calls
+    # in between are awaited on the event loop without holding a thread.
+    reservation = asyncio.ensure_future(run_in_threadpool(reserve_quota, req.session_id))
+    try:
+        entitlement = await asyncio.shield(reservation)
+    except asyncio.CancelledError:
+        # The client left mid-reservation; hand the quota back once it lands.
+        reservation.add_done_callback(_release_abandoned_reservation)
+        raise
+    if not _is_hero_unlocked_for_session(req.session_id, req.hero, entitlement):
+        await run_in_threadpool(release_quota, entitlement)
+        raise HTTPException(status_code=403, detail="This hero is a Premium unlock. Upgrade to use this hero.")
+    if not entitlement.reserved:
+        raise HTTPException(status_code=403, detail=f"Daily limit reached! Free accounts get {FREE_DAILY_LIMIT} problems per day. Upgrade to Premium for unlimited access!")
+    return hero, entitlement
+
+
+def _release_abandoned_reservation(reservation: asyncio.Future) -> None:
+    if reservation.cancelled() or reservation.exception() is not None:
+        return
+    asyncio.ensure_future(run_in_threadpool(release_quota, reservation.result()))
+
+
+async def _story_run(
+    req: StoryRequest, hero: dict, entitlement: Entitlement, events: Optional[StoryEvents | StoryProgress] = None,
+) -> dict:
+    """Run an admitted quest; the quota reservation is handed back if it fails.
+
+    An abandoned quest (cancelled because its client left) is handed back
+    too, unless it had already reached the award step.
+    """
+    completing = False
+    try:
+        ctx = await run_in_threadpool(_story_prelude, req)
+        safe_problem = sanitize_input(req.problem)
+        content = await _story_content(req, hero, safe_problem, ctx, events)
+        completing = True
+        return await run_in_threadpool(_story_complete, req, entitlement, safe_problem, ctx, content)
+    except asyncio.CancelledError:
+        if not completing:
+            await run_in_threadpool(release_quota, entitlement)
+        raise
     except HTTPException:
+        await run_in_threadpool(release_quota, entitlement)
         raise
     except Exception as e:
+        await run_in_threadpool(release_quota, entitlement)
         logger.exception("Story generation failed")
         if "FREE_CLOUD_BUDGET_EXCEEDED" in str(e):
             raise HTTPException(status_code=429, detail="Cloud budget exceeded")
         raise HTTPException(status_code=500, detail=f"Story generation failed: {type(e).__name__}. Please try again.")
 
+
+# Per-request work cancelled because the client disconnected, for /api/admin/perf.
+_client_watch = DisconnectWatcher()
+
+# Retries that carry an Idempotency-Key get the first attempt's response
+# (see backend/idempotency.py); replay counts for /api/admin/perf.
+_idempotency = IdempotencyStore()
+
+
+def _idempotency_key(request: Request, endpoint: str, session_id: str) -> Optional[tuple]:
+    """Scope of the request's ``Idempotency-Key`` header, or None without one."""
+    key = request.headers.get("idempotency-key")
+    if key is None:
+        return None
+    if not key or len(key) > 255:
+        raise HTTPException(status_code=400, detail="Idempotency-Key must be 1-255 characters")
+    return (endpoint, session_id, key)
+
+
+def _idempotent_response(response: Response, replayed: bool) -> None:
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+
+
+async def _run_idempotent(req: BaseModel, request: Request, response: Response, endpoint: str, make_coro) -> Any:
+    """Await ``make_coro()`` at most once per Idempotency-Key (see :func:`_run_idempotent_sync`)."""
+    key = _idempotency_key(request, endpoint, req.session_id)
+    try:
+        result, replayed = await _idempotency.run(key, req.model_dump_json(), make_coro, kind=endpoint)
+    except IdempotencyConflict:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+    _idempotent_response(response, replayed)
+    return result
+
+
+def _run_idempotent_sync(req: BaseModel, request: Request, response: Response, endpoint: str, fn) -> Any:
+    """Run ``fn()`` at most once per Idempotency-Key; retries get its response.
+
+    Replays are marked with an ``Idempotent-Replayed: true`` header.
+    """
+    key = _idempotency_key(request, endpoint, req.session_id)
+    try:
+        result, replayed = _idempotency.run_sync(key, req.model_dump_json(), fn, kind=endpoint)
+    except IdempotencyConflict:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+    _idempotent_response(response, replayed)
+    return result
+
+
+@app.post("/api/story")
+async def generate_story(req: StoryRequest, request: Request, response: Response):
+    async def _quest():
+        hero, entitlement = await _story_admit(req, request)
+        return await _story_run(req, hero, entitlement)
+
+    try:
+        return await _client_watch.run(
+            request, _run_idempotent(req, request, response, "story", _quest), kind="story",
+        )
+    except ClientDisconnected:
+        return Response(status_code=499)
+
+
+# Time-to-first-segment of /api/story/stream, for /api/admin/perf.
+_story_stream_stats = StreamStats()
+
+
+@app.post("/api/story/stream")
+async def generate_story_stream(req: StoryRequest, request: Request):
+    """/api/story as Server-Sent Events (see backend/story_stream.py).
+
+    Validation, rate-limit and quota errors are ordinary HTTP errors; once
+    the stream has started, failures arrive as an ``error`` event.  A retry
+    with the same ``Idempotency-Key`` as a finished quest gets its events
+    again, ending in the stored ``done`` payload, without running it twice.
+    """
+    key = _idempotency_key(request, "story_stream", req.session_id)
+    events = StoryEvents()
+    admitted = asyncio.get_running_loop().create_future()
+
+    async def _quest():
+        hero, entitlement = await _story_admit(req, request)
+        admitted.set_result(None)
+        return await _story_run(req, hero, entitlement, events)
+
+    run = asyncio.ensure_future(_idempotency.run(key, req.model_dump_json(), _quest, kind="story_stream"))
+    try:
+        # Streaming starts once this request's quest is admitted; a replay
+        # (or a duplicate that joined the first attempt) just finishes.
+        await asyncio.wait([run, admitted], return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        run.cancel()
+        raise
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+    if not admitted.done():
+        try:
+            result, replayed = run.result()
+        except IdempotencyConflict:
+            raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+        if replayed:
+            headers["Idempotent-Replayed"] = "true"
+
+        async def _replay():
+            events.finish(result)
+
+        return StreamingResponse(events.stream(_replay()), media_type="text/event-stream", headers=headers)
+
+    async def _produce():
+        try:
+            result, _ = await run
+            events.finish(result)
+        except HTTPException as exc:
+            events.fail(exc.status_code, exc.detail)
+        except asyncio.CancelledError:
+            _client_watch.record("story_stream")   # the stream was closed under us
+            raise
+        finally:
+            _story_stream_stats.record(events)
+
+    return StreamingResponse(events.stream(_produce()), media_type="text/event-stream", headers=headers)
+
+
+# Polled quests (/api/story/jobs) on a bounded pool, for /api/admin/perf.
+_story_jobs = JobQueue()
+
+# Longest a GET /api/story/jobs/{id} is held open waiting for news.
+STORY_JOB_MAX_WAIT_SECONDS = float(os.environ.get("STORY_JOB_MAX_WAIT_SECONDS", "25"))
+
+
+def _require_story_jobs() -> None:
+    if not STORY_JOBS_ENABLED:
+        raise HTTPException(status_code=501, detail="Story jobs are not available on this deployment. Use /api/story/stream.")
+
+
+@app.post("/api/story/jobs", status_code=202)
+async def start_story_job(req: StoryRequest, request: Request, response: Response):
+    """/api/story as a job: answers ``{"job_id"}`` at once (see backend/background_jobs.py).
+
+    Validation, rate-limit and quota errors are ordinary HTTP errors, as
+    are a full queue (503) and a session with too many quests in progress
+    (429); once queued, failures arrive as the job's ``error``.  With
+    several workers the job API is off (501).
+    """
+    _require_story_jobs()
+    async def _submit():
+        hero, entitlement = await _story_admit(req, request)
+
+        async def _quest(report):
+            try:
+                return await _story_run(req, hero, entitlement, StoryProgress(report))
+            except HTTPException as exc:
+                raise JobFailed(exc.status_code, exc.detail)
+
+        try:
+            job_id = _story_jobs.submit(
+                _quest, owner=req.session_id, kind="story",
+                on_drop=lambda: run_in_threadpool(release_quota, entitlement),
+            )
+        except JobRejected as exc:
+            await run_in_threadpool(release_quota, entitlement)
+            if exc.reason == "owner_limit":
+                raise HTTPException(status_code=429, detail="Too many quests in progress. Please wait for one to finish.")
+            raise HTTPException(status_code=503, detail="The quest queue is full. Please try again shortly.")
+        return {"job_id": job_id, "status": "queued"}
+
+    return await _run_idempotent(req, request, response, "story_jobs", _submit)
+
+
+@app.get("/api/story/jobs/{job_id}")
+async def get_story_job(job_id: str, since: int = 0, wait: float = STORY_JOB_MAX_WAIT_SECONDS):
+    """Long-poll a story job.
+
+    Answers as soon as the job's ``version`` is past *since* or it has
+    finished, else after *wait* seconds: ``status`` (queued / running /
+    done / failed), ``version``, and ``partial`` (the parts made so far, in
+    /api/story's shape), ``result`` (the full response) or ``error``.
+    """
+    _require_story_jobs()
+    job = await _story_jobs.wait(job_id, since, _clamp(wait, 0, STORY_JOB_MAX_WAIT_SECONDS))
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired story job")
+    return {"job_id": job_id, **job}
+
+
+@app.get("/api/story/enrichment/{job_id}")
+def get_story_enrichment(job_id: str):
+    """AI analogy / victory beat for a quick-math quest's ``enrichment_job``."""
+    _require_story_jobs()
+    job = _story_enrichment.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired enrichment job")
+    if job["status"] != "done":
+        return {"status": job["status"]}
+    return {"status": "done", **job["result"]}
+
 class BonusCoinsRequest(BaseModel):
     session_id: str
     coins: int
@@ -3512,38 +4451,44 @@ def add_bonus_coins(req: BonusCoinsRequest):
     validate_session_id(req.session_id)
     if not check_rate_limit(f"bonus:{req.session_id}", max_requests=10, window=60):
         raise HTTPException(status_code=429, detail="Too many bonus requests")
-    session = get_session(req.session_id)
-    bonus = min(max(req.coins, 0), 50)
-    session["coins"] += bonus
-    _save_session(req.session_id)
-    return {"coins": session["coins"], "bonus": bonus}
+    with _session_lock(req.session_id):
+        session = get_session(req.session_id)
+        bonus = min(max(req.coins, 0), 50)
+        session["coins"] += bonus
+        _save_session(req.session_id)
+        return {"coins": session["coins"], "bonus": bonus}
 
 class DailyChestRequest(BaseModel):
     session_id: str
 
 @app.post("/api/daily-chest")
-def claim_daily_chest(req: DailyChestRequest):
+def claim_daily_chest(req: DailyChestRequest, request: Request, response: Response):
     validate_session_id(req.session_id)
-    session = get_session(req.session_id)
-    today = datetime.date.today().isoformat()
-    if session.get("daily_chest_last_claim") == today:
+    return _run_idempotent_sync(req, request, response, "daily_chest", lambda: _claim_daily_chest(req))
+
+
+def _claim_daily_chest(req: DailyChestRequest) -> dict:
+    with _session_lock(req.session_id):
+        session = get_session(req.session_id)
+        today = datetime.date.today().isoformat()
+        if session.get("daily_chest_last_claim") == today:
+            return {
+                "claimed": False,
+                "coins": session["coins"],
+                "message": "Daily chest already opened today!",
+            }
+        age_group = normalize_age_group(session.get("age_group"))
+        bonus = DAILY_CHEST_REWARDS.get(age_group, 35)
+        session["coins"] += bonus
+        session["daily_chest_last_claim"] = today
+        _update_badges(session)
+        _save_session(req.session_id, durable=True)
         return {
-            "claimed": False,
+            "claimed": True,
             "coins": session["coins"],
-            "message": "Daily chest already opened today!",
+            "bonus": bonus,
+            "message": f"Daily chest opened! +{bonus} gold",
         }
-    age_group = normalize_age_group(session.get("age_group"))
-    bonus = DAILY_CHEST_REWARDS.get(age_group, 35)
-    session["coins"] += bonus
-    session["daily_chest_last_claim"] = today
-    _update_badges(session)
-    _save_session(req.session_id)
-    return {
-        "claimed": True,
-        "coins": session["coins"],
-        "bonus": bonus,
-        "message": f"Daily chest opened! +{bonus} gold",
-    }
 
 # ── Guild / Ideology / Perseverance / DDA Endpoints ──────────────────────────
 
@@ -3562,18 +4507,19 @@ class SetGuildRequest(BaseModel):
 def set_player_guild(req: SetGuildRequest):
     """Set the player's faction/guild and award the initiate badge."""
     validate_session_id(req.session_id)
-    session = get_session(req.session_id)
-    session["guild"] = req.guild
-    _update_badges(session)
-    guild_cfg = GUILD_CONFIG[req.guild]
-    _save_session(req.session_id)
-    return {
-        "guild": req.guild,
-        "guild_config": guild_cfg,
-        "badges": session.get("badges", []),
-        "badge_details": _get_badge_details(session.get("badges", [])),
-        "message": f"Welcome to {guild_cfg['name']}! {guild_cfg['tagline']}",
-    }
+    with _session_lock(req.session_id):
+        session = get_session(req.session_id)
+        session["guild"] = req.guild
+        _update_badges(session)
+        guild_cfg = GUILD_CONFIG[req.guild]
+        _save_session(req.session_id)
+        return {
+            "guild": req.guild,
+            "guild_config": guild_cfg,
+            "badges": session.get("badges", []),
+            "badge_details": _get_badge_details(session.get("badges", [])),
+            "message": f"Welcome to {guild_cfg['name']}! {guild_cfg['tagline']}",
+        }
 
 class IdeologyRequest(BaseModel):
     session_id: str
@@ -3589,18 +4535,19 @@ class IdeologyRequest(BaseModel):
 def update_ideology(req: IdeologyRequest):
     """Shift the player's ideology meter based on their problem-solving approach."""
     validate_session_id(req.session_id)
-    session = get_session(req.session_id)
-    current = int(session.get("ideology_meter", 0))
-    new_val = max(-100, min(100, current + req.shift))
-    session["ideology_meter"] = new_val
-    _update_badges(session)
-    _save_session(req.session_id)
-    return {
-        "ideology_meter": new_val,
-        "ideology_label": _ideology_label(new_val),
-        "badges": session.get("badges", []),
-        "badge_details": _get_badge_details(session.get("badges", [])),
-    }
+    with _session_lock(req.session_id):
+        session = get_session(req.session_id)
+        current = int(session.get("ideology_meter", 0))
+        new_val = max(-100, min(100, current + req.shift))
+        session["ideology_meter"] = new_val
+        _update_badges(session)
+        _save_session(req.session_id)
+        return {
+            "ideology_meter": new_val,
+            "ideology_label": _ideology_label(new_val),
+            "badges": session.get("badges", []),
+            "badge_details": _get_badge_details(session.get("badges", [])),
+        }
 
 # ── Lead Mentor Hint System ───────────────────────────────────────────────────
 
@@ -3662,16 +4609,17 @@ def get_mentor_hint(req: MentorHintRequest):
     the hint use and boosts the player's perseverance score.
     """
     validate_session_id(req.session_id)
-    session = get_session(req.session_id)
-    guild_id = session.get("guild")
-    player_name = session.get("player_name", "Hero")
-    age_group = session.get("age_group", "8-10")
-
-    # Record hint use (same logic as /api/player/hint)
-    session["hint_count"] = int(session.get("hint_count", 0)) + 1
-    session["perseverance_score"] = int(session.get("perseverance_score", 0)) + 1
-    _update_badges(session)
-    _save_session(req.session_id)
+    with _session_lock(req.session_id):
+        session = get_session(req.session_id)
+        guild_id = session.get("guild")
+        player_name = session.get("player_name", "Hero")
+        age_group = session.get("age_group", "8-10")
+
+        # Record hint use (same logic as /api/player/hint)
+        session["hint_count"] = int(session.get("hint_count", 0)) + 1
+        session["perseverance_score"] = int(session.get("perseverance_score", 0)) + 1
+        _update_badges(session)
+        _save_session(req.session_id)
 
     # Build guild-themed system prompt
     guild_theme = MENTOR_GUILD_THEMES.get(guild_id)
@@ -3705,16 +4653,14 @@ def get_mentor_hint(req: MentorHintRequest):
 
     explanation: str = ""
     try:
-        response, timed_out = run_with_timeout(
-            lambda: get_openai_client().chat.completions.create(
-                model=AZURE_ANALOGY_MODEL,
-                timeout=AI_ANALOGY_TIMEOUT_SECONDS,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt},
-                ],
-            ),
-            AI_ANALOGY_TIMEOUT_SECONDS + TIMEOUT_BUFFER_SECONDS,
+        response, timed_out = _ai_chat(
+            AZURE_ANALOGY_MODEL,
+            [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt},
+            ],
+            AI_ANALOGY_TIMEOUT_SECONDS,
+            "mentor",
         )
         if not timed_out and response is not None:
             explanation = (response.choices[0].message.content if response.choices else "").strip()
@@ -3744,21 +4690,22 @@ class HintRequest(BaseModel):
 def record_hint_use(req: HintRequest):
     """Record that the player used a hint — boosts perseverance score."""
     validate_session_id(req.session_id)
-    session = get_session(req.session_id)
-    session["hint_count"] = int(session.get("hint_count", 0)) + 1
-    # Perseverance: +1 for using a hint, +2 if they got it right after
-    bonus = 3 if req.eventually_correct else 1
-    session["perseverance_score"] = int(session.get("perseverance_score", 0)) + bonus
-    _update_badges(session)
-    _save_session(req.session_id)
-    return {
-        "hint_count": session["hint_count"],
-        "perseverance_score": session["perseverance_score"],
-        "badges": session.get("badges", []),
-        "badge_details": _get_badge_details(session.get("badges", [])),
-        "message": "💡 Great thinking — using hints shows real learning power!" if req.eventually_correct
-                   else "💡 Hint used — keep going, you've got this!",
-    }
+    with _session_lock(req.session_id):
+        session = get_session(req.session_id)
+        session["hint_count"] = int(session.get("hint_count", 0)) + 1
+        # Perseverance: +1 for using a hint, +2 if they got it right after
+        bonus = 3 if req.eventually_correct else 1
+        session["perseverance_score"] = int(session.get("perseverance_score", 0)) + bonus
+        _update_badges(session)
+        _save_session(req.session_id)
+        return {
+            "hint_count": session["hint_count"],
+            "perseverance_score": session["perseverance_score"],
+            "badges": session.get("badges", []),
+            "badge_details": _get_badge_details(session.get("badges", [])),
+            "message": "💡 Great thinking — using hints shows real learning power!" if req.eventually_correct
+                       else "💡 Hint used — keep going, you've got this!",
+        }
 
 # ── Logic Sentry ────────────────────────────────────────────────────────────
 
@@ -3839,17 +4786,18 @@ def logic_sentry_analyze(req: LogicSentryRequest):
     if not check_rate_limit(f"logic_sentry:{req.session_id}", max_requests=20, window=60):
         raise HTTPException(status_code=429, detail="Too many requests. Please wait a moment.")
 
-    session = get_session(req.session_id)
-    guild_id = session.get("guild")
-    player_name = normalize_player_name(session.get("player_name", "Hero"))
+    with _session_lock(req.session_id):
+        session = get_session(req.session_id)
+        guild_id = session.get("guild")
+        player_name = normalize_player_name(session.get("player_name", "Hero"))
 
-    # Compute penalty before AI call so we can return it even on fallback
-    penalty = _perseverance_penalty(req.correct_answer, req.student_input)
+        # Compute penalty before AI call so we can return it even on fallback
+        penalty = _perseverance_penalty(req.correct_answer, req.student_input)
 
-    # Apply perseverance penalty to session
-    current_perseverance = int(session.get("perseverance_score", 0))
-    session["perseverance_score"] = max(0, current_perseverance - penalty)
-    _save_session(req.session_id)
+        # Apply perseverance penalty to session
+        current_perseverance = int(session.get("perseverance_score", 0))
+        session["perseverance_score"] = max(0, current_perseverance - penalty)
+        _save_session(req.session_id)
 
     # Guild-specific in-universe voice
     guild_phrase = _SENTRY_GUILD_FEEDBACK.get(guild_id, "Your ki is fluctuating!")
@@ -3885,16 +4833,14 @@ def logic_sentry_analyze(req: LogicSentryRequest):
 
     result: dict | None = None
     try:
-        response, timed_out = run_with_timeout(
-            lambda: get_openai_client().chat.completions.create(
-                model=AZURE_ANALOGY_MODEL,
-                timeout=AI_ANALOGY_TIMEOUT_SECONDS,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt},
-                ],
-            ),
-            AI_ANALOGY_TIMEOUT_SECONDS + TIMEOUT_BUFFER_SECONDS,
+        response, timed_out = _ai_chat(
+            AZURE_ANALOGY_MODEL,
+            [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt},
+            ],
+            AI_ANALOGY_TIMEOUT_SECONDS,
+            "sentry",
         )
         if not timed_out and response is not None:
             raw = (response.choices[0].message.content if response.choices else "").strip()
@@ -3996,16 +4942,14 @@ def correct_answer_tutor(req: CorrectAnswerTutorRequest):
             f"Hero: {req.hero}\n"
             "Explain why this answer is correct in a fun, child-friendly way."
         )
-        response, timed_out = run_with_timeout(
-            lambda: get_openai_client().chat.completions.create(
-                model=AZURE_ANALOGY_MODEL,
-                timeout=AI_ANALOGY_TIMEOUT_SECONDS,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt},
-                ],
-            ),
-            AI_ANALOGY_TIMEOUT_SECONDS + TIMEOUT_BUFFER_SECONDS,
+        response, timed_out = _ai_chat(
+            AZURE_ANALOGY_MODEL,
+            [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt},
+            ],
+            AI_ANALOGY_TIMEOUT_SECONDS,
+            "tutor",
         )
         if not timed_out and response is not None:
             text = (response.choices[0].message.content if response.choices else "").strip()
@@ -4162,6 +5106,7 @@ def admin_set_feature_flag(flag_name: str, req: FeatureFlagPatchRequest, request
     _flag_cache.pop(clean_name, None)
 
     updated = set_feature_flag(clean_name, req.is_active)
+    _session_backend.publish("flag", clean_name)  # other workers drop it too
     logger.info(f"[FEATURE_FLAG] {clean_name} → {req.is_active} (admin: {ip})")
     return updated
 
@@ -4175,7 +5120,7 @@ def admin_guardian_status(request: Request):
     ip = get_client_ip(request)
     if not check_rate_limit(f"admin_guardian:{ip}", max_requests=30, window=60):
         raise HTTPException(status_code=429, detail="Too many requests.")
-    return get_guardian_status()
+    return {**get_guardian_status(), "ai_breakers": _ai_breakers.stats()}
 
 
 class GuardianResetRequest(BaseModel):
@@ -4232,6 +5177,39 @@ def admin_guardian_enable(request: Request):
     logger.warning("[GUARDIAN] Enabled via admin API from %s", ip)
     return {"ok": True, "message": "Guardian enabled."}
 
+# ── Performance / capacity stats ──────────────────────────────────────────────
+
+@app.get("/api/admin/perf")
+def admin_perf_stats(request: Request):
+    """Return in-process performance counters (admin only).
+
+    Used to size worker memory and the DB pool on Azure App Service.
+    """
+    _admin_guard(request)
+    ip = get_client_ip(request)
+    if not check_rate_limit(f"admin_perf:{ip}", max_requests=30, window=60):
+        raise HTTPException(status_code=429, detail="Too many requests.")
+    return {
+        "db_pool": get_db_pool_stats(),
+        "premium_cache": get_premium_cache_stats(),
+        "session_writes": _session_persister.stats(),
+        "session_cache": sessions.stats(),
+        "session_locks": _session_locks.stats(),
+        "session_backend": _session_backend.stats(),
+        "ai_executor": _ai_executor.stats(),
+        "story_pipeline": _story_timings.stats(),
+        "story_stream": _story_stream_stats.stats(),
+        "story_enrichment": _story_enrichment.stats(),
+        "story_jobs": _story_jobs.stats(),
+        "ai_cache": _ai_cache.stats(),
+        "ai_singleflight": _ai_flights.stats(),
+        "ai_hedging": _ai_hedger.stats(),
+        "ai_timeouts": _ai_timeouts.stats(),
+        "story_deadline": _story_deadline.stats(),
+        "client_disconnects": _client_watch.stats(),
+        "idempotency": _idempotency.stats(),
+    }
+
 # Allowed event types from the Concrete Packers mini-game.
 _CONCRETE_PACKERS_EVENTS = frozenset({
     "drag_start", "drag_cancel", "slot_occupied",
@@ -4506,12 +5484,8 @@ def get_player_stats(session_id: str):
     history = session.get("history", [])
     quests = int(session.get("quests_completed", 0))
 
-    # Compute per-guild quest counts from history
-    guild_quests: dict = {}
-    for entry in history:
-        g = entry.get("guild")
-        if g:
-            guild_quests[g] = guild_quests.get(g, 0) + 1
+    # Per-guild quest counts over the full history (aggregated in the DB)
+    guild_quests = get_quest_guild_counts(session_id)
 
     return {
         "player_name": session.get("player_name", "Hero"),
@@ -4530,12 +5504,26 @@ def get_player_stats(session_id: str):
         "badges": session.get("badges", []),
         "badge_details": _get_badge_details(session.get("badges", [])),
         "guild_quests": guild_quests,
-        "mastery": session.get("mastery", {}),
+        "mastery": MasteryTable.coerce(session.get("mastery")).to_dict(),
         "recent_history": history[-10:],
         "coins": int(session.get("coins", 0)),
     }
 
 
+@app.get("/api/player/history/{session_id}")
+def get_player_history(session_id: str, before_id: Optional[int] = None, limit: int = 50):
+    """Full quest history for the parent dashboard, newest first, paginated.
+
+    Pass the returned ``next_before_id`` as ``before_id`` for the next page.
+    """
+    try:
+        validate_session_id(session_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid session ID")
+    get_session(session_id)  # runs the one-time legacy backfill if needed
+    return get_quest_history_page(session_id, before_id=before_id, limit=_clamp(limit, 1, 200))
+
+
 def _generate_image(prompt: str) -> dict:
     """Generate an image using Gemini 2.5 Flash.
 
@@ -4545,7 +5533,14 @@ def _generate_image(prompt: str) -> dict:
     Returns {"image": base64_str, "mime": "image/png"} on success,
     or {"image": None, "mime": None} on failure.
     Raises HTTPException(429) if the cloud budget is exceeded.
+
+    Identical prompts already in flight (same story segment for a whole
+    classroom) share one Gemini call.
     """
+    return _ai_flights.do_sync(("image", prompt), lambda: _generate_image_once(prompt), kind="image")
+
+
+def _generate_image_once(prompt: str) -> dict:
     try:
         response = get_gemini_client().models.generate_content(
             model=GEMINI_IMAGE_MODEL,
@@ -4581,7 +5576,8 @@ async def generate_segment_image(req: SegmentImageRequest):
     hero = CHARACTERS.get(req.hero)
     if not hero:
         raise HTTPException(status_code=400, detail="Unknown hero")
-    if not _is_hero_unlocked_for_session(req.session_id, req.hero):
+    # Entitlement lookup hits PostgreSQL — keep it off the event loop.
+    if not await run_in_threadpool(_is_hero_unlocked_for_session, req.session_id, req.hero):
         raise HTTPException(status_code=403, detail="This hero is a Premium unlock. Upgrade to use this hero.")
 
     scene_moods = [
@@ -4615,7 +5611,7 @@ async def generate_segment_image(req: SegmentImageRequest):
 
 
 @app.post("/api/segment-images-batch")
-async def generate_segment_images_batch(req: BatchSegmentImageRequest):
+async def generate_segment_images_batch(req: BatchSegmentImageRequest, request: Request):
     validate_session_id(req.session_id)
     if not check_rate_limit(f"batchimg:{req.session_id}", max_requests=4, window=60):
         raise HTTPException(status_code=429, detail="Too many image requests. Please wait.")
@@ -4624,7 +5620,8 @@ async def generate_segment_images_batch(req: BatchSegmentImageRequest):
     hero = CHARACTERS.get(req.hero)
     if not hero:
         raise HTTPException(status_code=400, detail="Unknown hero")
-    if not _is_hero_unlocked_for_session(req.session_id, req.hero):
+    # Entitlement lookup hits PostgreSQL — keep it off the event loop.
+    if not await run_in_threadpool(_is_hero_unlocked_for_session, req.session_id, req.hero):
         raise HTTPException(status_code=403, detail="This hero is a Premium unlock. Upgrade to use this hero.")
 
     scene_moods = [
@@ -4634,10 +5631,9 @@ async def generate_segment_images_batch(req: BatchSegmentImageRequest):
         "celebrating victory with a triumphant pose, confetti and sparkles, joyful"
     ]
 
-    import asyncio
+    abandoned = threading.Event()
 
     def _gen_one(seg_text, seg_idx):
-        import time as _time
         mood = scene_moods[min(seg_idx, len(scene_moods) - 1)]
         image_prompt = (
             f"A vivid, high-quality digital illustration for a children's adventure story. "
@@ -4648,6 +5644,8 @@ async def generate_segment_images_batch(req: BatchSegmentImageRequest):
             f"IMPORTANT: absolutely no text, letters, numbers, words, or symbols anywhere in the image."
         )
         for attempt in range(3):
+            if abandoned.is_set():
+                return {"image": None, "mime": None}
             try:
                 logger.warning(f"[IMG] Generating image for segment {seg_idx} (attempt {attempt+1})...")
                 result = _generate_image(image_prompt)
@@ -4660,16 +5658,23 @@ async def generate_segment_images_batch(req: BatchSegmentImageRequest):
                 if "FREE_CLOUD_BUDGET_EXCEEDED" in str(e):
                     return {"image": None, "mime": None, "error": "budget_exceeded"}
             if attempt < 2:
-                _time.sleep(1)
+                abandoned.wait(1)
         return {"image": None, "mime": None}
 
-    loop = asyncio.get_event_loop()
-    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as pool:
+    loop = asyncio.get_running_loop()
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=4)
+    try:
         tasks = [
             loop.run_in_executor(pool, _gen_one, seg, idx)
             for idx, seg in enumerate(req.segments)
         ]
-        results = await asyncio.gather(*tasks)
+        results = await _client_watch.run(request, asyncio.gather(*tasks), kind="segment_images", abandoned=abandoned)
+    except ClientDisconnected:
+        return Response(status_code=499)
+    finally:
+        # Segments not started yet are dropped; running ones stop after
+        # their current attempt.  Never block the event loop on them.
+        pool.shutdown(wait=False, cancel_futures=True)
 
     return {"images": list(results)}
 
@@ -4677,6 +5682,14 @@ async def generate_segment_images_batch(req: BatchSegmentImageRequest):
 def _get_elevenlabs_key():
     return os.environ.get("ELEVENLABS_API_KEY", "")
 
+_tts_http_client = None
+
+def get_tts_http_client():
+    global _tts_http_client
+    if _tts_http_client is None:
+        _tts_http_client = httpx.AsyncClient()
+    return _tts_http_client
+
 STORYTELLER_VOICES = [
     "9BWtsMINqrJLrRacOk9x",  # Aria - warm, engaging female (2024)
     "cgSgspJ2msm6clMCkdW9",  # Jessica - bright, enthusiastic female (2024)
@@ -4710,8 +5723,7 @@ async def generate_tts(req: TTSRequest, request: Request):
     scan_input_for_attacks(req.text, request)
     if not check_rate_limit(f"tts:{hash(req.text[:20])}", max_requests=15, window=60):
         raise HTTPException(status_code=429, detail="Too many TTS requests. Please wait.")
-    import asyncio
-    def _gen_audio():
+    async def _gen_audio():
         try:
             voice_id = req.voice_id if req.voice_id and req.voice_id in STORYTELLER_VOICES else random.choice(STORYTELLER_VOICES)
             url = f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}"
@@ -4730,7 +5742,8 @@ async def generate_tts(req: TTSRequest, request: Request):
                     "use_speaker_boost": True,
                 },
             }
-            resp = http_requests.post(url, json=payload, headers=headers, timeout=30)
+            # Async, so a client disconnect cancels the ElevenLabs request itself.
+            resp = await get_tts_http_client().post(url, json=payload, headers=headers, timeout=30)
             if resp.status_code == 200:
                 audio_b64 = base64.b64encode(resp.content).decode('utf-8')
                 return {"audio": audio_b64, "mime": "audio/mpeg"}
@@ -4740,7 +5753,10 @@ async def generate_tts(req: TTSRequest, request: Request):
             pass
         return {"audio": None}
 
-    return await asyncio.to_thread(_gen_audio)
+    try:
+        return await _client_watch.run(request, _gen_audio(), kind="tts")
+    except ClientDisconnected:
+        return Response(status_code=499)
 
 
 @app.post("/api/image")
@@ -4780,26 +5796,31 @@ def generate_image(req: StoryRequest):
 
 
 @app.post("/api/shop/buy")
-def buy_item(req: ShopRequest):
+def buy_item(req: ShopRequest, request: Request, response: Response):
     validate_session_id(req.session_id)
-    session = get_session(req.session_id)
-    item = next((i for i in SHOP_ITEMS if i["id"] == req.item_id), None)
-    if not item:
-        raise HTTPException(status_code=400, detail="Unknown item")
-    is_consumable = item.get("consumable", False)
-    if not is_consumable and item["id"] in session["inventory"]:
-        raise HTTPException(status_code=400, detail="Already owned")
-    if session["coins"] < item["price"]:
-        raise HTTPException(status_code=400, detail="Not enough coins")
-
-    session["coins"] -= item["price"]
-    if is_consumable:
-        session["potions"].append(item["id"])
-    else:
-        session["inventory"].append(item["id"])
-    _update_badges(session)
-    _save_session(req.session_id)
-    return {"coins": session["coins"], "inventory": session["inventory"], "equipped": session["equipped"], "potions": session["potions"]}
+    return _run_idempotent_sync(req, request, response, "shop_buy", lambda: _buy_item(req))
+
+
+def _buy_item(req: ShopRequest) -> dict:
+    with _session_lock(req.session_id):
+        session = get_session(req.session_id)
+        item = next((i for i in SHOP_ITEMS if i["id"] == req.item_id), None)
+        if not item:
+            raise HTTPException(status_code=400, detail="Unknown item")
+        is_consumable = item.get("consumable", False)
+        if not is_consumable and item["id"] in session["inventory"]:
+            raise HTTPException(status_code=400, detail="Already owned")
+        if session["coins"] < item["price"]:
+            raise HTTPException(status_code=400, detail="Not enough coins")
+
+        session["coins"] -= item["price"]
+        if is_consumable:
+            session["potions"].append(item["id"])
+        else:
+            session["inventory"].append(item["id"])
+        _update_badges(session)
+        _save_session(req.session_id, durable=True)
+        return {"coins": session["coins"], "inventory": session["inventory"], "equipped": session["equipped"], "potions": session["potions"]}
 
 class EquipRequest(BaseModel):
     item_id: str
@@ -4808,26 +5829,28 @@ class EquipRequest(BaseModel):
 @app.post("/api/shop/equip")
 def equip_item(req: EquipRequest):
     validate_session_id(req.session_id)
-    session = get_session(req.session_id)
-    if req.item_id not in session["inventory"]:
-        raise HTTPException(status_code=400, detail="Item not owned")
-    item = next((i for i in SHOP_ITEMS if i["id"] == req.item_id), None)
-    if not item:
-        raise HTTPException(status_code=400, detail="Unknown item")
-    cat = item["category"]
-    session["equipped"] = [eid for eid in session["equipped"] if next((i for i in SHOP_ITEMS if i["id"] == eid), {}).get("category") != cat]
-    session["equipped"].append(req.item_id)
-    _save_session(req.session_id)
-    return {"equipped": session["equipped"]}
+    with _session_lock(req.session_id):
+        session = get_session(req.session_id)
+        if req.item_id not in session["inventory"]:
+            raise HTTPException(status_code=400, detail="Item not owned")
+        item = next((i for i in SHOP_ITEMS if i["id"] == req.item_id), None)
+        if not item:
+            raise HTTPException(status_code=400, detail="Unknown item")
+        cat = item["category"]
+        session["equipped"] = [eid for eid in session["equipped"] if next((i for i in SHOP_ITEMS if i["id"] == eid), {}).get("category") != cat]
+        session["equipped"].append(req.item_id)
+        _save_session(req.session_id)
+        return {"equipped": session["equipped"]}
 
 @app.post("/api/shop/unequip")
 def unequip_item(req: EquipRequest):
     validate_session_id(req.session_id)
-    session = get_session(req.session_id)
-    if req.item_id in session["equipped"]:
-        session["equipped"].remove(req.item_id)
-    _save_session(req.session_id)
-    return {"equipped": session["equipped"]}
+    with _session_lock(req.session_id):
+        session = get_session(req.session_id)
+        if req.item_id in session["equipped"]:
+            session["equipped"].remove(req.item_id)
+        _save_session(req.session_id)
+        return {"equipped": session["equipped"]}
 
 class UsePotionRequest(BaseModel):
     potion_id: str
@@ -4836,20 +5859,21 @@ class UsePotionRequest(BaseModel):
 @app.post("/api/shop/use-potion")
 def use_potion(req: UsePotionRequest):
     validate_session_id(req.session_id)
-    session = get_session(req.session_id)
-    if req.potion_id not in session["potions"]:
-        raise HTTPException(status_code=400, detail="Potion not owned")
-    session["potions"].remove(req.potion_id)
-    item = next((i for i in SHOP_ITEMS if i["id"] == req.potion_id), None)
-    _save_session(req.session_id)
-    return {"potions": session["potions"], "effect": item["effect"] if item else None}
+    with _session_lock(req.session_id):
+        session = get_session(req.session_id)
+        if req.potion_id not in session["potions"]:
+            raise HTTPException(status_code=400, detail="Potion not owned")
+        session["potions"].remove(req.potion_id)
+        item = next((i for i in SHOP_ITEMS if i["id"] == req.potion_id), None)
+        _save_session(req.session_id, durable=True)
+        return {"potions": session["potions"], "effect": item["effect"] if item else None}
 
 
 @app.get("/api/pdf/{session_id}")
 def generate_pdf(session_id: str):
     validate_session_id(session_id)
     session = get_session(session_id)
-    history = session.get("history", [])
+    has_history = bool(session.get("history"))
 
     pdf = FPDF()
     pdf.add_page()
@@ -4857,14 +5881,14 @@ def generate_pdf(session_id: str):
     pdf.cell(0, 10, "Math Quest Progress Report", ln=True, align="C")
     pdf.ln(10)
 
-    if history:
+    if has_history:
         pdf.set_font("Helvetica", "B", 10)
         pdf.cell(60, 8, "Date", border=1, align="C")
         pdf.cell(70, 8, "Concept", border=1, align="C")
         pdf.cell(60, 8, "Hero", border=1, align="C")
         pdf.ln()
         pdf.set_font("Helvetica", "", 10)
-        for entry in history:
+        for entry in iter_quest_history(session_id):
             clean_hero = "".join(c for c in entry["hero"] if c.isascii())
             clean_concept = "".join(c for c in entry["concept"] if c.isascii())
             pdf.cell(60, 8, entry["time"], border=1, align="C")
@@ -4874,7 +5898,7 @@ def generate_pdf(session_id: str):
     else:
         pdf.cell(0, 10, "No quests completed yet.", ln=True, align="C")
 
-    pdf_bytes = pdf.output()
+    pdf_bytes = bytes(pdf.output())
     return Response(content=pdf_bytes, media_type="application/pdf",
                     headers={"Content-Disposition": "attachment; filename=Math_Quest_Report.pdf"})
 
@@ -4920,12 +5944,13 @@ class PrivacySettingsRequest(BaseModel):
 @app.post("/api/parent-pin/set")
 def set_parent_pin(req: ParentPinRequest):
     validate_session_id(req.session_id)
-    session = get_session(req.session_id)
-    if not _is_valid_parent_pin(req.pin):
-        raise HTTPException(status_code=400, detail="PIN must be exactly 4 digits")
-    session["_parent_pin_hash"] = _hash_parent_pin(req.pin)
-    _save_session(req.session_id)
-    return {"success": True, "has_parent_pin": True}
+    with _session_lock(req.session_id):
+        session = get_session(req.session_id)
+        if not _is_valid_parent_pin(req.pin):
+            raise HTTPException(status_code=400, detail="PIN must be exactly 4 digits")
+        session["_parent_pin_hash"] = _hash_parent_pin(req.pin)
+        _save_session(req.session_id)
+        return {"success": True, "has_parent_pin": True}
 
 @app.post("/api/parent-pin/verify")
 def verify_parent_pin(req: ParentPinVerifyRequest):
@@ -4950,28 +5975,29 @@ def get_privacy_settings(session_id: str):
 @app.post("/api/privacy/settings")
 def update_privacy_settings(req: PrivacySettingsRequest):
     validate_session_id(req.session_id)
-    session = get_session(req.session_id)
-    stored_hash = session.get("_parent_pin_hash")
-    if stored_hash:
-        attempt_hash = _hash_parent_pin(req.pin)
-        if not hmac.compare_digest(stored_hash, attempt_hash):
-            raise HTTPException(status_code=403, detail="Incorrect PIN")
-    if req.settings is not None:
-        raw = req.settings
-    else:
-        current = _sanitize_privacy_settings(session.get("privacy_settings"))
-        raw = {
-            "parental_consent": req.parental_consent if req.parental_consent is not None else current["parental_consent"],
-            "allow_telemetry": req.allow_telemetry if req.allow_telemetry is not None else current["allow_telemetry"],
-            "allow_personalization": req.allow_personalization if req.allow_personalization is not None else current["allow_personalization"],
-            "data_retention_days": req.data_retention_days if req.data_retention_days is not None else current["data_retention_days"],
+    with _session_lock(req.session_id):
+        session = get_session(req.session_id)
+        stored_hash = session.get("_parent_pin_hash")
+        if stored_hash:
+            attempt_hash = _hash_parent_pin(req.pin)
+            if not hmac.compare_digest(stored_hash, attempt_hash):
+                raise HTTPException(status_code=403, detail="Incorrect PIN")
+        if req.settings is not None:
+            raw = req.settings
+        else:
+            current = _sanitize_privacy_settings(session.get("privacy_settings"))
+            raw = {
+                "parental_consent": req.parental_consent if req.parental_consent is not None else current["parental_consent"],
+                "allow_telemetry": req.allow_telemetry if req.allow_telemetry is not None else current["allow_telemetry"],
+                "allow_personalization": req.allow_personalization if req.allow_personalization is not None else current["allow_personalization"],
+                "data_retention_days": req.data_retention_days if req.data_retention_days is not None else current["data_retention_days"],
+            }
+        session["privacy_settings"] = _sanitize_privacy_settings(raw)
+        _save_session(req.session_id)
+        return {
+            "success": True,
+            "privacy_settings": session["privacy_settings"],
         }
-    session["privacy_settings"] = _sanitize_privacy_settings(raw)
-    _save_session(req.session_id)
-    return {
-        "success": True,
-        "privacy_settings": session["privacy_settings"],
-    }
 
 class EarlyAccessRequest(BaseModel):
     # email is optional — when a Firebase Bearer token is provided the email is
@@ -5042,49 +6068,47 @@ def early_access_claim(req: EarlyAccessRequest, authorization: str = Header(defa
     # ── Database path (preferred) ────────────────────────────────────────────
     if db_url:
         try:
-            from backend.database import get_db_connection
-            conn = get_db_connection()
-            cur = conn.cursor()
+            from backend.database import db_connection
+            with db_connection() as conn:
+                cur = conn.cursor()
 
-            cur.execute("SELECT id FROM leads WHERE email = %s", (email,))
-            if cur.fetchone():
-                cur.close()
-                conn.close()
-                raise HTTPException(status_code=409, detail="This email has already claimed a code — check your inbox!")
+                cur.execute("SELECT id FROM leads WHERE email = %s", (email,))
+                if cur.fetchone():
+                    cur.close()
+                    raise HTTPException(status_code=409, detail="This email has already claimed a code — check your inbox!")
 
-            code = _generate_promo_code()
-            while True:
-                cur.execute("SELECT id FROM promo_codes WHERE code = %s", (code,))
-                if not cur.fetchone():
-                    break
                 code = _generate_promo_code()
-
-            cur.execute(
-                """INSERT INTO promo_codes (code, discount_type, discount_value, max_uses, grants_premium_days, active)
-                   VALUES (%s, 'percent', 0, 1, 30, true)""",
-                (code,)
-            )
-            cur.execute(
-                "INSERT INTO leads (email, promo_code) VALUES (%s, %s)",
-                (email, code)
-            )
-            conn.commit()
-
-            # Email failure must not roll back a successful DB signup — log and continue.
-            try:
-                email_ok = send_promo_email(email, code)
-            except Exception as email_exc:
-                logger.error(f"[EARLY_ACCESS] Email send exception (db path): {email_exc}\n{traceback.format_exc()}")
-                email_ok = False
-
-            if email_ok:
-                cur.execute("UPDATE leads SET email_sent = true WHERE email = %s", (email,))
+                while True:
+                    cur.execute("SELECT id FROM promo_codes WHERE code = %s", (code,))
+                    if not cur.fetchone():
+                        break
+                    code = _generate_promo_code()
+
+                cur.execute(
+                    """INSERT INTO promo_codes (code, discount_type, discount_value, max_uses, grants_premium_days, active)
+                       VALUES (%s, 'percent', 0, 1, 30, true)""",
+                    (code,)
+                )
+                cur.execute(
+                    "INSERT INTO leads (email, promo_code) VALUES (%s, %s)",
+                    (email, code)
+                )
                 conn.commit()
-            else:
-                logger.warning(f"[EARLY_ACCESS] Email not sent for {email} (code={code}) — lead still recorded in DB")
 
-            cur.close()
-            conn.close()
+                # Email failure must not roll back a successful DB signup — log and continue.
+                try:
+                    email_ok = send_promo_email(email, code)
+                except Exception as email_exc:
+                    logger.error(f"[EARLY_ACCESS] Email send exception (db path): {email_exc}\n{traceback.format_exc()}")
+                    email_ok = False
+
+                if email_ok:
+                    cur.execute("UPDATE leads SET email_sent = true WHERE email = %s", (email,))
+                    conn.commit()
+                else:
+                    logger.warning(f"[EARLY_ACCESS] Email not sent for {email} (code={code}) — lead still recorded in DB")
+
+                cur.close()
 
             logger.info(f"[EARLY_ACCESS] Lead captured (db): {email}, code={code}, email_sent={email_ok}")
             return {"success": True, "message": "Check your email for your free promo code!"}
@@ -5126,13 +6150,12 @@ def early_access_stats(request: Request):
     if not admin_key or not hmac.compare_digest(admin_key, provided_key):
         raise HTTPException(status_code=403, detail="Forbidden")
 
-    from backend.database import get_db_connection
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT COUNT(*), COUNT(CASE WHEN email_sent THEN 1 END) FROM leads")
-    total, sent = cur.fetchone()
-    cur.close()
-    conn.close()
+    from backend.database import db_connection
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT COUNT(*), COUNT(CASE WHEN email_sent THEN 1 END) FROM leads")
+        total, sent = cur.fetchone()
+        cur.close()
     return {"total_leads": total, "emails_sent": sent}
 
 
@@ -5183,61 +6206,56 @@ def promo_send_code(req: SendCodeRequest, request: Request):
     # ── Database path (preferred) ────────────────────────────────────────────
     if db_url:
         try:
-            from backend.database import get_db_connection
-            conn = get_db_connection()
-            cur = conn.cursor()
+            from backend.database import db_connection
+            with db_connection() as conn:
+                cur = conn.cursor()
+
+                cur.execute("SELECT id FROM leads WHERE email = %s", (email,))
+                if cur.fetchone():
+                    cur.close()
+                    raise HTTPException(status_code=409, detail="This email has already claimed a code — check your inbox!")
 
-            cur.execute("SELECT id FROM leads WHERE email = %s", (email,))
-            if cur.fetchone():
-                cur.close()
-                conn.close()
-                raise HTTPException(status_code=409, detail="This email has already claimed a code — check your inbox!")
-
-            code = _generate_prem_code()
-            attempts = 0
-            while attempts < 10:
-                cur.execute("SELECT id FROM promo_codes WHERE code = %s", (code,))
-                if not cur.fetchone():
-                    break
                 code = _generate_prem_code()
-                attempts += 1
-            else:
-                # All 10 attempts collided — extremely unlikely but raise to avoid a constraint error.
-                logger.error("[PROMO_SEND] Could not generate a unique promo code after 10 attempts")
-                cur.close()
-                conn.close()
-                raise HTTPException(status_code=500, detail="Something went wrong. Please try again.")
+                attempts = 0
+                while attempts < 10:
+                    cur.execute("SELECT id FROM promo_codes WHERE code = %s", (code,))
+                    if not cur.fetchone():
+                        break
+                    code = _generate_prem_code()
+                    attempts += 1
+                else:
+                    # All 10 attempts collided — extremely unlikely but raise to avoid a constraint error.
+                    logger.error("[PROMO_SEND] Could not generate a unique promo code after 10 attempts")
+                    cur.close()
+                    raise HTTPException(status_code=500, detail="Something went wrong. Please try again.")
 
-            # ── Step 1: attempt email BEFORE writing anything to the DB ──────
-            # If delivery fails the user is not locked out and can retry.
-            try:
-                email_ok = send_promo_email(email, code)
-            except Exception as email_exc:
-                print(email_exc)
-                logger.error(f"[PROMO_SEND] Resend error: {email_exc}\n{traceback.format_exc()}")
+                # ── Step 1: attempt email BEFORE writing anything to the DB ──────
+                # If delivery fails the user is not locked out and can retry.
+                try:
+                    email_ok = send_promo_email(email, code)
+                except Exception as email_exc:
+                    print(email_exc)
+                    logger.error(f"[PROMO_SEND] Resend error: {email_exc}\n{traceback.format_exc()}")
+                    cur.close()
+                    raise HTTPException(status_code=500, detail="Failed to send email. Please try again.")
+
+                if not email_ok:
+                    logger.error(f"[PROMO_SEND] Email dispatch returned failure for {email} (code={code}) — aborting DB write")
+                    cur.close()
+                    raise HTTPException(status_code=500, detail="Failed to send email. Please try again.")
+
+                # ── Step 2: email confirmed — now persist to PostgreSQL ──────────
+                cur.execute(
+                    """INSERT INTO promo_codes (code, discount_type, discount_value, max_uses, grants_premium_days, active)
+                       VALUES (%s, 'percent', 0, 1, 30, true)""",
+                    (code,)
+                )
+                cur.execute(
+                    "INSERT INTO leads (email, promo_code, email_sent) VALUES (%s, %s, %s)",
+                    (email, code, True)
+                )
+                conn.commit()
                 cur.close()
-                conn.close()
-                raise HTTPException(status_code=500, detail="Failed to send email. Please try again.")
-
-            if not email_ok:
-                logger.error(f"[PROMO_SEND] Email dispatch returned failure for {email} (code={code}) — aborting DB write")
-                cur.close()
-                conn.close()
-                raise HTTPException(status_code=500, detail="Failed to send email. Please try again.")
-
-            # ── Step 2: email confirmed — now persist to PostgreSQL ──────────
-            cur.execute(
-                """INSERT INTO promo_codes (code, discount_type, discount_value, max_uses, grants_premium_days, active)
-                   VALUES (%s, 'percent', 0, 1, 30, true)""",
-                (code,)
-            )
-            cur.execute(
-                "INSERT INTO leads (email, promo_code, email_sent) VALUES (%s, %s, %s)",
-                (email, code, True)
-            )
-            conn.commit()
-            cur.close()
-            conn.close()
 
             # ── Step 3: replicate to Cosmos DB (best-effort) ─────────────────
             try:
@@ -5294,20 +6312,19 @@ def promo_send_code(req: SendCodeRequest, request: Request):
 def promo_list(request: Request):
     """Return all promo codes with redemption status (admin only)."""
     _admin_guard(request)
-    from backend.database import get_db_connection
+    from backend.database import db_connection
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT p.code, p.grants_premium_days, p.active, p.created_at,
-                   l.email AS redeemed_by
-            FROM promo_codes p
-            LEFT JOIN leads l ON l.promo_code = p.code
-            ORDER BY p.created_at DESC
-        """)
-        rows = cur.fetchall()
-        cur.close()
-        conn.close()
+        with db_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                SELECT p.code, p.grants_premium_days, p.active, p.created_at,
+                       l.email AS redeemed_by
+                FROM promo_codes p
+                LEFT JOIN leads l ON l.promo_code = p.code
+                ORDER BY p.created_at DESC
+            """)
+            rows = cur.fetchall()
+            cur.close()
         codes = []
         for row in rows:
             days = row[1]
@@ -5341,30 +6358,29 @@ def promo_generate(req: PromoGenerateRequest, request: Request):
     count = max(1, min(50, req.count))
     dtype = req.duration_type if req.duration_type in _DURATION_DAYS else "30_day"
     days = _DURATION_DAYS[dtype]
-    from backend.database import get_db_connection
+    from backend.database import db_connection
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        generated = []
-        for _ in range(count):
-            code = _generate_promo_code()
-            attempts = 0
-            while attempts < 10:
-                cur.execute("SELECT id FROM promo_codes WHERE code = %s", (code,))
-                if not cur.fetchone():
-                    break
+        with db_connection() as conn:
+            cur = conn.cursor()
+            generated = []
+            for _ in range(count):
                 code = _generate_promo_code()
-                attempts += 1
-            cur.execute(
-                """INSERT INTO promo_codes
-                   (code, discount_type, discount_value, max_uses, grants_premium_days, active)
-                   VALUES (%s, 'percent', 0, 1, %s, true)""",
-                (code, days),
-            )
-            generated.append(code)
-        conn.commit()
-        cur.close()
-        conn.close()
+                attempts = 0
+                while attempts < 10:
+                    cur.execute("SELECT id FROM promo_codes WHERE code = %s", (code,))
+                    if not cur.fetchone():
+                        break
+                    code = _generate_promo_code()
+                    attempts += 1
+                cur.execute(
+                    """INSERT INTO promo_codes
+                       (code, discount_type, discount_value, max_uses, grants_premium_days, active)
+                       VALUES (%s, 'percent', 0, 1, %s, true)""",
+                    (code, days),
+                )
+                generated.append(code)
+            conn.commit()
+            cur.close()
         logger.info(f"[PROMO_GEN] Admin generated {len(generated)} {dtype} codes")
         return {"codes": generated, "duration_type": dtype, "grants_premium_days": days}
     except Exception as e:
@@ -5602,36 +6618,35 @@ def admin_check_subscribers(request: Request):
     if not admin_key or not hmac.compare_digest(admin_key, provided_key):
         raise HTTPException(status_code=403, detail="Forbidden")
 
-    from backend.database import get_db_connection
+    from backend.database import db_connection
 
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
+        with db_connection() as conn:
+            cur = conn.cursor()
 
-        cur.execute("SELECT COUNT(*) FROM app_users")
-        total_users = cur.fetchone()[0]
-
-        cur.execute("SELECT COUNT(*) FROM app_users WHERE stripe_customer_id IS NOT NULL")
-        stripe_customers = cur.fetchone()[0]
-
-        cur.execute("""
-            SELECT COUNT(*) FROM app_users
-            WHERE subscription_status IN ('active', 'trialing', 'past_due')
-        """)
-        premium_count = cur.fetchone()[0]
-
-        cur.execute("""
-            SELECT session_id, stripe_customer_id, stripe_subscription_id,
-                   subscription_status, created_at, updated_at
-            FROM app_users
-            WHERE subscription_status != 'free'
-               OR stripe_customer_id IS NOT NULL
-               OR stripe_subscription_id IS NOT NULL
-            ORDER BY updated_at DESC
-        """)
-        rows = cur.fetchall()
-        cur.close()
-        conn.close()
+            cur.execute("SELECT COUNT(*) FROM app_users")
+            total_users = cur.fetchone()[0]
+
+            cur.execute("SELECT COUNT(*) FROM app_users WHERE stripe_customer_id IS NOT NULL")
+            stripe_customers = cur.fetchone()[0]
+
+            cur.execute("""
+                SELECT COUNT(*) FROM app_users
+                WHERE subscription_status IN ('active', 'trialing', 'past_due')
+            """)
+            premium_count = cur.fetchone()[0]
+
+            cur.execute("""
+                SELECT session_id, stripe_customer_id, stripe_subscription_id,
+                       subscription_status, created_at, updated_at
+                FROM app_users
+                WHERE subscription_status != 'free'
+                   OR stripe_customer_id IS NOT NULL
+                   OR stripe_subscription_id IS NOT NULL
+                ORDER BY updated_at DESC
+            """)
+            rows = cur.fetchall()
+            cur.close()
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database error: {e}")
 
@@ -0,0 +1,336 @@
+"""
+In-process cache of live game sessions.
+
+Replaces the plain ``sessions`` dict in ``main.py``, which evicted in
+insertion order once 10 000 sessions were resident.  :class:`SessionCache`
+evicts the least-recently-*used* session instead, and also:
+
+* drops sessions idle for longer than ``idle_ttl`` seconds,
+* keeps the estimated resident footprint under ``max_bytes``,
+* calls ``on_evict(sid, session)`` before a session is dropped so pending
+  writes can be flushed (a session being flushed is still visible to
+  readers, and a read revives it); if the callback raises, the session
+  stays resident rather than losing its unsaved writes,
+* counts hits, misses, evictions and resident bytes for the admin perf
+  endpoint.
+
+Configuration (environment variables)
+-------------------------------------
+SESSION_CACHE_MAX_ENTRIES       – resident sessions per worker (default 10000)
+SESSION_CACHE_MAX_BYTES         – estimated bytes per worker (default 256 MiB)
+SESSION_CACHE_IDLE_TTL_SECONDS  – idle time before a session is dropped
+                                  (default 3600)
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from typing import Any, Callable, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+SESSION_CACHE_MAX_ENTRIES = int(os.environ.get("SESSION_CACHE_MAX_ENTRIES", "10000"))
+SESSION_CACHE_MAX_BYTES = int(os.environ.get("SESSION_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+SESSION_CACHE_IDLE_TTL_SECONDS = float(os.environ.get("SESSION_CACHE_IDLE_TTL_SECONDS", "3600"))
+
+_MISSING = object()
+
+
+def estimate_size(obj: Any) -> int:
+    """Approximate deep size in bytes of a JSON-like object graph."""
+    seen: set[int] = set()
+    stack = [obj]
+    total = 0
+    while stack:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        total += sys.getsizeof(item)
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            stack.extend(item)
+        elif hasattr(type(item), "__slots__") and not isinstance(item, (str, bytes, int, float)):
+            # Slotted objects (PlayerSession, MasteryTable): walk the slots,
+            # not the Mapping view, which may synthesize temporary objects.
+            for name in type(item).__slots__:
+                value = getattr(item, name, None)
+                if value is not None:
+                    stack.append(value)
+    return total
+
+
+class SessionCache(MutableMapping):
+    """Thread-safe LRU + idle-TTL + byte-budget map of ``sid -> session``."""
+
+    def __init__(
+        self,
+        *,
+        max_entries: int = SESSION_CACHE_MAX_ENTRIES,
+        max_bytes: int = SESSION_CACHE_MAX_BYTES,
+        idle_ttl: float = SESSION_CACHE_IDLE_TTL_SECONDS,
+        on_evict: Optional[Callable[[str, Any], None]] = None,
+        sizeof: Callable[[Any], int] = estimate_size,
+    ):
+        if max_entries < 1:
+            raise ValueError("max_entries must be >= 1")
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self._on_evict = on_evict
+        self._sizeof = sizeof
+
+        self._lock = threading.Lock()
+        self._data: OrderedDict[str, Any] = OrderedDict()   # LRU order, oldest first
+        self._last_used: dict[str, float] = {}
+        self._sizes: dict[str, int] = {}
+        self._bytes = 0
+        self._evicting: dict[str, Any] = {}   # dropped from the LRU, flush in progress
+        self._last_sweep = time.monotonic()
+
+        # Counters for the admin perf endpoint
+        self._hits = 0
+        self._misses = 0
+        self._evicted_lru = 0
+        self._evicted_bytes = 0
+        self._expired_idle = 0
+        self._revived = 0
+        self._flush_failures = 0
+
+    # ── lookups ───────────────────────────────────────────────────────────────
+
+    def get(self, sid: str, default: Any = None) -> Any:
+        """Return the session and mark it most-recently used (counts hit/miss)."""
+        with self._lock:
+            session = self._data.get(sid, _MISSING)
+            if session is _MISSING:
+                session = self._evicting.get(sid, _MISSING)
+                if session is _MISSING:
+                    self._misses += 1
+                    return default
+                # Read while its eviction flush runs: keep it resident.
+                self._revived += 1
+                self._data[sid] = session
+                self._add_size_locked(sid, session)
+            self._data.move_to_end(sid)
+            self._last_used[sid] = time.monotonic()
+            self._hits += 1
+            return session
+
+    def peek(self, sid: str, default: Any = None) -> Any:
+        """Return the session without touching recency or counters."""
+        with self._lock:
+            session = self._data.get(sid, _MISSING)
+            if session is _MISSING:
+                session = self._evicting.get(sid, default)
+            return session
+
+    def __getitem__(self, sid: str) -> Any:
+        session = self.get(sid, _MISSING)
+        if session is _MISSING:
+            raise KeyError(sid)
+        return session
+
+    def __contains__(self, sid: object) -> bool:
+        with self._lock:
+            return sid in self._data or sid in self._evicting
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
+
+    def __iter__(self) -> Iterator[str]:
+        with self._lock:
+            return iter(list(self._data))
+
+    # ── inserts / removals ────────────────────────────────────────────────────
+
+    def __setitem__(self, sid: str, session: Any) -> None:
+        with self._lock:
+            self._insert_locked(sid, session)
+        self._enforce_budgets()
+
+    def setdefault(self, sid: str, session: Any = None) -> Any:
+        """Atomically insert *session* unless *sid* is already resident.
+
+        Returns whichever session ends up cached, so two threads that both
+        missed and loaded the same sid agree on one object.
+        """
+        with self._lock:
+            existing = self._data.get(sid, _MISSING)
+            if existing is _MISSING:
+                existing = self._evicting.get(sid, _MISSING)
+            if existing is not _MISSING:
+                self._data[sid] = existing
+                self._data.move_to_end(sid)
+                self._last_used[sid] = time.monotonic()
+                self._add_size_locked(sid, existing)
+                return existing
+            self._insert_locked(sid, session)
+        self._enforce_budgets()
+        return session
+
+    def __delitem__(self, sid: str) -> None:
+        with self._lock:
+            if sid not in self._data:
+                raise KeyError(sid)
+            self._remove_locked(sid)
+
+    def pop(self, sid: str, default: Any = _MISSING) -> Any:
+        """Remove without the eviction callback (the caller owns the session)."""
+        with self._lock:
+            if sid in self._data:
+                return self._remove_locked(sid)
+        if default is _MISSING:
+            raise KeyError(sid)
+        return default
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._last_used.clear()
+            self._sizes.clear()
+            self._bytes = 0
+
+    def update_size(self, sid: str) -> None:
+        """Re-estimate *sid*'s footprint after it was mutated."""
+        with self._lock:
+            session = self._data.get(sid, _MISSING)
+        if session is _MISSING:
+            return
+        try:
+            size = self._sizeof(session)
+        except RuntimeError:   # mutated mid-walk; keep the old estimate
+            return
+        with self._lock:
+            if self._data.get(sid, _MISSING) is session:
+                self._bytes += size - self._sizes.get(sid, 0)
+                self._sizes[sid] = size
+        if self._bytes > self.max_bytes:
+            self._enforce_budgets()
+
+    # ── eviction ──────────────────────────────────────────────────────────────
+
+    def sweep(self) -> int:
+        """Evict every session idle for longer than ``idle_ttl``."""
+        cutoff = time.monotonic() - self.idle_ttl
+        with self._lock:
+            self._last_sweep = time.monotonic()
+            victims = []
+            for sid in self._data:   # oldest first; stop at the first fresh one
+                if self._last_used.get(sid, 0.0) > cutoff:
+                    break
+                victims.append(sid)
+            taken = self._take_locked(victims)
+            self._expired_idle += len(taken)
+        self._evict(taken)
+        return len(taken)
+
+    def _enforce_budgets(self) -> None:
+        with self._lock:
+            sweep_due = time.monotonic() - self._last_sweep > min(self.idle_ttl, 60.0)
+            victims = []
+            count = len(self._data)
+            resident = self._bytes
+            lru = iter(self._data)
+            while count > self.max_entries or (resident > self.max_bytes and count > 1):
+                sid = next(lru)
+                victims.append(sid)
+                if count > self.max_entries:
+                    self._evicted_lru += 1
+                else:
+                    self._evicted_bytes += 1
+                count -= 1
+                resident -= self._sizes.get(sid, 0)
+            taken = self._take_locked(victims)
+        self._evict(taken)
+        if sweep_due:
+            self.sweep()
+
+    def _take_locked(self, sids: list[str]) -> list[tuple[str, Any]]:
+        taken = []
+        for sid in sids:
+            session = self._remove_locked(sid)
+            self._evicting[sid] = session
+            taken.append((sid, session))
+        return taken
+
+    def _evict(self, taken: list[tuple[str, Any]]) -> None:
+        for sid, session in taken:
+            failed = False
+            try:
+                if self._on_evict is not None:
+                    self._on_evict(sid, session)
+            except Exception as exc:
+                logger.warning("[SESSION] Flush before evicting %s failed; keeping it resident: %s", sid, exc)
+                failed = True
+            with self._lock:
+                if self._evicting.get(sid) is not session:
+                    continue
+                del self._evicting[sid]
+                if failed:
+                    # Its unsaved writes would be lost: keep it, as most
+                    # recently used so the next attempt is not immediate.
+                    self._flush_failures += 1
+                    if sid not in self._data:
+                        self._data[sid] = session
+                        self._last_used[sid] = time.monotonic()
+                        self._add_size_locked(sid, session)
+
+    # ── internals (caller holds _lock) ────────────────────────────────────────
+
+    def _insert_locked(self, sid: str, session: Any) -> None:
+        if sid in self._data:
+            self._remove_locked(sid)
+        self._evicting.pop(sid, None)
+        self._data[sid] = session
+        self._last_used[sid] = time.monotonic()
+        self._add_size_locked(sid, session)
+
+    def _add_size_locked(self, sid: str, session: Any) -> None:
+        if sid in self._sizes:
+            return
+        try:
+            size = self._sizeof(session)
+        except RuntimeError:
+            size = 0
+        self._sizes[sid] = size
+        self._bytes += size
+
+    def _remove_locked(self, sid: str) -> Any:
+        session = self._data.pop(sid)
+        self._last_used.pop(sid, None)
+        self._bytes -= self._sizes.pop(sid, 0)
+        return session
+
+    # ── metrics ───────────────────────────────────────────────────────────────
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._hits + self._misses
+            count = len(self._data)
+            return {
+                "entries": count,
+                "max_entries": self.max_entries,
+                "resident_bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "avg_session_bytes": self._bytes // count if count else 0,
+                "idle_ttl_s": self.idle_ttl,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 4) if lookups else 0.0,
+                "evicted_lru": self._evicted_lru,
+                "evicted_bytes": self._evicted_bytes,
+                "expired_idle": self._expired_idle,
+                "revived_during_flush": self._revived,
+                "kept_after_failed_flush": self._flush_failures,
+                "flushing": len(self._evicting),
+            }
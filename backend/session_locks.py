@@ -0,0 +1,89 @@
+"""
+Striped per-session locks.
+
+Sync endpoints run concurrently in Starlette's threadpool and used to
+read-modify-write the same session dict with no locking, so a double-tapped
+purchase could lose an update.  :class:`StripedLocks` hashes each session id
+onto one of a fixed number of re-entrant locks: memory stays constant no
+matter how many sessions exist, and two sessions only contend when they
+share a stripe.
+
+Hold a stripe only around the session mutation itself — never around an AI
+call or other slow I/O.
+
+Configuration (environment variables)
+-------------------------------------
+SESSION_LOCK_STRIPES          – number of locks (default 1024)
+SESSION_LOCK_TIMEOUT_SECONDS  – max wait for a stripe (default 10)
+"""
+
+from __future__ import annotations
+
+import contextlib
+import os
+import threading
+import time
+import zlib
+
+SESSION_LOCK_STRIPES = int(os.environ.get("SESSION_LOCK_STRIPES", "1024"))
+SESSION_LOCK_TIMEOUT_SECONDS = float(os.environ.get("SESSION_LOCK_TIMEOUT_SECONDS", "10"))
+
+
+class SessionLockTimeout(RuntimeError):
+    """Raised when a session's stripe could not be acquired in time."""
+
+
+class StripedLocks:
+    """Fixed pool of ``threading.RLock`` objects keyed by hash of a string."""
+
+    def __init__(self, stripes: int = SESSION_LOCK_STRIPES, timeout: float = SESSION_LOCK_TIMEOUT_SECONDS):
+        if stripes < 1:
+            raise ValueError("stripes must be >= 1")
+        self.timeout = timeout
+        self._locks = [threading.RLock() for _ in range(stripes)]
+        self._stats_lock = threading.Lock()
+        self._acquired = 0
+        self._contended = 0
+        self._timeouts = 0
+        self._wait_total = 0.0
+        self._max_wait = 0.0
+
+    def lock_for(self, key: str) -> threading.RLock:
+        # crc32 rather than hash(): stable across processes and restarts.
+        return self._locks[zlib.crc32(key.encode("utf-8")) % len(self._locks)]
+
+    @contextlib.contextmanager
+    def hold(self, key: str, timeout: float | None = None):
+        """``with locks.hold(sid):`` — raises SessionLockTimeout if it waits too long."""
+        lock = self.lock_for(key)
+        timeout = self.timeout if timeout is None else timeout
+        waited = 0.0
+        if not lock.acquire(blocking=False):
+            started = time.monotonic()
+            acquired = lock.acquire(timeout=timeout)
+            waited = time.monotonic() - started
+            with self._stats_lock:
+                self._contended += 1
+                if not acquired:
+                    self._timeouts += 1
+            if not acquired:
+                raise SessionLockTimeout(f"Session {key} is busy (waited {timeout:.1f}s)")
+        with self._stats_lock:
+            self._acquired += 1
+            self._wait_total += waited
+            self._max_wait = max(self._max_wait, waited)
+        try:
+            yield
+        finally:
+            lock.release()
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "stripes": len(self._locks),
+                "acquired": self._acquired,
+                "contended": self._contended,
+                "timeouts": self._timeouts,
+                "avg_wait_ms": round(self._wait_total * 1000 / self._acquired, 3) if self._acquired else 0.0,
+                "max_wait_ms": round(self._max_wait * 1000, 3),
+            }
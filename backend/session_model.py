@@ -0,0 +1,334 @@
+"""
+Compact in-memory representation and binary encoding of game sessions.
+
+Sessions used to be plain dicts of ~30 keys, with ``mastery`` held as one
+small dict per skill.  :class:`PlayerSession` keeps the same mapping
+interface (``session["coins"]``, ``.get``, ``.setdefault``…) so endpoint
+code is unchanged, but stores the known fields in ``__slots__`` and mastery
+as three fixed arrays indexed by :data:`MATH_SKILLS`.  Unknown keys still
+work; they go into a small overflow dict.
+
+:func:`encode_session` turns a session into the blob stored in
+``game_sessions.blob``: msgpack (or orjson when msgpack is unavailable),
+zstd-compressed above a size threshold when ``zstandard`` is installed.
+:func:`decode_session` reads every blob flavour plus legacy JSON text, so
+rows written by older builds keep loading.
+
+Until the cutover, :func:`encode_session_row` also renders the session as
+JSON for the ``data`` column, so anything still reading ``data`` (reports,
+or a rollback to a build that predates ``blob``) sees the real session.
+The cutover is a deploy setting ``SESSION_WRITE_JSON=0``, safe once every
+running build reads ``blob`` and rolling back past that is no longer
+needed; from then on ``data`` is written as ``{}``.
+
+Configuration (environment variables)
+-------------------------------------
+SESSION_BLOB_FORMAT              – ``msgpack`` or ``json`` (default msgpack)
+SESSION_BLOB_COMPRESS_MIN_BYTES  – compress blobs at least this large when
+                                   zstandard is installed (default 2048)
+SESSION_BLOB_ZSTD_LEVEL          – zstd compression level (default 3)
+SESSION_WRITE_JSON               – also write the JSONB ``data`` column next
+                                   to ``blob``; ``0`` after the cutover
+                                   (default 1)
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import threading
+from array import array
+from collections.abc import Mapping, MutableMapping
+from typing import Any, Iterator
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - falls back to the stdlib encoder
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - falls back to JSON blobs
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+SESSION_BLOB_FORMAT = os.environ.get("SESSION_BLOB_FORMAT", "msgpack").strip().lower()
+SESSION_BLOB_COMPRESS_MIN_BYTES = int(os.environ.get("SESSION_BLOB_COMPRESS_MIN_BYTES", "2048"))
+SESSION_BLOB_ZSTD_LEVEL = int(os.environ.get("SESSION_BLOB_ZSTD_LEVEL", "3"))
+SESSION_WRITE_JSON = os.environ.get("SESSION_WRITE_JSON", "1") != "0"
+
+MATH_SKILLS = ["addition", "subtraction", "multiplication", "division", "fractions", "decimals", "algebra", "exponents"]
+_SKILL_INDEX = {skill: i for i, skill in enumerate(MATH_SKILLS)}
+
+# Every key the app reads or writes on a session.  Anything else lands in
+# PlayerSession._extra.
+SESSION_FIELDS = (
+    "coins", "inventory", "equipped", "potions", "history",
+    "player_name", "age_group", "selected_realm", "preferred_language",
+    "streak_count", "last_active_date", "quests_completed", "badges",
+    "daily_chest_last_claim", "privacy_settings", "mastery",
+    "guild", "ideology_meter", "perseverance_score", "hint_count", "difficulty_level",
+    "player_level", "player_xp", "hero_unlocked", "tycoon_currency",
+    "_history_logged", "_schema_version", "_parent_pin_hash",
+)
+_FIELD_SET = frozenset(SESSION_FIELDS)
+
+_MISSING = object()
+
+# Blob tags (first byte)
+_TAG_MSGPACK = b"m"
+_TAG_JSON = b"j"
+_TAG_ZSTD = b"z"
+
+
+# ── mastery ───────────────────────────────────────────────────────────────────
+
+
+class MasteryEntry(MutableMapping):
+    """``{"correct", "total", "mastery_score"}`` view onto one table row."""
+
+    __slots__ = ("_table", "_i")
+    _COLUMNS = {"correct": "correct", "total": "total", "mastery_score": "score"}
+
+    def __init__(self, table: "MasteryTable", index: int):
+        self._table = table
+        self._i = index
+
+    def __getitem__(self, key: str) -> Any:
+        column = self._COLUMNS.get(key)
+        if column is None:
+            raise KeyError(key)
+        return getattr(self._table, column)[self._i]
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        column = self._COLUMNS.get(key)
+        if column is None:
+            raise KeyError(key)
+        getattr(self._table, column)[self._i] = float(value) if column == "score" else int(value)
+
+    def __delitem__(self, key: str) -> None:
+        raise TypeError("mastery entries have fixed fields")
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._COLUMNS)
+
+    def __len__(self) -> int:
+        return len(self._COLUMNS)
+
+    def __repr__(self) -> str:
+        return repr(dict(self))
+
+
+class MasteryTable(MutableMapping):
+    """Per-skill mastery as three arrays indexed by :data:`MATH_SKILLS`."""
+
+    __slots__ = ("correct", "total", "score")
+
+    def __init__(self, data: Any = None):
+        n = len(MATH_SKILLS)
+        self.correct = array("q", bytes(8 * n))
+        self.total = array("q", bytes(8 * n))
+        self.score = array("d", bytes(8 * n))
+        if isinstance(data, Mapping):
+            for skill, entry in data.items():
+                if skill in _SKILL_INDEX and isinstance(entry, Mapping):
+                    self[skill] = entry
+
+    @classmethod
+    def coerce(cls, value: Any) -> "MasteryTable":
+        return value if isinstance(value, cls) else cls(value)
+
+    def __getitem__(self, skill: str) -> MasteryEntry:
+        return MasteryEntry(self, _SKILL_INDEX[skill])
+
+    def __setitem__(self, skill: str, entry: Mapping) -> None:
+        i = _SKILL_INDEX[skill]
+        self.correct[i] = int(entry.get("correct", 0))
+        self.total[i] = int(entry.get("total", 0))
+        self.score[i] = float(entry.get("mastery_score", 0.0))
+
+    def __delitem__(self, skill: str) -> None:
+        self[skill] = {}
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(MATH_SKILLS)
+
+    def __len__(self) -> int:
+        return len(MATH_SKILLS)
+
+    def to_dict(self) -> dict:
+        return {
+            skill: {"correct": correct, "total": total, "mastery_score": score}
+            for skill, correct, total, score in zip(MATH_SKILLS, self.correct, self.total, self.score)
+        }
+
+    def __repr__(self) -> str:
+        return f"MasteryTable({self.to_dict()!r})"
+
+
+# ── session ───────────────────────────────────────────────────────────────────
+
+
+class PlayerSession(MutableMapping):
+    """Slotted, dict-compatible game session."""
+
+    __slots__ = SESSION_FIELDS + ("_extra",)
+
+    def __init__(self, data: Mapping | None = None):
+        self._extra = None
+        if data:
+            for key, value in data.items():
+                self[key] = value
+
+    def __getitem__(self, key: str) -> Any:
+        if key in _FIELD_SET:
+            value = getattr(self, key, _MISSING)
+        elif self._extra is not None:
+            value = self._extra.get(key, _MISSING)
+        else:
+            value = _MISSING
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def get(self, key: str, default: Any = None) -> Any:
+        if key in _FIELD_SET:
+            return getattr(self, key, default)
+        return self._extra.get(key, default) if self._extra is not None else default
+
+    def __contains__(self, key: object) -> bool:
+        if key in _FIELD_SET:
+            return hasattr(self, key)
+        return self._extra is not None and key in self._extra
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        if key == "mastery":
+            value = MasteryTable.coerce(value)
+        if key in _FIELD_SET:
+            setattr(self, key, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def setdefault(self, key: str, default: Any = None) -> Any:
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            self[key] = default
+            value = self[key]
+        return value
+
+    def __delitem__(self, key: str) -> None:
+        if key in _FIELD_SET:
+            try:
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        elif self._extra is not None and key in self._extra:
+            del self._extra[key]
+        else:
+            raise KeyError(key)
+
+    def __iter__(self) -> Iterator[str]:
+        for key in SESSION_FIELDS:
+            if hasattr(self, key):
+                yield key
+        if self._extra:
+            yield from list(self._extra)
+
+    def __len__(self) -> int:
+        return sum(1 for key in SESSION_FIELDS if hasattr(self, key)) + len(self._extra or ())
+
+    def to_dict(self) -> dict:
+        data = {}
+        for key in SESSION_FIELDS:
+            value = getattr(self, key, _MISSING)
+            if value is not _MISSING:
+                data[key] = value.to_dict() if key == "mastery" else value
+        if self._extra:
+            data.update(self._extra)
+        return data
+
+    def __repr__(self) -> str:
+        return f"PlayerSession({self.to_dict()!r})"
+
+
+def session_to_dict(session: Mapping) -> dict:
+    """Plain, JSON-compatible dict of any session mapping."""
+    if isinstance(session, PlayerSession):
+        return session.to_dict()
+    return {
+        key: value.to_dict() if isinstance(value, MasteryTable) else value
+        for key, value in session.items()
+    }
+
+
+# ── encoding ──────────────────────────────────────────────────────────────────
+
+_zstd_local = threading.local()
+
+
+def _zstd_compressor():
+    compressor = getattr(_zstd_local, "compressor", None)
+    if compressor is None:
+        compressor = _zstd_local.compressor = zstandard.ZstdCompressor(level=SESSION_BLOB_ZSTD_LEVEL)
+    return compressor
+
+
+def _dumps_json(data: dict) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, separators=(",", ":")).encode("utf-8")
+
+
+def encode_session(session: Mapping, fmt: str = SESSION_BLOB_FORMAT) -> bytes:
+    """Serialize *session* into a tagged, optionally compressed blob."""
+    return _encode_dict(session_to_dict(session), fmt)
+
+
+def encode_session_row(
+    session: Mapping, fmt: str = SESSION_BLOB_FORMAT, write_json: bool = SESSION_WRITE_JSON,
+) -> bytes | tuple[bytes, str]:
+    """Serialize *session* for a ``game_sessions`` row.
+
+    Returns the blob, or ``(blob, json_text)`` while *write_json* keeps the
+    ``data`` column populated.
+    """
+    data = session_to_dict(session)
+    blob = _encode_dict(data, fmt)
+    if not write_json:
+        return blob
+    return blob, _dumps_json(data).decode("utf-8")
+
+
+def _encode_dict(data: dict, fmt: str) -> bytes:
+    if fmt == "msgpack" and msgpack is not None:
+        blob = _TAG_MSGPACK + msgpack.packb(data, use_bin_type=True)
+    else:
+        blob = _TAG_JSON + _dumps_json(data)
+    if zstandard is not None and len(blob) >= SESSION_BLOB_COMPRESS_MIN_BYTES:
+        blob = _TAG_ZSTD + _zstd_compressor().compress(blob)
+    return blob
+
+
+def decode_session(blob: bytes | memoryview | str) -> dict:
+    """Inverse of :func:`encode_session`; also accepts legacy JSON text."""
+    if isinstance(blob, str):
+        return json.loads(blob)
+    blob = bytes(blob)
+    tag, body = blob[:1], blob[1:]
+    if tag == _TAG_ZSTD:
+        if zstandard is None:
+            raise RuntimeError("session blob is zstd-compressed but zstandard is not installed")
+        return decode_session(zstandard.ZstdDecompressor().decompress(body))
+    if tag == _TAG_MSGPACK:
+        if msgpack is None:
+            raise RuntimeError("session blob is msgpack but msgpack is not installed")
+        return msgpack.unpackb(body, raw=False, strict_map_key=False)
+    if tag == _TAG_JSON:
+        return orjson.loads(body) if orjson is not None else json.loads(body)
+    return json.loads(blob)   # untagged JSON from older builds
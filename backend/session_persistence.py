@@ -0,0 +1,299 @@
+"""
+Write-behind persistence for in-memory game sessions.
+
+Endpoints used to upsert the whole session document after every small
+mutation (equip, hint, bonus coins, tycoon autosave…).  With the
+:class:`WriteBehindPersister` they only *mark the session dirty*; a
+background thread coalesces repeated marks per session and writes many
+sessions in one multi-row upsert, either every ``interval`` seconds or as
+soon as ``batch_size`` sessions are waiting.
+
+Money-sensitive paths call :meth:`WriteBehindPersister.flush` with the
+session id to persist synchronously (it raises :class:`SessionFlushError`
+if the row could not be written, or :class:`SessionConflict` if another
+worker saved the session first), and the app flushes everything on
+shutdown via :meth:`WriteBehindPersister.stop`.
+
+A batch that fails is retried row by row, so one row the database keeps
+rejecting is isolated instead of holding back every session in its batch.
+A session that cannot be serialized at all is logged and dropped from the
+queue rather than retried forever.
+
+Configuration (environment variables)
+-------------------------------------
+SESSION_FLUSH_INTERVAL_SECONDS  – max delay before a dirty session is
+                                  written (default 2)
+SESSION_FLUSH_BATCH_SIZE        – sessions per upsert; reaching it wakes the
+                                  flusher early (default 200)
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from typing import Callable, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+SESSION_FLUSH_INTERVAL_SECONDS = float(os.environ.get("SESSION_FLUSH_INTERVAL_SECONDS", "2"))
+SESSION_FLUSH_BATCH_SIZE = int(os.environ.get("SESSION_FLUSH_BATCH_SIZE", "200"))
+
+
+class SessionFlushError(Exception):
+    """A synchronous flush could not write the session; it stays queued."""
+
+
+class SessionConflict(SessionFlushError):
+    """The session lost a version race: our copy was stale and is not retried."""
+
+
+class WriteBehindPersister:
+    """Coalescing, batching write-behind queue keyed by session id.
+
+    *snapshot* ``(sid) -> payload | None`` serializes the current state of a
+    session (``None`` if it no longer exists); *write_batch* persists a list
+    of ``(sid, payload)`` rows and raises on failure, in which case the rows
+    stay dirty and are retried on the next flush.  It may return the ids
+    that lost a version race to another writer; those rows are stale, so
+    they are counted as conflicts and dropped rather than retried.
+
+    Only one flush writes at a time, so an older snapshot can never land in
+    the database after a newer one.
+    """
+
+    def __init__(
+        self,
+        snapshot: Callable[[str], Optional[str]],
+        write_batch: Callable[[list[tuple[str, str]]], Optional[Iterable[str]]],
+        *,
+        interval: float = SESSION_FLUSH_INTERVAL_SECONDS,
+        batch_size: int = SESSION_FLUSH_BATCH_SIZE,
+    ):
+        if batch_size < 1:
+            raise ValueError("batch_size must be >= 1")
+        self._snapshot = snapshot
+        self._write_batch = write_batch
+        self.interval = interval
+        self.batch_size = batch_size
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._dirty: dict[str, float] = {}   # sid -> monotonic time first marked dirty
+        self._wakeup = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._stopping = False
+
+        # Counters for the admin perf endpoint
+        self._marks = 0
+        self._flushes = 0
+        self._sync_flushes = 0
+        self._rows_written = 0
+        self._failures = 0
+        self._row_failures = 0
+        self._conflicts = 0
+        self._unserializable = 0
+        self._last_batch_size = 0
+        self._max_batch_size = 0
+        self._last_lag = 0.0
+        self._max_lag = 0.0
+        self._lag_total = 0.0
+
+    # ── producer side ─────────────────────────────────────────────────────────
+
+    def mark_dirty(self, sid: str) -> None:
+        """Queue *sid* for the next flush; repeated marks coalesce."""
+        with self._lock:
+            self._marks += 1
+            self._dirty.setdefault(sid, time.monotonic())
+            pending = len(self._dirty)
+            start = self._thread is None and not self._stopping
+        if start:
+            self.start()
+        if pending >= self.batch_size:
+            self._wakeup.set()
+
+    def is_dirty(self, sid: str) -> bool:
+        with self._lock:
+            return sid in self._dirty
+
+    # ── flushing ──────────────────────────────────────────────────────────────
+
+    def flush(self, sid: str | None = None) -> int:
+        """Write *sid* (or every dirty session) now; returns rows written.
+
+        Raises :class:`SessionFlushError` if *sid* was given and its row
+        could not be written (it stays dirty for the background flusher,
+        unless it cannot be serialized at all), or :class:`SessionConflict`
+        if it lost a version race.
+        """
+        written = 0
+        with self._flush_lock:
+            if sid is not None:
+                with self._lock:
+                    self._sync_flushes += 1
+                count, lost = self._flush_ids([sid])
+                if lost:
+                    raise SessionConflict(f"session {sid} was saved by another writer")
+                if count < 0:
+                    raise SessionFlushError(f"could not write session {sid}")
+                return count
+            # Sessions marked while this flush runs wait for the next one.
+            with self._lock:
+                pending = list(self._dirty)
+            for start in range(0, len(pending), self.batch_size):
+                count, _ = self._flush_ids(pending[start:start + self.batch_size])
+                if count < 0:
+                    break
+                written += count
+        return written
+
+    def _flush_ids(self, sids: Iterable[str]) -> tuple[int, set[str]]:
+        """Take *sids* off the dirty set and write them; caller holds _flush_lock.
+
+        Returns ``(rows written, ids that lost a version race)``; rows
+        written is -1 if rows were due and none could be written, including
+        when every snapshot was deferred or rejected.
+        """
+        with self._lock:
+            taken = {sid: self._dirty.pop(sid) for sid in sids if sid in self._dirty}
+        if not taken:
+            return 0, set()
+        rows, skipped = [], 0
+        for sid in sorted(taken):   # stable row-lock order across workers
+            try:
+                payload = self._snapshot(sid)
+            except RuntimeError as exc:
+                # Mutated mid-serialization by a request thread; try again later.
+                logger.debug("[SESSION] Snapshot of %s deferred: %s", sid, exc)
+                self._requeue({sid: taken[sid]})
+                skipped += 1
+                continue
+            except (TypeError, ValueError) as exc:
+                # The session holds data the encoder rejects; retrying won't help.
+                with self._lock:
+                    self._unserializable += 1
+                logger.warning("[SESSION] Session %s cannot be serialized; dropping its pending write: %s", sid, exc)
+                skipped += 1
+                continue
+            if payload is not None:
+                rows.append((sid, payload))
+        if not rows:
+            return (-1 if skipped else 0), set()
+        try:
+            lost = set(self._write_batch(rows) or ())
+        except Exception as exc:
+            with self._lock:
+                self._failures += 1
+            logger.warning("[SESSION] Batch write of %d sessions failed: %s", len(rows), exc)
+            if len(rows) > 1:
+                rows, lost = self._write_singly(rows, taken)
+            else:
+                self._failed(rows, taken)
+                rows, lost = [], set()
+            if not rows and not lost:
+                return -1, lost
+        if lost:
+            with self._lock:
+                self._conflicts += len(lost)
+            rows = [row for row in rows if row[0] not in lost]
+            if not rows:
+                return 0, lost
+        now = time.monotonic()
+        lags = [now - taken[sid] for sid, _ in rows]
+        with self._lock:
+            self._flushes += 1
+            self._rows_written += len(rows)
+            self._last_batch_size = len(rows)
+            self._max_batch_size = max(self._max_batch_size, len(rows))
+            self._last_lag = max(lags)
+            self._max_lag = max(self._max_lag, self._last_lag)
+            self._lag_total += sum(lags)
+        return len(rows), lost
+
+    def _write_singly(
+        self, rows: list[tuple[str, str]], taken: dict[str, float],
+    ) -> tuple[list[tuple[str, str]], set[str]]:
+        """Retry a failed batch one row at a time.
+
+        Returns the rows that went through and the ids that lost a version race.
+        """
+        written, lost = [], set()
+        for row in rows:
+            try:
+                lost.update(self._write_batch([row]) or ())
+            except Exception as exc:
+                logger.warning("[SESSION] Write of session %s failed: %s", row[0], exc)
+                self._failed([row], taken)
+            else:
+                written.append(row)
+        return written, lost
+
+    def _failed(self, rows: list[tuple[str, str]], taken: dict[str, float]) -> None:
+        """Keep *rows* dirty for the next flush."""
+        with self._lock:
+            self._row_failures += len(rows)
+        self._requeue({sid: taken[sid] for sid, _ in rows})
+
+    def _requeue(self, entries: dict[str, float]) -> None:
+        with self._lock:
+            for sid, since in entries.items():
+                # Keep the older timestamp so flush lag stays honest.
+                self._dirty[sid] = min(since, self._dirty.get(sid, since))
+
+    # ── background thread ─────────────────────────────────────────────────────
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="session-write-behind", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stopping:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            if self._stopping:
+                break
+            try:
+                self.flush()
+            except Exception as exc:  # never let the flusher die
+                logger.warning("[SESSION] Write-behind flush error: %s", exc)
+
+    def stop(self, timeout: float = 10.0) -> int:
+        """Stop the flusher thread and synchronously write everything pending."""
+        with self._lock:
+            self._stopping = True
+            thread, self._thread = self._thread, None
+        self._wakeup.set()
+        if thread is not None:
+            thread.join(timeout)
+        return self.flush()
+
+    # ── metrics ───────────────────────────────────────────────────────────────
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            oldest = min(self._dirty.values(), default=None)
+            return {
+                "pending": len(self._dirty),
+                "oldest_pending_age_s": round(now - oldest, 3) if oldest is not None else 0.0,
+                "marks": self._marks,
+                "flushes": self._flushes,
+                "sync_flushes": self._sync_flushes,
+                "rows_written": self._rows_written,
+                "failures": self._failures,
+                "row_failures": self._row_failures,
+                "conflicts": self._conflicts,
+                "unserializable": self._unserializable,
+                "last_batch_size": self._last_batch_size,
+                "max_batch_size": self._max_batch_size,
+                "avg_batch_size": round(self._rows_written / self._flushes, 2) if self._flushes else 0.0,
+                "last_flush_lag_s": round(self._last_lag, 3),
+                "max_flush_lag_s": round(self._max_lag, 3),
+                "avg_flush_lag_s": round(self._lag_total / self._rows_written, 3) if self._rows_written else 0.0,
+            }
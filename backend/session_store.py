@@ -0,0 +1,268 @@
+"""
+Pluggable storage behind the in-process session cache.
+
+``SESSION_BACKEND`` selects how a worker's session cache relates to
+``game_sessions``:
+
+* ``local`` (default) — one worker owns every session.  The database is just
+  the durable copy; rows are loaded on a cache miss and written back by the
+  write-behind persister.
+* ``postgres`` — several workers (``gunicorn -w N``) share ``game_sessions``.
+  Each keeps a local read-through cache; every write is guarded by the
+  row's ``version`` column (a new session is only inserted if no row
+  exists yet) and announced with ``NOTIFY`` so the other workers drop
+  their copy, and a listener thread on a dedicated connection applies the
+  announcements from everyone else.  A write that loses the version race
+  is reported back to the persister, which fails the save with
+  :class:`~backend.session_persistence.SessionConflict` (``main.py`` saves
+  write-through in this mode, so no change is dropped silently).  Each time
+  the listener reconnects, NOTIFYs sent while it was down are lost, so it
+  asks the cache to drop everything and forgets every version.
+
+The same channel carries other cross-worker invalidations (e.g. feature
+flags): payloads are ``"<origin>|<key>"`` for sessions and
+``"<origin>|<kind>:<key>"`` for anything else.
+
+Configuration (environment variables)
+-------------------------------------
+SESSION_BACKEND                 – ``local`` or ``postgres`` (default local)
+SESSION_NOTIFY_CHANNEL          – LISTEN/NOTIFY channel (default
+                                  ``game_sessions_changed``)
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import select
+import socket
+import threading
+import uuid
+from typing import Callable, Optional
+
+from backend import database
+
+logger = logging.getLogger(__name__)
+
+SESSION_BACKEND = os.environ.get("SESSION_BACKEND", "local").strip().lower()
+SESSION_NOTIFY_CHANNEL = os.environ.get("SESSION_NOTIFY_CHANNEL", "game_sessions_changed").strip()
+
+_LISTEN_POLL_SECONDS = 5.0
+_LISTEN_RETRY_MAX_SECONDS = 30.0
+
+
+class LocalSessionBackend:
+    """Single-worker storage: load on miss, unconditional batched upserts."""
+
+    name = "local"
+
+    def __init__(self, load=None, save=None):
+        self._load = load or database.load_session_record
+        self._save = save or database.save_sessions_batch
+        self._on_invalidate: Callable[[str], None] = lambda sid: None
+        self._on_conflict: Callable[[str], None] = lambda sid: None
+        self._on_reset: Callable[[], None] = lambda: None
+        self._handlers: dict[str, Callable[[str], None]] = {}
+        self._lock = threading.Lock()
+        self._loads = 0
+        self._writes = 0
+
+    def start(
+        self,
+        on_invalidate: Callable[[str], None],
+        on_conflict: Callable[[str], None],
+        on_reset: Optional[Callable[[], None]] = None,
+    ) -> None:
+        """Register the cache callbacks (and start listening, if applicable).
+
+        *on_reset* is called when invalidations may have been missed; it
+        should write what it can and drop every cached session.
+        """
+        self._on_invalidate = on_invalidate
+        self._on_conflict = on_conflict
+        if on_reset is not None:
+            self._on_reset = on_reset
+
+    def stop(self) -> None:
+        pass
+
+    def subscribe(self, kind: str, handler: Callable[[str], None]) -> None:
+        """Call ``handler(key)`` when another worker publishes ``kind:key``."""
+        self._handlers[kind] = handler
+
+    def publish(self, kind: str, key: str) -> None:
+        """Tell the other workers that ``kind:key`` changed (no-op when local)."""
+
+    def load(self, sid: str) -> Optional[dict]:
+        with self._lock:
+            self._loads += 1
+        record = self._load(sid)
+        return record[0] if record else None
+
+    def write_batch(self, rows: list[tuple[str, str]]) -> list[str]:
+        """Write *rows*; returns the ids that lost a version race (none here)."""
+        self._save(rows)
+        with self._lock:
+            self._writes += len(rows)
+        return []
+
+    def forget(self, sid: str) -> None:
+        """The cache dropped *sid*; release any per-session bookkeeping."""
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"backend": self.name, "loads": self._loads, "rows_written": self._writes}
+
+
+class PostgresSessionBackend(LocalSessionBackend):
+    """Multi-worker storage: versioned writes plus LISTEN/NOTIFY invalidation."""
+
+    name = "postgres"
+
+    def __init__(self, load=None, save=None, channel: str = SESSION_NOTIFY_CHANNEL, connect=None):
+        super().__init__(load, save)
+        self.channel = channel
+        self.origin = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._connect = connect or database.connect_direct
+        self._versions: dict[str, int] = {}   # sid -> version our cached copy was loaded/saved at
+        self._thread: threading.Thread | None = None
+        self._stopping = threading.Event()
+        self._invalidations = 0
+        self._conflicts = 0
+        self._listener_errors = 0
+        self._resyncs = 0
+
+    # ── storage ───────────────────────────────────────────────────────────────
+
+    def load(self, sid: str) -> Optional[dict]:
+        with self._lock:
+            self._loads += 1
+        record = self._load(sid)
+        if not record:
+            return None
+        data, version = record
+        with self._lock:
+            self._versions[sid] = version
+        return data
+
+    def write_batch(self, rows: list[tuple[str, str]]) -> list[str]:
+        with self._lock:
+            # Sessions we never loaded or saved are new: insert-only.
+            expected = {sid: self._versions[sid] for sid, _ in rows if sid in self._versions}
+        written = self._save(rows, expected, self.channel, self.origin)
+        lost = [sid for sid, _ in rows if sid not in written]
+        with self._lock:
+            self._versions.update(written)
+            self._writes += len(written)
+            self._conflicts += len(lost)
+            for sid in lost:
+                self._versions.pop(sid, None)
+        for sid in lost:
+            # Another worker saved this session after we loaded it: our copy
+            # is stale, so drop it and let the next request reload theirs.
+            logger.warning("[SESSION] Version conflict on %s; discarding stale local copy", sid)
+            self._on_conflict(sid)
+        return lost
+
+    def forget(self, sid: str) -> None:
+        with self._lock:
+            self._versions.pop(sid, None)
+
+    # ── invalidation ──────────────────────────────────────────────────────────
+
+    def publish(self, kind: str, key: str) -> None:
+        database.notify(self.channel, f"{self.origin}|{kind}:{key}")
+
+    def handle_notification(self, payload: str) -> None:
+        """Apply one NOTIFY payload from the channel."""
+        origin, _, key = payload.partition("|")
+        if not key or origin == self.origin:
+            return
+        kind, sep, rest = key.partition(":")
+        if sep and kind in self._handlers:
+            self._handlers[kind](rest)
+            return
+        self.forget(key)
+        with self._lock:
+            self._invalidations += 1
+        self._on_invalidate(key)
+
+    def start(self, on_invalidate, on_conflict, on_reset=None) -> None:
+        super().start(on_invalidate, on_conflict, on_reset)
+        if self._thread is not None:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._listen_forever, name="session-listener", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopping.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(_LISTEN_POLL_SECONDS + 1)
+
+    def _resync(self) -> None:
+        """Recover from a listener gap: NOTIFYs sent meanwhile are gone."""
+        self._on_reset()
+        with self._lock:
+            self._versions.clear()
+            self._resyncs += 1
+
+    def _listen_forever(self) -> None:
+        backoff = 1.0
+        listened = False
+        while not self._stopping.is_set():
+            conn = None
+            try:
+                conn = self._connect()
+                conn.autocommit = True
+                cur = conn.cursor()
+                cur.execute(f'LISTEN "{self.channel}"')
+                cur.close()
+                logger.info("[SESSION] Listening for session changes on %s as %s", self.channel, self.origin)
+                if listened:
+                    self._resync()
+                listened = True
+                backoff = 1.0
+                while not self._stopping.is_set():
+                    if select.select([conn], [], [], _LISTEN_POLL_SECONDS) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self.handle_notification(conn.notifies.pop(0).payload)
+            except Exception as exc:
+                with self._lock:
+                    self._listener_errors += 1
+                logger.warning("[SESSION] Session listener error (retrying in %.0fs): %s", backoff, exc)
+                self._stopping.wait(backoff)
+                backoff = min(backoff * 2, _LISTEN_RETRY_MAX_SECONDS)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        with self._lock:
+            stats.update({
+                "origin": self.origin,
+                "channel": self.channel,
+                "tracked_versions": len(self._versions),
+                "remote_invalidations": self._invalidations,
+                "version_conflicts": self._conflicts,
+                "listener_alive": self._thread is not None and self._thread.is_alive(),
+                "listener_errors": self._listener_errors,
+                "listener_resyncs": self._resyncs,
+            })
+        return stats
+
+
+def create_session_backend(kind: str = SESSION_BACKEND) -> LocalSessionBackend:
+    """Build the backend named by ``SESSION_BACKEND``."""
+    if kind == "postgres":
+        return PostgresSessionBackend()
+    if kind != "local":
+        logger.warning("[SESSION] Unknown SESSION_BACKEND=%r; using local", kind)
+    return LocalSessionBackend()
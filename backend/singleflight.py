@@ -0,0 +1,130 @@
+"""
+Request coalescing ("singleflight") for identical in-flight AI calls.
+
+When a classroom submits the same worksheet problem at the same moment,
+every request used to make its own upstream call for the same prompt.
+:class:`SingleFlight` lets the first caller for a key (the *leader*) make
+the call while every identical caller that arrives before it finishes (a
+*follower*) waits for, and shares, the leader's result — or its exception.
+Keys are the content-addressed keys of :mod:`backend.ai_cache`, so "same
+key" means "same prompt".
+
+Two flavours share the counters:
+
+* :meth:`SingleFlight.do` for coroutines on the event loop.  The call runs
+  as its own task, so a cancelled waiter never cancels it for the others;
+  it is cancelled only once every waiter has gone.
+* :meth:`SingleFlight.do_sync` for blocking callers on threads.
+
+Shared results are handed to every waiter as the same object; treat them as
+read-only.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Hashable
+
+
+class _SyncCall:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: BaseException | None = None
+
+
+class _AsyncCall:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self):
+        self.task: asyncio.Task | None = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Deduplicates concurrent calls that share a key."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sync: dict[Hashable, _SyncCall] = {}
+        self._async: dict[tuple[int, Hashable], _AsyncCall] = {}   # (id(loop), key)
+        self._by_kind: dict[str, dict] = {}
+
+    async def do(self, key: Hashable, make_coro: Callable[[], Awaitable[Any]], kind: str = "ai") -> Any:
+        """Await ``make_coro()`` — or the identical call already in flight."""
+        loop = asyncio.get_running_loop()
+        flight_key = (id(loop), key)
+        call = self._async.get(flight_key)
+        if call is None:
+            call = self._async[flight_key] = _AsyncCall()
+            call.task = loop.create_task(self._lead(flight_key, call, make_coro))
+            self._count(kind, "calls")
+        else:
+            self._count(kind, "coalesced")
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                # Every waiter was cancelled; nobody wants the result.
+                self._release(flight_key, call)
+                call.task.cancel()
+
+    async def _lead(self, flight_key: tuple[int, Hashable], call: _AsyncCall, make_coro: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            return await make_coro()
+        finally:
+            self._release(flight_key, call)
+
+    def _release(self, flight_key: tuple[int, Hashable], call: _AsyncCall) -> None:
+        # Later callers start a fresh call instead of joining a finished or
+        # abandoned one.
+        if self._async.get(flight_key) is call:
+            del self._async[flight_key]
+
+    def do_sync(self, key: Hashable, fn: Callable[[], Any], kind: str = "ai") -> Any:
+        """Run ``fn()`` — or wait for the identical call another thread is making."""
+        with self._lock:
+            call = self._sync.get(key)
+            leader = call is None
+            if leader:
+                call = self._sync[key] = _SyncCall()
+            self._count_locked(kind, "calls" if leader else "coalesced")
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                self._sync.pop(key, None)
+            call.done.set()
+
+    def _count(self, kind: str, counter: str) -> None:
+        with self._lock:
+            self._count_locked(kind, counter)
+
+    def _count_locked(self, kind: str, counter: str) -> None:
+        stats = self._by_kind.get(kind)
+        if stats is None:
+            stats = self._by_kind[kind] = {"calls": 0, "coalesced": 0}
+        stats[counter] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            by_kind = {kind: dict(s) for kind, s in self._by_kind.items()}
+            return {
+                "in_flight": len(self._sync) + len(self._async),
+                "coalesced": sum(s["coalesced"] for s in by_kind.values()),
+                "by_kind": by_kind,
+            }
@@ -0,0 +1,229 @@
+"""
+Server-Sent Events plumbing for ``POST /api/story/stream``.
+
+``/api/story`` answers only once every model call has finished.  The
+streaming variant sends each part of the quest as soon as it exists:
+
+    event: math        data: {"math_steps": [...]}
+    event: segment     data: {"index": 0, "text": "..."}     (one per paragraph)
+    event: analogy     data: {"teaching_analogy": {...}}
+    event: victory     data: {"victory_story": "..."}
+    event: mini_games  data: {"mini_games": [...]}
+    event: done        data: <the full /api/story response>
+    event: error       data: {"status": 429, "detail": "..."}
+
+Story paragraphs are cut out of the storyteller's token stream by
+:class:`SegmentSplitter` as each ``---SEGMENT---`` delimiter arrives, so the
+first one reaches the child after a single model's first tokens rather than
+the whole pipeline.  Events may be re-sent with new data (a re-solved answer
+replaces the first one, index by index); ``done`` is always last and
+authoritative.
+
+:class:`StoryEvents` queues one request's events and turns them into the
+response body; :class:`StoryProgress` takes the same events for a polled
+quest (``/api/story/jobs``) and keeps them as a partial response;
+:class:`SegmentBroadcast` fans the paragraphs of one shared
+(coalesced) storyteller call out to every quest waiting on it;
+:class:`StreamStats` aggregates time-to-first-segment for the admin perf
+endpoint.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import threading
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional
+
+SEGMENT_DELIMITER = "---SEGMENT---"
+MAX_SEGMENTS = 6
+
+
+def format_sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+class SegmentSplitter:
+    """Feed streamed story text; ``on_segment(index, text)`` fires per finished paragraph.
+
+    The last paragraph has no trailing delimiter, so it is only known once
+    the reply is complete — the caller sends it from the full text.
+    """
+
+    def __init__(self, on_segment: Callable[[int, str], None], limit: int = MAX_SEGMENTS):
+        self._on_segment = on_segment
+        self._limit = limit
+        self._buffer = ""
+        self.count = 0
+
+    def feed(self, text: str) -> None:
+        self._buffer += text
+        while True:
+            pos = self._buffer.find(SEGMENT_DELIMITER)
+            if pos < 0:
+                return
+            segment = self._buffer[:pos].strip()
+            self._buffer = self._buffer[pos + len(SEGMENT_DELIMITER):]
+            if segment and self.count < self._limit:
+                self._on_segment(self.count, segment)
+                self.count += 1
+
+
+class SegmentBroadcast:
+    """Per-key fan-out of streamed paragraphs to every subscribed quest.
+
+    Subscribers that join late are first replayed the paragraphs published
+    so far.  Event-loop only; not thread-safe.
+    """
+
+    def __init__(self):
+        self._streams: dict[Any, tuple[list, list]] = {}   # key -> (published, subscribers)
+
+    def subscribe(self, key: Any, on_item: Callable[[Any], None]) -> None:
+        published, subscribers = self._streams.setdefault(key, ([], []))
+        for item in published:
+            on_item(item)
+        subscribers.append(on_item)
+
+    def unsubscribe(self, key: Any, on_item: Callable[[Any], None]) -> None:
+        entry = self._streams.get(key)
+        if entry is None:
+            return
+        if on_item in entry[1]:
+            entry[1].remove(on_item)
+        if not entry[1]:
+            del self._streams[key]
+
+    def publish(self, key: Any, item: Any) -> None:
+        entry = self._streams.get(key)
+        if entry is None:
+            return
+        entry[0].append(item)
+        for on_item in list(entry[1]):
+            on_item(item)
+
+    def end(self, key: Any) -> None:
+        self._streams.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._streams)
+
+
+class StoryEvents:
+    """Ordered SSE events for one streaming quest."""
+
+    def __init__(self):
+        self._queue: asyncio.Queue[Optional[str]] = asyncio.Queue()
+        self._sent: dict[str, Any] = {}
+        self.started = time.monotonic()
+        self.first_segment_s: Optional[float] = None
+        self.failed = False
+
+    def emit(self, event: str, data: dict) -> None:
+        """Queue *event* unless the same data was already sent for it."""
+        slot = f"segment:{data['index']}" if event == "segment" else event
+        if self._sent.get(slot) == data:
+            return
+        self._sent[slot] = data
+        if event == "segment" and self.first_segment_s is None:
+            self.first_segment_s = time.monotonic() - self.started
+        self._queue.put_nowait(format_sse(event, data))
+
+    def finish(self, response: dict) -> None:
+        """Send whatever part of *response* was not streamed yet, then ``done``."""
+        self.emit("math", {"math_steps": response["math_steps"]})
+        for index, text in enumerate(response["segments"]):
+            self.emit("segment", {"index": index, "text": text})
+        self.emit("analogy", {"teaching_analogy": response["teaching_analogy"]})
+        self.emit("victory", {"victory_story": response["victory_story"]})
+        self.emit("mini_games", {"mini_games": response["mini_games"]})
+        self._queue.put_nowait(format_sse("done", response))
+        self._queue.put_nowait(None)
+
+    def fail(self, status: int, detail: str) -> None:
+        self.failed = True
+        self._queue.put_nowait(format_sse("error", {"status": status, "detail": detail}))
+        self._queue.put_nowait(None)
+
+    async def stream(self, produce: Awaitable[None]) -> AsyncIterator[str]:
+        """Run *produce* (which ends with :meth:`finish` or :meth:`fail`) and yield its events.
+
+        If the client goes away the generator is closed and *produce* is
+        cancelled with it.
+        """
+        task = asyncio.ensure_future(produce)
+        try:
+            while True:
+                item = await self._queue.get()
+                if item is None:
+                    return
+                yield item
+        finally:
+            if not task.done():
+                task.cancel()
+
+
+class StoryProgress:
+    """The parts of a polled quest so far, as a partial ``/api/story`` response.
+
+    Takes the same :meth:`emit` calls as :class:`StoryEvents`; *on_change*
+    gets the updated partial response whenever a part is new or changed.
+    """
+
+    def __init__(self, on_change: Callable[[dict], None]):
+        self._on_change = on_change
+        self._parts: dict[str, Any] = {}
+        self._segments: dict[int, str] = {}
+
+    def emit(self, event: str, data: dict) -> None:
+        if event == "segment":
+            if self._segments.get(data["index"]) == data["text"]:
+                return
+            self._segments[data["index"]] = data["text"]
+        else:
+            if all(self._parts.get(key) == value for key, value in data.items()):
+                return
+            self._parts.update(data)
+        self._on_change(self.partial())
+
+    def partial(self) -> dict:
+        # Only the unbroken run of paragraphs from the first one.
+        segments = []
+        while len(segments) in self._segments:
+            segments.append(self._segments[len(segments)])
+        return {**self._parts, "segments": segments}
+
+
+class StreamStats:
+    """Time-to-first-segment and total duration across streamed quests."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._streams = 0
+        self._failed = 0
+        self._first_total_s = 0.0
+        self._first_count = 0
+        self._first_max_s = 0.0
+        self._total_s = 0.0
+
+    def record(self, events: StoryEvents) -> None:
+        elapsed = time.monotonic() - events.started
+        with self._lock:
+            self._streams += 1
+            self._failed += events.failed
+            self._total_s += elapsed
+            if events.first_segment_s is not None:
+                self._first_count += 1
+                self._first_total_s += events.first_segment_s
+                self._first_max_s = max(self._first_max_s, events.first_segment_s)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "streams": self._streams,
+                "failed": self._failed,
+                "avg_first_segment_ms": round(self._first_total_s * 1000 / self._first_count, 1) if self._first_count else 0.0,
+                "max_first_segment_ms": round(self._first_max_s * 1000, 1),
+                "avg_total_ms": round(self._total_s * 1000 / self._streams, 1) if self._streams else 0.0,
+            }
@@ -0,0 +1,115 @@
+"""
+Tiny async task-graph scheduler for multi-call AI pipelines.
+
+``/api/story`` used to run its model calls as one straight line (solve →
+verify → story → decorations) even though most of them only need the math
+answer, and the teaching analogy needs nothing at all.  :class:`TaskGraph`
+lets the pipeline declare each call with the names of the results it needs;
+:meth:`TaskGraph.run` starts every node as soon as its inputs are ready, so
+the wall time is the longest dependency chain rather than the sum of all
+calls.
+
+Each node is an ``async def fn(**inputs)`` receiving its dependencies'
+results as keyword arguments.  Nodes are expected to handle their own
+fallbacks; if one raises anyway, every node still running is cancelled and
+the exception propagates from :meth:`run`.
+
+Start offsets and durations of every node are kept on the graph and can be
+aggregated across runs with :class:`GraphTimings` for the admin perf
+endpoint.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+from typing import Any, Awaitable, Callable, Iterable
+
+
+class TaskGraph:
+    """A set of named async nodes with dependencies, run with maximum overlap."""
+
+    def __init__(self):
+        self._nodes: dict[str, tuple[Callable[..., Awaitable[Any]], tuple[str, ...]]] = {}
+        self.timings: dict[str, tuple[float, float]] = {}   # name -> (start offset s, duration s)
+        self.elapsed = 0.0
+
+    def add(self, name: str, fn: Callable[..., Awaitable[Any]], deps: Iterable[str] = ()) -> "TaskGraph":
+        if name in self._nodes:
+            raise ValueError(f"duplicate task {name!r}")
+        deps = tuple(deps)
+        for dep in deps:
+            if dep not in self._nodes:
+                # Requiring dependencies to be declared first rules out cycles.
+                raise ValueError(f"task {name!r} depends on unknown task {dep!r}")
+        self._nodes[name] = (fn, deps)
+        return self
+
+    async def run(self) -> dict[str, Any]:
+        """Run every node; returns ``{name: result}``."""
+        started = time.monotonic()
+        tasks: dict[str, asyncio.Task] = {}
+
+        async def _node(name: str, fn, deps: tuple[str, ...]):
+            inputs = {}
+            for dep in deps:
+                inputs[dep] = await tasks[dep]
+            node_started = time.monotonic()
+            try:
+                return await fn(**inputs)
+            finally:
+                self.timings[name] = (node_started - started, time.monotonic() - node_started)
+
+        for name, (fn, deps) in self._nodes.items():
+            tasks[name] = asyncio.ensure_future(_node(name, fn, deps))
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            raise
+        finally:
+            self.elapsed = time.monotonic() - started
+        return {name: task.result() for name, task in tasks.items()}
+
+
+class GraphTimings:
+    """Per-node start/duration aggregates across many :class:`TaskGraph` runs."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._runs = 0
+        self._total_s = 0.0
+        self._max_s = 0.0
+        self._nodes: dict[str, list[float]] = {}   # name -> [runs, start_s, duration_s, max_s]
+
+    def record(self, graph: TaskGraph) -> None:
+        with self._lock:
+            self._runs += 1
+            self._total_s += graph.elapsed
+            self._max_s = max(self._max_s, graph.elapsed)
+            for name, (start, duration) in graph.timings.items():
+                node = self._nodes.setdefault(name, [0, 0.0, 0.0, 0.0])
+                node[0] += 1
+                node[1] += start
+                node[2] += duration
+                node[3] = max(node[3], duration)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "runs": self._runs,
+                "avg_ms": round(self._total_s * 1000 / self._runs, 1) if self._runs else 0.0,
+                "max_ms": round(self._max_s * 1000, 1),
+                "nodes": {
+                    name: {
+                        "runs": runs,
+                        "avg_start_ms": round(start * 1000 / runs, 1),
+                        "avg_ms": round(duration * 1000 / runs, 1),
+                        "max_ms": round(max_s * 1000, 1),
+                    }
+                    for name, (runs, start, duration, max_s) in self._nodes.items()
+                },
+            }
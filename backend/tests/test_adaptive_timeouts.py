@@ -0,0 +1,75 @@
+"""
+Adaptive AI timeouts (backend/adaptive_timeouts.py):
+  - the configured timeout is used until a model has enough samples
+  - then p<percentile> × multiplier, clamped to the min / max bounds and
+    never above the configured timeout
+  - timeouts and errors count only as fallbacks; hung calls do not raise
+    the next timeout
+  - the rolling histogram forgets samples older than its window
+"""
+
+import time
+
+import pytest
+
+from backend.adaptive_timeouts import AdaptiveTimeouts, LatencyHistogram
+
+
+def _policy(**kwargs):
+    return AdaptiveTimeouts(**{"enabled": True, "percentile": 90, "multiplier": 2.0, "min_seconds": 1.0,
+                               "max_seconds": 20.0, "min_samples": 10, "window": 600, **kwargs})
+
+
+def test_configured_timeout_until_enough_samples():
+    policy = _policy()
+    for _ in range(9):
+        policy.record("story", 2.0)
+    assert policy.timeout_for("story", 16) == 16
+    policy.record("story", 2.0)
+    assert policy.timeout_for("story", 16) == pytest.approx(4.0, rel=0.15)
+    assert policy.stats()["models"]["story"]["timeout_s"] == pytest.approx(4.0, rel=0.15)
+
+
+def test_timeout_is_clamped():
+    policy = _policy()
+    for _ in range(10):
+        policy.record("fast", 0.1)
+        policy.record("slow", 15.0)
+    assert policy.timeout_for("fast", 10) == 1.0
+    assert policy.timeout_for("slow", 30) == 20.0
+    assert policy.timeout_for("slow", 10) == 10   # the configured value is the ceiling
+
+
+def test_hung_calls_do_not_ratchet_the_timeout():
+    policy = _policy(percentile=99)
+    for _ in range(97):
+        policy.record("math", 2.0)
+    before = policy.timeout_for("math", 14)
+    for _ in range(20):
+        # 3% of calls hang until their timeout, again and again
+        for _ in range(3):
+            timeout = policy.timeout_for("math", 14)
+            policy.record("math", timeout, timed_out=True)
+    assert policy.timeout_for("math", 14) == before
+    for _ in range(5):
+        policy.record("math", 0.01, failed=True)
+    stats = policy.stats()["models"]["math"]
+    assert stats["samples"] == 97   # timeouts and errors stay out of the histogram
+    assert stats["timeouts"] == 60 and stats["errors"] == 5
+
+
+def test_disabled_policy_keeps_configured_timeouts():
+    policy = _policy(enabled=False)
+    for _ in range(20):
+        policy.record("story", 0.5)
+    assert policy.timeout_for("story", 16) == 16
+
+
+def test_histogram_percentiles_and_window():
+    histogram = LatencyHistogram(window=0.1)
+    for seconds in [0.1] * 90 + [5.0] * 10:
+        histogram.add(seconds)
+    assert histogram.percentile(50) == pytest.approx(0.1, rel=0.15)
+    assert histogram.percentile(99) == pytest.approx(5.0, rel=0.15)
+    time.sleep(0.11)
+    assert histogram.count() == 0
@@ -0,0 +1,97 @@
+"""
+AI artifact cache (backend/ai_cache.py):
+  - keys depend on every field and the prompt version
+  - memory tier, then the persistent tier (which refills memory)
+  - oversized and disabled stores are skipped
+  - the player's name is templated out and back in
+  - equivalent problem wordings share a key
+"""
+
+import asyncio
+import json
+
+import main
+from backend.ai_cache import PLAYER_TOKEN, AIArtifactCache, fill_player, template_player
+
+
+class FakeStore:
+    """Dict-backed stand-in for the ai_artifact_cache table."""
+
+    def __init__(self):
+        self.rows = {}
+        self.loads = 0
+
+    def load(self, key):
+        self.loads += 1
+        return self.rows.get(key)
+
+    def save(self, key, kind, value_json, ttl):
+        self.rows[key] = value_json
+
+
+def test_keys_cover_fields_and_version():
+    cache = AIArtifactCache(1)
+    key = cache.key("story", problem="3*14", hero="Arcanos")
+    assert key == cache.key("story", hero="Arcanos", problem="3*14")
+    assert key != cache.key("story", problem="3*14", hero="Blaze")
+    assert key != cache.key("victory", problem="3*14", hero="Arcanos")
+    assert key != AIArtifactCache(2).key("story", problem="3*14", hero="Arcanos")
+
+
+def test_memory_then_persistent_tier():
+    store = FakeStore()
+    writer = AIArtifactCache(1, load=store.load, save=store.save)
+    key = writer.key("analogy", problem="3*14")
+    assert writer.get("analogy", key) is None
+    writer.put("analogy", key, {"title": "Cow Rows"})
+    assert json.loads(store.rows[key]) == {"title": "Cow Rows"}
+
+    # A second worker only has the persistent tier.
+    reader = AIArtifactCache(1, load=store.load, save=store.save)
+    assert reader.get("analogy", key) == {"title": "Cow Rows"}
+    assert reader.get("analogy", key) == {"title": "Cow Rows"}
+    assert store.loads == 2   # the writer's miss and the reader's first lookup
+    stats = reader.stats()["by_kind"]["analogy"]
+    assert (stats["db_hits"], stats["memory_hits"], stats["hit_rate"]) == (1, 1, 1.0)
+
+
+def test_aget_from_event_loop():
+    store = FakeStore()
+    cache = AIArtifactCache(1, load=store.load, save=store.save)
+    key = cache.key("math", problem="3*14")
+
+    async def _run():
+        missed = await cache.aget("math", key)
+        cache.put("math", key, {"answer": "42"})
+        await asyncio.sleep(0.05)   # the persistent write runs off the loop
+        return missed, await cache.aget("math", key)
+
+    missed, hit = asyncio.run(_run())
+    assert missed is None and hit == {"answer": "42"}
+    assert key in store.rows
+
+
+def test_oversized_and_disabled_are_skipped():
+    cache = AIArtifactCache(1, max_value_bytes=16)
+    key = cache.key("story", problem="x")
+    cache.put("story", key, "a" * 100)
+    assert cache.get("story", key) is None
+    assert cache.stats()["by_kind"]["story"]["too_large"] == 1
+
+    off = AIArtifactCache(1, enabled=False)
+    off.put("story", key, "short")
+    assert off.get("story", key) is None
+
+
+def test_player_templating():
+    text = template_player("Zoe and Zoey cheer. Go, Zoe!", "Zoe")
+    assert text == f"{PLAYER_TOKEN} and Zoey cheer. Go, {PLAYER_TOKEN}!"
+    assert fill_player(text, "Sam") == "Sam and Zoey cheer. Go, Sam!"
+
+
+def test_equivalent_problems_share_a_key():
+    key = main._problem_cache_key
+    assert key("What is 12 × 7?") == key("12*7") == key("calculate 12 x 7") == "12*7"
+    assert key("What is 84 ÷ 7?") == key("84/7")
+    assert key("What is 12 × 7?") != key("What is 12 × 8?")
+    assert key("How  many Dragons?") == "how many dragons?"
@@ -0,0 +1,149 @@
+"""
+Bounded AI executor (backend/ai_executor.py):
+  - results and exceptions pass through like the old run_with_timeout
+  - timeouts, queue cancellation and abandoned-call accounting
+  - saturation rejects instead of queueing without bound
+  - time_left() exposes the call deadline to the SDK
+  - no thread is created per call
+  - run_async: values, cancellation on timeout, the in-flight cap
+"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+import main
+from backend.ai_executor import AIExecutor, time_left
+
+
+class TestAIExecutor:
+    def test_returns_value(self):
+        executor = AIExecutor(max_workers=2, max_queue=2)
+        assert executor.run(lambda: 42, timeout=1, kind="math") == (42, False)
+        stats = executor.stats()
+        assert stats["by_kind"]["math"]["completed"] == 1
+        assert stats["in_flight"] == 0 and stats["queued"] == 0
+
+    def test_exceptions_propagate(self):
+        executor = AIExecutor(max_workers=1, max_queue=1)
+
+        def _boom():
+            raise ValueError("upstream said no")
+
+        with pytest.raises(ValueError):
+            executor.run(_boom, timeout=1, kind="story")
+        assert executor.stats()["by_kind"]["story"]["failed"] == 1
+
+    def test_timeout_marks_call_abandoned_until_it_finishes(self):
+        executor = AIExecutor(max_workers=1, max_queue=1)
+        release = threading.Event()
+        assert executor.run(lambda: release.wait(2), timeout=0.05, kind="verify") == (None, True)
+        stats = executor.stats()
+        assert stats["abandoned_running"] == 1
+        assert stats["by_kind"]["verify"]["abandoned"] == 1
+        release.set()
+        deadline = time.monotonic() + 2
+        while executor.stats()["in_flight"] and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert executor.stats()["abandoned_running"] == 0
+
+    def test_queued_call_is_cancelled_on_timeout(self):
+        executor = AIExecutor(max_workers=1, max_queue=4)
+        release = threading.Event()
+        started = []
+        blocker = threading.Thread(target=executor.run, args=(lambda: release.wait(2), 2))
+        blocker.start()
+        time.sleep(0.05)
+        assert executor.run(lambda: started.append(1), timeout=0.05, kind="analogy") == (None, True)
+        release.set()
+        blocker.join(2)
+        assert started == []
+        assert executor.stats()["by_kind"]["analogy"]["cancelled_queued"] == 1
+        assert executor.stats()["queued"] == 0
+
+    def test_saturated_executor_rejects(self):
+        executor = AIExecutor(max_workers=1, max_queue=1)
+        release = threading.Event()
+        threads = [
+            threading.Thread(target=executor.run, args=(lambda: release.wait(2), 2))
+            for _ in range(2)   # one running, one queued
+        ]
+        for t in threads:
+            t.start()
+        time.sleep(0.05)
+        assert executor.run(lambda: "late", timeout=1, kind="tutor") == (None, True)
+        assert executor.stats()["by_kind"]["tutor"]["rejected"] == 1
+        release.set()
+        for t in threads:
+            t.join(2)
+
+    def test_time_left_tracks_deadline(self):
+        executor = AIExecutor(max_workers=1, max_queue=1)
+        value, timed_out = executor.run(lambda: time_left(30), timeout=5)
+        assert not timed_out
+        assert 4 < value <= 5
+        assert time_left(7) == 7   # outside a call
+
+
+class TestRunAsync:
+    def test_returns_value(self):
+        executor = AIExecutor(max_workers=1, max_queue=1)
+
+        async def _call():
+            return "story"
+
+        assert asyncio.run(executor.run_async(_call, timeout=1, kind="story")) == ("story", False)
+        assert executor.stats()["by_kind"]["story"]["completed"] == 1
+
+    def test_timeout_cancels_the_call(self):
+        executor = AIExecutor(max_workers=1, max_queue=1)
+        cancelled = []
+
+        async def _slow():
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        started = time.monotonic()
+        assert asyncio.run(executor.run_async(_slow, timeout=0.05, kind="math")) == (None, True)
+        assert time.monotonic() - started < 1
+        assert cancelled == [True]
+        stats = executor.stats()
+        assert stats["by_kind"]["math"]["timeouts"] == 1
+        assert stats["by_kind"]["math"]["failed"] == 0
+        assert stats["async_in_flight"] == 0
+
+    def test_exceptions_propagate(self):
+        executor = AIExecutor(max_workers=1, max_queue=1)
+
+        async def _boom():
+            raise ValueError("upstream said no")
+
+        with pytest.raises(ValueError):
+            asyncio.run(executor.run_async(_boom, timeout=1, kind="verify"))
+        assert executor.stats()["by_kind"]["verify"]["failed"] == 1
+
+    def test_in_flight_cap(self):
+        executor = AIExecutor(max_workers=1, max_queue=1, max_async_in_flight=2)
+
+        async def _call():
+            await asyncio.sleep(0.02)
+            return 1
+
+        async def _many():
+            return await asyncio.gather(*(executor.run_async(_call, timeout=1) for _ in range(6)))
+
+        assert asyncio.run(_many()) == [(1, False)] * 6
+        assert executor.stats()["max_async_in_flight"] == 2
+
+
+def test_run_with_timeout_reuses_pool_threads():
+    main.run_with_timeout(lambda: None, 1)
+    before = threading.active_count()
+    for _ in range(20):
+        assert main.run_with_timeout(lambda: "ok", 1, kind="story") == ("ok", False)
+    assert threading.active_count() <= before + 1
@@ -0,0 +1,172 @@
+"""
+Background job registry (backend/background_jobs.py):
+  - pending → done / failed
+  - TTL expiry and size-bounded eviction (pending jobs are cancelled)
+  - JobQueue: queued → running → done with partial results and long-polling
+  - JobQueue: bounded workers, per-owner limit, full queue, failures, drops
+"""
+
+import asyncio
+
+import pytest
+
+from backend.background_jobs import BackgroundJobs, JobFailed, JobQueue, JobRejected
+
+
+def test_job_lifecycle():
+    jobs = BackgroundJobs()
+
+    async def _run():
+        release = asyncio.Event()
+
+        async def _work():
+            await release.wait()
+            return {"answer": 42}
+
+        job_id = jobs.start(_work, kind="test")
+        pending = jobs.get(job_id)
+        release.set()
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        return pending, jobs.get(job_id)
+
+    pending, done = asyncio.run(_run())
+    assert pending == {"status": "pending", "result": None}
+    assert done == {"status": "done", "result": {"answer": 42}}
+    assert jobs.stats()["completed"] == 1
+
+
+def test_failed_job():
+    jobs = BackgroundJobs()
+
+    async def _run():
+        async def _boom():
+            raise ValueError("nope")
+
+        job_id = jobs.start(_boom)
+        await asyncio.sleep(0.01)
+        return jobs.get(job_id)
+
+    assert asyncio.run(_run())["status"] == "failed"
+    assert jobs.stats()["failed"] == 1
+
+
+def test_expired_jobs_are_gone():
+    jobs = BackgroundJobs(ttl=0)
+
+    async def _run():
+        async def _work():
+            return 1
+
+        job_id = jobs.start(_work)
+        await asyncio.sleep(0.01)
+        return jobs.get(job_id)
+
+    assert asyncio.run(_run()) is None
+
+
+def test_oldest_jobs_are_evicted_and_cancelled():
+    jobs = BackgroundJobs(max_jobs=2)
+
+    async def _run():
+        async def _forever():
+            await asyncio.sleep(5)
+
+        ids = [jobs.start(_forever) for _ in range(3)]
+        await asyncio.sleep(0)
+        return [jobs.get(job_id) for job_id in ids]
+
+    first, second, third = asyncio.run(_run())
+    assert first is None
+    assert second["status"] == third["status"] == "pending"
+    assert jobs.stats()["evicted"] == 1
+
+
+def test_queue_reports_partials_to_long_polls():
+    queue = JobQueue()
+
+    async def _run():
+        step = asyncio.Event()
+
+        async def _work(report):
+            report({"math_steps": ["3 x 14 = 42"]})
+            await step.wait()
+            return {"answer": 42}
+
+        job_id = queue.submit(_work, owner="s1")
+        first = await queue.wait(job_id, since=0, timeout=1)
+        idle = await queue.wait(job_id, since=first["version"], timeout=0.05)
+        asyncio.get_running_loop().call_later(0.05, step.set)
+        done = await queue.wait(job_id, since=first["version"], timeout=1)
+        return first, idle, done
+
+    first, idle, done = asyncio.run(_run())
+    assert first["status"] == "running"
+    assert idle == first and idle["partial"] == {"math_steps": ["3 x 14 = 42"]}
+    assert done["status"] == "done" and done["result"] == {"answer": 42}
+    assert queue.stats()["completed"] == 1
+
+
+def test_queue_bounds_workers_and_owners():
+    queue = JobQueue(workers=2, max_queued=1, per_owner=1)
+    running = []
+    peak = []
+
+    async def _work(report):
+        running.append(1)
+        peak.append(len(running))
+        await asyncio.sleep(0.05)
+        running.pop()
+        return "ok"
+
+    async def _run():
+        ids = [queue.submit(_work, owner=owner) for owner in ("s1", "s2", "s3")]
+        await asyncio.sleep(0)
+        with pytest.raises(JobRejected) as full:
+            queue.submit(_work, owner="s4")
+        with pytest.raises(JobRejected) as busy:
+            queue.submit(_work, owner="s1")
+        queued = queue.get(ids[2])
+        return ids, full.value.reason, busy.value.reason, queued, [await queue.wait(i, timeout=1) for i in ids]
+
+    ids, full, busy, queued, views = asyncio.run(_run())
+    assert (full, busy) == ("queue_full", "owner_limit")
+    assert queued["status"] == "queued" and queued["queued_ahead"] == 0
+    assert max(peak) == 2
+    stats = queue.stats()
+    assert stats["rejected"] == {"queue_full": 1, "owner_limit": 1}
+    assert stats["max_queue_wait_ms"] > 0
+
+
+def test_queue_failures_and_drops():
+    queue = JobQueue(workers=1, max_jobs=3)
+    dropped = []
+
+    async def _refuse(report):
+        raise JobFailed(403, "Daily limit reached")
+
+    async def _crash(report):
+        raise ValueError("nope")
+
+    async def _drop():
+        dropped.append(1)
+
+    async def _run():
+        refused = queue.submit(_refuse, owner="a")
+        crashed = queue.submit(_crash, owner="b")
+        views = [await queue.wait(job_id, timeout=1) for job_id in (refused, crashed)]
+        blocker = queue.submit(lambda report: asyncio.sleep(5), owner="c")
+        queue.submit(lambda report: asyncio.sleep(5), owner="d", on_drop=_drop)
+        await asyncio.sleep(0.01)
+        # Each of these evicts the oldest job: the crashed one, the running
+        # blocker, then the job still queued behind it.
+        for owner in "efg":
+            queue.submit(lambda report: asyncio.sleep(5), owner=owner)
+        await asyncio.sleep(0.01)
+        return views, queue.get(blocker)
+
+    (refused, crashed), blocker = asyncio.run(_run())
+    assert refused["error"] == {"status": 403, "detail": "Daily limit reached"}
+    assert crashed["error"] == {"status": 500, "detail": "Job failed"}
+    assert blocker is None and dropped == [1]
+    assert queue.stats()["dropped"] == 2
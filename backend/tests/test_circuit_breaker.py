@@ -0,0 +1,76 @@
+"""
+Per-model circuit breakers (backend/circuit_breaker.py):
+  - failures or slow calls past the threshold open the breaker
+  - an open breaker rejects calls until it turns half-open
+  - half-open probes close it again, or a failed probe re-opens it
+  - models are tracked independently
+"""
+
+import time
+
+from backend.circuit_breaker import CircuitBreakers
+
+
+def _breakers(**kwargs):
+    return CircuitBreakers(**{"enabled": True, "min_calls": 4, "failure_percent": 50, "slow_percent": 75,
+                              "slow_fraction": 0.5, "open_seconds": 0.05, "half_open_probes": 2, **kwargs})
+
+
+def test_failures_open_the_breaker():
+    breakers = _breakers()
+    for ok in (True, False, True):
+        assert breakers.allow("story")
+        breakers.record("story", ok, 0.1, 10)
+    assert breakers.stats()["models"]["story"]["state"] == "closed"   # below min_calls
+    breakers.record("story", False, 0.1, 10)
+    stats = breakers.stats()["models"]["story"]
+    assert stats["state"] == "open" and stats["times_opened"] == 1
+    assert not breakers.allow("story")
+    assert breakers.allow("math")   # other models are unaffected
+    assert breakers.stats()["models"]["story"]["rejected"] == 1
+
+
+def test_slow_calls_open_the_breaker():
+    breakers = _breakers()
+    for _ in range(4):
+        breakers.record("math", True, 6.0, 10)   # over half the timeout
+    assert breakers.stats()["models"]["math"]["state"] == "open"
+    assert breakers.stats()["models"]["math"]["last_reason"] == "4/4 calls slow"
+
+
+def test_half_open_probes_close_or_reopen():
+    breakers = _breakers()
+    for _ in range(4):
+        breakers.record("story", False, 0.1, 10)
+    time.sleep(0.06)
+    assert breakers.allow("story") and breakers.allow("story")
+    assert not breakers.allow("story")   # only two probes at a time
+    breakers.record("story", True, 0.1, 10)
+    breakers.record("story", True, 0.1, 10)
+    assert breakers.stats()["models"]["story"]["state"] == "closed"
+
+    for _ in range(4):
+        breakers.record("story", False, 0.1, 10)
+    time.sleep(0.06)
+    assert breakers.allow("story")
+    breakers.record("story", False, 0.1, 10)
+    assert breakers.stats()["models"]["story"]["state"] == "open"
+    assert breakers.stats()["models"]["story"]["times_opened"] == 3   # opened, closed, opened, probe re-opened
+
+
+def test_cancelled_probe_frees_its_slot():
+    breakers = _breakers(half_open_probes=1)
+    for _ in range(4):
+        breakers.record("story", False, 0.1, 10)
+    time.sleep(0.06)
+    assert breakers.allow("story")
+    breakers.cancel("story")
+    assert breakers.allow("story")
+
+
+def test_disabled_breakers_always_allow():
+    breakers = _breakers(enabled=False)
+    for _ in range(10):
+        breakers.record("story", False, 0.1, 10)
+    assert breakers.allow("story")
+    assert breakers.stats()["models"] == {}
@@ -0,0 +1,190 @@
+"""
+Unit tests for the PostgreSQL connection pool (backend/db_pool.py):
+  - ConnectionPool checkout / checkin / reuse
+  - acquire timeout, health checks, rollback-on-release
+  - AsyncConnectionPool
+"""
+
+import asyncio
+import threading
+
+import pytest
+
+from backend.db_pool import ConnectionPool, AsyncConnectionPool, PoolTimeout
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Helpers
+# ─────────────────────────────────────────────────────────────────────────────
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, sql, params=None):
+        if self.conn.broken:
+            raise RuntimeError("server closed the connection unexpectedly")
+        self.conn.status = 1  # in transaction
+
+    def fetchone(self):
+        return (1,)
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+        self.broken = False
+        self.status = 0  # TRANSACTION_STATUS_IDLE
+        self.rollbacks = 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def get_transaction_status(self):
+        return self.status
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.status = 0
+
+    def commit(self):
+        self.status = 0
+
+    def close(self):
+        self.closed = True
+
+
+def make_pool(**kwargs):
+    created = []
+
+    def connect():
+        conn = FakeConnection()
+        created.append(conn)
+        return conn
+
+    kwargs.setdefault("max_size", 2)
+    kwargs.setdefault("acquire_timeout", 0.2)
+    return ConnectionPool(connect, **kwargs), created
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# ConnectionPool
+# ─────────────────────────────────────────────────────────────────────────────
+
+
+class TestConnectionPool:
+    def test_connection_is_reused_after_close(self):
+        pool, created = make_pool()
+        conn = pool.acquire()
+        conn.close()
+        conn2 = pool.acquire()
+        assert conn2.raw is created[0]
+        assert len(created) == 1
+
+    def test_close_is_idempotent(self):
+        pool, _ = make_pool()
+        conn = pool.acquire()
+        conn.close()
+        conn.close()
+        assert pool.stats()["idle"] == 1
+
+    def test_acquire_times_out_when_exhausted(self):
+        pool, _ = make_pool(max_size=1)
+        held = pool.acquire()
+        with pytest.raises(PoolTimeout):
+            pool.acquire(timeout=0.05)
+        assert pool.stats()["acquire_timeouts"] == 1
+        held.close()
+
+    def test_waiter_is_woken_by_release(self):
+        pool, _ = make_pool(max_size=1, acquire_timeout=2)
+        held = pool.acquire()
+        got = []
+
+        def _waiter():
+            conn = pool.acquire()
+            got.append(conn.raw)
+            conn.close()
+
+        t = threading.Thread(target=_waiter)
+        t.start()
+        held.close()
+        t.join(2)
+        assert got == [held.raw]
+
+    def test_open_transaction_is_rolled_back_on_release(self):
+        pool, created = make_pool()
+        conn = pool.acquire()
+        conn.cursor().execute("UPDATE x SET y = 1")
+        conn.close()
+        assert created[0].rollbacks == 1
+        assert created[0].status == 0
+
+    def test_closed_connection_is_discarded(self):
+        pool, created = make_pool()
+        conn = pool.acquire()
+        created[0].closed = True
+        conn.close()
+        assert pool.stats()["open"] == 0
+        pool.acquire().close()
+        assert len(created) == 2
+
+    def test_stale_idle_connection_fails_health_check(self):
+        pool, created = make_pool(healthcheck_after=0)
+        pool.acquire().close()
+        created[0].broken = True
+        conn = pool.acquire()
+        assert conn.raw is created[1]
+        assert pool.stats()["healthcheck_failures"] == 1
+
+    def test_prune_idle_keeps_min_size(self):
+        pool, _ = make_pool(min_size=1, max_size=3, max_idle=0)
+        a, b, c = pool.acquire(), pool.acquire(), pool.acquire()
+        for conn in (a, b, c):
+            conn.close()
+        pool.prune_idle()
+        assert pool.stats()["open"] == 1
+
+    def test_connect_failure_frees_slot(self):
+        calls = {"n": 0}
+
+        def connect():
+            calls["n"] += 1
+            if calls["n"] == 1:
+                raise RuntimeError("connection refused")
+            return FakeConnection()
+
+        pool = ConnectionPool(connect, max_size=1, acquire_timeout=0.1)
+        with pytest.raises(RuntimeError):
+            pool.acquire()
+        pool.acquire().close()
+        assert pool.stats()["open"] == 1
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# AsyncConnectionPool
+# ─────────────────────────────────────────────────────────────────────────────
+
+
+class TestAsyncConnectionPool:
+    def test_run_returns_result_and_releases(self):
+        pool, created = make_pool()
+        apool = AsyncConnectionPool(pool)
+        result = asyncio.run(apool.run(lambda conn: conn.raw is created[0]))
+        assert result is True
+        assert pool.stats()["in_use"] == 0
+
+    def test_async_context_manager(self):
+        pool, _ = make_pool()
+        apool = AsyncConnectionPool(pool)
+
+        async def _use():
+            async with apool.connection() as conn:
+                return pool.stats()["in_use"]
+
+        assert asyncio.run(_use()) == 1
+        assert pool.stats()["in_use"] == 0
@@ -0,0 +1,48 @@
+"""
+Request deadline budgets (backend/deadlines.py):
+  - outside a scope every call keeps its own timeout
+  - inside one, timeouts shrink to what is left, then calls are skipped
+  - tasks spawned inside the scope share its deadline
+"""
+
+import asyncio
+import time
+
+from backend.deadlines import DeadlineBudget, remaining
+
+
+def test_no_scope_means_no_limit():
+    budget = DeadlineBudget(budget=1.0, min_call=0.5)
+    assert remaining() is None
+    assert budget.timeout("story", 16) == 16
+    assert budget.stats()["by_stage"] == {}
+
+
+def test_timeouts_shrink_then_calls_are_skipped():
+    budget = DeadlineBudget(budget=1.0, min_call=0.3)
+    with budget.scope():
+        assert budget.timeout("analogy", 0.5) == 0.5
+        shortened = budget.timeout("math", 14, overhead=0.2)
+        assert 0.7 < shortened <= 0.8
+        time.sleep(0.6)
+        assert budget.timeout("story", 16, overhead=0.2) is None
+    assert remaining() is None
+    stats = budget.stats()
+    assert stats["by_stage"]["math"]["shortened"] == 1
+    assert stats["by_stage"]["story"]["skipped"] == 1
+    assert stats["by_stage"]["analogy"]["shortened"] == 0
+    assert stats["requests"] == 1 and stats["overran"] == 0
+
+
+def test_spawned_tasks_share_the_deadline():
+    budget = DeadlineBudget(budget=5.0)
+
+    async def _child():
+        return remaining()
+
+    async def _run():
+        with budget.scope():
+            return await asyncio.ensure_future(_child())
+
+    left = asyncio.run(_run())
+    assert left is not None and 4.5 < left <= 5.0
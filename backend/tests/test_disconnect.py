@@ -0,0 +1,68 @@
+"""
+Client disconnects (backend/disconnect.py):
+  - work that finishes first is returned and counted as completed
+  - a disconnect cancels the work, runs its cleanup and raises ClientDisconnected
+  - /api/story hands the quota reservation back for an abandoned quest
+"""
+
+import asyncio
+import threading
+
+import pytest
+
+import main
+from backend.disconnect import ClientDisconnected, DisconnectWatcher
+
+
+class FakeRequest:
+    """ASGI receive that reports a disconnect after *after* seconds."""
+
+    def __init__(self, after: float = 60):
+        self.after = after
+
+    async def receive(self):
+        await asyncio.sleep(self.after)
+        return {"type": "http.disconnect"}
+
+
+def test_finished_work_is_returned():
+    watch = DisconnectWatcher()
+    result = asyncio.run(watch.run(FakeRequest(), asyncio.sleep(0.01, result="ok"), kind="tts"))
+    assert result == "ok"
+    assert watch.stats() == {"cancelled": 0, "by_kind": {"tts": {"completed": 1, "cancelled": 0}}}
+
+
+def test_disconnect_cancels_work_and_runs_cleanup():
+    watch = DisconnectWatcher()
+    cleaned = []
+    abandoned = threading.Event()
+
+    async def _work():
+        try:
+            await asyncio.sleep(5)
+        finally:
+            cleaned.append(1)
+
+    with pytest.raises(ClientDisconnected):
+        asyncio.run(watch.run(FakeRequest(after=0.02), _work(), kind="story", abandoned=abandoned))
+    assert cleaned == [1]
+    assert abandoned.is_set()
+    assert watch.stats()["by_kind"]["story"]["cancelled"] == 1
+
+
+def test_abandoned_quest_releases_its_quota(monkeypatch):
+    released = []
+
+    async def _slow_content(*args, **kwargs):
+        await asyncio.sleep(5)
+
+    monkeypatch.setattr(main, "_story_content", _slow_content)
+    monkeypatch.setattr(main, "_story_prelude", lambda req: {})
+    monkeypatch.setattr(main, "release_quota", released.append)
+    req = main.StoryRequest(hero="Arcanos", problem="3 x 14", session_id="sess_disconnect1")
+    entitlement = object()
+    watch = DisconnectWatcher()
+
+    with pytest.raises(ClientDisconnected):
+        asyncio.run(watch.run(FakeRequest(after=0.05), main._story_run(req, {}, entitlement), kind="story"))
+    assert released == [entitlement]
@@ -0,0 +1,98 @@
+"""
+Unit tests for the request-scoped entitlement helpers (in-memory fallback):
+  - load_entitlement
+  - reserve_quota / release_quota
+"""
+
+import threading
+import uuid
+
+import pytest
+
+from backend import database
+from backend.database import (
+    FREE_DAILY_LIMIT,
+    load_entitlement,
+    reserve_quota,
+    release_quota,
+    update_user_stripe,
+)
+
+
+@pytest.fixture(autouse=True)
+def no_database(monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", "")
+
+
+def new_sid() -> str:
+    return f"sess_{uuid.uuid4().hex[:12]}"
+
+
+class TestLoadEntitlement:
+    def test_new_session_is_free_with_full_quota(self):
+        ent = load_entitlement(new_sid())
+        assert not ent.is_premium
+        assert ent.usage == 0
+        assert ent.remaining == FREE_DAILY_LIMIT
+        assert ent.can_solve
+
+    def test_premium_session_is_unlimited(self):
+        sid = new_sid()
+        update_user_stripe(sid, status="active")
+        ent = load_entitlement(sid)
+        assert ent.is_premium
+        assert ent.remaining == -1
+        assert ent.usage_payload()["is_premium"] is True
+
+
+class TestReserveQuota:
+    def test_reserve_counts_usage(self):
+        sid = new_sid()
+        ent = reserve_quota(sid)
+        assert ent.reserved
+        assert ent.usage == 1
+        assert load_entitlement(sid).usage == 1
+
+    def test_reserve_denied_at_limit(self):
+        sid = new_sid()
+        for _ in range(FREE_DAILY_LIMIT):
+            assert reserve_quota(sid).reserved
+        ent = reserve_quota(sid)
+        assert not ent.reserved
+        assert ent.usage == FREE_DAILY_LIMIT
+        assert not ent.can_solve
+
+    def test_premium_never_denied(self):
+        sid = new_sid()
+        update_user_stripe(sid, status="trialing")
+        for _ in range(FREE_DAILY_LIMIT + 3):
+            assert reserve_quota(sid).reserved
+
+    def test_release_returns_quota(self):
+        sid = new_sid()
+        ent = reserve_quota(sid)
+        release_quota(ent)
+        assert not ent.reserved
+        assert load_entitlement(sid).usage == 0
+        # Releasing twice must not double-refund.
+        release_quota(ent)
+        assert load_entitlement(sid).usage == 0
+
+    def test_concurrent_reservations_never_exceed_limit(self):
+        sid = new_sid()
+        granted = []
+        lock = threading.Lock()
+
+        def _worker():
+            ent = reserve_quota(sid)
+            if ent.reserved:
+                with lock:
+                    granted.append(ent)
+
+        threads = [threading.Thread(target=_worker) for _ in range(FREE_DAILY_LIMIT * 4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert len(granted) == FREE_DAILY_LIMIT
+        assert database._memory_get_daily_usage(sid) == FREE_DAILY_LIMIT
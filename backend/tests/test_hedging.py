@@ -0,0 +1,90 @@
+"""
+Hedged AI calls (backend/hedging.py):
+  - no hedging until a model has enough latency samples, or when disabled
+  - the delay comes from the shared adaptive-timeout histograms
+  - a call slower than the observed percentile is duplicated; the faster wins
+  - a failed attempt falls through to the other one
+  - the budget caps how many calls are hedged
+"""
+
+import asyncio
+
+import pytest
+
+from backend.adaptive_timeouts import AdaptiveTimeouts
+from backend.hedging import Hedger, HedgeSuperseded
+
+
+def _hedger(**kwargs):
+    return Hedger(AdaptiveTimeouts(), **kwargs)
+
+
+def _warm(hedger, model="story", latency=0.0, n=5):
+    for _ in range(n):
+        hedger.latencies.record(model, latency)
+
+
+def test_disabled_or_cold_model_is_not_hedged():
+    hedger = _hedger(models=["story"], enabled=False, min_samples=1, min_delay=0)
+    assert asyncio.run(hedger.run("story", lambda: asyncio.sleep(0, result="a"))) == "a"
+    assert hedger.stats()["by_model"] == {}
+
+    hedger = _hedger(models=["story"], enabled=True, min_samples=5, min_delay=0)
+    _warm(hedger, n=4)
+    assert hedger.delay("story") is None
+    _warm(hedger, n=1)
+    assert hedger.delay("story") == 0.05   # the histogram's lowest bucket
+    assert asyncio.run(hedger.run("story", lambda: asyncio.sleep(0, result="b"))) == "b"
+    assert hedger.stats()["by_model"]["story"]["hedged"] == 0
+
+
+def test_slow_call_is_hedged_and_hedge_wins():
+    hedger = _hedger(models=["story"], enabled=True, min_samples=5, min_delay=0.02, budget_percent=100)
+    _warm(hedger)
+    attempts = []
+
+    async def _call():
+        attempts.append(1)
+        # The first attempt stalls; the duplicate answers quickly.
+        await asyncio.sleep(5 if len(attempts) == 1 else 0.01)
+        return len(attempts)
+
+    assert asyncio.run(asyncio.wait_for(hedger.run("story", _call), 1)) == 2
+    stats = hedger.stats()["by_model"]["story"]
+    assert stats["hedged"] == 1 and stats["hedge_wins"] == 1
+    assert stats["win_rate"] == 1.0
+
+
+def test_failed_attempt_falls_through_to_the_other():
+    hedger = _hedger(models=["math"], enabled=True, percentile=50, min_samples=5, min_delay=0.02, budget_percent=100)
+    _warm(hedger, model="math")
+    attempts = []
+
+    async def _call():
+        attempts.append(1)
+        if len(attempts) == 1:
+            await asyncio.sleep(0.1)
+            raise HedgeSuperseded()
+        await asyncio.sleep(0.1)
+        return "hedge"
+
+    assert asyncio.run(hedger.run("math", _call)) == "hedge"
+
+    async def _always_fails():
+        await asyncio.sleep(0.1)
+        raise ValueError("upstream down")
+
+    with pytest.raises(ValueError):
+        asyncio.run(hedger.run("math", _always_fails))
+    assert hedger.stats()["by_model"]["math"]["both_failed"] == 1
+
+
+def test_budget_caps_hedges():
+    hedger = _hedger(models=["story"], enabled=True, min_samples=5, min_delay=0.005, budget_percent=0)
+    _warm(hedger)
+    hedger._tokens = 1.0
+    for _ in range(3):
+        asyncio.run(hedger.run("story", lambda: asyncio.sleep(0.1, result="slow")))
+    stats = hedger.stats()["by_model"]["story"]
+    assert stats["hedged"] == 1
+    assert stats["calls"] == 3
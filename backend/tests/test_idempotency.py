@@ -0,0 +1,140 @@
+"""
+Idempotency keys (backend/idempotency.py):
+  - a retried key replays the first response without running again
+  - concurrent duplicates wait for, and share, the first attempt
+  - failures are not kept; a retry runs again
+  - a key reused for a different request is a conflict
+  - blocking callers on threads get the same guarantees
+  - a retried shop purchase or daily-chest claim is not applied twice
+"""
+
+import asyncio
+import threading
+import time
+import uuid
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from backend.idempotency import IdempotencyConflict, IdempotencyStore
+
+
+def test_retry_replays_first_response():
+    store = IdempotencyStore()
+    calls = []
+
+    async def _work():
+        calls.append(1)
+        return {"coins": 50, "inventory": ["cape"]}
+
+    async def _run():
+        first = await store.run(("story", "s1", "k"), "{}", _work, kind="story")
+        second = await store.run(("story", "s1", "k"), "{}", _work, kind="story")
+        other_key = await store.run(("story", "s1", "k2"), "{}", _work, kind="story")
+        return first, second, other_key
+
+    first, second, other_key = asyncio.run(_run())
+    assert calls == [1, 1]
+    assert first == ({"coins": 50, "inventory": ["cape"]}, False)
+    assert second == ({"coins": 50, "inventory": ["cape"]}, True)
+    assert other_key[1] is False
+    assert store.stats()["by_kind"]["story"] == {"executed": 2, "replayed": 1, "joined": 0, "conflicts": 0}
+
+
+def test_stored_response_is_a_snapshot():
+    store = IdempotencyStore()
+    inventory = ["cape"]
+    store.run_sync("k", "{}", lambda: {"inventory": inventory})
+    inventory.append("crown")   # the live session list keeps changing
+    assert store.run_sync("k", "{}", lambda: None) == ({"inventory": ["cape"]}, True)
+
+
+def test_concurrent_duplicates_share_one_run():
+    store = IdempotencyStore()
+    calls = []
+
+    async def _work():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "story"
+
+    async def _run():
+        return await asyncio.gather(*(store.run("k", "{}", _work) for _ in range(4)))
+
+    results = asyncio.run(_run())
+    assert calls == [1]
+    assert sorted(results) == [("story", False)] + [("story", True)] * 3
+    assert store.stats()["in_flight"] == 0
+
+
+def test_failures_are_not_kept():
+    store = IdempotencyStore()
+    attempts = []
+
+    def _flaky():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RuntimeError("rate limited")
+        return "ok"
+
+    with pytest.raises(RuntimeError):
+        store.run_sync("k", "{}", _flaky)
+    assert store.run_sync("k", "{}", _flaky) == ("ok", False)
+    assert len(attempts) == 2
+
+
+def test_key_reused_for_another_request_conflicts():
+    store = IdempotencyStore()
+    store.run_sync("k", '{"item_id": "cape"}', lambda: "cape")
+    with pytest.raises(IdempotencyConflict):
+        store.run_sync("k", '{"item_id": "crown"}', lambda: "crown")
+    assert store.stats()["by_kind"]["request"]["conflicts"] == 1
+
+
+def test_threads_run_a_key_once_and_entries_expire():
+    store = IdempotencyStore(ttl=0.2)
+    calls = []
+    results = []
+
+    def _buy():
+        calls.append(1)
+        time.sleep(0.05)
+        return "bought"
+
+    threads = [threading.Thread(target=lambda: results.append(store.run_sync("k", "{}", _buy))) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert calls == [1]
+    assert [r for r, _ in results] == ["bought"] * 8
+    assert sum(replayed for _, replayed in results) == 7
+
+    time.sleep(0.25)
+    assert store.run_sync("k", "{}", _buy) == ("bought", False)
+    assert len(calls) == 2
+
+
+def test_retried_purchase_and_chest_apply_once(monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", "")
+    sid = f"sess_{uuid.uuid4().hex[:12]}"
+    main.get_session(sid)["coins"] = 500
+    client = TestClient(main.app)
+    buy = {"item_id": "healing_potion", "session_id": sid}
+    try:
+        first = client.post("/api/shop/buy", json=buy, headers={"Idempotency-Key": "buy-1"})
+        retry = client.post("/api/shop/buy", json=buy, headers={"Idempotency-Key": "buy-1"})
+        again = client.post("/api/shop/buy", json=buy, headers={"Idempotency-Key": "buy-2"})
+        chest = [client.post("/api/daily-chest", json={"session_id": sid}, headers={"Idempotency-Key": "chest-1"})
+                 for _ in range(2)]
+        session = main.get_session(sid)
+    finally:
+        main.sessions.pop(sid, None)
+    assert retry.json() == first.json()
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert "Idempotent-Replayed" not in first.headers
+    assert again.json()["potions"] == ["healing_potion"] * 2
+    assert chest[1].json() == chest[0].json() and chest[0].json()["claimed"] is True
+    assert session["potions"].count("healing_potion") == 2
+    assert session["coins"] == 500 - 2 * 50 + chest[0].json()["bonus"]
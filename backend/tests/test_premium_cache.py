@@ -0,0 +1,104 @@
+"""
+Unit tests for the premium-status cache:
+  - TTLCache (backend/cache.py) LRU / TTL / counters
+  - database.is_premium served from cache, invalidated by update_user_stripe
+  - the Stripe webhook dropping the cached status
+"""
+
+import json
+import uuid
+
+import pytest
+
+from backend import cache as cache_mod
+from backend import database
+from backend.cache import TTLCache
+from backend.database import (
+    get_premium_cache_stats,
+    invalidate_premium_cache,
+    is_premium,
+    update_user_stripe,
+)
+
+
+@pytest.fixture(autouse=True)
+def no_database(monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", "")
+    invalidate_premium_cache()
+
+
+def new_sid() -> str:
+    return f"sess_{uuid.uuid4().hex[:12]}"
+
+
+class TestTTLCache:
+    def test_hit_and_miss_are_counted(self):
+        c = TTLCache(maxsize=4, ttl=60)
+        assert c.get("a") is None
+        c.set("a", 1)
+        assert c.get("a") == 1
+        stats = c.stats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 1
+        assert stats["hit_rate"] == 0.5
+
+    def test_least_recently_used_is_evicted(self):
+        c = TTLCache(maxsize=2, ttl=60)
+        c.set("a", 1)
+        c.set("b", 2)
+        c.get("a")
+        c.set("c", 3)
+        assert "a" in c and "c" in c
+        assert "b" not in c
+        assert c.stats()["evictions"] == 1
+
+    def test_entries_expire(self, monkeypatch):
+        now = [1000.0]
+        monkeypatch.setattr(cache_mod.time, "monotonic", lambda: now[0])
+        c = TTLCache(maxsize=2, ttl=10)
+        c.set("a", 1)
+        now[0] += 11
+        assert c.get("a") is None
+        assert c.stats()["expirations"] == 1
+
+    def test_invalidate(self):
+        c = TTLCache(maxsize=2, ttl=60)
+        c.set("a", 1)
+        assert c.invalidate("a") is True
+        assert c.invalidate("a") is False
+        assert c.stats()["invalidations"] == 1
+
+
+class TestPremiumCache:
+    def test_repeat_lookups_hit_the_cache(self, monkeypatch):
+        sid = new_sid()
+        calls = []
+        real = database.get_or_create_user
+        monkeypatch.setattr(database, "get_or_create_user", lambda s: calls.append(s) or real(s))
+        assert not is_premium(sid)
+        assert not is_premium(sid)
+        assert calls == [sid]
+        assert get_premium_cache_stats()["hits"] >= 1
+
+    def test_update_user_stripe_invalidates(self):
+        sid = new_sid()
+        assert not is_premium(sid)
+        update_user_stripe(sid, status="active")
+        assert is_premium(sid)
+        update_user_stripe(sid, status="free")
+        assert not is_premium(sid)
+
+    def test_webhook_drops_cached_status(self, monkeypatch):
+        from fastapi.testclient import TestClient
+        from main import app
+
+        monkeypatch.delenv("STRIPE_WEBHOOK_SECRET", raising=False)
+        sid = new_sid()
+        assert not is_premium(sid)
+        event = {
+            "type": "checkout.session.completed",
+            "data": {"object": {"metadata": {"session_id": sid}, "subscription": "sub_123", "customer": "cus_123"}},
+        }
+        resp = TestClient(app).post("/api/stripe/webhook", content=json.dumps(event))
+        assert resp.status_code == 200
+        assert is_premium(sid)
@@ -0,0 +1,166 @@
+"""
+Unit tests for the append-only quest history (in-memory fallback):
+  - append_quest_history / get_quest_history_page / iter_quest_history
+  - get_quest_guild_counts
+  - _record_quest window trimming and the legacy-session backfill (kept whole until it commits)
+  - a failed quest insert keeps the entry in the session until a later one commits
+  - GET /api/player/history/{session_id}
+"""
+
+import uuid
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from backend.database import (
+    append_quest_history,
+    get_quest_guild_counts,
+    get_quest_history_page,
+    iter_quest_history,
+)
+
+
+@pytest.fixture(autouse=True)
+def no_database(monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", "")
+
+
+def new_sid() -> str:
+    return f"sess_{uuid.uuid4().hex[:12]}"
+
+
+def quest(n: int, guild=None) -> dict:
+    return {"time": "2026-01-01 10:00", "concept": f"{n}+{n}", "hero": "Arcanos", "guild": guild}
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Database helpers
+# ─────────────────────────────────────────────────────────────────────────────
+
+
+class TestQuestHistoryStore:
+    def test_pages_are_newest_first_and_chain(self):
+        sid = new_sid()
+        append_quest_history(sid, [quest(n) for n in range(5)])
+        first = get_quest_history_page(sid, limit=2)
+        assert [e["concept"] for e in first["entries"]] == ["4+4", "3+3"]
+        second = get_quest_history_page(sid, before_id=first["next_before_id"], limit=2)
+        assert [e["concept"] for e in second["entries"]] == ["2+2", "1+1"]
+        last = get_quest_history_page(sid, before_id=second["next_before_id"], limit=2)
+        assert [e["concept"] for e in last["entries"]] == ["0+0"]
+        assert last["next_before_id"] is None
+
+    def test_iter_streams_oldest_first_across_pages(self):
+        sid = new_sid()
+        append_quest_history(sid, [quest(n) for n in range(7)])
+        concepts = [e["concept"] for e in iter_quest_history(sid, page_size=3)]
+        assert concepts == [f"{n}+{n}" for n in range(7)]
+
+    def test_sessions_are_isolated(self):
+        a, b = new_sid(), new_sid()
+        append_quest_history(a, [quest(1)])
+        assert get_quest_history_page(b)["entries"] == []
+
+    def test_guild_counts(self):
+        sid = new_sid()
+        append_quest_history(sid, [quest(1, "architects"), quest(2, "architects"), quest(3), quest(4, "strategists")])
+        assert get_quest_guild_counts(sid) == {"architects": 2, "strategists": 1}
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Session integration
+# ─────────────────────────────────────────────────────────────────────────────
+
+
+class TestSessionWindow:
+    def test_record_quest_keeps_bounded_window(self):
+        sid = new_sid()
+        session = {"history": []}
+        for n in range(main.QUEST_HISTORY_WINDOW + 5):
+            main._record_quest(sid, session, quest(n))
+        assert len(session["history"]) == main.QUEST_HISTORY_WINDOW
+        assert session["history"][-1]["concept"] == f"{main.QUEST_HISTORY_WINDOW + 4}+{main.QUEST_HISTORY_WINDOW + 4}"
+        assert len(list(iter_quest_history(sid))) == main.QUEST_HISTORY_WINDOW + 5
+
+    def test_legacy_history_is_backfilled_once(self, monkeypatch):
+        sid = new_sid()
+        legacy = {"history": [quest(n) for n in range(30)], "coins": 5}
+        monkeypatch.setattr(main._session_backend, "load", lambda _sid: legacy)
+        session = main.get_session(sid)
+        try:
+            assert len(session["history"]) == main.QUEST_HISTORY_WINDOW
+            assert session["_history_logged"] is True
+            main._backfill_quest_history(sid, session)  # no-op the second time
+            assert len(list(iter_quest_history(sid))) == 30
+        finally:
+            main.sessions.pop(sid, None)
+
+    def test_failed_backfill_keeps_legacy_history(self, monkeypatch):
+        sid = new_sid()
+        legacy = {"history": [quest(n) for n in range(30)], "coins": 5}
+        monkeypatch.setattr(main._session_backend, "load", lambda _sid: legacy)
+
+        def _down(_sid, _entries, strict=False):
+            raise ConnectionError("database unavailable")
+
+        monkeypatch.setattr(main, "append_quest_history", _down)
+        session = main.get_session(sid)
+        try:
+            assert len(session["history"]) == 30
+            assert not session.get("_history_logged")
+            main._record_quest(sid, session, quest(30))
+            assert len(session["history"]) == 31   # still the only copy
+
+            monkeypatch.setattr(main, "append_quest_history", append_quest_history)
+            main._record_quest(sid, session, quest(31))
+            assert session["_history_logged"] is True
+            assert len(session["history"]) == main.QUEST_HISTORY_WINDOW
+            assert len(list(iter_quest_history(sid))) == 32
+        finally:
+            main.sessions.pop(sid, None)
+
+    def test_failed_insert_keeps_entry_until_logged(self, monkeypatch):
+        sid = new_sid()
+        session = {"history": [], "_history_logged": True}
+        for n in range(main.QUEST_HISTORY_WINDOW):
+            main._record_quest(sid, session, quest(n))
+
+        def _down(_sid, _entries, strict=False):
+            raise ConnectionError("database unavailable")
+
+        monkeypatch.setattr(main, "append_quest_history", _down)
+        main._record_quest(sid, session, quest(100))
+        main._record_quest(sid, session, quest(101))
+        assert len(session["history"]) == main.QUEST_HISTORY_WINDOW + 2   # not trimmed
+        assert session["_history_unlogged"] == 2
+
+        monkeypatch.setattr(main, "append_quest_history", append_quest_history)
+        main._record_quest(sid, session, quest(102))
+        assert "_history_unlogged" not in session
+        assert len(session["history"]) == main.QUEST_HISTORY_WINDOW
+        concepts = [e["concept"] for e in iter_quest_history(sid)]
+        assert concepts[-3:] == ["100+100", "101+101", "102+102"]
+        assert len(concepts) == main.QUEST_HISTORY_WINDOW + 3
+
+    def test_history_endpoint_paginates(self):
+        sid = new_sid()
+        append_quest_history(sid, [quest(n) for n in range(3)])
+        client = TestClient(main.app)
+        resp = client.get(f"/api/player/history/{sid}", params={"limit": 2})
+        assert resp.status_code == 200
+        body = resp.json()
+        assert len(body["entries"]) == 2
+        resp = client.get(f"/api/player/history/{sid}", params={"before_id": body["next_before_id"]})
+        assert [e["concept"] for e in resp.json()["entries"]] == ["0+0"]
+        main.sessions.pop(sid, None)
+
+    def test_pdf_streams_full_history(self):
+        sid = new_sid()
+        session = main.get_session(sid)
+        for n in range(main.QUEST_HISTORY_WINDOW + 3):
+            main._record_quest(sid, session, quest(n))
+        resp = TestClient(main.app).get(f"/api/pdf/{sid}")
+        assert resp.status_code == 200
+        assert resp.content.startswith(b"%PDF")
+        main.sessions.pop(sid, None)
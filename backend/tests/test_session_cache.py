@@ -0,0 +1,138 @@
+"""
+Unit tests for the in-process session cache (backend/session_cache.py):
+  - LRU eviction by recency, byte budget, idle TTL
+  - flush-before-evict callback, revival during a flush, and sessions kept
+    resident when that flush fails
+  - stats
+"""
+
+import threading
+
+from backend import session_cache as session_cache_mod
+from backend.session_cache import SessionCache, estimate_size
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Helpers
+# ─────────────────────────────────────────────────────────────────────────────
+
+
+def make_cache(**kwargs):
+    evicted = []
+    kwargs.setdefault("max_entries", 3)
+    kwargs.setdefault("max_bytes", 10 ** 9)
+    kwargs.setdefault("idle_ttl", 3600)
+    cache = SessionCache(on_evict=lambda sid, session: evicted.append(sid), **kwargs)
+    return cache, evicted
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# SessionCache
+# ─────────────────────────────────────────────────────────────────────────────
+
+
+class TestSessionCache:
+    def test_least_recently_used_is_evicted(self):
+        cache, evicted = make_cache()
+        for sid in "abc":
+            cache[sid] = {"sid": sid}
+        cache.get("a")  # a becomes most recent; b is now the oldest
+        cache["d"] = {}
+        assert evicted == ["b"]
+        assert "a" in cache and "b" not in cache
+        assert cache.stats()["evicted_lru"] == 1
+
+    def test_byte_budget_evicts_oldest(self):
+        cache, evicted = make_cache(max_entries=100, max_bytes=250, sizeof=lambda s: 100)
+        for sid in "abc":
+            cache[sid] = {}
+        assert evicted == ["a"]
+        assert cache.stats()["resident_bytes"] == 200
+        assert cache.stats()["evicted_bytes"] == 1
+
+    def test_update_size_tracks_growth(self):
+        cache, evicted = make_cache(max_entries=100, max_bytes=10 ** 6)
+        session = {"history": []}
+        cache["a"] = session
+        before = cache.stats()["resident_bytes"]
+        session["history"].extend({"concept": f"{n}+{n}"} for n in range(50))
+        cache.update_size("a")
+        assert cache.stats()["resident_bytes"] > before
+
+    def test_idle_sessions_are_swept(self, monkeypatch):
+        now = [1000.0]
+        monkeypatch.setattr(session_cache_mod.time, "monotonic", lambda: now[0])
+        cache, evicted = make_cache(idle_ttl=60)
+        cache["a"] = {}
+        now[0] += 30
+        cache["b"] = {}
+        now[0] += 45
+        assert cache.sweep() == 1
+        assert evicted == ["a"]
+        assert cache.stats()["expired_idle"] == 1
+
+    def test_session_is_readable_while_eviction_flushes(self):
+        flushing = threading.Event()
+        release = threading.Event()
+
+        def on_evict(sid, session):
+            flushing.set()
+            release.wait(2)
+
+        cache = SessionCache(max_entries=1, max_bytes=10 ** 9, idle_ttl=3600, on_evict=on_evict)
+        first = {"coins": 5}
+        cache["a"] = first
+        t = threading.Thread(target=lambda: cache.__setitem__("b", {}))
+        t.start()
+        assert flushing.wait(2)
+        assert cache.peek("a") is first
+        assert cache.get("a") is first   # revived, not reloaded
+        release.set()
+        t.join(2)
+        assert cache.peek("a") is first
+        assert cache.stats()["revived_during_flush"] == 1
+
+    def test_failed_flush_keeps_session_resident(self):
+        attempts = []
+
+        def on_evict(sid, session):
+            attempts.append(sid)
+            if len(attempts) == 1:
+                raise ConnectionError("database unavailable")
+
+        cache = SessionCache(max_entries=1, max_bytes=10 ** 9, idle_ttl=3600, on_evict=on_evict)
+        dirty = {"coins": 5}
+        cache["a"] = dirty
+        cache["b"] = {}
+        assert cache.peek("a") is dirty   # not dropped with its writes unsaved
+        assert cache.stats()["kept_after_failed_flush"] == 1
+        cache["c"] = {}   # evicts "b", then retries "a"
+        assert attempts == ["a", "b", "a"]
+        assert "a" not in cache
+
+    def test_setdefault_keeps_first_inserted(self):
+        cache, _ = make_cache()
+        winner = cache.setdefault("a", {"n": 1})
+        loser = cache.setdefault("a", {"n": 2})
+        assert winner is loser
+        assert cache.peek("a") == {"n": 1}
+
+    def test_pop_skips_eviction_callback(self):
+        cache, evicted = make_cache()
+        cache["a"] = {}
+        assert cache.pop("a") == {}
+        assert cache.pop("a", None) is None
+        assert evicted == []
+
+    def test_hit_rate(self):
+        cache, _ = make_cache()
+        cache["a"] = {}
+        cache.get("a")
+        cache.get("missing")
+        assert cache.stats()["hit_rate"] == 0.5
+
+
+def test_estimate_size_grows_with_content():
+    small = {"history": []}
+    large = {"history": [{"concept": "x" * 100} for _ in range(10)]}
+    assert estimate_size(large) > estimate_size(small)
@@ -0,0 +1,161 @@
+"""
+Per-session concurrency control:
+  - StripedLocks (backend/session_locks.py) re-entrancy, timeout, stats
+  - stress: many threads hammering one session through the real endpoints
+    never lose an update or overspend coins
+"""
+
+import threading
+import time
+import uuid
+
+import pytest
+from fastapi import HTTPException
+
+import main
+from backend.session_locks import SessionLockTimeout, StripedLocks
+
+
+@pytest.fixture(autouse=True)
+def no_database(monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", "")
+
+
+class YieldingSession(dict):
+    """Session dict that gives up the GIL on every read.
+
+    Widens each read-modify-write window so that, without the session lock,
+    these tests lose updates reliably instead of once in a blue moon.
+    """
+
+    def __getitem__(self, key):
+        time.sleep(0)
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        time.sleep(0)
+        return super().get(key, default)
+
+
+def yielding_session(sid: str, **fields) -> YieldingSession:
+    session = YieldingSession(main.get_session(sid), **fields)
+    main.sessions[sid] = session
+    return session
+
+
+def new_sid() -> str:
+    return f"sess_{uuid.uuid4().hex[:12]}"
+
+
+def hammer(fn, workers: int):
+    barrier = threading.Barrier(workers)
+    results, errors = [], []
+    lock = threading.Lock()
+
+    def _run():
+        barrier.wait()
+        try:
+            out = fn()
+            with lock:
+                results.append(out)
+        except HTTPException as exc:
+            with lock:
+                errors.append(exc.status_code)
+
+    threads = [threading.Thread(target=_run) for _ in range(workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(10)
+    return results, errors
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# StripedLocks
+# ─────────────────────────────────────────────────────────────────────────────
+
+
+class TestStripedLocks:
+    def test_same_key_maps_to_same_lock(self):
+        locks = StripedLocks(stripes=8)
+        assert locks.lock_for("sess_a") is locks.lock_for("sess_a")
+
+    def test_hold_is_reentrant(self):
+        locks = StripedLocks(stripes=8)
+        with locks.hold("sess_a"):
+            with locks.hold("sess_a"):
+                pass
+        assert locks.stats()["acquired"] == 2
+
+    def test_hold_times_out_when_busy(self):
+        locks = StripedLocks(stripes=1, timeout=0.05)
+        held = threading.Event()
+        release = threading.Event()
+
+        def _holder():
+            with locks.hold("sess_a"):
+                held.set()
+                release.wait(2)
+
+        t = threading.Thread(target=_holder)
+        t.start()
+        held.wait(2)
+        with pytest.raises(SessionLockTimeout):
+            with locks.hold("sess_b"):  # shares the only stripe
+                pass
+        release.set()
+        t.join(2)
+        assert locks.stats()["timeouts"] == 1
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Stress: one session, many threads
+# ─────────────────────────────────────────────────────────────────────────────
+
+
+class TestSessionStress:
+    def test_concurrent_purchases_never_overspend(self):
+        sid = new_sid()
+        price = next(i["price"] for i in main.SHOP_ITEMS if i["id"] == "healing_potion")
+        affordable = 10
+        yielding_session(sid, coins=price * affordable)
+        req = main.ShopRequest(session_id=sid, item_id="healing_potion")
+
+        results, errors = hammer(lambda: main._buy_item(req), workers=40)
+
+        session = main.get_session(sid)
+        assert len(results) == affordable
+        assert errors == [400] * (40 - affordable)
+        assert session["coins"] == 0
+        assert session["potions"].count("healing_potion") == affordable
+        main.sessions.pop(sid, None)
+
+    def test_concurrent_hints_are_all_counted(self):
+        sid = new_sid()
+        yielding_session(sid)
+        req = main.HintRequest(session_id=sid)
+
+        results, errors = hammer(lambda: main.record_hint_use(req), workers=50)
+
+        session = main.get_session(sid)
+        assert errors == []
+        assert session["hint_count"] == 50
+        assert session["perseverance_score"] == 50
+        main.sessions.pop(sid, None)
+
+    def test_mixed_coin_traffic_balances(self):
+        sid = new_sid()
+        yielding_session(sid, coins=1000)
+        buy = main.ShopRequest(session_id=sid, item_id="healing_potion")
+        chest = main.DailyChestRequest(session_id=sid)
+
+        def _one(i=iter(range(10 ** 6))):
+            return main._claim_daily_chest(chest) if next(i) % 2 else main._buy_item(buy)
+
+        hammer(_one, workers=30)
+
+        session = main.get_session(sid)
+        bought = session["potions"].count("healing_potion")
+        chest_bonus = main.DAILY_CHEST_REWARDS[session["age_group"]]
+        assert session["coins"] == 1000 + chest_bonus - bought * 50
+        main.sessions.pop(sid, None)
@@ -0,0 +1,170 @@
+"""
+Compact session model and blob codec (backend/session_model.py):
+  - PlayerSession behaves like the dict it replaces
+  - mastery arrays round-trip through the dict view
+  - encode/decode for msgpack, JSON and legacy rows; rows keep their JSON
+    copy until the SESSION_WRITE_JSON cutover
+  - get_session() hands out PlayerSession objects, and refuses (503) to
+    replace a session it could not load
+"""
+
+import json
+import uuid
+
+import pytest
+
+import main
+from backend import session_model
+from backend.session_cache import estimate_size
+from backend.session_model import (
+    MATH_SKILLS,
+    MasteryTable,
+    PlayerSession,
+    decode_session,
+    encode_session,
+    encode_session_row,
+    session_to_dict,
+)
+from backend.database import SessionLoadError
+
+
+@pytest.fixture(autouse=True)
+def no_database(monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", "")
+
+
+def sample_session() -> dict:
+    return {
+        "coins": 42,
+        "inventory": ["wooden_sword"],
+        "history": [{"concept": "3 + 4", "realm": "Sky Citadel"}],
+        "player_name": "Ada",
+        "badges": ["first_quest"],
+        "guild": None,
+        "mastery": {"fractions": {"correct": 2, "total": 3, "mastery_score": 0.4}},
+        "_history_logged": True,
+        "custom_flag": "kept",
+    }
+
+
+class TestPlayerSession:
+    def test_dict_interface(self):
+        session = PlayerSession(sample_session())
+        assert session["coins"] == 42
+        assert session.get("potions") is None
+        assert "potions" not in session and "coins" in session
+        assert session.setdefault("potions", []) == []
+        session["coins"] += 8
+        assert session["coins"] == 50
+        assert session["custom_flag"] == "kept"
+        del session["guild"]
+        assert "guild" not in session
+        with pytest.raises(KeyError):
+            session["guild"]
+        assert not hasattr(session, "__dict__")
+
+    def test_to_dict_round_trip(self):
+        data = sample_session()
+        session = PlayerSession(data)
+        plain = session.to_dict()
+        assert plain["custom_flag"] == "kept"
+        assert plain["mastery"]["fractions"] == {"correct": 2, "total": 3, "mastery_score": 0.4}
+        assert set(plain["mastery"]) == set(MATH_SKILLS)
+        assert PlayerSession(plain) == session
+
+    def test_smaller_than_the_dict_it_replaces(self):
+        data = sample_session()
+        main._ensure_session_defaults(data)
+        session = PlayerSession(data)
+        assert estimate_size(session) < estimate_size(data)
+
+
+class TestMasteryTable:
+    def test_entries_write_through_to_arrays(self):
+        table = MasteryTable()
+        entry = table["algebra"]
+        entry["total"] = entry["total"] + 1
+        entry["mastery_score"] = 0.25
+        i = MATH_SKILLS.index("algebra")
+        assert table.total[i] == 1 and table.score[i] == 0.25
+
+    def test_unknown_skills_and_junk_are_dropped(self):
+        table = MasteryTable({"cooking": {"total": 5}, "algebra": "junk"})
+        assert dict(table["algebra"]) == {"correct": 0, "total": 0, "mastery_score": 0.0}
+        with pytest.raises(KeyError):
+            table["cooking"]
+
+    def test_quest_updates_mastery(self):
+        session = PlayerSession()
+        main._update_mastery_after_quest(session, "1/2 + 1/4", correct=True)
+        assert session["mastery"]["fractions"]["correct"] == 1
+        assert isinstance(session["mastery"], MasteryTable)
+
+
+class TestCodec:
+    def test_msgpack_round_trip(self):
+        session = PlayerSession(sample_session())
+        blob = encode_session(session, fmt="msgpack")
+        assert blob[:1] == b"m"
+        assert decode_session(blob) == session.to_dict()
+
+    def test_json_round_trip(self):
+        session = PlayerSession(sample_session())
+        blob = encode_session(session, fmt="json")
+        assert blob[:1] == b"j"
+        assert decode_session(blob) == session.to_dict()
+
+    def test_legacy_json_rows_still_decode(self):
+        data = sample_session()
+        assert decode_session(json.dumps(data)) == data
+        assert decode_session(json.dumps(data).encode()) == data
+
+    def test_rows_carry_json_until_cutover(self):
+        session = PlayerSession(sample_session())
+        blob, text = encode_session_row(session, write_json=True)
+        assert decode_session(blob) == json.loads(text) == session.to_dict()
+        assert encode_session_row(session, write_json=False) == blob
+
+    def test_large_blobs_are_compressed_when_zstd_is_available(self, monkeypatch):
+        if session_model.zstandard is None:
+            pytest.skip("zstandard not installed")
+        monkeypatch.setattr(session_model, "SESSION_BLOB_COMPRESS_MIN_BYTES", 64)
+        data = sample_session()
+        data["history"] = [{"concept": "3 + 4", "realm": "Sky Citadel"}] * 50
+        blob = encode_session(data)
+        assert blob[:1] == b"z"
+        assert decode_session(blob) == session_to_dict(data)
+
+
+class TestGetSession:
+    def test_new_and_loaded_sessions_are_player_sessions(self, monkeypatch):
+        sid = f"sess_{uuid.uuid4().hex[:12]}"
+        assert isinstance(main.get_session(sid), PlayerSession)
+        main.sessions.pop(sid, None)
+
+        monkeypatch.setattr(main._session_backend, "load", lambda _sid: sample_session())
+        session = main.get_session(sid)
+        assert isinstance(session, PlayerSession)
+        assert session["mastery"]["fractions"]["correct"] == 2
+        payload = main._public_session_payload(session)
+        assert payload["mastery"]["fractions"]["total"] == 3
+        assert "_history_logged" not in payload
+        main.sessions.pop(sid, None)
+
+    def test_snapshot_is_a_decodable_blob(self):
+        sid = f"sess_{uuid.uuid4().hex[:12]}"
+        main.get_session(sid)["coins"] = 9
+        blob, text = main._session_snapshot(sid)
+        assert decode_session(blob)["coins"] == json.loads(text)["coins"] == 9
+        main.sessions.pop(sid, None)
+
+    def test_unreadable_row_is_not_replaced_by_a_fresh_session(self, monkeypatch):
+        def _undecodable(_sid):
+            raise SessionLoadError("session blob is zstd-compressed but zstandard is not installed")
+
+        sid = f"sess_{uuid.uuid4().hex[:12]}"
+        monkeypatch.setattr(main._session_backend, "load", _undecodable)
+        with pytest.raises(main.HTTPException) as err:
+            main.get_session(sid)
+        assert err.value.status_code == 503
+        assert sid not in main.sessions
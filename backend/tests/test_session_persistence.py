@@ -0,0 +1,266 @@
+"""
+Unit tests for the write-behind session persister (backend/session_persistence.py):
+  - coalescing repeated marks, batching, synchronous flush
+  - retry after a failed batch write, deferred snapshots (a synchronous
+    flush of one raises), unserializable sessions are dropped
+  - a failed synchronous flush raises; a bad row is isolated from its batch
+  - rows that lose a version race are reported, not retried
+  - background flusher and flush-on-stop
+  - a durable save that cannot be written fails the request (503), and one
+    that lost a version race fails with 409
+  - with SESSION_BACKEND=postgres every save is written through
+"""
+
+import json
+import threading
+import time
+import uuid
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from backend.session_persistence import SessionConflict, SessionFlushError, WriteBehindPersister
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Helpers
+# ─────────────────────────────────────────────────────────────────────────────
+
+
+class FakeStore:
+    def __init__(self):
+        self.sessions = {}
+        self.batches = []
+        self.fail = False
+        self.poison = set()
+        self.stale = set()
+        self.lock = threading.Lock()
+
+    def snapshot(self, sid):
+        data = self.sessions.get(sid)
+        return json.dumps(data) if data is not None else None
+
+    def write_batch(self, rows):
+        if self.fail:
+            raise RuntimeError("database is down")
+        if self.poison & {sid for sid, _ in rows}:
+            raise ValueError("row rejected")
+        with self.lock:
+            self.batches.append([sid for sid, _ in rows])
+        return [sid for sid, _ in rows if sid in self.stale]
+
+    def written(self):
+        return [sid for batch in self.batches for sid in batch]
+
+
+def make_persister(**kwargs):
+    store = FakeStore()
+    kwargs.setdefault("interval", 60)
+    persister = WriteBehindPersister(store.snapshot, store.write_batch, **kwargs)
+    return persister, store
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# WriteBehindPersister
+# ─────────────────────────────────────────────────────────────────────────────
+
+
+class TestWriteBehindPersister:
+    def test_repeated_marks_coalesce_into_one_write(self):
+        persister, store = make_persister()
+        store.sessions["a"] = {"coins": 1}
+        for _ in range(5):
+            persister.mark_dirty("a")
+        assert persister.flush() == 1
+        assert store.batches == [["a"]]
+        persister.stop()
+
+    def test_many_sessions_share_one_batch(self):
+        persister, store = make_persister(batch_size=3)
+        for sid in "abcde":
+            store.sessions[sid] = {}
+            persister.mark_dirty(sid)
+        persister.stop()
+        assert [len(b) for b in store.batches] == [3, 2]
+        assert sorted(store.written()) == list("abcde")
+        assert persister.stats()["max_batch_size"] == 3
+
+    def test_sync_flush_writes_only_that_session(self):
+        persister, store = make_persister()
+        store.sessions.update(a={}, b={})
+        persister.mark_dirty("a")
+        persister.mark_dirty("b")
+        assert persister.flush("a") == 1
+        assert store.written() == ["a"]
+        assert persister.is_dirty("b")
+        assert persister.stats()["sync_flushes"] == 1
+        persister.stop()
+
+    def test_failed_write_is_retried(self):
+        persister, store = make_persister()
+        store.sessions["a"] = {}
+        persister.mark_dirty("a")
+        store.fail = True
+        assert persister.flush() == 0
+        assert persister.is_dirty("a")
+        assert persister.stats()["failures"] == 1
+        store.fail = False
+        assert persister.flush() == 1
+        assert not persister.is_dirty("a")
+        persister.stop()
+
+    def test_failed_sync_flush_raises_and_stays_dirty(self):
+        persister, store = make_persister()
+        store.sessions["a"] = {}
+        persister.mark_dirty("a")
+        store.fail = True
+        with pytest.raises(SessionFlushError):
+            persister.flush("a")
+        assert persister.is_dirty("a")
+        store.fail = False
+        assert persister.flush("a") == 1
+        persister.stop()
+
+    def test_bad_row_does_not_hold_back_its_batch(self):
+        persister, store = make_persister()
+        for sid in "abc":
+            store.sessions[sid] = {}
+            persister.mark_dirty(sid)
+        store.poison.add("b")
+        assert persister.flush() == 2
+        assert sorted(store.written()) == ["a", "c"]
+        assert persister.is_dirty("b") and not persister.is_dirty("a")
+        assert persister.stats()["row_failures"] == 1
+        persister.stop()
+
+    def test_lost_version_race_is_reported_not_retried(self):
+        persister, store = make_persister()
+        for sid in "abc":
+            store.sessions[sid] = {}
+            persister.mark_dirty(sid)
+        store.stale.add("b")
+        assert persister.flush() == 2
+        assert not persister.is_dirty("b")
+        persister.mark_dirty("b")
+        with pytest.raises(SessionConflict):
+            persister.flush("b")
+        assert not persister.is_dirty("b")
+        assert persister.stats()["conflicts"] == 2
+        persister.stop()
+
+    def test_snapshot_error_defers_session(self):
+        calls = {"n": 0}
+
+        def snapshot(sid):
+            calls["n"] += 1
+            if calls["n"] == 1:
+                raise RuntimeError("dictionary changed size during iteration")
+            return "{}"
+
+        written = []
+        persister = WriteBehindPersister(snapshot, written.extend, interval=60)
+        persister.mark_dirty("a")
+        assert persister.flush() == 0
+        assert persister.is_dirty("a")
+        assert persister.flush() == 1
+        assert written == [("a", "{}")]
+        persister.stop()
+
+    def test_sync_flush_of_deferred_snapshot_raises(self):
+        def snapshot(sid):
+            raise RuntimeError("dictionary changed size during iteration")
+
+        persister = WriteBehindPersister(snapshot, lambda rows: None, interval=60)
+        persister.mark_dirty("a")
+        with pytest.raises(SessionFlushError):
+            persister.flush("a")
+        assert persister.is_dirty("a")
+
+    def test_unserializable_session_is_dropped(self):
+        persister, store = make_persister()
+        store.sessions.update(a={}, b={"bad": object()})
+        persister.mark_dirty("a")
+        persister.mark_dirty("b")
+        assert persister.flush() == 1
+        assert store.written() == ["a"]
+        assert not persister.is_dirty("b")
+        persister.mark_dirty("b")
+        with pytest.raises(SessionFlushError):
+            persister.flush("b")
+        assert persister.stats()["unserializable"] == 2
+        persister.stop()
+
+    def test_evicted_session_is_dropped(self):
+        persister, store = make_persister()
+        persister.mark_dirty("gone")
+        assert persister.flush() == 0
+        assert not persister.is_dirty("gone")
+        persister.stop()
+
+    def test_background_thread_flushes_on_interval(self):
+        persister, store = make_persister(interval=0.02)
+        store.sessions["a"] = {}
+        persister.mark_dirty("a")
+        deadline = time.monotonic() + 2
+        while not store.batches and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert store.written() == ["a"]
+        assert persister.stats()["last_flush_lag_s"] >= 0
+        persister.stop()
+
+    def test_stop_flushes_pending_sessions(self):
+        persister, store = make_persister()
+        store.sessions["a"] = {}
+        persister.mark_dirty("a")
+        assert persister.stop() == 1
+        assert store.written() == ["a"]
+        assert persister.stats()["pending"] == 0
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Durable saves (main._save_session)
+# ─────────────────────────────────────────────────────────────────────────────
+
+
+def test_durable_purchase_fails_loudly_when_unsaved(monkeypatch):
+    def _down(rows):
+        raise RuntimeError("database is down")
+
+    sid = f"sess_{uuid.uuid4().hex[:12]}"
+    main.get_session(sid)["coins"] = 500
+    monkeypatch.setattr(main._session_persister, "_write_batch", _down)
+    try:
+        res = TestClient(main.app).post("/api/shop/buy", json={"item_id": "healing_potion", "session_id": sid})
+        assert res.status_code == 503
+        assert main._session_persister.is_dirty(sid)   # still queued for the flusher
+    finally:
+        main.sessions.pop(sid, None)
+        monkeypatch.undo()
+        main._session_persister.flush()
+
+
+def test_durable_purchase_that_lost_a_version_race_fails(monkeypatch):
+    sid = f"sess_{uuid.uuid4().hex[:12]}"
+    main.get_session(sid)["coins"] = 500
+    monkeypatch.setattr(main._session_persister, "_write_batch", lambda rows: [sid for sid, _ in rows])
+    try:
+        res = TestClient(main.app).post("/api/shop/buy", json={"item_id": "healing_potion", "session_id": sid})
+        assert res.status_code == 409
+        assert not main._session_persister.is_dirty(sid)
+    finally:
+        main.sessions.pop(sid, None)
+
+
+def test_postgres_mode_writes_every_save_through(monkeypatch):
+    sid = f"sess_{uuid.uuid4().hex[:12]}"
+    main.get_session(sid)
+    monkeypatch.setattr(main._session_backend, "name", "postgres")
+    monkeypatch.setattr(main._session_persister, "_write_batch", lambda rows: [sid for sid, _ in rows])
+    try:
+        with pytest.raises(main.HTTPException) as exc:
+            main._save_session(sid)   # not durable, but a lost race must not be dropped quietly
+        assert exc.value.status_code == 409
+        assert not main._session_persister.is_dirty(sid)
+    finally:
+        main.sessions.pop(sid, None)
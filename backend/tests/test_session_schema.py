@@ -0,0 +1,95 @@
+"""
+Schema-versioned sessions:
+  - new and legacy sessions are normalized once and stamped
+  - steady-state get_session() skips the normalization work
+  - the daily streak still rolls over on the first visit of a day, and
+    that rollover is saved
+"""
+
+import datetime
+import uuid
+
+import pytest
+
+import main
+
+
+@pytest.fixture(autouse=True)
+def no_database(monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", "")
+
+
+def new_sid() -> str:
+    return f"sess_{uuid.uuid4().hex[:12]}"
+
+
+def count_calls(monkeypatch, name):
+    calls = []
+    original = getattr(main, name)
+
+    def _counting(*args, **kwargs):
+        calls.append(args)
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(main, name, _counting)
+    return calls
+
+
+class TestSessionSchema:
+    def test_new_session_is_stamped_and_complete(self):
+        sid = new_sid()
+        session = main.get_session(sid)
+        assert session["_schema_version"] == main.SESSION_SCHEMA_VERSION
+        assert set(main.MATH_SKILLS) <= set(session["mastery"])
+        assert session["preferred_language"] == "en"
+        assert "_schema_version" not in main._public_session_payload(session)
+        main.sessions.pop(sid, None)
+
+    def test_steady_state_skips_normalization(self, monkeypatch):
+        sid = new_sid()
+        main.get_session(sid)
+        ensure = count_calls(monkeypatch, "_ensure_session_defaults")
+        badges = count_calls(monkeypatch, "_update_badges")
+        for _ in range(5):
+            main.get_session(sid)
+        assert ensure == [] and badges == []
+        main.sessions.pop(sid, None)
+
+    def test_legacy_document_is_migrated_once(self, monkeypatch):
+        sid = new_sid()
+        legacy = {"coins": 7, "player_name": "<b>Ada</b>", "history": [], "_history_logged": True}
+        monkeypatch.setattr(main._session_backend, "load", lambda _sid: dict(legacy))
+        dirty = []
+        monkeypatch.setattr(main._session_persister, "mark_dirty", dirty.append)
+
+        session = main.get_session(sid)
+        assert session["player_name"] == "bAdab"
+        assert session["coins"] == 7
+        assert session["_schema_version"] == main.SESSION_SCHEMA_VERSION
+        assert dirty == [sid]   # written back so the next load skips it
+
+        main.sessions.pop(sid, None)
+        stamped = dict(session)
+        monkeypatch.setattr(main._session_backend, "load", lambda _sid: dict(stamped))
+        ensure = count_calls(monkeypatch, "_ensure_session_defaults")
+        main.get_session(sid)
+        assert ensure == []
+        assert dirty == [sid]
+        main.sessions.pop(sid, None)
+
+    def test_streak_rolls_over_on_a_new_day(self, monkeypatch):
+        sid = new_sid()
+        session = main.get_session(sid)
+        yesterday = datetime.date.today() - datetime.timedelta(days=1)
+        session["last_active_date"] = yesterday.isoformat()
+        session["streak_count"] = 2
+        dirty = []
+        monkeypatch.setattr(main._session_persister, "mark_dirty", dirty.append)
+        session = main.get_session(sid)
+        assert session["streak_count"] == 3
+        assert session["last_active_date"] == datetime.date.today().isoformat()
+        assert "streak_3" in session["badges"]
+        assert dirty == [sid]
+        main.get_session(sid)
+        assert dirty == [sid]   # same day: nothing to save
+        main.sessions.pop(sid, None)
@@ -0,0 +1,352 @@
+"""
+Pluggable session backends (backend/session_store.py):
+  - local backend: load-on-miss, unconditional writes
+  - postgres backend against an in-memory stand-in for game_sessions +
+    LISTEN/NOTIFY: versioned writes, insert-only creation, cross-worker
+    invalidation, conflicts reported to the caller, feature-flag fan-out,
+    resync after the listener reconnects
+  - two workers sharing one store: write in one, read in the other
+  - optional: two real uvicorn workers against TEST_DATABASE_URL
+"""
+
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from pathlib import Path
+
+import pytest
+
+from backend.session_cache import SessionCache
+from backend.session_locks import StripedLocks
+from backend.session_persistence import SessionConflict, WriteBehindPersister
+from backend import session_store
+from backend.session_store import LocalSessionBackend, PostgresSessionBackend, create_session_backend
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Helpers
+# ─────────────────────────────────────────────────────────────────────────────
+
+
+class FakeSharedStore:
+    """``game_sessions`` + a NOTIFY channel shared by every attached backend."""
+
+    def __init__(self):
+        self.rows: dict[str, tuple[dict, int]] = {}
+        self.listeners: list[PostgresSessionBackend] = []
+        self._lock = threading.Lock()
+
+    def load(self, sid):
+        with self._lock:
+            row = self.rows.get(sid)
+        return (json.loads(json.dumps(row[0])), row[1]) if row else None
+
+    def save(self, rows, expected_versions=None, channel=None, origin=""):
+        written = {}
+        with self._lock:
+            for sid, data in rows:
+                current = self.rows.get(sid, (None, 0))[1]
+                if sid in self.rows and expected_versions is not None and expected_versions.get(sid) != current:
+                    continue
+                self.rows[sid] = (json.loads(data), current + 1 if sid in self.rows else 0)
+                written[sid] = self.rows[sid][1]
+        for sid in written:
+            self.deliver(f"{origin}|{sid}")
+        return written
+
+    def deliver(self, payload):
+        for backend in self.listeners:
+            backend.handle_notification(payload)
+
+    def attach(self) -> PostgresSessionBackend:
+        backend = PostgresSessionBackend(load=self.load, save=self.save, channel="test")
+        self.listeners.append(backend)
+        return backend
+
+
+class FakeCursor:
+    def execute(self, sql):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakeListenConnection:
+    """Just enough of a psycopg2 connection for ``_listen_forever``."""
+
+    def __init__(self, drop: bool):
+        self._ours, self._theirs = socket.socketpair()
+        self._drop = drop
+        self.autocommit = False
+        self.notifies = []
+        if drop:
+            self._theirs.send(b"x")   # readable at once, then poll() fails
+
+    def cursor(self):
+        return FakeCursor()
+
+    def fileno(self):
+        return self._ours.fileno()
+
+    def poll(self):
+        if self._drop:
+            raise ConnectionError("server closed the connection")
+
+    def close(self):
+        self._ours.close()
+        self._theirs.close()
+
+
+class Worker:
+    """The session plumbing of one ``main.py`` process, minus HTTP."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.cache = SessionCache(max_entries=100, max_bytes=10 ** 9, idle_ttl=3600)
+        self.locks = StripedLocks(stripes=8)
+        self.persister = WriteBehindPersister(
+            lambda sid: json.dumps(self.cache.peek(sid)), backend.write_batch, interval=3600,
+        )
+        backend.start(on_invalidate=self.invalidate, on_conflict=self.drop)
+        backend.stop()   # no LISTEN thread: FakeSharedStore delivers inline
+
+    def invalidate(self, sid):
+        if not self.persister.is_dirty(sid):
+            self.drop(sid)
+
+    def drop(self, sid):
+        self.cache.pop(sid, None)
+
+    def get(self, sid):
+        session = self.cache.get(sid)
+        if session is None:
+            session = self.backend.load(sid) or {"coins": 0}
+            session = self.cache.setdefault(sid, session)
+        return session
+
+    def save(self, sid):
+        self.persister.mark_dirty(sid)
+        self.persister.flush(sid)
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Backends
+# ─────────────────────────────────────────────────────────────────────────────
+
+
+class TestLocalBackend:
+    def test_load_unwraps_record_and_counts(self):
+        backend = LocalSessionBackend(load=lambda sid: ({"coins": 3}, 7), save=lambda rows: None)
+        assert backend.load("sess_a") == {"coins": 3}
+        assert backend.stats() == {"backend": "local", "loads": 1, "rows_written": 0}
+
+    def test_write_batch_is_unconditional(self):
+        saved = []
+        backend = LocalSessionBackend(load=lambda sid: None, save=saved.extend)
+        backend.write_batch([("sess_a", "{}"), ("sess_b", "{}")])
+        assert [sid for sid, _ in saved] == ["sess_a", "sess_b"]
+        assert backend.stats()["rows_written"] == 2
+
+    def test_factory(self):
+        assert create_session_backend("local").name == "local"
+        assert create_session_backend("postgres").name == "postgres"
+        assert create_session_backend("redis").name == "local"
+
+
+class TestPostgresBackend:
+    def test_own_notifications_are_ignored(self):
+        store = FakeSharedStore()
+        backend = store.attach()
+        invalidated = []
+        backend.start(on_invalidate=invalidated.append, on_conflict=lambda sid: None)
+        backend.stop()
+        backend.write_batch([("sess_a", "{}")])
+        assert invalidated == []
+        store.deliver("someone-else|sess_a")
+        assert invalidated == ["sess_a"]
+        assert backend.stats()["remote_invalidations"] == 1
+
+    def test_stale_write_is_rejected_and_reported(self):
+        store = FakeSharedStore()
+        a, b = store.attach(), store.attach()
+        conflicts = []
+        a.start(on_invalidate=lambda sid: None, on_conflict=conflicts.append)
+        a.stop()
+        store.save([("sess_a", '{"coins": 1}')])
+        a.load("sess_a")
+        b.load("sess_a")
+        b.write_batch([("sess_a", '{"coins": 2}')])   # b wins the race
+        assert a.write_batch([("sess_a", '{"coins": 3}')]) == ["sess_a"]   # a's version is stale
+        assert conflicts == ["sess_a"]
+        assert store.rows["sess_a"][0] == {"coins": 2}
+        assert a.stats()["version_conflicts"] == 1
+
+    def test_versions_advance_across_writes(self):
+        store = FakeSharedStore()
+        backend = store.attach()
+        backend.write_batch([("sess_a", "{}")])
+        backend.write_batch([("sess_a", "{}")])
+        backend.write_batch([("sess_a", "{}")])
+        assert store.rows["sess_a"][1] == 2
+        assert backend.stats()["version_conflicts"] == 0
+
+    def test_subscribed_kinds_bypass_session_invalidation(self):
+        store = FakeSharedStore()
+        backend = store.attach()
+        flags, invalidated = [], []
+        backend.start(on_invalidate=invalidated.append, on_conflict=lambda sid: None)
+        backend.stop()
+        backend.subscribe("flag", flags.append)
+        store.deliver("other|flag:new_shop")
+        assert flags == ["new_shop"]
+        assert invalidated == []
+
+    def test_reconnect_resets_cache_and_versions(self, monkeypatch):
+        monkeypatch.setattr(session_store, "_LISTEN_POLL_SECONDS", 0.05)
+        connections = [FakeListenConnection(drop=True), FakeListenConnection(drop=False)]
+        store = FakeSharedStore()
+        backend = PostgresSessionBackend(
+            load=store.load, save=store.save, channel="test", connect=lambda: connections.pop(0),
+        )
+        store.save([("sess_a", "{}")])
+        backend.load("sess_a")
+        reset = threading.Event()
+        backend.start(on_invalidate=lambda sid: None, on_conflict=lambda sid: None, on_reset=reset.set)
+        try:
+            assert reset.wait(5.0)
+        finally:
+            backend.stop()
+        stats = backend.stats()
+        assert stats["listener_errors"] == 1
+        assert stats["listener_resyncs"] == 1
+        assert stats["tracked_versions"] == 0
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Two workers, one store
+# ─────────────────────────────────────────────────────────────────────────────
+
+
+class TestMultiWorker:
+    def test_write_in_one_worker_read_in_another(self):
+        store = FakeSharedStore()
+        a, b = Worker(store.attach()), Worker(store.attach())
+
+        assert b.get("sess_a")["coins"] == 0    # b caches the empty session
+        with a.locks.hold("sess_a"):
+            a.get("sess_a")["coins"] = 50
+            a.save("sess_a")
+
+        assert b.get("sess_a")["coins"] == 50   # NOTIFY dropped b's copy
+
+        with b.locks.hold("sess_a"):
+            b.get("sess_a")["coins"] -= 20
+            b.save("sess_a")
+
+        assert a.get("sess_a")["coins"] == 30
+        assert store.rows["sess_a"] == ({"coins": 30}, 1)
+
+    def test_conflicting_worker_reloads_winner(self):
+        store = FakeSharedStore()
+        store.save([("sess_a", '{"coins": 10}')])
+        a, b = Worker(store.attach()), Worker(store.attach())
+        a.get("sess_a")
+        b.get("sess_a")
+        # Simulate a lost NOTIFY: b never hears about a's write.
+        store.listeners.remove(b.backend)
+        a.get("sess_a")["coins"] = 99
+        a.save("sess_a")
+        b.get("sess_a")["coins"] = 1
+        with pytest.raises(SessionConflict):
+            b.save("sess_a")
+        assert store.rows["sess_a"][0] == {"coins": 99}
+        assert b.get("sess_a")["coins"] == 99
+
+    def test_second_creator_loses_the_race(self):
+        store = FakeSharedStore()
+        a, b = Worker(store.attach()), Worker(store.attach())
+        a.get("sess_new")["coins"] = 5
+        b.get("sess_new")["coins"] = 7
+        store.listeners.remove(b.backend)   # both created it before either saved
+        a.save("sess_new")
+        with pytest.raises(SessionConflict):
+            b.save("sess_new")
+        assert store.rows["sess_new"] == ({"coins": 5}, 0)
+        assert b.get("sess_new")["coins"] == 5
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Real processes (needs a disposable PostgreSQL database)
+# ─────────────────────────────────────────────────────────────────────────────
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_until_up(httpx, url, proc, deadline=20.0):
+    stop = time.monotonic() + deadline
+    while time.monotonic() < stop:
+        if proc.poll() is not None:
+            raise RuntimeError(f"worker exited with {proc.returncode}")
+        try:
+            httpx.get(url, timeout=1.0)
+            return
+        except httpx.TransportError:
+            time.sleep(0.2)
+    raise RuntimeError(f"worker at {url} never came up")
+
+
+@pytest.mark.skipif(not os.environ.get("TEST_DATABASE_URL"), reason="TEST_DATABASE_URL not set")
+def test_two_uvicorn_workers_share_sessions():
+    httpx = pytest.importorskip("httpx")
+    root = Path(__file__).resolve().parents[2]
+    env = dict(
+        os.environ,
+        DATABASE_URL=os.environ["TEST_DATABASE_URL"],
+        SESSION_BACKEND="postgres",
+        SESSION_FLUSH_INTERVAL_SECONDS="0.2",
+    )
+    ports = [_free_port(), _free_port()]
+    procs = [
+        subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "backend.main:app", "--port", str(port)],
+            cwd=root, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        for port in ports
+    ]
+    try:
+        a, b = (f"http://127.0.0.1:{port}" for port in ports)
+        _wait_until_up(httpx, f"{a}/api/health", procs[0])
+        _wait_until_up(httpx, f"{b}/api/health", procs[1])
+        sid = f"sess_{uuid.uuid4().hex[:12]}"
+
+        def profile(base):
+            return httpx.get(f"{base}/api/session/{sid}", timeout=5.0).json()
+
+        def wait_for(base, key, value):
+            stop = time.monotonic() + 5.0
+            while time.monotonic() < stop:
+                if profile(base).get(key) == value:
+                    return True
+                time.sleep(0.1)
+            return False
+
+        profile(b)   # b caches the fresh session first
+        httpx.post(f"{a}/api/session/profile", json={"session_id": sid, "player_name": "Ada"}, timeout=5.0)
+        assert wait_for(b, "player_name", "Ada")
+        httpx.post(f"{b}/api/session/profile", json={"session_id": sid, "player_name": "Grace"}, timeout=5.0)
+        assert wait_for(a, "player_name", "Grace")
+    finally:
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            proc.wait(10)
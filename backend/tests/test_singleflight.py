@@ -0,0 +1,112 @@
+"""
+Singleflight coalescing (backend/singleflight.py):
+  - identical async calls in flight share one result (and one exception)
+  - a cancelled waiter does not cancel the call for the others
+  - blocking callers on threads coalesce the same way
+"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from backend.singleflight import SingleFlight
+
+
+def test_async_calls_share_one_result():
+    flights = SingleFlight()
+    calls = []
+
+    async def _work():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"answer": 42}
+
+    async def _run():
+        return await asyncio.gather(*(flights.do("k", _work, kind="math") for _ in range(5)))
+
+    results = asyncio.run(_run())
+    assert calls == [1]
+    assert results == [{"answer": 42}] * 5
+    assert flights.stats()["by_kind"]["math"] == {"calls": 1, "coalesced": 4}
+    assert flights.stats()["in_flight"] == 0
+
+
+def test_async_exception_reaches_every_waiter():
+    flights = SingleFlight()
+
+    async def _boom():
+        await asyncio.sleep(0.01)
+        raise ValueError("upstream down")
+
+    async def _run():
+        return await asyncio.gather(*(flights.do("k", _boom) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(_run())
+    assert all(isinstance(r, ValueError) for r in results)
+
+
+def test_cancelled_waiter_leaves_call_running():
+    flights = SingleFlight()
+    finished = []
+
+    async def _work():
+        await asyncio.sleep(0.05)
+        finished.append(1)
+        return "done"
+
+    async def _run():
+        first = asyncio.ensure_future(flights.do("k", _work))
+        second = asyncio.ensure_future(flights.do("k", _work))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return await second, first.cancelled()
+
+    assert asyncio.run(_run()) == ("done", True)
+    assert finished == [1]
+
+
+def test_call_is_cancelled_when_every_waiter_leaves():
+    flights = SingleFlight()
+    cancelled = []
+
+    async def _work():
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append(1)
+            raise
+
+    async def _run():
+        waiter = asyncio.ensure_future(flights.do("k", _work))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        await asyncio.sleep(0.01)
+
+    asyncio.run(_run())
+    assert cancelled == [1]
+    assert flights.stats()["in_flight"] == 0
+
+
+def test_sync_calls_share_one_result():
+    flights = SingleFlight()
+    calls = []
+    results = []
+
+    def _work():
+        calls.append(1)
+        time.sleep(0.1)
+        return "image"
+
+    threads = [threading.Thread(target=lambda: results.append(flights.do_sync("k", _work, kind="image")))
+               for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert calls == [1]
+    assert results == ["image"] * 4
+    assert flights.stats()["by_kind"]["image"]["coalesced"] == 3
@@ -0,0 +1,510 @@
+"""
+Async /api/story pipeline (AsyncOpenAI on the event loop):
+  - full AI path: analogy and math first, then everything that needs the answer
+  - an INCORRECT verdict triggers a re-solve only with AI_VERIFY_RESOLVE
+  - math timeout is cancelled and falls back to quick mode
+  - upstream errors degrade to the same fallbacks as before
+  - an open circuit breaker skips the model and falls back at once
+  - stages after a slow solve skip their calls once the deadline is nearly spent
+  - quick-math quests make no model call; enrichment arrives via a job
+  - a repeated problem is served from the AI artifact cache, player name swapped in
+  - a classroom submitting the same problem at once shares one call per model
+  - retries carrying an Idempotency-Key run the quest once and replay it
+  - /api/story/jobs answers with a job id; long-polls see its parts, then the result
+  - with several workers the job API is off and quick-math keeps static enrichment
+  - /api/story/stream sends each paragraph as the storyteller streams it
+  - a retried /api/story/stream with the same Idempotency-Key replays its events
+"""
+
+import asyncio
+import json
+import re
+import uuid
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from starlette.requests import Request
+
+import main
+from backend.adaptive_timeouts import AdaptiveTimeouts
+from backend.background_jobs import JobQueue
+from backend.circuit_breaker import CircuitBreakers
+from backend.deadlines import DeadlineBudget
+
+PROBLEM = "A farmer has 3 fields with 14 cows in each field. How many cows are there?"
+
+
+@pytest.fixture(autouse=True)
+def no_database(monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", "")
+
+
+@pytest.fixture(autouse=True)
+def fresh_ai_cache():
+    main._ai_cache.clear()
+    yield
+    main._ai_cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def fresh_breakers(monkeypatch):
+    monkeypatch.setattr(main, "_ai_breakers", CircuitBreakers())
+    monkeypatch.setattr(main, "_ai_timeouts", AdaptiveTimeouts())
+
+
+def new_sid() -> str:
+    return f"sess_{uuid.uuid4().hex[:12]}"
+
+
+def _reply(content: str):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+class FakeAsyncOpenAI:
+    """Answers each model's prompt with a canned reply after *delay* seconds."""
+
+    def __init__(self, delay: float = 0.05, slow_models=(), error: Exception = None, verdict="CORRECT", answer="42"):
+        self.delay = delay
+        self.verdict = verdict
+        self.answer = answer
+        self.slow_models = set(slow_models)
+        self.error = error
+        self.calls = []
+        self.active = 0
+        self.max_active = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    async def _create(self, model, messages, timeout=None, stream=False):
+        if stream:
+            reply = await self._create(model, messages, timeout)
+            return self._stream(reply.choices[0].message.content)
+        self.calls.append(model)
+        if self.error is not None:
+            raise self.error
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(30 if model in self.slow_models else self.delay)
+        finally:
+            self.active -= 1
+        system = messages[0]["content"] if messages[0]["role"] == "system" else ""
+        if model == main.AZURE_MATH_MODEL:
+            if "flagged as incorrect" in messages[-1]["content"]:
+                return _reply("STEP 1: Multiply 3 by 14 again.\nANSWER: 42")
+            return _reply(f"STEP 1: Multiply 3 by 14.\nANSWER: {self.answer}")
+        if model == main.AZURE_VERIFY_MODEL:
+            return _reply(f"{self.verdict}\n3 x 14 = 42")
+        if "game designer" in system:
+            return _reply(json.dumps([
+                {"type": t, "title": "Go", "prompt": "Solve", "question": "3 x 14", "correct_answer": "42",
+                 "choices": ["40", "42", "44"], "time_limit": 20, "reward_coins": 10,
+                 "hero_action": "zap", "fail_message": "Try again"}
+                for t in ("quicktime", "timed", "choice")
+            ]))
+        if "analogies" in system:
+            return _reply(json.dumps({
+                "title": "Cow Rows", "analogy": "Rows of cows.", "why_this_works": ["a", "b", "c"],
+                "where_it_breaks": "Cows move.", "example_steps": ["1", "2", "3"],
+                "check_question": "4 x 14?", "alternate_analogies": ["x", "y"],
+            }))
+        if "World Builder" in system:
+            return _reply("The gate opens. Three rows of fourteen make 42. Something stirs.")
+        name = re.search(r"The child player is named ([^.]+)\.", messages[-1]["content"]).group(1)
+        return _reply(f"One.---SEGMENT---Two.---SEGMENT---Three.---SEGMENT---Well done, {name}.")
+
+
+    async def _stream(self, text):
+        # One chunk per paragraph (delimiter included), one delay apart.
+        pieces = text.split("---SEGMENT---")
+        for i, piece in enumerate(pieces):
+            if i:
+                await asyncio.sleep(self.delay)
+            content = piece + ("---SEGMENT---" if i < len(pieces) - 1 else "")
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content))])
+
+
+@pytest.fixture
+def fake_ai(monkeypatch):
+    def _install(**kwargs):
+        client = FakeAsyncOpenAI(**kwargs)
+        monkeypatch.setattr(main, "get_async_openai_client", lambda: client)
+        return client
+    return _install
+
+
+def _quest(sid: str, problem: str = PROBLEM, **extra) -> dict:
+    res = TestClient(main.app).post("/api/story", json={
+        "hero": "Arcanos", "problem": problem, "session_id": sid, "force_full_ai": True, **extra,
+    })
+    assert res.status_code == 200, res.text
+    return res.json()
+
+
+def test_full_ai_path(fake_ai):
+    ai = fake_ai()
+    sid = new_sid()
+    try:
+        data = _quest(sid)
+    finally:
+        main.sessions.pop(sid, None)
+    assert data["solve_mode"] == "full_ai"
+    assert data["segments"] == ["One.", "Two.", "Three.", "Well done, Hero."]
+    assert data["math_steps"] == ["Multiply 3 by 14.", "Answer: 42"]
+    assert data["teaching_analogy"]["title"] == "Cow Rows"
+    assert data["victory_story"].startswith("The gate opens.")
+    assert [mg["question"] for mg in data["mini_games"]] == ["3 x 14"] * 3
+    assert data["coins"] == 50 and data["quests_completed"] == 1
+    # analogy and math from the start, then verify/story/victory/mini-games together
+    assert len(ai.calls) == 6
+    assert sorted(ai.calls[:2]) == sorted([main.AZURE_ANALOGY_MODEL, main.AZURE_MATH_MODEL])
+    assert ai.max_active == 4
+    assert set(main._story_timings.stats()["nodes"]) == {"analogy", "math", "verify", "story", "victory", "mini_games"}
+
+
+def test_incorrect_verdict_is_only_logged_by_default(fake_ai):
+    ai = fake_ai(verdict="INCORRECT", answer="41")
+    sid = new_sid()
+    try:
+        data = _quest(sid)
+    finally:
+        main.sessions.pop(sid, None)
+    assert data["math_steps"][-1] == "Answer: 41"
+    assert len(ai.calls) == 6
+
+
+def test_incorrect_verdict_triggers_resolve(fake_ai, monkeypatch):
+    monkeypatch.setattr(main, "AI_VERIFY_RESOLVE", True)
+    ai = fake_ai(verdict="INCORRECT", answer="41")
+    sid = new_sid()
+    try:
+        data = _quest(sid)
+    finally:
+        main.sessions.pop(sid, None)
+    assert data["solve_mode"] == "full_ai"
+    assert data["math_steps"] == ["Multiply 3 by 14 again.", "Answer: 42"]
+    # re-solve, then story, victory and mini-games again
+    assert len(ai.calls) == 10
+
+
+def test_math_timeout_falls_back_to_quick_mode(fake_ai, monkeypatch):
+    fake_ai(slow_models={main.AZURE_MATH_MODEL})
+    monkeypatch.setattr(main, "AI_MATH_TIMEOUT_SECONDS", 0.1)
+    monkeypatch.setattr(main, "TIMEOUT_BUFFER_SECONDS", 0)
+    timeouts_before = main._ai_executor.stats()["by_kind"].get("math", {}).get("timeouts", 0)
+    sid = new_sid()
+    try:
+        data = _quest(sid)
+    finally:
+        main.sessions.pop(sid, None)
+    assert data["solve_mode"] == "quick_fallback"
+    assert data["quick_mode_reason"] == "ai_math_timeout"
+    assert main._ai_executor.stats()["by_kind"]["math"]["timeouts"] == timeouts_before + 1
+    assert main._ai_executor.stats()["async_in_flight"] == 0
+
+
+def test_upstream_errors_use_static_fallbacks(fake_ai):
+    fake_ai(error=RuntimeError("upstream down"))
+    sid = new_sid()
+    try:
+        data = _quest(sid)
+    finally:
+        main.sessions.pop(sid, None)
+    assert data["solve_mode"] == "quick_fallback"
+    assert data["quick_mode_reason"] == "ai_math_unavailable"
+    skill = main._detect_math_skill(main.sanitize_input(PROBLEM))
+    assert data["teaching_analogy"] == main.MATH_ANALOGIES.get(skill, main.MATH_ANALOGIES["addition"])
+    assert len(data["mini_games"]) == 3
+
+
+def test_open_breaker_falls_back_without_calling(fake_ai, monkeypatch):
+    client = fake_ai()
+    breakers = CircuitBreakers(min_calls=2, open_seconds=60)
+    for _ in range(2):
+        breakers.record(main.AZURE_MATH_MODEL, False, 0.1, 16)
+    monkeypatch.setattr(main, "_ai_breakers", breakers)
+    sid = new_sid()
+    try:
+        data = _quest(sid)
+    finally:
+        main.sessions.pop(sid, None)
+    assert data["solve_mode"] == "quick_fallback"
+    assert main.AZURE_MATH_MODEL not in client.calls
+    assert breakers.stats()["models"][main.AZURE_MATH_MODEL]["state"] == "open"
+    assert breakers.stats()["models"][main.AZURE_MATH_MODEL]["rejected"] == 1
+
+
+def test_spent_deadline_skips_later_stages(fake_ai, monkeypatch):
+    client = fake_ai(delay=0.4)
+    deadline = DeadlineBudget(budget=1.0, min_call=0.7)
+    monkeypatch.setattr(main, "_story_deadline", deadline)
+    monkeypatch.setattr(main, "TIMEOUT_BUFFER_SECONDS", 0)
+    sid = new_sid()
+    try:
+        data = _quest(sid)
+    finally:
+        main.sessions.pop(sid, None)
+    # Math took 0.4 s of the 1 s budget: nothing after it is worth a call.
+    assert data["solve_mode"] == "quick_fallback"
+    assert data["quick_mode_reason"] == "ai_story_timeout"
+    assert len(data["mini_games"]) == 3
+    assert main.AZURE_STORY_MODEL not in client.calls
+    stats = deadline.stats()
+    assert stats["by_stage"]["story"]["skipped"] == 1
+    assert stats["by_stage"]["math"]["shortened"] == 1   # 14 s cut to the 1 s budget, and still answered
+    assert stats["requests"] == 1 and stats["overran"] == 0
+
+
+def test_quick_math_is_zero_llm_with_deferred_enrichment(fake_ai):
+    ai = fake_ai(delay=0.3)
+    sid = new_sid()
+
+    async def _run():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            started = asyncio.get_running_loop().time()
+            res = await client.post("/api/story", json={"hero": "Arcanos", "problem": "12 + 7", "session_id": sid})
+            elapsed = asyncio.get_running_loop().time() - started
+            data = res.json()
+            pending = (await client.get(f"/api/story/enrichment/{data['enrichment_job']}")).json()
+            await asyncio.sleep(0.5)
+            done = (await client.get(f"/api/story/enrichment/{data['enrichment_job']}")).json()
+            return elapsed, data, pending, done
+
+    try:
+        elapsed, data, pending, done = asyncio.run(_run())
+    finally:
+        main.sessions.pop(sid, None)
+    assert elapsed < 0.3   # did not wait for a single model call
+    assert data["solve_mode"] == "quick_math"
+    assert data["victory_story"] and data["teaching_analogy"]
+    assert pending == {"status": "pending"}
+    assert done["status"] == "done"
+    assert done["teaching_analogy"]["title"] == "Cow Rows"
+    assert done["victory_story"].startswith("The gate opens.")
+    assert sorted(ai.calls) == sorted([main.AZURE_ANALOGY_MODEL, main.AZURE_STORY_MODEL])
+
+
+def test_unknown_enrichment_job_is_404():
+    assert TestClient(main.app).get("/api/story/enrichment/nope").status_code == 404
+
+
+def test_jobs_are_off_with_several_workers(fake_ai, monkeypatch):
+    ai = fake_ai()
+    monkeypatch.setattr(main, "STORY_JOBS_ENABLED", False)
+    sid = new_sid()
+    client = TestClient(main.app)
+    try:
+        quick = client.post("/api/story", json={"hero": "Arcanos", "problem": "3 x 4", "session_id": sid})
+        job = client.post("/api/story/jobs", json={"hero": "Arcanos", "problem": PROBLEM, "session_id": sid})
+    finally:
+        main.sessions.pop(sid, None)
+    assert quick.status_code == 200
+    assert quick.json()["enrichment_job"] is None
+    assert quick.json()["teaching_analogy"]
+    assert job.status_code == 501
+    assert client.get("/api/story/jobs/anything").status_code == 501
+    assert ai.calls == []
+
+
+def test_repeat_problem_is_served_from_cache(fake_ai):
+    ai = fake_ai()
+    first, second = new_sid(), new_sid()
+    hits_before = main._ai_cache.stats()["by_kind"].get("story", {}).get("memory_hits", 0)
+    try:
+        _quest(first, player_name="Zoe")
+        assert len(ai.calls) == 6
+        data = _quest(second, problem=PROBLEM.upper(), player_name="Sam")
+    finally:
+        main.sessions.pop(first, None)
+        main.sessions.pop(second, None)
+    assert len(ai.calls) == 6   # every artifact came from the cache
+    assert data["solve_mode"] == "full_ai"
+    assert data["segments"][-1] == "Well done, Sam."
+    assert data["math_steps"] == ["Multiply 3 by 14.", "Answer: 42"]
+    assert data["teaching_analogy"]["title"] == "Cow Rows"
+    assert sorted(mg["correct_answer"] for mg in data["mini_games"]) == ["42"] * 3
+    assert main._ai_cache.stats()["by_kind"]["story"]["memory_hits"] == hits_before + 1
+
+
+def test_rejected_math_is_not_cached(fake_ai):
+    ai = fake_ai(verdict="INCORRECT", answer="41")
+    first, second = new_sid(), new_sid()
+    try:
+        _quest(first)
+        _quest(second)
+    finally:
+        main.sessions.pop(first, None)
+        main.sessions.pop(second, None)
+    assert ai.calls.count(main.AZURE_MATH_MODEL) == 2
+
+
+def test_classroom_burst_is_coalesced(fake_ai):
+    ai = fake_ai(delay=0.2)
+    sids = [new_sid() for _ in range(10)]
+
+    async def _run():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            responses = await asyncio.gather(*(
+                client.post("/api/story", json={
+                    "hero": "Arcanos", "problem": PROBLEM, "session_id": sid,
+                    "force_full_ai": True, "player_name": f"Kid{n}",
+                }, headers={"X-Forwarded-For": f"10.0.0.{n}"})
+                for n, sid in enumerate(sids)
+            ))
+            return [r.json() for r in responses]
+
+    coalesced_before = main._ai_flights.stats()["coalesced"]
+    try:
+        results = asyncio.run(_run())
+    finally:
+        for sid in sids:
+            main.sessions.pop(sid, None)
+    assert len(ai.calls) == 6   # one call per model for the whole class
+    assert [data["segments"][-1] for data in results] == [f"Well done, Kid{n}." for n in range(10)]
+    # late arrivals may hit the cache instead, but most quests joined a call in flight
+    assert main._ai_flights.stats()["coalesced"] > coalesced_before
+
+
+def test_retries_with_idempotency_key_run_once(fake_ai):
+    ai = fake_ai(delay=0.2)
+    sid = new_sid()
+    body = {"hero": "Arcanos", "problem": PROBLEM, "session_id": sid, "force_full_ai": True}
+    headers = {"Idempotency-Key": "quest-1"}
+
+    async def _run():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            concurrent = await asyncio.gather(*(
+                client.post("/api/story", json=body, headers=headers) for _ in range(3)
+            ))
+            later = await client.post("/api/story", json=body, headers=headers)
+            reused = await client.post("/api/story", json={**body, "problem": "7 x 8"}, headers=headers)
+            return [*concurrent, later], reused
+
+    try:
+        responses, reused = asyncio.run(_run())
+        session = main.get_session(sid)
+    finally:
+        main.sessions.pop(sid, None)
+    assert [r.status_code for r in responses] == [200] * 4
+    assert len({r.text for r in responses}) == 1
+    assert sum(r.headers.get("Idempotent-Replayed") == "true" for r in responses) == 3
+    assert len(ai.calls) == 6
+    assert session["coins"] == 50 and session["quests_completed"] == 1
+    assert reused.status_code == 422
+
+
+def test_story_job_long_polls_parts_then_result(fake_ai, monkeypatch):
+    fake_ai(delay=0.2)
+    monkeypatch.setattr(main, "_story_jobs", JobQueue(per_owner=1))
+    sid = new_sid()
+    body = {"hero": "Arcanos", "problem": PROBLEM, "session_id": sid, "force_full_ai": True}
+
+    async def _run():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            started = await client.post("/api/story/jobs", json=body)
+            busy = await client.post("/api/story/jobs", json=body)
+            job_id = started.json()["job_id"]
+            views, version = [], 0
+            while not views or views[-1]["status"] not in ("done", "failed"):
+                res = await client.get(f"/api/story/jobs/{job_id}", params={"since": version, "wait": 5})
+                views.append(res.json())
+                version = views[-1]["version"]
+            missing = await client.get("/api/story/jobs/nope", params={"wait": 0})
+            return started, busy, views, missing
+
+    try:
+        started, busy, views, missing = asyncio.run(_run())
+    finally:
+        main.sessions.pop(sid, None)
+    assert started.status_code == 202 and started.json()["status"] == "queued"
+    assert busy.status_code == 429
+    partials = [v["partial"] for v in views if v["status"] == "running"]
+    assert any(p.get("math_steps") and not p.get("segments") for p in partials)
+    assert any(0 < len(p.get("segments", [])) < 4 for p in partials)
+    result = views[-1]["result"]
+    assert views[-1]["status"] == "done"
+    assert result["segments"] == ["One.", "Two.", "Three.", "Well done, Hero."]
+    assert result["coins"] == 50
+    assert missing.status_code == 404
+    assert main._story_jobs.stats()["completed"] == 1
+
+
+def _read_sse(text: str) -> list:
+    events = []
+    for block in text.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def test_stream_sends_paragraphs_as_they_arrive(fake_ai):
+    fake_ai(delay=0.2)
+    sid = new_sid()
+    req = main.StoryRequest(hero="Arcanos", problem=PROBLEM, session_id=sid, force_full_ai=True)
+    request = Request({"type": "http", "method": "POST", "path": "/api/story/stream", "headers": [],
+                       "client": ("127.0.0.1", 50000), "query_string": b""})
+
+    async def _run():
+        # Iterate the body directly: httpx's ASGI transport buffers the
+        # whole response, which would hide when each event was sent.
+        started = asyncio.get_running_loop().time()
+        response = await main.generate_story_stream(req, request)
+        assert response.media_type == "text/event-stream"
+        arrivals, body = {}, ""
+        async for chunk in response.body_iterator:
+            body += chunk
+            for event, _ in _read_sse(chunk):
+                arrivals.setdefault(event, asyncio.get_running_loop().time() - started)
+        return arrivals, _read_sse(body)
+
+    try:
+        arrivals, events = asyncio.run(_run())
+    finally:
+        main.sessions.pop(sid, None)
+    names = [event for event, _ in events]
+    assert names[-1] == "done"
+    assert names.index("math") < names.index("segment")
+    segments = [data for event, data in events if event == "segment"]
+    assert [seg["index"] for seg in segments] == [0, 1, 2, 3]
+    done = events[-1][1]
+    assert done["segments"] == [seg["text"] for seg in segments]
+    assert done["solve_mode"] == "full_ai" and done["coins"] == 50
+    # math (0.2 s) + the storyteller's first chunk, not the whole 4-chunk stream
+    assert arrivals["segment"] < 0.45
+    assert arrivals["done"] - arrivals["segment"] >= 0.5
+    assert main._story_stream_stats.stats()["streams"] >= 1
+
+
+def test_stream_rejects_before_streaming():
+    res = TestClient(main.app).post("/api/story/stream", json={
+        "hero": "Nobody", "problem": PROBLEM, "session_id": new_sid(),
+    })
+    assert res.status_code == 400
+
+
+def test_stream_retry_replays_events(fake_ai):
+    ai = fake_ai()
+    sid = new_sid()
+    body = {"hero": "Arcanos", "problem": PROBLEM, "session_id": sid, "force_full_ai": True}
+    headers = {"Idempotency-Key": "quest-stream-1"}
+    client = TestClient(main.app)
+    try:
+        first = client.post("/api/story/stream", json=body, headers=headers)
+        calls = len(ai.calls)
+        retry = client.post("/api/story/stream", json=body, headers=headers)
+        session = main.get_session(sid)
+    finally:
+        main.sessions.pop(sid, None)
+    assert first.status_code == retry.status_code == 200
+    assert "Idempotent-Replayed" not in first.headers
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    # The same events (replayed in response order rather than arrival order)
+    assert sorted(_read_sse(retry.text), key=repr) == sorted(_read_sse(first.text), key=repr)
+    assert _read_sse(retry.text)[-1] == _read_sse(first.text)[-1]
+    assert len(ai.calls) == calls
+    assert session["coins"] == 50 and session["quests_completed"] == 1
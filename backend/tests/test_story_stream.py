@@ -0,0 +1,83 @@
+"""
+SSE plumbing for /api/story/stream (backend/story_stream.py):
+  - paragraphs are cut from arbitrary token chunks at each delimiter
+  - repeated events with unchanged data are sent once; finish() ends with done
+  - closing the stream cancels the producer
+  - a shared storyteller call's paragraphs reach late subscribers too
+"""
+
+import asyncio
+
+from backend.story_stream import SegmentBroadcast, SegmentSplitter, StoryEvents, format_sse
+
+
+def test_splitter_handles_delimiters_across_chunks():
+    seen = []
+    splitter = SegmentSplitter(lambda i, text: seen.append((i, text)), limit=2)
+    for chunk in ["One", " fish.---SEG", "MENT---", "\n---SEGMENT---Two.---SEGMENT---Thr", "ee.---SEGMENT---Four."]:
+        splitter.feed(chunk)
+    assert seen == [(0, "One fish."), (1, "Two.")]   # blank paragraph skipped, capped at 2
+
+
+def test_events_dedupe_and_finish():
+    response = {"math_steps": ["a"], "segments": ["One.", "Two."], "teaching_analogy": None,
+                "victory_story": "Yay", "mini_games": []}
+
+    async def _run():
+        events = StoryEvents()
+        events.emit("math", {"math_steps": ["a"]})
+        events.emit("segment", {"index": 0, "text": "One."})
+
+        async def _produce():
+            events.finish(response)
+
+        return [chunk async for chunk in events.stream(_produce())]
+
+    chunks = asyncio.run(_run())
+    assert chunks == [
+        format_sse("math", {"math_steps": ["a"]}),
+        format_sse("segment", {"index": 0, "text": "One."}),
+        format_sse("segment", {"index": 1, "text": "Two."}),
+        format_sse("analogy", {"teaching_analogy": None}),
+        format_sse("victory", {"victory_story": "Yay"}),
+        format_sse("mini_games", {"mini_games": []}),
+        format_sse("done", response),
+    ]
+
+
+def test_closing_stream_cancels_producer():
+    cancelled = []
+
+    async def _run():
+        events = StoryEvents()
+
+        async def _produce():
+            events.emit("math", {"math_steps": []})
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append(1)
+                raise
+
+        stream = events.stream(_produce())
+        await stream.__anext__()
+        await stream.aclose()
+        await asyncio.sleep(0)
+
+    asyncio.run(_run())
+    assert cancelled == [1]
+
+
+def test_broadcast_replays_to_late_subscribers():
+    broadcast = SegmentBroadcast()
+    first, late = [], []
+    broadcast.subscribe("k", first.append)
+    broadcast.publish("k", (0, "One."))
+    broadcast.subscribe("k", late.append)
+    broadcast.publish("k", (1, "Two."))
+    broadcast.publish("other", (0, "Nobody listening."))
+    assert first == late == [(0, "One."), (1, "Two.")]
+
+    broadcast.unsubscribe("k", first.append)
+    broadcast.unsubscribe("k", late.append)
+    assert len(broadcast) == 0
@@ -0,0 +1,82 @@
+"""
+Async task-graph scheduler (backend/task_graph.py):
+  - nodes receive their dependencies' results
+  - independent nodes overlap; wall time is the longest chain
+  - a failing node cancels the rest and propagates
+  - per-node timings and their aggregation
+"""
+
+import asyncio
+
+import pytest
+
+from backend.task_graph import GraphTimings, TaskGraph
+
+
+def _sleeper(delay, value):
+    async def _fn(**inputs):
+        await asyncio.sleep(delay)
+        return value if not inputs else (value, inputs)
+    return _fn
+
+
+def test_dependencies_are_passed_as_keywords():
+    async def _double(a):
+        return a * 2
+
+    graph = TaskGraph().add("a", _sleeper(0, 21)).add("b", _double, ["a"])
+    assert asyncio.run(graph.run()) == {"a": 21, "b": 42}
+
+
+def test_wall_time_is_the_longest_chain():
+    graph = (
+        TaskGraph()
+        .add("root", _sleeper(0.1, 1))
+        .add("side", _sleeper(0.1, 2))
+        .add("left", _sleeper(0.1, 3), ["root"])
+        .add("right", _sleeper(0.1, 4), ["root"])
+    )
+    asyncio.run(graph.run())
+    assert graph.elapsed < 0.35   # two levels, not four calls in a row
+    assert graph.timings["side"][0] < 0.05
+    assert graph.timings["left"][0] >= 0.09
+    assert abs(graph.timings["left"][0] - graph.timings["right"][0]) < 0.05
+
+
+def test_failure_cancels_running_nodes():
+    cancelled = []
+
+    async def _boom():
+        raise ValueError("nope")
+
+    async def _slow():
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    graph = TaskGraph().add("slow", _slow).add("boom", _boom)
+    with pytest.raises(ValueError):
+        asyncio.run(graph.run())
+    assert cancelled == [True]
+
+
+def test_unknown_and_duplicate_tasks_are_rejected():
+    graph = TaskGraph().add("a", _sleeper(0, 1))
+    with pytest.raises(ValueError):
+        graph.add("a", _sleeper(0, 1))
+    with pytest.raises(ValueError):
+        graph.add("b", _sleeper(0, 1), ["missing"])
+
+
+def test_graph_timings_aggregate_runs():
+    timings = GraphTimings()
+    for _ in range(3):
+        graph = TaskGraph().add("a", _sleeper(0.01, 1)).add("b", _sleeper(0.01, 2), ["a"])
+        asyncio.run(graph.run())
+        timings.record(graph)
+    stats = timings.stats()
+    assert stats["runs"] == 3
+    assert stats["nodes"]["b"]["runs"] == 3
+    assert stats["nodes"]["b"]["avg_start_ms"] >= stats["nodes"]["a"]["avg_ms"] * 0.9
@@ -26,7 +26,22 @@ export async function fetchSession(sessionId) {
   }
 }
 
-export async function generateStory(hero, problem, sessionId, options = {}) {
+// A fresh Idempotency-Key.  Send the same key when retrying the same quest
+// so the backend replays the first response instead of running (and
+// charging for) it again.
+export function newIdempotencyKey() {
+  if (globalThis.crypto && globalThis.crypto.randomUUID) return globalThis.crypto.randomUUID()
+  return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`
+}
+
+function storyHeaders(options) {
+  return {
+    'Content-Type': 'application/json',
+    'Idempotency-Key': options.idempotencyKey || newIdempotencyKey(),
+  }
+}
+
+function storyRequestBody(hero, problem, sessionId, options) {
   const body = {
     hero,
     problem,
@@ -38,6 +53,11 @@ export async function generateStory(hero, problem, sessionId, options = {}) {
   if (options.forceFullAi) body.force_full_ai = true
   if (options.guild) body.guild = options.guild
   if (options.ideologyShift !== undefined) body.ideology_shift = options.ideologyShift
+  return body
+}
+
+export async function generateStory(hero, problem, sessionId, options = {}) {
+  const body = storyRequestBody(hero, problem, sessionId, options)
   const controller = new AbortController()
   const timeoutMs = options.timeoutMs || 28000
   const timeout = setTimeout(() => controller.abort(), timeoutMs)
@@ -45,7 +65,7 @@ export async function generateStory(hero, problem, sessionId, options = {}) {
   try {
     res = await fetch(`${API_BASE}/story`, {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
+      headers: storyHeaders(options),
       body: JSON.stringify(body),
       signal: controller.signal,
     })
@@ -64,6 +84,75 @@ export async function generateStory(hero, problem, sessionId, options = {}) {
   return res.json();
 }
 
+// Streaming variant of generateStory over Server-Sent Events: `onEvent(event,
+// data)` fires for math / segment / analogy / victory / mini_games as the
+// backend produces them, and the promise resolves with the full response
+// from the final `done` event (the same shape generateStory returns).
+export async function streamStory(hero, problem, sessionId, options = {}, onEvent = () => {}) {
+  const body = storyRequestBody(hero, problem, sessionId, options)
+  const controller = new AbortController()
+  const timeoutMs = options.timeoutMs || 28000
+  const timeout = setTimeout(() => controller.abort(), timeoutMs)
+  try {
+    const res = await fetch(`${API_BASE}/story/stream`, {
+      method: 'POST',
+      headers: storyHeaders(options),
+      body: JSON.stringify(body),
+      signal: controller.signal,
+    })
+    if (!res.ok) {
+      const err = await res.json();
+      throw new Error(err.detail || 'Story generation failed');
+    }
+    const reader = res.body.getReader()
+    const decoder = new TextDecoder()
+    let buffer = ''
+    for (;;) {
+      const { value, done } = await reader.read()
+      if (done) break
+      buffer += decoder.decode(value, { stream: true })
+      let sep
+      while ((sep = buffer.indexOf('\n\n')) >= 0) {
+        const block = buffer.slice(0, sep)
+        buffer = buffer.slice(sep + 2)
+        let event = 'message'
+        let data = ''
+        for (const line of block.split('\n')) {
+          if (line.startsWith('event: ')) event = line.slice(7)
+          else if (line.startsWith('data: ')) data += line.slice(6)
+        }
+        const payload = data ? JSON.parse(data) : null
+        if (event === 'done') return payload
+        if (event === 'error') throw new Error((payload && payload.detail) || 'Story generation failed')
+        onEvent(event, payload)
+      }
+    }
+    throw new Error('Quest stream ended early. Please retry.')
+  } catch (err) {
+    if (err.name === 'AbortError') {
+      throw new Error('Quest timed out. Quick Mode will trigger for simple math. Please retry.')
+    }
+    throw err
+  } finally {
+    clearTimeout(timeout)
+  }
+}
+
+// Quick-math quests come back with static analogy/victory text and an
+// `enrichment_job`; the AI versions are fetched here once they are ready.
+export async function fetchStoryEnrichment(jobId, { intervalMs = 1500, maxWaitMs = 30000 } = {}) {
+  const deadline = Date.now() + maxWaitMs
+  while (Date.now() < deadline) {
+    const res = await fetch(`${API_BASE}/story/enrichment/${encodeURIComponent(jobId)}`)
+    if (!res.ok) return null
+    const data = await res.json()
+    if (data.status === 'done') return data
+    if (data.status === 'failed') return null
+    await new Promise(resolve => setTimeout(resolve, intervalMs))
+  }
+  return null
+}
+
 export async function generateImage(hero, problem, sessionId) {
   const res = await fetch(`${API_BASE}/image`, {
     method: 'POST',
@@ -356,6 +445,24 @@ export async function fetchPlayerStats(sessionId) {
   return res.json()
 }
 
+// Full quest history, newest first.  The session only carries a short recent
+// window, so the parent dashboard pages through the server-side log.
+export async function fetchQuestHistory(sessionId, { pageSize = 200, maxPages = 25 } = {}) {
+  const entries = []
+  let beforeId = null
+  for (let page = 0; page < maxPages; page++) {
+    const params = new URLSearchParams({ limit: String(pageSize) })
+    if (beforeId !== null) params.set('before_id', String(beforeId))
+    const res = await fetch(`${API_BASE}/player/history/${sessionId}?${params}`)
+    if (!res.ok) break
+    const data = await res.json()
+    entries.push(...(data.entries || []))
+    beforeId = data.next_before_id ?? null
+    if (beforeId === null) break
+  }
+  return entries
+}
+
 // ── Concrete Packers telemetry ───────────────────────────────────────────────
 // Fire-and-forget: never blocks the UI.  Errors are silently swallowed so
 // a telemetry outage can never interrupt the learning experience.
@@ -1,6 +1,6 @@
-import { useMemo, useRef, useEffect } from 'react'
+import { useMemo, useRef, useEffect, useState } from 'react'
 import { gsap } from 'gsap'
-import { getPdfUrl } from '../api/client'
+import { getPdfUrl, fetchQuestHistory } from '../api/client'
 import GuildBadge from './GuildBadge'
 import IdeologyMeter from './IdeologyMeter'
 import PerseveranceBar from './PerseveranceBar'
@@ -24,7 +24,12 @@ const GUILD_NAMES = {
 
 function ParentDashboard({ sessionId, session, onClose }) {
   const ref = useRef(null)
-  const history = session?.history || []
+  const [fullHistory, setFullHistory] = useState(null)
+  // Oldest first, like the session's own recent window.
+  const history = useMemo(
+    () => (fullHistory ? [...fullHistory].reverse() : (session?.history || [])),
+    [fullHistory, session?.history],
+  )
   const guild = session?.guild || null
   const ideologyMeter = Number(session?.ideology_meter ?? 0)
   const ideologyLabel = session?.ideology_label ?? 'Balanced Explorer'
@@ -54,6 +59,15 @@ function ParentDashboard({ sessionId, session, onClose }) {
     return Object.entries(map)
   }, [history])
 
+  useEffect(() => {
+    if (!sessionId) return undefined
+    let cancelled = false
+    fetchQuestHistory(sessionId)
+      .then((entries) => { if (!cancelled) setFullHistory(entries) })
+      .catch(() => {})
+    return () => { cancelled = true }
+  }, [sessionId])
+
   useEffect(() => {
     gsap.from(ref.current, { y: 50, opacity: 0, duration: 0.4, ease: 'back.out(1.5)' })
   }, [])
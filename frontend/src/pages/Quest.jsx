@@ -9,7 +9,7 @@ import TeachingAnalogyCard from '../components/TeachingAnalogyCard'
 import IdeologyMeter from '../components/IdeologyMeter'
 import GuildBadge from '../components/GuildBadge'
 import PerseveranceBar from '../components/PerseveranceBar'
-import { generateStory, generateSegmentImagesBatch, analyzeMathPhoto, fetchSubscription, recordHintUse, updateIdeology, getMentorHint, updateSessionProfile } from '../api/client'
+import { streamStory, newIdempotencyKey, fetchStoryEnrichment, generateSegmentImagesBatch, analyzeMathPhoto, fetchSubscription, recordHintUse, updateIdeology, getMentorHint, updateSessionProfile } from '../api/client'
 import { generateProblem, checkAnswer, xpThreshold, xpEarned } from '../utils/MathEngine'
 import { playClick, playCast, playHit } from '../utils/SoundEngine'
 import { trackEvent } from '../utils/Telemetry'
@@ -88,6 +88,9 @@ export default function Quest({ sessionId, session, selectedHero, setSelectedHer
   const [castFlash, setCastFlash] = useState(false)
   const fileInputRef = useRef(null)
   const headerRef = useRef(null)
+  const enrichmentJobRef = useRef(null)
+  // One Idempotency-Key per problem, so retrying a quest never runs it twice.
+  const questKeyRef = useRef({ problem: null, key: null })
   const activeAgeMode = AGE_MODE_LABELS[profile?.age_group] || AGE_MODE_LABELS['8-10']
   const currentGuild = profile?.guild || session?.guild || null
   const inputPlaceholder = profile?.age_group === '5-7'
@@ -193,6 +196,7 @@ export default function Quest({ sessionId, session, selectedHero, setSelectedHer
     setApiConnectionError(null)
     setTeachingAnalogy(null)
     setVictoryStory(null)
+    enrichmentJobRef.current = null
     setShowNarrativeChoice(false)
     setHintUsedThisRound(false)
     setMentorExplanation(null)
@@ -201,14 +205,37 @@ export default function Quest({ sessionId, session, selectedHero, setSelectedHer
 
     try {
       const solvedEquation = currentProblem.problem
-      const result = await generateStory(selectedHero, solvedEquation, sessionId, {
+      if (questKeyRef.current.problem !== currentProblem) {
+        questKeyRef.current = { problem: currentProblem, key: newIdempotencyKey() }
+      }
+      // Show each part of the quest as it streams in; the final result
+      // below replaces all of it.
+      const streamed = []
+      const onStoryEvent = (event, data) => {
+        if (event === 'segment') {
+          streamed[data.index] = data.text
+          setSegments(streamed.slice())
+          setShowResult(true)
+        } else if (event === 'math') {
+          setMathSteps(data.math_steps || [])
+        } else if (event === 'mini_games') {
+          setMiniGames(data.mini_games || [])
+        } else if (event === 'analogy') {
+          setTeachingAnalogy(data.teaching_analogy || null)
+        } else if (event === 'victory') {
+          setVictoryStory(data.victory_story || null)
+        }
+      }
+      const result = await streamStory(selectedHero, solvedEquation, sessionId, {
         ageGroup: profile?.age_group,
         playerName: profile?.player_name,
         selectedRealm: profile?.selected_realm,
         forceFullAi,
         timeoutMs: forceFullAi ? 45000 : 28000,
         guild: currentGuild,
-      })
+        // A Full AI retry is a different request from the quick one.
+        idempotencyKey: `${questKeyRef.current.key}${forceFullAi ? ':full' : ''}`,
+      }, onStoryEvent)
       const segs = result.segments || [result.story]
       setSegments(segs)
       setMathSteps(result.math_steps || [])
@@ -217,6 +244,18 @@ export default function Quest({ sessionId, session, selectedHero, setSelectedHer
       setQuickModeReason(result.quick_mode_reason || '')
       setTeachingAnalogy(result.teaching_analogy || null)
       setVictoryStory(result.victory_story || null)
+      // Quick-math quests: swap in the AI analogy/victory beat when ready,
+      // unless another quest has started in the meantime.
+      enrichmentJobRef.current = result.enrichment_job || null
+      if (result.enrichment_job) {
+        fetchStoryEnrichment(result.enrichment_job)
+          .then(extra => {
+            if (!extra || enrichmentJobRef.current !== result.enrichment_job) return
+            if (extra.teaching_analogy) setTeachingAnalogy(extra.teaching_analogy)
+            if (extra.victory_story) setVictoryStory(extra.victory_story)
+          })
+          .catch(() => {})
+      }
       // Update ideology/perseverance/DDA from response
       if (result.ideology_meter !== undefined) setIdeologyOverride(result.ideology_meter)
       if (result.perseverance_score !== undefined) setPerseveranceOverride(result.perseverance_score)
@@ -0,0 +1,73 @@
+"""
+Benchmark: steady-state ``get_session()`` cost before and after schema versioning.
+
+"before" replays the old behaviour — every access re-runs
+``_ensure_session_defaults()`` (normalizers, mastery defaults for every
+skill, streak and badge evaluation).  "after" is the current
+``get_session()``, which only does that once per session and then just
+checks the daily streak.  Runs entirely in memory; no database needed.
+
+Usage:
+    python scripts/bench_get_session.py --sessions 1000 --reads 200000
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+os.environ["DATABASE_URL"] = ""
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+import main  # noqa: E402
+
+
+def _legacy_get_session(sid):
+    session = main.get_session(sid)
+    main._ensure_session_defaults(session)
+    return session
+
+
+def _run(label, get, sids, reads):
+    order = [random.choice(sids) for _ in range(reads)]
+    samples = []
+    chunk = 1000
+    started = time.perf_counter()
+    for i in range(0, reads, chunk):
+        t0 = time.perf_counter()
+        for sid in order[i:i + chunk]:
+            get(sid)
+        samples.append((time.perf_counter() - t0) * 1e6 / len(order[i:i + chunk]))
+    elapsed = time.perf_counter() - started
+    samples.sort()
+    print(
+        f"{label:<8} mean={statistics.mean(samples):7.2f} us  "
+        f"p95={samples[int(len(samples) * 0.95) - 1]:7.2f} us  "
+        f"throughput={reads / elapsed:10.0f} reads/s"
+    )
+    return elapsed
+
+
+def main_():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sessions", type=int, default=1000)
+    parser.add_argument("--reads", type=int, default=200000)
+    args = parser.parse_args()
+
+    sids = [f"sess_bench{n:07d}" for n in range(args.sessions)]
+    for sid in sids:
+        session = main.get_session(sid)
+        session["quests_completed"] = random.randint(0, 40)
+        session["history"] = [{"concept": "3 + 4", "realm": "Sky Citadel"}] * 20
+
+    before = _run("before", _legacy_get_session, sids, args.reads)
+    after = _run("after", main.get_session, sids, args.reads)
+    print(f"speedup  {before / after:.1f}x")
+    print("session_cache:", main.sessions.stats())
+
+
+if __name__ == "__main__":
+    main_()
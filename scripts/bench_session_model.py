@@ -0,0 +1,92 @@
+"""
+Benchmark: resident memory and save throughput of game sessions.
+
+Builds realistic sessions (full defaults, a 20-quest history window, some
+mastery) twice — as plain dicts, the old representation, and as
+``PlayerSession`` objects — and reports tracemalloc bytes per resident
+session.  Then times the per-save serialization step for stdlib
+``json.dumps`` (the old JSONB path) against every ``encode_session``
+flavour available in this environment.  Runs in memory; no database needed.
+
+Usage:
+    python scripts/bench_session_model.py --sessions 10000 --saves 20000
+"""
+
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+os.environ["DATABASE_URL"] = ""
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+import main  # noqa: E402
+from backend import session_model  # noqa: E402
+from backend.session_model import PlayerSession, encode_session  # noqa: E402
+
+
+def _session_dict(n: int) -> dict:
+    session = {"coins": random.randint(0, 500), "_history_logged": True, "_schema_version": 1}
+    main._ensure_session_defaults(session)
+    session["history"] = [
+        {"concept": f"{n % 97} + {k}", "realm": "Sky Citadel", "guild": "architects", "timestamp": "2026-10-17T09:00:00"}
+        for k in range(20)
+    ]
+    for skill in random.sample(main.MATH_SKILLS, 3):
+        session["mastery"][skill] = {"correct": 3, "total": 5, "mastery_score": 0.6}
+    return session
+
+
+def _resident_bytes(build, count: int) -> float:
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = [build(n) for n in range(count)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return (after - before) / count
+
+
+def _throughput(label: str, encode, sessions, saves: int) -> None:
+    size = len(encode(sessions[0]))
+    started = time.perf_counter()
+    for i in range(saves):
+        encode(sessions[i % len(sessions)])
+    elapsed = time.perf_counter() - started
+    print(f"{label:<16} {saves / elapsed:10.0f} saves/s  {elapsed * 1e6 / saves:7.2f} us/save  {size:6d} B/blob")
+
+
+def main_():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sessions", type=int, default=10000)
+    parser.add_argument("--saves", type=int, default=20000)
+    args = parser.parse_args()
+
+    random.seed(7)
+    dict_bytes = _resident_bytes(_session_dict, args.sessions)
+    random.seed(7)
+    slot_bytes = _resident_bytes(lambda n: PlayerSession(_session_dict(n)), args.sessions)
+    print(f"resident dict          {dict_bytes:8.0f} B/session")
+    print(f"resident PlayerSession {slot_bytes:8.0f} B/session  ({1 - slot_bytes / dict_bytes:.0%} smaller)")
+
+    sessions = [PlayerSession(_session_dict(n)) for n in range(200)]
+    plain = [s.to_dict() for s in sessions]
+    _throughput("json.dumps", lambda s: json.dumps(s), plain, args.saves)
+    _throughput("encode json", lambda s: encode_session(s, fmt="json"), sessions, args.saves)
+    if session_model.msgpack is not None:
+        _throughput("encode msgpack", lambda s: encode_session(s, fmt="msgpack"), sessions, args.saves)
+    if session_model.zstandard is not None:
+        session_model.SESSION_BLOB_COMPRESS_MIN_BYTES = 0
+        _throughput("msgpack+zstd", lambda s: encode_session(s, fmt="msgpack"), sessions, args.saves)
+    else:
+        print("msgpack+zstd     skipped (zstandard not installed)")
+
+
+if __name__ == "__main__":
+    main_()
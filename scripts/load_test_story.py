@@ -0,0 +1,252 @@
+"""
+Load test: concurrent /api/story quests against a fake OpenAI upstream.
+
+Starts a local OpenAI-compatible ``/chat/completions`` server that answers
+every model's prompt (math steps, verification, story segments, mini-games,
+analogy, victory beat) after a fixed delay, points the app at it through
+``OPENAI_BASE_URL``, runs the app under uvicorn with no database, and fires
+``--quests`` full-AI quests (unique sessions) with ``--concurrency`` in
+flight.  Reports throughput, latency percentiles and how many quests fell
+back to quick mode because an upstream call timed out or was rejected.
+``--quick`` sends a basic-arithmetic problem without ``force_full_ai``
+instead, to measure the quick-math fast path against a slow upstream.
+Every quest sends the same problem, so the AI artifact cache is off unless
+``--cache`` is given (then only the first quests reach the upstream).
+``--stream`` uses ``/api/story/stream`` and also reports time to the first
+story paragraph; streamed upstream replies spread their paragraphs evenly
+over ``--delay``.
+
+Run it against two checkouts to compare builds, e.g.:
+    git worktree add /tmp/before HEAD~1
+    python scripts/load_test_story.py --app-dir /tmp/before/backend
+    python scripts/load_test_story.py
+
+Usage:
+    python scripts/load_test_story.py --quests 400 --concurrency 200 --delay 0.5
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+
+import httpx
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+PROBLEM = "A farmer has 3 fields with 14 cows in each field. How many cows are there?"
+QUICK_PROBLEM = "12 x 7"
+
+
+# ── fake upstream ─────────────────────────────────────────────────────────────
+
+
+def _fake_content(messages: list) -> str:
+    system = messages[0]["content"] if messages[0]["role"] == "system" else ""
+    user = messages[-1]["content"]
+    if user.startswith("Solve this math problem"):
+        return "STEP 1: Multiply 3 by 14.\nSTEP 2: 3 x 14 = 42.\nANSWER: 42"
+    if "math checker" in system:
+        return "CORRECT\n3 x 14 = 42"
+    if "game designer" in system:
+        return json.dumps([
+            {"type": t, "title": "Cow Count", "prompt": "Solve it!", "question": "3 x 14", "correct_answer": "42",
+             "choices": ["40", "42", "44"], "time_limit": 20, "reward_coins": 10,
+             "hero_action": "zaps the gate", "fail_message": "Try again!"}
+            for t in ("quicktime", "timed", "choice")
+        ])
+    if "analogies" in system:
+        return json.dumps({
+            "title": "Rows of Cows", "analogy": "Three fields are three equal rows.",
+            "why_this_works": ["a", "b", "c"], "where_it_breaks": "Cows wander.",
+            "example_steps": ["1", "2", "3"], "check_question": "What about 4 fields?",
+            "alternate_analogies": ["x", "y"],
+        })
+    if "World Builder" in system:
+        return "The gate opens. Three rows of fourteen make 42. Something stirs beyond the wall."
+    return "One.---SEGMENT---Two.---SEGMENT---Three.---SEGMENT---Four."
+
+
+def build_fake_upstream(delay: float):
+    from fastapi import FastAPI, Request
+    from fastapi.responses import StreamingResponse
+
+    app = FastAPI()
+    served = {"calls": 0}
+
+    @app.get("/calls")
+    async def calls():
+        return served
+
+    @app.post("/chat/completions")
+    async def chat(request: Request):
+        body = await request.json()
+        served["calls"] += 1
+        if body.get("stream"):
+            return StreamingResponse(_chunks(body.get("model", "fake"), _fake_content(body["messages"])),
+                                     media_type="text/event-stream")
+        await asyncio.sleep(delay)
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "fake"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": _fake_content(body["messages"])},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+        }
+
+    async def _chunks(model: str, content: str):
+        pieces = content.split("---SEGMENT---")
+        for i, piece in enumerate(pieces):
+            await asyncio.sleep(delay / len(pieces))
+            text = piece + ("---SEGMENT---" if i < len(pieces) - 1 else "")
+            chunk = {
+                "id": "chatcmpl-stream", "object": "chat.completion.chunk", "created": int(time.time()),
+                "model": model, "choices": [{"index": 0, "delta": {"content": text}, "finish_reason": None}],
+            }
+            yield f"data: {json.dumps(chunk)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return app
+
+
+# ── harness ───────────────────────────────────────────────────────────────────
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def _wait_ready(url: str, timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up")
+
+
+async def _stream_quest(client, url: str, payload: dict, headers: dict) -> tuple[str, float]:
+    """POST to /api/story/stream; returns ``(solve_mode or http_<code>, seconds to first segment)``."""
+    started = time.perf_counter()
+    first_segment = None
+    async with client.stream("POST", url, json=payload, headers=headers) as res:
+        if res.status_code != 200:
+            return f"http_{res.status_code}", 0.0
+        event = None
+        async for line in res.aiter_lines():
+            if line.startswith("event: "):
+                event = line[7:]
+                if event == "segment" and first_segment is None:
+                    first_segment = time.perf_counter() - started
+            elif line.startswith("data: ") and event == "done":
+                return json.loads(line[6:]).get("solve_mode"), first_segment
+            elif line.startswith("data: ") and event == "error":
+                return "stream_error", first_segment or 0.0
+    return "stream_cut", first_segment or 0.0
+
+
+async def _run_quests(base: str, quests: int, concurrency: int, quick: bool, stream: bool) -> tuple[list, list, dict]:
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    latencies, first_segments, modes = [], [], {}
+    gate = asyncio.Semaphore(concurrency)
+
+    async def _one(client, n):
+        async with gate:
+            started = time.perf_counter()
+            # One player per quest: distinct session and client address, so
+            # the per-session and per-IP rate limits stay out of the way.
+            payload = {
+                "hero": "Arcanos", "problem": QUICK_PROBLEM if quick else PROBLEM,
+                "session_id": f"sess_{uuid.uuid4().hex[:12]}", "force_full_ai": not quick,
+            }
+            headers = {"X-Forwarded-For": f"10.{n >> 16 & 255}.{n >> 8 & 255}.{n & 255}"}
+            if stream:
+                key, first_segment = await _stream_quest(client, f"{base}/api/story/stream", payload, headers)
+                first_segments.append(first_segment)
+            else:
+                res = await client.post(f"{base}/api/story", json=payload, headers=headers)
+                key = res.json().get("solve_mode") if res.status_code == 200 else f"http_{res.status_code}"
+            latencies.append(time.perf_counter() - started)
+            modes[key] = modes.get(key, 0) + 1
+
+    async with httpx.AsyncClient(timeout=120, limits=limits) as client:
+        await asyncio.gather(*(_one(client, n) for n in range(quests)))
+    return latencies, first_segments, modes
+
+
+def main_():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--quests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--delay", type=float, default=0.5, help="fake upstream latency per AI call (s)")
+    parser.add_argument("--quick", action="store_true", help="quick-math problems instead of full-AI quests")
+    parser.add_argument("--cache", action="store_true", help="leave the AI artifact cache on")
+    parser.add_argument("--stream", action="store_true", help="use /api/story/stream and time the first paragraph")
+    parser.add_argument("--app-dir", default=os.path.join(ROOT, "backend"), help="backend/ directory to serve")
+    parser.add_argument("--fake-upstream-port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.fake_upstream_port:
+        import uvicorn
+        uvicorn.run(build_fake_upstream(args.delay), host="127.0.0.1", port=args.fake_upstream_port,
+                    log_level="warning", backlog=4096, timeout_keep_alive=120)
+        return
+
+    upstream_port, app_port = _free_port(), _free_port()
+    upstream = subprocess.Popen([sys.executable, __file__, "--delay", str(args.delay),
+                                 "--fake-upstream-port", str(upstream_port)])
+    env = dict(os.environ, DATABASE_URL="", OPENAI_API_KEY="fake", AI_CACHE_ENABLED="1" if args.cache else "0",
+               OPENAI_BASE_URL=f"http://127.0.0.1:{upstream_port}",
+               PYTHONPATH=os.path.dirname(os.path.abspath(args.app_dir)))
+    app = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(app_port),
+         "--log-level", "error", "--backlog", "4096", "--timeout-keep-alive", "120"],
+        cwd=args.app_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        base = f"http://127.0.0.1:{app_port}"
+        asyncio.run(_wait_ready(f"http://127.0.0.1:{upstream_port}/docs"))
+        asyncio.run(_wait_ready(f"{base}/docs"))
+        started = time.perf_counter()
+        latencies, first_segments, modes = asyncio.run(
+            _run_quests(base, args.quests, args.concurrency, args.quick, args.stream))
+        elapsed = time.perf_counter() - started
+        upstream_calls = httpx.get(f"http://127.0.0.1:{upstream_port}/calls").json()["calls"]
+    finally:
+        app.terminate()
+        upstream.terminate()
+        app.wait()
+        upstream.wait()
+
+    latencies.sort()
+    first_segments.sort()
+    pct = lambda p, values=latencies: values[min(len(values) - 1, int(p * len(values)))]  # noqa: E731
+    print(f"app               {os.path.abspath(args.app_dir)}")
+    print(f"quests            {args.quests} {'quick-math' if args.quick else 'full-AI'} "
+          f"({args.concurrency} concurrent, {args.delay:.2f}s per AI call, cache {'on' if args.cache else 'off'}"
+          f"{', streamed' if args.stream else ''})")
+    print(f"throughput        {args.quests / elapsed:8.1f} quests/s  ({elapsed:.1f}s total)")
+    print(f"latency p50/p95/p99 {pct(0.50):6.3f}s / {pct(0.95):.3f}s / {pct(0.99):.3f}s  (mean {statistics.mean(latencies):.3f}s)")
+    if first_segments:
+        print(f"first segment p50/p95 {pct(0.50, first_segments):6.3f}s / {pct(0.95, first_segments):.3f}s")
+    print(f"upstream calls    {upstream_calls} ({upstream_calls / args.quests:.2f} per quest)")
+    print(f"outcomes          {json.dumps(modes, sort_keys=True)}")
+
+
+if __name__ == "__main__":
+    main_()
@@ -6,6 +6,18 @@
 # --timeout-keep-alive 75: keeps persistent connections alive for 75 s so that
 # Azure's load-balancer (idle timeout 4 min) and long-running AI requests
 # (up to ~20 s) are handled without premature connection drops.
+#
+# WEB_CONCURRENCY > 1 runs several uvicorn workers under gunicorn; set
+# SESSION_BACKEND=postgres as well so the workers share game sessions.
+if [ "${WEB_CONCURRENCY:-1}" -gt 1 ]; then
+    exec gunicorn backend.main:app \
+        -k uvicorn.workers.UvicornWorker \
+        -w "${WEB_CONCURRENCY}" \
+        --bind "0.0.0.0:${PORT:-8000}" \
+        --keep-alive 75 \
+        --timeout 120 \
+        --graceful-timeout 30
+fi
 exec uvicorn backend.main:app \
     --host 0.0.0.0 \
     --port "${PORT:-8000}" \